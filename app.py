@@ -1,9 +1,35 @@
-from fastapi import FastAPI, Request, Form, HTTPException, Depends, Header, File, UploadFile
+from fastapi import FastAPI, Request, Response, Form, HTTPException, Depends, Header, File, UploadFile
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse, RedirectResponse
-from supabase import create_client, Client
+from supabase import create_client
 from config import config as app_config
+from core.data_access import AsyncSupabase, QueryResult, add_write_listener
+from core.counts import execute_counted, invalidate_counts
+from core.inventory import reserve_inventory, reserve_inventory_batched, rollback_reservation
+from core.ledger import (
+    StockMovement, add_stock_listener, apply_stock_movements, fetch_all, fetch_ledger_history, stock_as_of,
+    take_stock_snapshot, verify_stock_ledger
+)
+from core.order_detail import detail_items, detail_version, load_order_detail
+from core.order_list import ORDER_LIST_COLUMNS, ORDER_LIST_TABLE, attach_item_images, refresh_order_list_rows
+from core.pagination import InvalidCursor, KeysetPage, MOVEMENTS_KEYSET, ORDERS_KEYSET, PRODUCTS_KEYSET, fetch_page
+from core.order_flags import derive_order_flags, resolve_payment_method
+from core.search import ORDER_SEARCH_CANDIDATES, order_search_conditions, phone_digits, rank_orders
+from core.bom import bom_index
+from core.forecast import depletion_forecast
+from core.buildable import buildable_index
+from core.flower_stats import flower_usage
+from core.seller_counts import load_seller_filter, seller_filter_rows
+from core.autocomplete import autocomplete
+from core.replica import reference_replica
+from core.procurement import plan_procurement, planner_available
+from core.conditional import PageValidator, make_etag
+from core.fragments import row_fragments
+from core.streaming import create_streaming_templates
+from core.thumbnails import thumbnails
+from core.dataloader import RequestLoaders, request_loaders
+from monitoring.query_stats import RequestQueryStats, current_query_stats, query_stats
 from models import Product, Order, OrderItem, User, ORDER_STATUSES, PAYMENT_METHODS, ProductCreateRequest, OrderCreateRequest, Flower, ProductComposition, ProductCompositionRequest, FlowerMovement, FlowerDeliveryRequest, FlowerWriteoffRequest, ACTIVE_STATUSES, ARCHIVE_STATUSES
 from typing import Optional, List
 from datetime import datetime, date
@@ -30,13 +56,14 @@ app = FastAPI(
 
 # Templates and static files
 templates = Jinja2Templates(directory="templates")
+streaming_templates = create_streaming_templates(templates)
 # Mount static files only if directory exists
 import os
 if os.path.exists("static"):
     app.mount("/static", StaticFiles(directory="static"), name="static")
 
-# Supabase client
-supabase: Client = None
+# Supabase client (async data-access layer, see core/data_access.py)
+supabase: Optional[AsyncSupabase] = None
 
 # ==================== REVERSE SYNC FUNCTIONS ====================
 
@@ -289,6 +316,13 @@ async def startup():
     global supabase
     
     logger.info("Starting CRM application...")
+    
+    if app_config.SUPABASE_FAKE_BACKEND:
+        from core.fake_backend import create_fake_supabase, load_fixtures
+        tables = load_fixtures(app_config.SUPABASE_FAKE_FIXTURES) if app_config.SUPABASE_FAKE_FIXTURES else None
+        supabase = create_fake_supabase(app_config.SUPABASE_FAKE_LATENCY_MS, tables, app_config.SUPABASE_MAX_CONCURRENCY)
+        logger.info(f"Using in-process fake Supabase backend ({app_config.SUPABASE_FAKE_LATENCY_MS}ms per query)")
+        return
     logger.info(f"SUPABASE_URL present: {bool(app_config.SUPABASE_URL)}")
     logger.info(f"SUPABASE_SERVICE_KEY present: {bool(app_config.SUPABASE_SERVICE_KEY)}")
     
@@ -299,30 +333,73 @@ async def startup():
     try:
         # Try service key first, fallback to anon key if needed
         service_key = app_config.SUPABASE_SERVICE_KEY or app_config.SUPABASE_ANON_KEY
-        supabase = create_client(app_config.SUPABASE_URL, service_key)
+        supabase = create_async_supabase(service_key)
         logger.info(f"Supabase client created with {'service' if app_config.SUPABASE_SERVICE_KEY else 'anon'} key")
         
         # Test connection with a simple query that should work with anon key
-        test_result = supabase.table("orders").select("id").limit(1).execute()
+        test_result = await supabase.table("orders").select("id").limit(1).execute()
         logger.info("Supabase connection test successful")
         logger.info("CRM application started successfully")
     except Exception as e:
         logger.error(f"Failed to initialize Supabase: {e}")
         # Try with anon key as fallback
         try:
-            supabase = create_client(app_config.SUPABASE_URL, app_config.SUPABASE_ANON_KEY)
+            if supabase:
+                await supabase.aclose()
+            supabase = create_async_supabase(app_config.SUPABASE_ANON_KEY)
             logger.info("Fallback: Using anon key for Supabase connection")
             logger.info("CRM application started with limited database access")
         except Exception as e2:
             logger.error(f"Fallback also failed: {e2}")
             logger.info("CRM application started with database connection issues")
 
-def get_supabase():
+@app.on_event("shutdown")
+async def shutdown():
+    """Close the shared Supabase HTTP client and the reference replica file"""
+    if supabase:
+        await supabase.aclose()
+    reference_replica.close()
+
+def create_async_supabase(key: str) -> AsyncSupabase:
+    """Create the async data-access client (plus a sync client for legacy modules)"""
+    return AsyncSupabase(
+        app_config.SUPABASE_URL,
+        key,
+        max_concurrency=app_config.SUPABASE_MAX_CONCURRENCY,
+        max_connections=app_config.SUPABASE_MAX_CONNECTIONS,
+        timeout=app_config.SUPABASE_HTTP_TIMEOUT,
+        sync_client=create_client(app_config.SUPABASE_URL, key)
+    )
+
+def get_supabase() -> AsyncSupabase:
     """Dependency to get Supabase client"""
     if not supabase:
         raise HTTPException(status_code=500, detail="Database not initialized")
     return supabase
 
+@app.middleware("http")
+async def request_scope_middleware(request: Request, call_next):
+    """
+    Request-scoped state:
+    - DataLoader batches and memoizes point lookups within one request
+    - query stats are summarized in the Server-Timing header and debug log
+    """
+    loaders = RequestLoaders()
+    stats = RequestQueryStats()
+    loaders_token = request_loaders.set(loaders)
+    stats_token = current_query_stats.set(stats)
+    try:
+        response = await call_next(request)
+    finally:
+        current_query_stats.reset(stats_token)
+        request_loaders.reset(loaders_token)
+
+    if app_config.QUERY_TIMING_HEADERS:
+        response.headers['Server-Timing'] = stats.server_timing(loaders.hits)
+    if stats.count:
+        logger.debug(f"{request.method} {request.url.path}: {stats.summary()}")
+    return response
+
 # ==================== DASHBOARD ====================
 
 @app.get("/")
@@ -344,20 +421,20 @@ async def list_orders(
     search: Optional[str] = None,
     page: int = 1,
     view: str = "active",  # active or archive
-    db: Client = Depends(get_supabase)
+    cursor: Optional[str] = None,
+    db: AsyncSupabase = Depends(get_supabase)
 ):
-    """List orders with filtering and pagination"""
+    """List orders with filtering and pagination (keyset cursor, offset fallback for ?page=N)"""
     
     try:
         limit = 50
-        offset = (page - 1) * limit
-        
         
-        # Build query - оптимизированная выборка только нужных полей для списка
-        query = db.table('orders').select(
-            'id, order_number, status, recipient_name, recipient_phone, delivery_address, total_amount, created_at, responsible_name',
-            count='exact'
-        )
+        # Build query - проекция order_list_rows (колонки списка + item_images) или orders
+        use_projection = app_config.ORDER_LIST_PROJECTION
+        if use_projection:
+            query = db.table(ORDER_LIST_TABLE).select(f'{ORDER_LIST_COLUMNS}, item_images, refreshed_at')
+        else:
+            query = db.table('orders').select(f'{ORDER_LIST_COLUMNS}, updated_at')
         
         # Apply filters
         if status and status != 'all':
@@ -369,148 +446,69 @@ async def list_orders(
             logger.info(f"Filtering by ARCHIVE_STATUSES: {len(ARCHIVE_STATUSES)} statuses")
         else:  # default to active - показываем ТОЛЬКО заказы с активными рабочими статусами
             query = query.in_('status', ACTIVE_STATUSES)
+            # Test/sync orders are flagged at ingest (core/order_flags.py), so totals stay exact
+            query = query.eq('is_test', False)
             logger.info(f"Filtering by ACTIVE_STATUSES: {len(ACTIVE_STATUSES)} statuses, completed in list: {'completed' in ACTIVE_STATUSES}")
         
-        if search:
-            # For search functionality, we'll filter by multiple OR conditions
-            # Since or_ method may not exist, we'll temporarily disable complex search
-            # and implement simple single-field search for now
-            search_term = f"%{search}%"
-            # Search primarily in order_number field  
-            query = query.ilike('order_number', search_term)
-        
-        # Sort and paginate
-        query = query.order('created_at', desc=True)
-        query = query.range(offset, offset + limit - 1)
-        
-        result = query.execute()
-        
-        # Log what we got before filtering
-        logger.info(f"Query executed. Got {len(result.data) if result.data else 0} orders for view={view}")
-        if result.data:
-            from collections import Counter
-            status_counts = Counter([o.get('status') for o in result.data])
-            logger.info(f"Before filtering - statuses in result: {dict(status_counts)}")
-        
-        # Minimal filtering - only skip obvious test/sync orders
-        if view == "active" and result.data:
-            filtered_orders = []
-            for order in result.data:
-                bitrix_id = order.get('bitrix_order_id')
-                recipient = order.get('recipient_name', '')
-                
-                # Skip only obvious test/sync orders
-                if bitrix_id and str(bitrix_id).startswith('175691'):  # Very specific test pattern
-                    logger.debug(f"Skipping test order with timestamp-like ID: {bitrix_id}")
-                    continue
-                    
-                # Skip test/sync orders by recipient name
-                if 'Получатель Обратной Синхронизации' in str(recipient):
-                    logger.debug(f"Skipping test order by recipient: {recipient}")
-                    continue
-                if 'Синхронизации' in str(recipient) or 'reverse_sync' in str(recipient).lower():
-                    logger.debug(f"Skipping sync order by recipient: {recipient}")
-                    continue
-                
-                # Accept all other orders (including those with empty recipient_name)
-                filtered_orders.append(order)
-            
-            result.data = filtered_orders
-            result.count = len(filtered_orders)
-            logger.info(f"After minimal filtering: {len(filtered_orders)} orders for view={view} (showing legitimate orders with any recipient status)")
+        if search and search.strip():
+            # Search by number, recipient, phone (any format) or address - trigram indexes
+            # (migrations/002_order_search.sql); newest candidates ranked by relevance
+            candidates = await query.match_any(order_search_conditions(search))\
+                .keyset(ORDERS_KEYSET)\
+                .limit(ORDER_SEARCH_CANDIDATES)\
+                .execute()
+            ranked = rank_orders(candidates.data or [], search, limit)
+            page_result = KeysetPage(ranked, None, False, len(ranked))
+        else:
+            # Sort and paginate by (created_at, id) cursor
+            try:
+                page_result = await fetch_page(query, ORDERS_KEYSET, limit, cursor, page, app_config.ORDERS_COUNT_STRATEGY)
+            except InvalidCursor:
+                logger.warning(f"Invalid orders cursor, falling back to page {page}")
+                page_result = await fetch_page(query, ORDERS_KEYSET, limit, None, page, app_config.ORDERS_COUNT_STRATEGY)
+        result = QueryResult(page_result.data, page_result.count)
         
         total_pages = (result.count // limit) + (1 if result.count % limit > 0 else 0)
         
-        # PERFORMANCE OPTIMIZATION: Batch load order items and products
-        # Instead of N+1 queries, use 2-3 batch queries for all orders
-        
-        orders_with_images = []
-        if result.data:
-            # Step 1: Collect all order IDs
-            order_ids = [order['id'] for order in result.data]
-            
-            # Step 2: Batch load multiple order items for each order (up to 6 items)
-            all_order_items = db.table('order_items')\
-                .select('order_id, product_id, product_snapshot')\
-                .in_('order_id', order_ids)\
-                .execute()
-            
-            # Group items by order_id (keep up to 6 items per order)
-            items_by_order = {}
-            if all_order_items.data:
-                for item in all_order_items.data:
-                    order_id = item['order_id']
-                    if order_id not in items_by_order:
-                        items_by_order[order_id] = []
-                    # Keep only up to 6 items per order
-                    if len(items_by_order[order_id]) < 6:
-                        items_by_order[order_id].append(item)
-            
-            # Step 3: Collect all product_ids that need images
-            product_ids_needed = []
-            for items_list in items_by_order.values():
-                for item in items_list:
-                    if item.get('product_id'):
-                        product_ids_needed.append(item['product_id'])
-            
-            # Step 4: Batch load product images for all needed products
-            products_data = {}
-            if product_ids_needed:
-                products_result = db.table('products')\
-                    .select('id, metadata')\
-                    .in_('id', product_ids_needed)\
-                    .execute()
-                
-                # Index products by ID for fast lookup
-                if products_result.data:
-                    products_data = {product['id']: product for product in products_result.data}
-                else:
-                    products_data = {}
-            
-            # Step 5: Assemble final data structure
-            for order in result.data:
-                order_dict = dict(order)
-                order_id = order['id']
-                
-                item_images = []
-                if order_id in items_by_order:
-                    items = items_by_order[order_id]
-                    
-                    for item in items:
-                        product_id = item.get('product_id')
-                        item_image = None
-                        
-                        # Try to get image from regular products first
-                        if product_id and product_id in products_data:
-                            product = products_data[product_id]
-                            if (product.get('metadata') and 
-                                product['metadata'].get('properties', {}).get('ru_img_miniature')):
-                                img_path = product['metadata']['properties']['ru_img_miniature']
-                                item_image = f"https://cvety.kz{img_path}"
-                        
-                        # Fallback: Try to get image for dynamic products (assembled bouquets) from production server
-                        if not item_image and item.get('product_snapshot'):
-                            snapshot = item['product_snapshot']
-                            if isinstance(snapshot, dict) and snapshot.get('bitrix', {}).get('product_id'):
-                                bitrix_product_id = snapshot['bitrix']['product_id']
-                                item_image = f"https://cvety.kz/miniature/{bitrix_product_id}-obrannyy-buket.jpg"
-                        
-                        if item_image:
-                            item_images.append(item_image)
-                
-                order_dict['item_images'] = item_images
-                # Keep backward compatibility for now
-                order_dict['first_item_image'] = item_images[0] if item_images else None
-                orders_with_images.append(order_dict)
+        # Validator from the page rows: an unchanged list is answered with 304 before images and render.
+        # ETag only - the newest updated_at misses rows that left the page (status change, delete)
+        version_field = 'refreshed_at' if use_projection else 'updated_at'
+        validator = PageValidator(
+            make_etag(
+                [(order['id'], order.get(version_field)) for order in result.data or []],
+                result.count, page_result.next_cursor,
+                None if use_projection else row_fragments.generation('product')
+            )
+        )
+        if validator.matches(request):
+            return validator.not_modified()
+        
+        # Миниатюры товаров: из проекции order_list_rows, без нее - 2 batch запроса
+        if use_projection:
+            orders_with_images = [
+                {**order, 'first_item_image': order['item_images'][0] if order.get('item_images') else None}
+                for order in result.data or []
+            ]
         else:
-            orders_with_images = []
+            orders_with_images = await attach_item_images(db, result.data or [])
         
-        response = templates.TemplateResponse("orders.html", {
+        # Rows come from the fragment cache; only changed orders are rendered
+        order_rows = row_fragments.render_rows(
+            templates.env, "partials/order_row.html", "order", orders_with_images,
+            version_fields=(version_field, 'first_item_image'),
+            context={"order_statuses": ORDER_STATUSES}
+        )
+        
+        # Large lists are streamed to the browser while the rows render
+        renderer = streaming_templates if app_config.STREAM_HTML else templates
+        response = renderer.TemplateResponse("orders.html", {
             "request": request,
             "orders": orders_with_images,
+            "order_rows": order_rows,
             "total": result.count,
             "page": page,
             "total_pages": total_pages,
+            "next_cursor": page_result.next_cursor,
             "active_page": "orders",
             "current_status": status,
             "search_term": search,
@@ -518,12 +516,8 @@ async def list_orders(
             "order_statuses": ORDER_STATUSES
         })
         
-        # Add cache-busting headers to ensure fresh order data
-        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-        response.headers["Pragma"] = "no-cache"
-        response.headers["Expires"] = "0"
-        
-        return response
+        # Browser keeps the page but revalidates it on every visit (ETag/Last-Modified)
+        return validator.apply(response)
         
     except Exception as e:
         logger.error(f"Orders list error: {e}")
@@ -533,386 +527,55 @@ async def list_orders(
             "active_page": "orders"
         })
 
-async def process_flower_inventory_for_products(items, db: Client, movement_type="order_usage"):
+async def update_inventory(items, db: AsyncSupabase, operation="reserve"):
     """
-    Process flower inventory based on product compositions
-    For each product in the order, deduct flowers from inventory based on product composition
+    Reserve or release stock for order items in one atomic reserve_inventory() RPC
+    (migrations/004_reserve_inventory.sql); a batched reservation plan until the function is installed
     """
-    try:
-        flower_movements = []
-        
-        for item in items:
-            product_id = item.get('product_id')
-            order_quantity = item.get('quantity', 1)
-            
-            if not product_id:
-                continue
-            
-            # Get product composition (what flowers are needed for this product)
-            composition_result = db.table('product_composition')\
-                .select('flower_id, amount, flowers(name)')\
-                .eq('product_id', product_id)\
-                .execute()
-            
-            if not composition_result.data:
-                logger.info(f"No flower composition found for product {product_id}, skipping flower deduction")
-                continue
-            
-            # For each flower in the product composition
-            for comp in composition_result.data:
-                flower_id = comp['flower_id']
-                flowers_per_product = comp['amount']
-                total_flowers_needed = flowers_per_product * order_quantity
-                flower_name = comp.get('flowers', {}).get('name', 'Unknown')
-                
-                # Check flower availability
-                flower_result = db.table('flowers')\
-                    .select('quantity')\
-                    .eq('id', flower_id)\
-                    .single()\
-                    .execute()
-                
-                if not flower_result.data:
-                    raise ValueError(f"Flower {flower_id} not found")
-                
-                current_flower_quantity = flower_result.data.get('quantity', 0)
-                
-                if current_flower_quantity < total_flowers_needed:
-                    raise ValueError(f"Insufficient flower stock for {flower_name}. Available: {current_flower_quantity}, Required: {total_flowers_needed}")
-                
-                new_flower_quantity = current_flower_quantity - total_flowers_needed
-                
-                # Update flower quantity
-                db.table('flowers')\
-                    .update({'quantity': new_flower_quantity, 'updated_at': datetime.utcnow().isoformat()})\
-                    .eq('id', flower_id)\
-                    .execute()
-                
-                # Create flower movement record
-                db.table('flower_inventory_movements').insert({
-                    'flower_id': flower_id,
-                    'movement_type': movement_type,
-                    'quantity': total_flowers_needed,
-                    'reason': f'Used in order (Product composition)',
-                    'note': f'Product requires {flowers_per_product} flowers × {order_quantity} quantity',
-                    'created_by': 'Order System'
-                }).execute()
-                
-                flower_movements.append({
-                    'flower_id': flower_id,
-                    'flower_name': flower_name,
-                    'old_quantity': current_flower_quantity,
-                    'new_quantity': new_flower_quantity,
-                    'used_quantity': total_flowers_needed
-                })
-                
-                logger.info(f"Flower inventory updated: {flower_name} {current_flower_quantity} → {new_flower_quantity} (used: {total_flowers_needed})")
-        
-        return {
-            'success': True,
-            'updates': flower_movements,
-            'message': f"Processed flower inventory for {len(flower_movements)} flower types"
-        }
-        
-    except Exception as e:
-        logger.error(f"Flower inventory processing error: {e}")
-        return {
-            'success': False,
-            'error': str(e)
-        }
+    result = await reserve_inventory(db, items, operation)
+    if result is None:
+        result = await reserve_inventory_batched(db, items, operation)
+    return result
 
-async def restore_flower_inventory_for_products(items, db: Client):
-    """
-    Restore flower inventory when orders are cancelled/refunded
-    For each product in the order, restore flowers to inventory based on product composition
-    """
-    try:
-        flower_movements = []
-        
-        for item in items:
-            product_id = item.get('product_id')
-            order_quantity = item.get('quantity', 1)
-            
-            if not product_id:
-                continue
-            
-            # Get product composition (what flowers were used for this product)
-            composition_result = db.table('product_composition')\
-                .select('flower_id, amount, flowers(name)')\
-                .eq('product_id', product_id)\
-                .execute()
-            
-            if not composition_result.data:
-                logger.info(f"No flower composition found for product {product_id}, skipping flower restoration")
-                continue
-            
-            # For each flower in the product composition
-            for comp in composition_result.data:
-                flower_id = comp['flower_id']
-                flowers_per_product = comp['amount']
-                total_flowers_to_restore = flowers_per_product * order_quantity
-                flower_name = comp.get('flowers', {}).get('name', 'Unknown')
-                
-                # Get current flower quantity
-                flower_result = db.table('flowers')\
-                    .select('quantity')\
-                    .eq('id', flower_id)\
-                    .single()\
-                    .execute()
-                
-                if not flower_result.data:
-                    logger.warning(f"Flower {flower_id} not found during restoration")
-                    continue
-                
-                current_flower_quantity = flower_result.data.get('quantity', 0)
-                new_flower_quantity = current_flower_quantity + total_flowers_to_restore
-                
-                # Update flower quantity
-                db.table('flowers')\
-                    .update({'quantity': new_flower_quantity, 'updated_at': datetime.utcnow().isoformat()})\
-                    .eq('id', flower_id)\
-                    .execute()
-                
-                # Create flower movement record for restoration (using 'delivery' type for restoration)
-                db.table('flower_inventory_movements').insert({
-                    'flower_id': flower_id,
-                    'movement_type': 'delivery',
-                    'quantity': total_flowers_to_restore,
-                    'reason': f'Order cancelled/refunded (restored)',
-                    'note': f'Product required {flowers_per_product} flowers × {order_quantity} quantity - now restored',
-                    'created_by': 'Order System'
-                }).execute()
-                
-                flower_movements.append({
-                    'flower_id': flower_id,
-                    'flower_name': flower_name,
-                    'old_quantity': current_flower_quantity,
-                    'new_quantity': new_flower_quantity,
-                    'restored_quantity': total_flowers_to_restore
-                })
-                
-                logger.info(f"Flower inventory restored: {flower_name} {current_flower_quantity} → {new_flower_quantity} (restored: {total_flowers_to_restore})")
-        
-        return {
-            'success': True,
-            'updates': flower_movements,
-            'message': f"Restored flower inventory for {len(flower_movements)} flower types"
-        }
-        
-    except Exception as e:
-        logger.error(f"Flower inventory restoration error: {e}")
-        return {
-            'success': False,
-            'error': str(e)
-        }
-
-async def check_flower_availability(items, db: Client):
-    """
-    Check if there are enough flowers available for all products in the order
-    Returns detailed information about flower availability and shortages
-    """
+async def deactivate_unbuildable_products(product_ids: List[str]):
+    """Deactivate active products that can no longer be built from flower stock (BUILDABLE_AUTO_DEACTIVATE)"""
+    if not supabase:
+        return
     try:
-        flower_requirements = {}  # flower_id -> total_amount_needed
-        flower_shortages = []
-        
-        for item in items:
-            product_id = item.get('product_id')
-            order_quantity = item.get('quantity', 1)
-            
-            if not product_id:
-                continue
-            
-            # Get product composition (what flowers are needed for this product)
-            composition_result = db.table('product_composition')\
-                .select('flower_id, amount, flowers(name)')\
-                .eq('product_id', product_id)\
-                .execute()
-            
-            if not composition_result.data:
-                # No composition - skip flower checking for this product
-                continue
-            
-            # Calculate total flower requirements for this product
-            for composition in composition_result.data:
-                flower_id = composition['flower_id']
-                flowers_per_product = composition['amount']
-                total_flowers_needed = flowers_per_product * order_quantity
-                
-                if flower_id in flower_requirements:
-                    flower_requirements[flower_id] += total_flowers_needed
-                else:
-                    flower_requirements[flower_id] = total_flowers_needed
-        
-        # Check availability for each required flower
-        if flower_requirements:
-            flower_ids = list(flower_requirements.keys())
-            flowers_result = db.table('flowers')\
-                .select('id, name, quantity')\
-                .in_('id', flower_ids)\
-                .execute()
-            
-            flowers_data = {flower['id']: flower for flower in flowers_result.data}
-            
-            for flower_id, needed_amount in flower_requirements.items():
-                if flower_id not in flowers_data:
-                    flower_shortages.append({
-                        'flower_id': flower_id,
-                        'flower_name': 'Unknown',
-                        'needed': needed_amount,
-                        'available': 0,
-                        'shortage': needed_amount
-                    })
-                    continue
-                
-                flower = flowers_data[flower_id]
-                available_amount = flower.get('quantity', 0)
-                
-                if available_amount < needed_amount:
-                    flower_shortages.append({
-                        'flower_id': flower_id,
-                        'flower_name': flower['name'],
-                        'needed': needed_amount,
-                        'available': available_amount,
-                        'shortage': needed_amount - available_amount
-                    })
+        result = await supabase.table('products')\
+            .update({
+                'is_active': False,
+                'updated_at': datetime.utcnow().isoformat()
+            })\
+            .in_('id', product_ids)\
+            .eq('is_active', True)\
+            .execute()
+        deactivated = result.data or []
+        if not deactivated:
+            return
+        row_fragments.invalidate('product', [product['id'] for product in deactivated])
+        autocomplete.invalidate('product', [product['id'] for product in deactivated])
         
-        return {
-            'success': len(flower_shortages) == 0,
-            'flower_requirements': flower_requirements,
-            'shortages': flower_shortages,
-            'message': 'All flowers available' if len(flower_shortages) == 0 else f'Insufficient flowers: {len(flower_shortages)} types'
-        }
+        if app_config.BITRIX_SYNC_ENABLED:
+            for product in deactivated:
+                bitrix_id = (product.get('metadata') or {}).get('bitrix_id')
+                if bitrix_id:
+                    asyncio.create_task(sync_product_status_to_bitrix(bitrix_id, is_active=False))
         
+        logger.info(f"❌ Auto-deactivated {len(deactivated)} products out of flowers: {', '.join(product['name'] for product in deactivated)}")
     except Exception as e:
-        logger.error(f"Flower availability check error: {e}")
-        return {
-            'success': False,
-            'error': str(e),
-            'shortages': []
-        }
+        logger.error(f"Error auto-deactivating products: {e}")
 
-async def validate_and_update_inventory(items, db: Client, operation="reserve"):
-    """
-    Validate product availability and update inventory
-    operation: 'reserve' (decrease quantity) or 'release' (increase quantity)
-    
-    NEW LOGIC: For products with flower composition, check flower availability instead of product quantity
-    """
-    try:
-        # STEP 1: Check flower availability for products with composition
-        if operation == "reserve":
-            flower_check = await check_flower_availability(items, db)
-            if not flower_check['success']:
-                # Build detailed error message for flower shortages
-                shortage_details = []
-                for shortage in flower_check['shortages']:
-                    shortage_details.append(
-                        f"{shortage['flower_name']}: нужно {shortage['needed']}, доступно {shortage['available']} (нехватка: {shortage['shortage']})"
-                    )
-                raise ValueError(f"Недостаточно цветов в инвентаре:\n" + "\n".join(shortage_details))
-        
-        # STEP 2: Process product inventory updates
-        inventory_updates = []
-        
-        for item in items:
-            product_id = item.get('product_id')
-            quantity = item.get('quantity', 1)
-            
-            if not product_id:
-                continue
-                
-            # Get current product inventory
-            product_result = db.table('products')\
-                .select('id, name, quantity')\
-                .eq('id', product_id)\
-                .single()\
-                .execute()
-                
-            if not product_result.data:
-                raise ValueError(f"Product {product_id} not found")
-                
-            product = product_result.data
-            current_quantity = product.get('quantity', 0)
-            
-            # Check if product has flower composition
-            composition_result = db.table('product_composition')\
-                .select('flower_id')\
-                .eq('product_id', product_id)\
-                .limit(1)\
-                .execute()
-            
-            has_composition = len(composition_result.data) > 0
-            
-            if operation == "reserve":
-                if has_composition:
-                    # For products with composition, flower availability was already checked above
-                    # We can skip product quantity validation as flowers are the primary constraint
-                    new_quantity = current_quantity  # Keep product quantity unchanged for flower-based products
-                else:
-                    # For products without composition, use traditional product quantity checking
-                    if current_quantity < quantity:
-                        raise ValueError(f"Insufficient stock for {product['name']}. Available: {current_quantity}, Required: {quantity}")
-                    new_quantity = current_quantity - quantity
-            else:  # release
-                if has_composition:
-                    # For flower-based products, don't modify product quantity
-                    new_quantity = current_quantity
-                else:
-                    # For traditional products, restore quantity
-                    new_quantity = current_quantity + quantity
-            
-            inventory_updates.append({
-                'product_id': product_id,
-                'product_name': product['name'],
-                'old_quantity': current_quantity,
-                'new_quantity': new_quantity,
-                'change_quantity': quantity if operation == "release" else -quantity
-            })
-        
-        # Apply all inventory updates
-        for update in inventory_updates:
-            db.table('products')\
-                .update({'quantity': update['new_quantity'], 'updated_at': datetime.utcnow().isoformat()})\
-                .eq('id', update['product_id'])\
-                .execute()
-                
-            logger.info(f"Inventory updated: {update['product_name']} {update['old_quantity']} → {update['new_quantity']}")
-        
-        # Process flower inventory for each product
-        flower_updates = []
-        if operation == "reserve":
-            flower_result = await process_flower_inventory_for_products(items, db, "order_usage")
-            if not flower_result['success']:
-                # Rollback product inventory changes
-                for update in inventory_updates:
-                    db.table('products')\
-                        .update({'quantity': update['old_quantity'], 'updated_at': datetime.utcnow().isoformat()})\
-                        .eq('id', update['product_id'])\
-                        .execute()
-                logger.error(f"Flower inventory error, rolled back product changes: {flower_result['error']}")
-                return flower_result
-            flower_updates = flower_result.get('updates', [])
-        elif operation == "release":
-            # Restore flower inventory when order is cancelled/refunded
-            flower_result = await restore_flower_inventory_for_products(items, db)
-            if flower_result['success']:
-                flower_updates = flower_result.get('updates', [])
-            else:
-                logger.warning(f"Failed to restore flower inventory: {flower_result['error']}")
+def on_stock_changed(items: List[dict]):
+    """Recount buildable products for the changed flowers; deactivate the ones that dropped to zero if enabled"""
+    dropped = buildable_index.apply_stock_changes(items)
+    if dropped and app_config.BUILDABLE_AUTO_DEACTIVATE:
+        asyncio.get_running_loop().create_task(deactivate_unbuildable_products(dropped))
 
-        return {
-            'success': True,
-            'updates': inventory_updates,
-            'flower_updates': flower_updates,
-            'message': f"Inventory {operation}d for {len(inventory_updates)} products, {len(flower_updates)} flower movements"
-        }
-        
-    except Exception as e:
-        logger.error(f"Inventory validation error: {e}")
-        return {
-            'success': False,
-            'error': str(e)
-        }
+add_stock_listener(on_stock_changed)
+add_stock_listener(autocomplete.apply_stock_changes)
+add_stock_listener(reference_replica.apply_stock_changes)
+add_write_listener(reference_replica.note_write)
 
 @app.get("/crm/orders/new", response_class=HTMLResponse)
 async def new_order_form(request: Request):
@@ -926,7 +589,7 @@ async def new_order_form(request: Request):
 @app.post("/crm/orders/new")
 async def create_order(
     order_data: dict,  # Using dict to handle complex nested structure
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Create a new order"""
     try:
@@ -938,14 +601,14 @@ async def create_order(
         logger.info(f"Generated new order number: {new_number}")
         
         # Check if number already exists in Supabase
-        existing_order = db.table('orders').select('id').eq('order_number', new_number).execute()
+        existing_order = await db.table('orders').select('id').eq('order_number', new_number).execute()
         if existing_order.data:
             # If exists, use local prefix to avoid conflicts
             new_number = order_number_generator.generate_local_order_number()
             logger.warning(f"Order number collision detected, using local number: {new_number}")
         
         # Validate and update inventory first
-        inventory_result = await validate_and_update_inventory(order_data.get('items', []), db, operation="reserve")
+        inventory_result = await update_inventory(order_data.get('items', []), db, operation="reserve")
         if not inventory_result['success']:
             raise HTTPException(status_code=400, detail=f"Inventory error: {inventory_result['error']}")
         
@@ -958,6 +621,7 @@ async def create_order(
             "status": "new",
             "recipient_name": order_data.get('recipient_name'),
             "recipient_phone": order_data.get('recipient_phone'),
+            "recipient_phone_digits": phone_digits(order_data.get('recipient_phone')),
             "delivery_address": order_data.get('delivery_address'),
             "delivery_date": order_data.get('delivery_date'),
             "delivery_time": order_data.get('delivery_time'),
@@ -976,8 +640,10 @@ async def create_order(
             "updated_at": datetime.utcnow().isoformat()
         }
         
+        new_order.update(derive_order_flags(new_order))
+        
         # Insert order
-        order_result = db.table('orders').insert(new_order).execute()
+        order_result = await db.table('orders').insert(new_order).execute()
         
         if order_result.data:
             order_id = order_result.data[0]['id']
@@ -996,19 +662,20 @@ async def create_order(
                             "price": item['price']
                         }
                     }
-                    db.table('order_items').insert(order_item).execute()
+                    await db.table('order_items').insert(order_item).execute()
                 
+                await refresh_order_list_rows(db, order_ids=[order_id])
                 logger.info(f"Created new order: {order_id} with number {new_number} (inventory reserved: {len(inventory_result['updates'])} products)")
                 return {"id": order_id, "order_number": new_number, "status": "success"}
                 
             except Exception as e:
-                # If order items creation fails, rollback inventory changes
+                # If order items creation fails, roll back the reservation
                 logger.error(f"Order items creation failed, rolling back inventory: {e}")
-                await validate_and_update_inventory(order_data.get('items', []), db, operation="release")
+                await rollback_reservation(db, inventory_result, order_data.get('items', []))
                 raise e
         else:
-            # If order creation fails, rollback inventory changes
-            await validate_and_update_inventory(order_data.get('items', []), db, operation="release")
+            # If order creation fails, roll back the reservation
+            await rollback_reservation(db, inventory_result, order_data.get('items', []))
             raise HTTPException(status_code=400, detail="Failed to create order")
             
     except Exception as e:
@@ -1019,146 +686,38 @@ async def create_order(
 async def order_detail(
     request: Request,
     order_id: str,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Order detail page"""
     
     try:
-        # Get order
-        order_result = db.table('orders')\
-            .select('*')\
-            .eq('id', order_id)\
-            .execute()
-        
-        if not order_result.data:
-            raise HTTPException(status_code=404, detail="Order not found")
-        
-        # Get first order from results
-        order_data = order_result.data[0] if order_result.data else None
+        # Order, items with product name/thumbnail, customer and florist in one request
+        order_data = await load_order_detail(db, order_id)
         if not order_data:
             raise HTTPException(status_code=404, detail="Order not found")
         
-        # Get order items
-        items_result = db.table('order_items')\
-            .select('*')\
-            .eq('order_id', order_id)\
-            .execute()
-        
-        # OPTIMIZATION: Batch load products to avoid N+1 queries with caching
-        from cache_utils import simple_cache, cache_key
-        
-        product_ids = [item.get('product_id') for item in items_result.data if item.get('product_id')]
-        products_by_id = {}
-        uncached_product_ids = []
-        
-        # Проверяем кэш для каждого продукта
-        for product_id in product_ids:
-            cache_k = cache_key('product', product_id)
-            cached_product = simple_cache.get(cache_k)
-            if cached_product:
-                products_by_id[product_id] = cached_product
-            else:
-                uncached_product_ids.append(product_id)
-        
-        # Загружаем только те продукты, которых нет в кэше
-        if uncached_product_ids:
-            products_query = db.table('products')\
-                .select('id, name, metadata')\
-                .in_('id', uncached_product_ids)\
-                .execute()
-            
-            # Добавляем в кэш и результат
-            for prod in products_query.data:
-                products_by_id[prod['id']] = prod
-                cache_k = cache_key('product', prod['id'])
-                simple_cache.set(cache_k, prod, ttl_seconds=300)  # 5 минут кэш для продуктов
-        
-        # Enrich order items with product images and names
-        items_with_images = []
-        for item in items_result.data:
-            item_dict = dict(item)
-            
-            # Get product data if product_id exists
-            product_image = None
-            product_name = None
-            
-            if item.get('product_id') and item['product_id'] in products_by_id:
-                product = products_by_id[item['product_id']]
-                # Get product name
-                product_name = product.get('name')
-                
-                # Get product image
-                if (product.get('metadata') and 
-                    product['metadata'].get('properties', {}).get('ru_img_miniature')):
-                    img_path = product['metadata']['properties']['ru_img_miniature']
-                    product_image = f"https://cvety.kz{img_path}"
-            
-            # Fallback: if no product_id or product not found, try product_snapshot
-            if not product_name and item.get('product_snapshot'):
-                snapshot = item['product_snapshot']
-                if isinstance(snapshot, dict) and snapshot.get('name'):
-                    product_name = snapshot['name']
-                    
-                    # Try to get image for dynamic products from production server
-                    if not product_image and snapshot.get('bitrix', {}).get('product_id'):
-                        bitrix_product_id = snapshot['bitrix']['product_id']
-                        # Format: https://cvety.kz/miniature/{product_id}-obrannyy-buket.jpg
-                        product_image = f"https://cvety.kz/miniature/{bitrix_product_id}-obrannyy-buket.jpg"
-            
-            # Final fallback for product name
-            if not product_name:
-                product_name = "Товар (название не указано)"
-            
-            item_dict['product_image'] = product_image
-            item_dict['product_name'] = product_name
-            items_with_images.append(item_dict)
-        
-        # Get customer information
-        customer_info = None
-        
-        if order_data.get('user_id'):
-            try:
-                customer_result = db.table('users')\
-                    .select('*')\
-                    .eq('id', order_data['user_id'])\
-                    .execute()
-                
-                if customer_result.data:
-                    customer_info = customer_result.data[0]
-            except Exception as e:
-                logger.warning(f"Failed to load customer info for order {order_id}: {e}")
-        
-        # Get responsible florist information
-        florist_info = None
+        items = order_data.pop('order_items', None) or []
+        customer_info = order_data.pop('customer', None)
+        florist_info = order_data.pop('florist', None)
+        
+        # Validator from everything the page shows: the order row, its items with product versions and
+        # the embedded users, so Bitrix sync and product edits from other processes change it too.
+        # ETag only - the order's updated_at does not move when an item or user changes
+        validator = PageValidator(
+            make_etag(
+                detail_version(order_data, items, customer_info, florist_info),
+                row_fragments.generation('order', order_id)
+            )
+        )
+        if validator.matches(request):
+            return validator.not_modified()
         
-        if order_data.get('responsible_id'):
-            try:
-                florist_result = db.table('users')\
-                    .select('*')\
-                    .eq('id', order_data['responsible_id'])\
-                    .execute()
-                
-                if florist_result.data:
-                    florist_info = florist_result.data[0]
-            except Exception as e:
-                logger.warning(f"Failed to load florist info for order {order_id}: {e}")
+        items_with_images = detail_items(items)
         
-        # Extract payment method from metadata
-        payment_method = "unknown"
-        if order_data.get('metadata', {}).get('order_properties'):
-            props = order_data['metadata']['order_properties']
-            
-            # Check for Kaspi payment indicators
-            if props.get('kaspiPhone') or props.get('CHECK_NUMBER'):
-                payment_method = "kaspi"
-            elif props.get('METHOD_PAY'):
-                method = props['METHOD_PAY'].lower()
-                if 'cash' in method or 'наличн' in method:
-                    payment_method = "cash"
-                elif 'card' in method or 'карт' in method:
-                    payment_method = "card"
-                elif 'transfer' in method or 'перевод' in method:
-                    payment_method = "transfer"
+        # Payment method is resolved at ingest; derive only for rows written before migration 003
+        payment_method = order_data.get('payment_method_resolved') or resolve_payment_method(
+            (order_data.get('metadata') or {}).get('order_properties')
+        )
         
         response = templates.TemplateResponse("order_detail.html", {
             "request": request,
@@ -1172,12 +731,8 @@ async def order_detail(
             "payment_methods": PAYMENT_METHODS
         })
         
-        # Add cache-busting headers to ensure fresh status data
-        response.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-        response.headers["Pragma"] = "no-cache"
-        response.headers["Expires"] = "0"
-        
-        return response
+        # Browser keeps the page but revalidates it on every visit (ETag/Last-Modified)
+        return validator.apply(response)
         
     except HTTPException:
         raise
@@ -1195,7 +750,7 @@ async def order_detail(
 async def update_order_status(
     order_id: str,
     status: str = Form(...),
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Update order status"""
     
@@ -1204,7 +759,7 @@ async def update_order_status(
             raise HTTPException(status_code=400, detail="Invalid status")
         
         # Get current order status and items for inventory management
-        current_order = db.table('orders')\
+        current_order = await db.table('orders')\
             .select('id, status, order_items(*)')\
             .eq('id', order_id)\
             .single()\
@@ -1229,7 +784,7 @@ async def update_order_status(
                             'quantity': item['quantity']
                         })
                     
-                    inventory_result = await validate_and_update_inventory(items_for_release, db, operation="release")
+                    inventory_result = await update_inventory(items_for_release, db, operation="release")
                     if inventory_result['success']:
                         logger.info(f"Released inventory for cancelled/refunded order {order_id}: {len(inventory_result['updates'])} products")
             
@@ -1244,19 +799,20 @@ async def update_order_status(
                             'quantity': item['quantity']
                         })
                     
-                    inventory_result = await validate_and_update_inventory(items_for_reserve, db, operation="reserve")
+                    inventory_result = await update_inventory(items_for_reserve, db, operation="reserve")
                     if not inventory_result['success']:
                         raise HTTPException(status_code=400, detail=f"Cannot reactivate order - inventory error: {inventory_result['error']}")
                     logger.info(f"Reserved inventory for reactivated order {order_id}: {len(inventory_result['updates'])} products")
         
         # Update order status
-        db.table('orders')\
+        await db.table('orders')\
             .update({
                 'status': status,
                 'updated_at': datetime.now().isoformat()
             })\
             .eq('id', order_id)\
             .execute()
+        await refresh_order_list_rows(db, order_ids=[order_id])
         
         # Синхронизируем изменение обратно в Bitrix (опционально)
         try:
@@ -1273,6 +829,13 @@ async def update_order_status(
 
 # ==================== PRODUCTS ====================
 
+def invalidate_product_views(product_ids: Optional[List[str]] = None):
+    """Drop cached thumbnails, rendered list rows and warehouse product names of changed products (all when None)"""
+    thumbnails.invalidate(product_ids)
+    row_fragments.invalidate('product', product_ids)
+    autocomplete.invalidate('product', product_ids)
+    flower_usage.invalidate()
+
 @app.get("/crm/products", response_class=HTMLResponse)
 async def list_products(
     request: Request,
@@ -1281,92 +844,119 @@ async def list_products(
     seller_id: Optional[str] = None,
     show_inactive: bool = True,  # CRM показывает все товары по умолчанию
     page: int = 1,
-    db: Client = Depends(get_supabase)
+    cursor: Optional[str] = None,
+    db: AsyncSupabase = Depends(get_supabase)
 ):
-    """List products with filtering and pagination"""
+    """List products with filtering and pagination (keyset cursor, offset fallback for ?page=N)"""
     
     try:
         limit = 50
-        offset = (page - 1) * limit
         
-        # Получаем список всех активных магазинов для фильтра (с description для подсчета)
-        sellers_query = db.table('sellers').select('id, name, description').eq('is_active', True).order('name')
-        sellers_result = sellers_query.execute()
-        sellers = sellers_result.data if sellers_result.data else []
-        
-        # Debug: логируем количество найденных магазинов
-        logger.info(f"Found {len(sellers)} active sellers for filter dropdown")
-        
-        # Извлекаем количество товаров из описания (временное решение)
-        # Количество сохранено в формате "Товаров: N" в поле description
-        import re
-        for seller in sellers:
-            product_count = 0
-            if seller.get('description') and 'Товаров:' in seller.get('description', ''):
-                match = re.search(r'Товаров: (\d+)', seller['description'])
-                if match:
-                    product_count = int(match.group(1))
-            seller['product_count'] = product_count
-        
-        # Debug: проверяем первых 3 магазинов
-        if sellers:
-            logger.info(f"First 3 sellers: {sellers[:3]}")
+        # Продавцы, товары и названия магазинов из локальной реплики, если она включена (core/replica.py)
+        local = await reference_replica.ready(db)
         
-        # Build query - оптимизированная выборка только нужных полей
-        query = db.table('products').select(
-            'id, name, price, old_price, is_active, created_at, description, slug, metadata, seller_id',
-            count='exact'
-        )
+        # Активные магазины для фильтра со счетчиками товаров (sellers.product_count, migrations/006)
+        if local:
+            sellers = seller_filter_rows(reference_replica.rows('sellers', {'is_active': True}))
+        else:
+            sellers = await load_seller_filter(db)
         
         # CRM логика: показывать все товары или только активные
+        filters = {}
         if not show_inactive:
             # Если явно запросили только активные товары
-            query = query.eq('is_active', True)
+            filters['is_active'] = True
         # По умолчанию (show_inactive=True) показываем все товары для администраторов
         
         # Apply filters
         if category:
-            query = query.eq('category_id', category)
+            filters['category_id'] = category
         
         if seller_id:
-            query = query.eq('seller_id', seller_id)
+            filters['seller_id'] = seller_id
+        
+        # Build query - оптимизированная выборка только нужных полей
+        query = db.table('products').select(
+            'id, name, price, old_price, is_active, created_at, updated_at, description, slug, seller_id, '
+            'in_stock:metadata->properties->>IN_STOCK, ru_url:metadata->properties->>ru_url'
+        )
+        for column, value in filters.items():
+            query = query.eq(column, value)
         
         if search:
             search_term = f"%{search}%"
             query = query.ilike('name', search_term)
         
-        # Sort and paginate - активные товары первыми, затем по дате создания
-        query = query.order('is_active', desc=True).order('created_at', desc=True)
-        query = query.range(offset, offset + limit - 1)
+        # Sort and paginate - активные товары первыми, затем по дате создания (курсор по is_active, created_at, id)
+        async def load_page(page_cursor: Optional[str]) -> KeysetPage:
+            if local:
+                return reference_replica.page('products', PRODUCTS_KEYSET, limit, page_cursor, page, filters, search)
+            return await fetch_page(query, PRODUCTS_KEYSET, limit, page_cursor, page, app_config.PRODUCTS_COUNT_STRATEGY)
         
-        result = query.execute()
+        try:
+            page_result = await load_page(cursor)
+        except InvalidCursor:
+            logger.warning(f"Invalid products cursor, falling back to page {page}")
+            page_result = await load_page(None)
+        result = QueryResult(page_result.data, page_result.count)
         total_pages = (result.count // limit) + (1 if result.count % limit > 0 else 0)
         
+        # Validator from the page rows and the seller filter (ETag only, as for the orders list);
+        # image and composition edits bump the product generation
+        validator = PageValidator(
+            make_etag(
+                [
+                    (product['id'], product.get('updated_at'), row_fragments.generation('product', product['id']))
+                    for product in result.data or []
+                ],
+                result.count, page_result.next_cursor, sellers
+            )
+        )
+        if validator.matches(request):
+            return validator.not_modified()
+        
         # Если есть seller_id в товарах, получаем информацию о магазинах
         if result.data:
             seller_ids = list(set([p['seller_id'] for p in result.data if p.get('seller_id')]))
             if seller_ids:
-                sellers_info_query = db.table('sellers').select('id, name').in_('id', seller_ids)
-                sellers_info_result = sellers_info_query.execute()
-                sellers_dict = {s['id']: s['name'] for s in sellers_info_result.data} if sellers_info_result.data else {}
+                if local:
+                    sellers_rows = list(reference_replica.get_many('sellers', seller_ids).values())
+                else:
+                    sellers_info_query = db.table('sellers').select('id, name').in_('id', seller_ids)
+                    sellers_rows = (await sellers_info_query.execute()).data or []
+                sellers_dict = {str(s['id']): s['name'] for s in sellers_rows}
                 
                 # Добавляем название магазина к каждому товару
                 for product in result.data:
                     if product.get('seller_id'):
-                        product['seller_name'] = sellers_dict.get(product['seller_id'], 'Неизвестный')
+                        product['seller_name'] = sellers_dict.get(str(product['seller_id']), 'Неизвестный')
         
-        return templates.TemplateResponse("products.html", {
+        # Миниатюры из общего резолвера (metadata целиком не выбирается)
+        image_urls = await thumbnails.product_urls(db, [product['id'] for product in result.data or []])
+        for product in result.data or []:
+            product['image_url'] = image_urls.get(product['id'])
+        
+        product_rows = row_fragments.render_rows(
+            templates.env, "partials/product_row.html", "product", result.data or [],
+            version_fields=('updated_at', 'image_url', 'seller_name')
+        )
+        
+        response = templates.TemplateResponse("products.html", {
             "request": request,
             "products": result.data,
+            "product_rows": product_rows,
             "total": result.count,
             "page": page,
             "total_pages": total_pages,
+            "next_cursor": page_result.next_cursor,
             "active_page": "products",
             "search_term": search,
             "sellers": sellers,
             "selected_seller_id": seller_id
         })
         
+        return validator.apply(response)
+        
     except Exception as e:
         logger.error(f"Products list error: {e}")
         return templates.TemplateResponse("error.html", {
@@ -1386,7 +976,7 @@ async def new_product_form(request: Request):
 @app.post("/crm/products/new")
 async def create_product(
     request: Request,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Create a new product with composition"""
     try:
@@ -1404,7 +994,7 @@ async def create_product(
             "name": data['name'],
             "slug": slug,
             "price": float(data['price']),
-            "quantity": data.get('quantity', 0),
+            "quantity": 0,  # initial stock is recorded in the ledger below
             "description": data.get('description'),
             "category_id": data.get('category_id'),
             "is_active": data.get('is_active', True),
@@ -1415,21 +1005,28 @@ async def create_product(
         }
         
         # Insert product into database
-        result = db.table('products').insert(new_product).execute()
+        result = await db.table('products').insert(new_product).execute()
         
         if result.data:
             product_id = result.data[0]['id']
             logger.info(f"Created new product: {product_id}")
+            autocomplete.invalidate('product', [product_id])
+            
+            if data.get('quantity'):
+                await apply_stock_movements(db, [
+                    StockMovement('product', product_id, 'count', count=int(data['quantity']), reason='Initial stock')
+                ])
             
             # Save composition if provided
             if composition and isinstance(composition, list):
                 for item in composition:
                     if item.get('flower_id') and item.get('amount'):
-                        db.table('product_composition').insert({
+                        await db.table('product_composition').insert({
                             'product_id': product_id,
                             'flower_id': item['flower_id'],
                             'amount': item['amount']
                         }).execute()
+                bom_index.invalidate()
             
             return {"id": product_id, "status": "success"}
         else:
@@ -1443,13 +1040,13 @@ async def create_product(
 async def product_detail(
     request: Request,
     product_id: str,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Product detail page"""
     
     try:
         # Get product
-        product_result = db.table('products')\
+        product_result = await db.table('products')\
             .select('*')\
             .eq('id', product_id)\
             .single()\
@@ -1458,8 +1055,19 @@ async def product_detail(
         if not product_result.data:
             raise HTTPException(status_code=404, detail="Product not found")
         
+        # Validator from the product row; composition edits bump the product generation
+        validator = PageValidator(
+            make_etag(
+                product_id, product_result.data.get('updated_at'),
+                row_fragments.generation('product', product_id)
+            ),
+            product_result.data.get('updated_at')
+        )
+        if validator.matches(request):
+            return validator.not_modified()
+        
         # Get product composition
-        composition_result = db.table('product_composition')\
+        composition_result = await db.table('product_composition')\
             .select('*, flowers(id, xml_id, name)')\
             .eq('product_id', product_id)\
             .order('amount', desc=True)\
@@ -1476,7 +1084,7 @@ async def product_detail(
         # Get seller info if available
         seller = None
         if product_result.data.get('seller_id'):
-            seller_result = db.table('sellers')\
+            seller_result = await db.table('sellers')\
                 .select('*')\
                 .eq('id', product_result.data['seller_id'])\
                 .single()\
@@ -1484,13 +1092,14 @@ async def product_detail(
             if seller_result.data:
                 seller = seller_result.data
         
-        return templates.TemplateResponse("product_detail.html", {
+        response = templates.TemplateResponse("product_detail.html", {
             "request": request,
             "product": product_result.data,
             "composition": composition,
             "seller": seller,
             "active_page": "products"
         })
+        return validator.apply(response)
         
     except HTTPException:
         raise
@@ -1506,12 +1115,12 @@ async def product_detail(
 async def edit_product_form(
     request: Request,
     product_id: str,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Product edit form"""
     
     try:
-        product_result = db.table('products')\
+        product_result = await db.table('products')\
             .select('*')\
             .eq('id', product_id)\
             .single()\
@@ -1521,7 +1130,7 @@ async def edit_product_form(
             raise HTTPException(status_code=404, detail="Product not found")
         
         # Get product composition
-        composition_result = db.table('product_composition')\
+        composition_result = await db.table('product_composition')\
             .select('*, flowers(id, xml_id, name)')\
             .eq('product_id', product_id)\
             .order('amount', desc=True)\
@@ -1557,7 +1166,7 @@ async def edit_product_form(
 async def update_product(
     product_id: str,
     request: Request,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Update product with composition"""
     
@@ -1566,7 +1175,7 @@ async def update_product(
         form_data = await request.form()
         
         # Get current product to preserve metadata
-        current = db.table('products').select('metadata').eq('id', product_id).single().execute()
+        current = await db.table('products').select('metadata').eq('id', product_id).single().execute()
         current_metadata = current.data.get('metadata', {}) if current.data else {}
         
         # Parse composition data from hidden input
@@ -1577,30 +1186,34 @@ async def update_product(
             composition = []
             logger.warning(f"Invalid composition data: {composition_data}")
         
-        # Update product
-        db.table('products').update({
+        # Update product (quantity goes through the stock ledger)
+        await db.table('products').update({
             'name': form_data.get('name'),
             'price': float(form_data.get('price', 0)),
-            'quantity': int(form_data.get('quantity', 0)),
             'description': form_data.get('description'),
             'metadata': current_metadata,
             'is_active': form_data.get('is_active') == 'true',
             'updated_at': datetime.now().isoformat()
         }).eq('id', product_id).execute()
+        await apply_stock_movements(db, [
+            StockMovement('product', product_id, 'count', count=int(form_data.get('quantity', 0)), reason='Product edit')
+        ])
         
         # Update composition
         # First, delete existing composition
-        db.table('product_composition').delete().eq('product_id', product_id).execute()
+        await db.table('product_composition').delete().eq('product_id', product_id).execute()
         
         # Then add new composition
         if composition and isinstance(composition, list):
             for item in composition:
                 if item.get('flower_id') and item.get('amount'):
-                    db.table('product_composition').insert({
+                    await db.table('product_composition').insert({
                         'product_id': product_id,
                         'flower_id': item['flower_id'],
                         'amount': item['amount']
                     }).execute()
+        bom_index.invalidate()
+        invalidate_product_views([product_id])
         
         return RedirectResponse("/crm/products", status_code=303)
         
@@ -1611,13 +1224,13 @@ async def update_product(
 @app.delete("/api/products/{product_id}")
 async def delete_product(
     product_id: str,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Delete product and its composition"""
     
     try:
         # First check if product exists
-        product_result = db.table('products')\
+        product_result = await db.table('products')\
             .select('id, name')\
             .eq('id', product_id)\
             .single()\
@@ -1629,10 +1242,12 @@ async def delete_product(
         product_name = product_result.data['name']
         
         # Delete composition first (foreign key constraint)
-        db.table('product_composition').delete().eq('product_id', product_id).execute()
+        await db.table('product_composition').delete().eq('product_id', product_id).execute()
         
         # Delete the product
-        result = db.table('products').delete().eq('id', product_id).execute()
+        result = await db.table('products').delete().eq('id', product_id).execute()
+        bom_index.invalidate()
+        invalidate_product_views([product_id])
         
         logger.info(f"Deleted product {product_id}: {product_name}")
         
@@ -1701,13 +1316,13 @@ async def sync_product_status_to_bitrix(bitrix_id: str, is_active: bool):
 @app.post("/api/products/{product_id}/activate")
 async def activate_product(
     product_id: str,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Активировать товар"""
     
     try:
         # Проверяем что товар существует и получаем его metadata
-        product_result = db.table('products')\
+        product_result = await db.table('products')\
             .select('id, name, is_active, metadata')\
             .eq('id', product_id)\
             .single()\
@@ -1730,13 +1345,15 @@ async def activate_product(
             }
         
         # Активируем товар в Supabase
-        result = db.table('products')\
+        result = await db.table('products')\
             .update({
                 'is_active': True,
                 'updated_at': datetime.utcnow().isoformat()
             })\
             .eq('id', product_id)\
             .execute()
+        row_fragments.invalidate('product', [product_id])
+        autocomplete.invalidate('product', [product_id])
         
         logger.info(f"Activated product {product_id}: {product_name}")
         
@@ -1760,13 +1377,13 @@ async def activate_product(
 @app.post("/api/products/{product_id}/deactivate")
 async def deactivate_product(
     product_id: str,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Деактивировать товар"""
     
     try:
         # Проверяем что товар существует и получаем его metadata
-        product_result = db.table('products')\
+        product_result = await db.table('products')\
             .select('id, name, is_active, metadata')\
             .eq('id', product_id)\
             .single()\
@@ -1789,13 +1406,15 @@ async def deactivate_product(
             }
         
         # Деактивируем товар в Supabase
-        result = db.table('products')\
+        result = await db.table('products')\
             .update({
                 'is_active': False,
                 'updated_at': datetime.utcnow().isoformat()
             })\
             .eq('id', product_id)\
             .execute()
+        row_fragments.invalidate('product', [product_id])
+        autocomplete.invalidate('product', [product_id])
         
         logger.info(f"Deactivated product {product_id}: {product_name}")
         
@@ -1851,13 +1470,13 @@ async def sync_product_availability_to_bitrix(bitrix_id: str, is_available: bool
 @app.post("/api/products/{product_id}/set-available")
 async def set_product_available(
     product_id: str,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Сделать товар доступным (в наличии)"""
     
     try:
         # Проверяем что товар существует и получаем его metadata
-        product_result = db.table('products')\
+        product_result = await db.table('products')\
             .select('id, name, metadata')\
             .eq('id', product_id)\
             .execute()
@@ -1879,13 +1498,15 @@ async def set_product_available(
         metadata['properties']['IN_STOCK'] = '158'  # В наличии
         
         # Обновляем товар в базе данных
-        db.table('products')\
+        await db.table('products')\
             .update({
                 'metadata': metadata,
                 'updated_at': datetime.now().isoformat()
             })\
             .eq('id', product_id)\
             .execute()
+        row_fragments.invalidate('product', [product_id])
+        autocomplete.invalidate('product', [product_id])
         
         # Получаем bitrix_id для синхронизации
         bitrix_id = None
@@ -1917,13 +1538,13 @@ async def set_product_available(
 @app.post("/api/products/{product_id}/set-unavailable")
 async def set_product_unavailable(
     product_id: str,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Сделать товар недоступным (нет в наличии)"""
     
     try:
         # Проверяем что товар существует и получаем его metadata
-        product_result = db.table('products')\
+        product_result = await db.table('products')\
             .select('id, name, metadata')\
             .eq('id', product_id)\
             .execute()
@@ -1945,13 +1566,15 @@ async def set_product_unavailable(
         metadata['properties']['IN_STOCK'] = '159'  # Нет в наличии
         
         # Обновляем товар в базе данных
-        db.table('products')\
+        await db.table('products')\
             .update({
                 'metadata': metadata,
                 'updated_at': datetime.now().isoformat()
             })\
             .eq('id', product_id)\
             .execute()
+        row_fragments.invalidate('product', [product_id])
+        autocomplete.invalidate('product', [product_id])
         
         # Получаем bitrix_id для синхронизации
         bitrix_id = None
@@ -1990,7 +1613,7 @@ async def inventory_management(
     request: Request,
     search: Optional[str] = None,
     page: int = 1,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Inventory management page for flowers"""
     
@@ -1999,7 +1622,7 @@ async def inventory_management(
         offset = (page - 1) * limit
         
         # Build query for flowers with stock information
-        query = db.table('flowers').select('id, name, name_en, quantity, is_active, updated_at', count='exact')
+        query = db.table('flowers').select('id, name, name_en, quantity, is_active, updated_at')
         
         # Apply search filter
         if search:
@@ -2010,11 +1633,17 @@ async def inventory_management(
         query = query.order('quantity', desc=False).order('name')
         query = query.range(offset, offset + limit - 1)
         
-        result = query.execute()
+        result = await execute_counted(query, app_config.INVENTORY_COUNT_STRATEGY)
         total_pages = (result.count // limit) + (1 if result.count % limit > 0 else 0)
         
-        # Get total count of flower types
-        total_flowers = db.table('flowers').select('*', count='exact').execute().count
+        # Get total count of flower types (without search it is the same total)
+        if search:
+            total_flowers = (await execute_counted(
+                db.table('flowers').select('id').limit(1),
+                app_config.INVENTORY_COUNT_STRATEGY
+            )).count
+        else:
+            total_flowers = result.count
         
         return templates.TemplateResponse("inventory.html", {
             "request": request,
@@ -2037,71 +1666,71 @@ async def inventory_management(
             "active_page": "inventory"
         })
 
+async def load_flowers(db: AsyncSupabase, search: Optional[str] = None) -> List[dict]:
+    """All flowers by name (local replica when enabled, see core/replica.py)"""
+    if await reference_replica.ready(db):
+        return reference_replica.rows('flowers', search=search)
+    
+    query = db.table('flowers').select('*').order('name')
+    
+    if search:
+        query = query.ilike('name', f'%{search}%')
+    
+    return (await query.execute()).data or []
+
+async def load_warehouse_stats(db: AsyncSupabase, search: Optional[str] = None) -> dict:
+    """Flowers with composition usage statistics for warehouse.html"""
+    # Composition statistics are kept per flower in memory and recomputed only after the BOM
+    # index reloads (core/flower_stats.py); the depletion forecast reloads alongside when stale
+    flowers, _, _ = await asyncio.gather(
+        load_flowers(db, search),
+        flower_usage.ensure_loaded(db),
+        depletion_forecast.ensure_loaded(db)
+    )
+    forecasts = depletion_forecast.forecast(flowers)
+    
+    warehouse_stats = [
+        {
+            'flower': flower,
+            **flower_usage.get(flower['id']),
+            'forecast': forecasts.get(flower['id'])
+        }
+        for flower in flowers
+    ]
+    
+    # Sort by most used flowers
+    warehouse_stats.sort(key=lambda x: x['total_used'], reverse=True)
+    
+    return {
+        "warehouse_stats": warehouse_stats,
+        "total_flowers": len(warehouse_stats),
+        "running_out": sum(1 for forecast in forecasts.values() if forecast['runs_out_before_delivery']),
+        "lead_days": depletion_forecast.lead_days
+    }
+
 @app.get("/crm/warehouse", response_class=HTMLResponse)
 async def warehouse_dashboard(
     request: Request,
     search: Optional[str] = None,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Warehouse (Склад) dashboard showing all flowers with usage statistics"""
     
+    if app_config.STREAM_HTML:
+        # Page shell is sent first; warehouse.html awaits load_warehouse() while streaming
+        return streaming_templates.TemplateResponse("warehouse.html", {
+            "request": request,
+            "load_warehouse": lambda: load_warehouse_stats(db, search),
+            "search": search or "",
+            "active_page": "warehouse"
+        })
+    
     try:
-        # Get all flowers
-        query = db.table('flowers').select('*').order('name')
-        
-        if search:
-            query = query.ilike('name', f'%{search}%')
-        
-        flowers_result = query.execute()
-        
-        # OPTIMIZED: Get all composition statistics in one query
-        all_compositions = db.table('product_composition')\
-            .select('flower_id, amount, products(id, name, metadata)')\
-            .execute()
-        
-        # Group compositions by flower_id for fast lookup
-        composition_by_flower = {}
-        for comp in all_compositions.data:
-            flower_id = comp['flower_id']
-            if flower_id not in composition_by_flower:
-                composition_by_flower[flower_id] = []
-            composition_by_flower[flower_id].append(comp)
-        
-        # Build warehouse statistics
-        warehouse_stats = []
-        
-        for flower in flowers_result.data:
-            flower_compositions = composition_by_flower.get(flower['id'], [])
-            
-            # Calculate statistics from the grouped data
-            total_used = sum(comp['amount'] for comp in flower_compositions)
-            products_count = len(flower_compositions)
-            
-            # Get recent products that use this flower (limit to 5)
-            recent_usage = []
-            for comp in flower_compositions[:5]:  # Take only first 5
-                if comp.get('products'):
-                    recent_usage.append({
-                        'product_name': comp['products']['name'],
-                        'amount': comp['amount']
-                    })
-            
-            warehouse_stats.append({
-                'flower': flower,
-                'total_used': total_used,
-                'products_count': products_count,
-                'recent_usage': recent_usage
-            })
-        
-        # Sort by most used flowers
-        warehouse_stats.sort(key=lambda x: x['total_used'], reverse=True)
-        
         return templates.TemplateResponse("warehouse.html", {
             "request": request,
-            "warehouse_stats": warehouse_stats,
+            **await load_warehouse_stats(db, search),
             "search": search or "",
-            "active_page": "warehouse",
-            "total_flowers": len(warehouse_stats)
+            "active_page": "warehouse"
         })
         
     except Exception as e:
@@ -2119,43 +1748,56 @@ async def warehouse_dashboard(
 async def flower_detail(
     request: Request,
     flower_id: str,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """
     Детальная страница цветка с возможностью редактирования
     """
     try:
+        # Flower and its compositions joined locally when the replica is enabled (core/replica.py)
+        local = await reference_replica.ready(db)
+        
         # Get flower data
-        flower_result = db.table('flowers')\
-            .select('*')\
-            .eq('id', flower_id)\
-            .limit(1)\
-            .execute()
+        if local:
+            flower = reference_replica.get('flowers', flower_id)
+        else:
+            flower_result = await db.table('flowers')\
+                .select('*')\
+                .eq('id', flower_id)\
+                .limit(1)\
+                .execute()
+            flower = flower_result.data[0] if flower_result.data else None
         
-        if not flower_result.data:
+        if not flower:
             return templates.TemplateResponse("error.html", {
                 "request": request,
                 "error": "Цветок не найден",
                 "active_page": "warehouse"
             })
         
-        flower = flower_result.data[0]
-        
         # Get composition statistics for this flower
-        compositions = db.table('product_composition')\
-            .select('product_id, amount, products(id, name, price, is_active, created_at)')\
-            .eq('flower_id', flower_id)\
-            .execute()
+        if local:
+            compositions = reference_replica.compositions(flower_id=flower_id)
+        else:
+            compositions = (await db.table('product_composition')\
+                .select('product_id, amount, products(id, name, price, is_active, created_at)')\
+                .eq('flower_id', flower_id)\
+                .execute()).data or []
+        
+        # Validator from the flower row and its compositions (the page has no other queries)
+        validator = PageValidator(make_etag(flower, compositions), flower.get('updated_at'))
+        if validator.matches(request):
+            return validator.not_modified()
         
         # Calculate statistics
-        total_used = sum(comp['amount'] for comp in compositions.data)
-        products_count = len(compositions.data)
+        total_used = sum(comp['amount'] for comp in compositions)
+        products_count = len(compositions)
         
         # Prepare products list with details
         products_using_flower = []
         total_products_value = 0
         
-        for comp in compositions.data:
+        for comp in compositions:
             if comp.get('products'):
                 product = comp['products']
                 product_info = {
@@ -2176,7 +1818,7 @@ async def flower_detail(
         # Calculate average usage
         avg_usage = total_used / products_count if products_count > 0 else 0
         
-        return templates.TemplateResponse("flower_detail.html", {
+        response = templates.TemplateResponse("flower_detail.html", {
             "request": request,
             "flower": flower,
             "total_used": total_used,
@@ -2186,6 +1828,7 @@ async def flower_detail(
             "total_products_value": total_products_value,
             "active_page": "warehouse"
         })
+        return validator.apply(response)
         
     except Exception as e:
         logger.error(f"Flower detail error: {e}")
@@ -2199,7 +1842,7 @@ async def flower_detail(
 async def update_flower(
     request: Request,
     flower_id: str,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """
     Обновление данных цветка
@@ -2226,7 +1869,7 @@ async def update_flower(
             })
         
         # Update flower in database
-        result = db.table('flowers')\
+        result = await db.table('flowers')\
             .update(update_data)\
             .eq('id', flower_id)\
             .execute()
@@ -2238,6 +1881,7 @@ async def update_flower(
                 "active_page": "warehouse"
             })
         
+        autocomplete.invalidate('flower', [flower_id])
         logger.info(f"Updated flower {flower_id}: {update_data['name']}")
         
         # Redirect back to flower detail page
@@ -2264,7 +1908,7 @@ async def update_flower(
 async def webhook_bitrix_order(
     request: Request,
     x_webhook_token: Optional[str] = Header(None),
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """
     Webhook endpoint для приема новых/обновленных заказов от Bitrix
@@ -2285,6 +1929,8 @@ async def webhook_bitrix_order(
         
         # Обрабатываем webhook
         result = await handler.handle_order_webhook(data)
+        if result.get('order_id'):
+            await refresh_order_list_rows(db, order_ids=[result['order_id']])
         
         return result
         
@@ -2296,7 +1942,7 @@ async def webhook_bitrix_order(
 async def webhook_bitrix_status(
     request: Request,
     x_webhook_token: Optional[str] = Header(None),
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """
     Webhook endpoint для приема изменений статуса заказа от Bitrix
@@ -2312,6 +1958,8 @@ async def webhook_bitrix_status(
     try:
         data = await request.json()
         result = await handler.handle_status_webhook(data)
+        if result.get('order_id'):
+            await refresh_order_list_rows(db, order_ids=[result['order_id']])
         return result
         
     except Exception as e:
@@ -2319,14 +1967,14 @@ async def webhook_bitrix_status(
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/sync/status")
-async def get_sync_status(db: Client = Depends(get_supabase)):
+async def get_sync_status(db: AsyncSupabase = Depends(get_supabase)):
     """
     API endpoint для получения статуса синхронизации
     """
     from webhook_handler import WebhookHandler
     
     handler = WebhookHandler(db)
-    stats = handler.get_sync_statistics()
+    stats = await handler.get_sync_statistics()
     
     return stats
 
@@ -2334,11 +1982,11 @@ async def get_sync_status(db: Client = Depends(get_supabase)):
 
 @app.get("/api/flowers")
 async def get_flowers(
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Get all active flowers from dictionary"""
     try:
-        result = db.table('flowers')\
+        result = await db.table('flowers')\
             .select('*')\
             .eq('is_active', True)\
             .order('sort_order')\
@@ -2353,17 +2001,26 @@ async def get_flowers(
 @app.post("/api/flowers", status_code=201)
 async def create_flower(
     flower_data: dict,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Create a new flower in dictionary"""
     try:
-        result = db.table('flowers')\
+        # Initial stock is recorded in the ledger, not written into the row
+        quantity = flower_data.pop('quantity', None)
+        result = await db.table('flowers')\
             .insert(flower_data)\
             .execute()
         
         if result.data:
             logger.info(f"Created flower: {flower_data.get('name')} ({flower_data.get('xml_id')})")
-            return result.data[0]
+            flower = result.data[0]
+            autocomplete.invalidate('flower', [flower['id']])
+            if quantity:
+                stock = await apply_stock_movements(db, [
+                    StockMovement('flower', flower['id'], 'count', count=int(quantity), reason='Initial stock')
+                ])
+                flower['quantity'] = stock['items'][0]['new_quantity']
+            return flower
         else:
             raise HTTPException(status_code=400, detail="Failed to create flower")
             
@@ -2373,7 +2030,7 @@ async def create_flower(
 
 @app.post("/api/flowers/bulk_update_names")
 async def bulk_update_flower_names(
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Mass update flower names from English to Russian"""
     try:
@@ -2431,7 +2088,7 @@ async def bulk_update_flower_names(
         
         for english_name, russian_name in translations.items():
             # Find and update flowers with English names
-            result = db.table('flowers')\
+            result = await db.table('flowers')\
                 .update({'name': russian_name})\
                 .eq('name', english_name)\
                 .execute()
@@ -2440,6 +2097,8 @@ async def bulk_update_flower_names(
                 updated_count += len(result.data)
                 logger.info(f"Updated '{english_name}' to '{russian_name}'")
         
+        if updated_count:
+            autocomplete.invalidate('flower')
         return {
             "success": True,
             "updated_count": updated_count,
@@ -2452,17 +2111,18 @@ async def bulk_update_flower_names(
 
 @app.post("/api/flowers/fix_encoding")
 async def fix_flower_encoding(
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Fix encoding issues by deactivating corrupted records"""
     try:
         # Deactivate the corrupted garden-peonies record
-        result = db.table('flowers')\
+        result = await db.table('flowers')\
             .update({'is_active': False})\
             .eq('xml_id', 'garden-peonies')\
             .execute()
         
         deactivated_count = len(result.data) if result.data else 0
+        autocomplete.invalidate('flower', [flower['id'] for flower in result.data or []])
         
         return {
             "success": True,
@@ -2479,20 +2139,23 @@ async def fix_flower_encoding(
 @app.get("/api/products/{product_id}/composition")
 async def get_product_composition(
     product_id: str,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Get composition for a product"""
     try:
-        # Get composition with flower details
-        result = db.table('product_composition')\
-            .select('*, flowers(id, xml_id, name)')\
-            .eq('product_id', product_id)\
-            .order('amount', desc=True)\
-            .execute()
+        # Get composition with flower details (joined locally when the replica is enabled)
+        if await reference_replica.ready(db):
+            items = reference_replica.compositions(product_id=product_id)
+        else:
+            items = (await db.table('product_composition')\
+                .select('*, flowers(id, xml_id, name)')\
+                .eq('product_id', product_id)\
+                .order('amount', desc=True)\
+                .execute()).data or []
         
         # Format response
         composition = []
-        for item in result.data:
+        for item in items:
             if item.get('flowers'):
                 composition.append({
                     'id': item['id'],
@@ -2511,12 +2174,12 @@ async def get_product_composition(
 async def update_product_composition(
     product_id: str,
     composition: List[ProductCompositionRequest],
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Update product composition"""
     try:
         # Delete existing composition
-        db.table('product_composition')\
+        await db.table('product_composition')\
             .delete()\
             .eq('product_id', product_id)\
             .execute()
@@ -2531,9 +2194,12 @@ async def update_product_composition(
                     'amount': item.amount
                 })
             
-            result = db.table('product_composition')\
+            result = await db.table('product_composition')\
                 .insert(new_items)\
                 .execute()
+        # Compositions changed: BOM index and product page ETag (core/conditional.py)
+        bom_index.invalidate()
+        row_fragments.invalidate('product', [product_id])
         
         return {"status": "success", "message": "Composition updated"}
     except Exception as e:
@@ -2543,16 +2209,18 @@ async def update_product_composition(
 @app.post("/api/product_composition", status_code=201)
 async def create_product_composition(
     composition_data: dict,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Create a single product composition entry"""
     try:
-        result = db.table('product_composition')\
+        result = await db.table('product_composition')\
             .insert(composition_data)\
             .execute()
         
         if result.data:
             logger.info(f"Created composition: product {composition_data.get('product_id')} + flower {composition_data.get('flower_id')}")
+            bom_index.invalidate()
+            row_fragments.invalidate('product', [composition_data.get('product_id')])
             return result.data[0]
         else:
             raise HTTPException(status_code=400, detail="Failed to create composition")
@@ -2566,39 +2234,32 @@ async def create_product_composition(
 @app.get("/api/products/search")
 async def search_products(
     q: str,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
-    """Search products by name for order creation"""
+    """Search products by name for order creation (in-memory, typo and transliteration tolerant)"""
     try:
-        # Search products
-        products = db.table('products')\
-            .select('id, name, price, quantity')\
-            .ilike('name', f'%{q}%')\
-            .eq('is_active', True)\
-            .limit(10)\
-            .execute()
-        
-        return products.data or []
+        await autocomplete.ensure_loaded(db)
+        return autocomplete.products.search(q, 10)
         
     except Exception as e:
         logger.error(f"Product search error: {e}")
         return []
 
 @app.get("/api/orders/stats")
-async def get_order_stats(db: Client = Depends(get_supabase)):
+async def get_order_stats(db: AsyncSupabase = Depends(get_supabase)):
     """API endpoint for order statistics"""
     
     try:
         today = date.today().isoformat()
         
         # Today's orders
-        today_orders = db.table('orders')\
+        today_orders = await db.table('orders')\
             .select('id, total_amount', count='exact')\
             .gte('created_at', today)\
             .execute()
         
         # Orders by status
-        all_orders = db.table('orders')\
+        all_orders = await db.table('orders')\
             .select('status')\
             .execute()
         
@@ -2624,7 +2285,7 @@ async def get_order_stats(db: Client = Depends(get_supabase)):
 @app.get("/crm/sync", response_class=HTMLResponse)
 async def sync_monitoring(
     request: Request,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Страница мониторинга синхронизации"""
     
@@ -2632,15 +2293,15 @@ async def sync_monitoring(
         from webhook_handler import WebhookHandler
         
         handler = WebhookHandler(db)
-        stats = handler.get_sync_statistics()
+        stats = await handler.get_sync_statistics()
         
         # Получаем состояние синхронизации
-        sync_state = db.table('sync_state')\
+        sync_state = await db.table('sync_state')\
             .select('*')\
             .execute()
         
         # Получаем маппинги
-        mappings_count = db.table('sync_mapping')\
+        mappings_count = await db.table('sync_mapping')\
             .select('entity_type', count='exact')\
             .execute()
         
@@ -2663,7 +2324,7 @@ async def sync_monitoring(
 # ==================== FLORISTS API ====================
 
 @app.get("/api/florists")
-async def get_florists(db: Client = Depends(get_supabase)):
+async def get_florists(db: AsyncSupabase = Depends(get_supabase)):
     """Get all florists for Cvetykz shop (Bitrix shop_id 17008)"""
     
     try:
@@ -2671,7 +2332,7 @@ async def get_florists(db: Client = Depends(get_supabase)):
         cvetykz_shop_id = "7f52091f-a6f1-4d23-a2c9-6754109065f4"
         bitrix_shop_id = "17008"
         
-        result = db.table('users')\
+        result = await db.table('users')\
             .select('id, name, email, phone, preferences')\
             .eq('preferences->>shop_id', cvetykz_shop_id)\
             .eq('preferences->>bitrix_shop_id', bitrix_shop_id)\
@@ -2706,7 +2367,7 @@ async def get_florists(db: Client = Depends(get_supabase)):
 async def assign_florist(
     order_id: str,
     florist_id: str = Form(...),
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Assign florist to order"""
     
@@ -2715,7 +2376,7 @@ async def assign_florist(
         cvetykz_shop_id = "7f52091f-a6f1-4d23-a2c9-6754109065f4"
         bitrix_shop_id = "17008"
         
-        florist_result = db.table('users')\
+        florist_result = await db.table('users')\
             .select('id, name, preferences')\
             .eq('id', florist_id)\
             .eq('preferences->>shop_id', cvetykz_shop_id)\
@@ -2731,7 +2392,7 @@ async def assign_florist(
         florist_name = florist['name']
         
         # Update order with responsible florist
-        db.table('orders')\
+        await db.table('orders')\
             .update({
                 'responsible_id': florist_id,
                 'responsible_name': florist_name,
@@ -2739,6 +2400,7 @@ async def assign_florist(
             })\
             .eq('id', order_id)\
             .execute()
+        await refresh_order_list_rows(db, order_ids=[order_id])
         
         logger.info(f"Assigned florist {florist_name} to order {order_id}")
         return {
@@ -2760,13 +2422,18 @@ async def assign_florist(
 
 @app.get("/api/products")
 async def api_get_products(
-    db: Client = Depends(get_supabase),
+    response: Response,
+    db: AsyncSupabase = Depends(get_supabase),
     skip: int = 0,
     limit: int = 100,
     include_inactive: bool = False,
-    seller_id: Optional[str] = None
+    seller_id: Optional[str] = None,
+    cursor: Optional[str] = None
 ):
-    """Get all products via API"""
+    """
+    Get all products via API
+    Next page: pass the X-Next-Cursor response header as ?cursor=... (skip is an offset fallback)
+    """
     try:
         query = db.table('products').select('*')
         
@@ -2778,8 +2445,16 @@ async def api_get_products(
         if seller_id:
             query = query.eq('seller_id', seller_id)
         
-        result = query.range(skip, skip + limit - 1).execute()
+        if cursor or not skip:
+            page_result = await fetch_page(query, PRODUCTS_KEYSET, limit, cursor)
+            if page_result.next_cursor:
+                response.headers['X-Next-Cursor'] = page_result.next_cursor
+            return page_result.data
+        
+        result = await query.keyset(PRODUCTS_KEYSET).range(skip, skip + limit - 1).execute()
         return result.data
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"API get products error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -2788,20 +2463,22 @@ async def api_get_products(
 @app.patch("/api/products/{product_id}/activate")
 async def activate_product(
     product_id: str,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Activate a single product"""
     try:
         # Check if product exists
-        product = db.table('products').select('*').eq('id', product_id).execute()
+        product = await db.table('products').select('*').eq('id', product_id).execute()
         if not product.data:
             raise HTTPException(status_code=404, detail="Product not found")
         
         # Update product status
-        result = db.table('products')\
+        result = await db.table('products')\
             .update({'is_active': True})\
             .eq('id', product_id)\
             .execute()
+        row_fragments.invalidate('product', [product_id])
+        autocomplete.invalidate('product', [product_id])
         
         # Sync to Bitrix if enabled
         if app_config.BITRIX_SYNC_ENABLED and product.data[0].get('bitrix_product_id'):
@@ -2823,20 +2500,22 @@ async def activate_product(
 @app.patch("/api/products/{product_id}/deactivate")
 async def deactivate_product(
     product_id: str,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Deactivate a single product"""
     try:
         # Check if product exists
-        product = db.table('products').select('*').eq('id', product_id).execute()
+        product = await db.table('products').select('*').eq('id', product_id).execute()
         if not product.data:
             raise HTTPException(status_code=404, detail="Product not found")
         
         # Update product status
-        result = db.table('products')\
+        result = await db.table('products')\
             .update({'is_active': False})\
             .eq('id', product_id)\
             .execute()
+        row_fragments.invalidate('product', [product_id])
+        autocomplete.invalidate('product', [product_id])
         
         # Sync to Bitrix if enabled
         if app_config.BITRIX_SYNC_ENABLED and product.data[0].get('bitrix_product_id'):
@@ -2858,7 +2537,7 @@ async def deactivate_product(
 @app.post("/api/products/bulk-activate")
 async def bulk_activate_products(
     product_ids: List[str],
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Activate multiple products at once"""
     try:
@@ -2866,10 +2545,12 @@ async def bulk_activate_products(
             raise HTTPException(status_code=400, detail="No product IDs provided")
         
         # Update all products
-        result = db.table('products')\
+        result = await db.table('products')\
             .update({'is_active': True})\
             .in_('id', product_ids)\
             .execute()
+        row_fragments.invalidate('product', product_ids)
+        autocomplete.invalidate('product', product_ids)
         
         activated_count = len(result.data) if result.data else 0
         
@@ -2901,7 +2582,7 @@ async def bulk_activate_products(
 @app.post("/api/products/bulk-deactivate")
 async def bulk_deactivate_products(
     product_ids: List[str],
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Deactivate multiple products at once"""
     try:
@@ -2909,10 +2590,12 @@ async def bulk_deactivate_products(
             raise HTTPException(status_code=400, detail="No product IDs provided")
         
         # Update all products
-        result = db.table('products')\
+        result = await db.table('products')\
             .update({'is_active': False})\
             .in_('id', product_ids)\
             .execute()
+        row_fragments.invalidate('product', product_ids)
+        autocomplete.invalidate('product', product_ids)
         
         deactivated_count = len(result.data) if result.data else 0
         
@@ -2944,7 +2627,7 @@ async def bulk_deactivate_products(
 @app.post("/api/orders")
 async def api_create_order(
     order_data: dict,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Create a new order via API"""
     try:
@@ -2956,14 +2639,14 @@ async def api_create_order(
         logger.info(f"Generated new order number: {new_number}")
         
         # Check if number already exists in Supabase
-        existing_order = db.table('orders').select('id').eq('order_number', new_number).execute()
+        existing_order = await db.table('orders').select('id').eq('order_number', new_number).execute()
         if existing_order.data:
             # If exists, use local prefix to avoid conflicts
             new_number = order_number_generator.generate_local_order_number()
             logger.warning(f"Order number collision detected, using local number: {new_number}")
         
         # Validate and update inventory first
-        inventory_result = await validate_and_update_inventory(order_data.get('items', []), db, operation="reserve")
+        inventory_result = await update_inventory(order_data.get('items', []), db, operation="reserve")
         if not inventory_result['success']:
             raise HTTPException(status_code=400, detail=f"Inventory error: {inventory_result['error']}")
         
@@ -2977,6 +2660,7 @@ async def api_create_order(
             "status": order_data.get('status', 'new'),
             "recipient_name": order_data.get('recipient_name', order_data.get('customer_name')),
             "recipient_phone": order_data.get('recipient_phone', order_data.get('customer_phone')),
+            "recipient_phone_digits": phone_digits(order_data.get('recipient_phone', order_data.get('customer_phone'))),
             "delivery_address": order_data.get('delivery_address'),
             "delivery_date": order_data.get('delivery_date'),
             "delivery_time": order_data.get('delivery_time'),
@@ -2995,8 +2679,10 @@ async def api_create_order(
             "updated_at": datetime.utcnow().isoformat()
         }
         
+        new_order.update(derive_order_flags(new_order))
+        
         # Insert order
-        order_result = db.table('orders').insert(new_order).execute()
+        order_result = await db.table('orders').insert(new_order).execute()
         
         if order_result.data:
             order_id = order_result.data[0]['id']
@@ -3015,8 +2701,9 @@ async def api_create_order(
                             "price": item.get('price', 0)
                         }
                     }
-                    db.table('order_items').insert(order_item).execute()
+                    await db.table('order_items').insert(order_item).execute()
                 
+                await refresh_order_list_rows(db, order_ids=[order_id])
                 logger.info(f"API created order: {order_id} with number {new_number} (inventory reserved: {len(inventory_result['updates'])} products)")
                 return {
                     "success": True,
@@ -3029,13 +2716,13 @@ async def api_create_order(
                 }
                 
             except Exception as e:
-                # If order items creation fails, rollback inventory changes
+                # If order items creation fails, roll back the reservation
                 logger.error(f"API order items creation failed, rolling back inventory: {e}")
-                await validate_and_update_inventory(order_data.get('items', []), db, operation="release")
+                await rollback_reservation(db, inventory_result, order_data.get('items', []))
                 raise e
         else:
-            # If order creation fails, rollback inventory changes
-            await validate_and_update_inventory(order_data.get('items', []), db, operation="release")
+            # If order creation fails, roll back the reservation
+            await rollback_reservation(db, inventory_result, order_data.get('items', []))
             raise HTTPException(status_code=400, detail="Failed to create order")
             
     except Exception as e:
@@ -3045,18 +2732,29 @@ async def api_create_order(
 
 @app.get("/api/orders")
 async def api_get_orders(
-    db: Client = Depends(get_supabase),
+    response: Response,
+    db: AsyncSupabase = Depends(get_supabase),
     skip: int = 0,
-    limit: int = 100
+    limit: int = 100,
+    cursor: Optional[str] = None
 ):
-    """Get all orders via API"""
+    """
+    Get all orders via API
+    Next page: pass the X-Next-Cursor response header as ?cursor=... (skip is an offset fallback)
+    """
     try:
-        result = db.table('orders')\
-            .select('*, order_items(*)')\
-            .order('created_at', desc=True)\
-            .range(skip, skip + limit - 1)\
-            .execute()
+        query = db.table('orders').select('*, order_items(*)')
+        
+        if cursor or not skip:
+            page_result = await fetch_page(query, ORDERS_KEYSET, limit, cursor)
+            if page_result.next_cursor:
+                response.headers['X-Next-Cursor'] = page_result.next_cursor
+            return page_result.data
+        
+        result = await query.keyset(ORDERS_KEYSET).range(skip, skip + limit - 1).execute()
         return result.data
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"API get orders error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -3068,7 +2766,7 @@ async def api_get_orders(
 async def upload_pre_delivery_photos(
     order_id: str,
     photos: List[UploadFile] = File(...),
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """
     Upload pre-delivery photos for an order and automatically change status to 'assembled'
@@ -3076,7 +2774,7 @@ async def upload_pre_delivery_photos(
     """
     try:
         # 1. Проверяем существование заказа и его статус
-        order_result = db.table('orders').select('*').eq('id', order_id).execute()
+        order_result = await db.table('orders').select('*').eq('id', order_id).execute()
         if not order_result.data:
             raise HTTPException(status_code=404, detail="Заказ не найден")
         
@@ -3121,11 +2819,12 @@ async def upload_pre_delivery_photos(
         current_photos = order.get('pre_delivery_photos', [])
         all_photos = current_photos + saved_photos
         
-        update_result = db.table('orders').update({
+        update_result = await db.table('orders').update({
             'pre_delivery_photos': all_photos,
             'status': 'assembled',  # Автоматическая смена статуса!
             'updated_at': datetime.now().isoformat()
         }).eq('id', order_id).execute()
+        await refresh_order_list_rows(db, order_ids=[order_id])
         
         logger.info(f"Pre-delivery photos uploaded for order {order_id}, status changed to 'assembled'")
         
@@ -3166,11 +2865,11 @@ async def upload_pre_delivery_photos(
 @app.get("/api/orders/{order_id}/pre-delivery-photos")
 async def get_pre_delivery_photos(
     order_id: str,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Get pre-delivery photos for an order"""
     try:
-        result = db.table('orders').select('pre_delivery_photos').eq('id', order_id).execute()
+        result = await db.table('orders').select('pre_delivery_photos').eq('id', order_id).execute()
         if not result.data:
             raise HTTPException(status_code=404, detail="Заказ не найден")
         
@@ -3188,12 +2887,12 @@ async def get_pre_delivery_photos(
 async def delete_pre_delivery_photo(
     order_id: str,
     photo_index: int,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Delete a specific pre-delivery photo by index"""
     try:
         # Получаем заказ
-        result = db.table('orders').select('pre_delivery_photos').eq('id', order_id).execute()
+        result = await db.table('orders').select('pre_delivery_photos').eq('id', order_id).execute()
         if not result.data:
             raise HTTPException(status_code=404, detail="Заказ не найден")
         
@@ -3211,7 +2910,7 @@ async def delete_pre_delivery_photo(
         photos.pop(photo_index)
         
         # Обновляем в БД
-        db.table('orders').update({
+        await db.table('orders').update({
             'pre_delivery_photos': photos,
             'updated_at': datetime.now().isoformat()
         }).eq('id', order_id).execute()
@@ -3228,14 +2927,33 @@ async def delete_pre_delivery_photo(
 
 # ==================== WEBHOOKS ====================
 
+# One column set for every orders-by-bitrix_order_id lookup in the webhook,
+# so repeated lookups within a request are served from the DataLoader cache
+WEBHOOK_ORDER_LOOKUP_COLUMNS = 'id, status, recipient_phone, delivery_address'
+
+# Webhook results that did not write the order
+WEBHOOK_NOOP_ACTIONS = ('skipped_duplicate', 'no_changes', 'unknown_event')
+
 @app.post("/webhooks/bitrix/order")
 async def webhook_bitrix_order(
     request: Request,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """
     Handle webhook from Bitrix for order creation/update
     """
+    result = await _process_bitrix_order_webhook(request, db)
+
+    # Drop rendered list rows of the written order (the projection itself follows the triggers)
+    if result.get('status') == 'success' and result.get('action') not in WEBHOOK_NOOP_ACTIONS:
+        bitrix_order_id = str(result.get('order_id') or '')
+        if bitrix_order_id.isdigit():
+            await refresh_order_list_rows(db, bitrix_order_ids=[int(bitrix_order_id)])
+    return result
+
+
+async def _process_bitrix_order_webhook(request: Request, db: AsyncSupabase) -> dict:
+    """Body of /webhooks/bitrix/order: validates, transforms and writes the order"""
     data = {}  # Initialize data variable
     try:
         # Get request body
@@ -3290,7 +3008,7 @@ async def webhook_bitrix_order(
             logger.info(f"Processing order update/status change for order {data.get('ID')}")
             
             # Check if order exists in Supabase
-            existing = db.table('orders').select('id, status').eq('bitrix_order_id', data['ID']).execute()
+            existing = await db.table('orders').select(WEBHOOK_ORDER_LOOKUP_COLUMNS).eq('bitrix_order_id', data['ID']).execute()
             
             if not existing.data:
                 logger.warning(f"Order {data.get('ID')} not found in Supabase for update")
@@ -3316,7 +3034,7 @@ async def webhook_bitrix_order(
             
             if update_data and existing.data:
                 # Update existing order
-                result = db.table('orders').update(update_data).eq('bitrix_order_id', data['ID']).execute()
+                result = await db.table('orders').update(update_data).eq('bitrix_order_id', data['ID']).execute()
                 
                 # Log status change if it occurred
                 if 'status' in update_data:
@@ -3344,21 +3062,21 @@ async def webhook_bitrix_order(
                 user_data = data['user']
                 
                 # Check if user already exists
-                user_result = db.table('users').select('id').eq('bitrix_user_id', int(bitrix_user_id)).execute()
+                user_result = await db.table('users').select('id').eq('bitrix_user_id', int(bitrix_user_id)).execute()
                 
                 if user_result.data:
                     # Update existing user
                     user_update = transformer.transform_bitrix_user(user_data, bitrix_user_id)
                     del user_update['created_at']  # Don't update creation time
                     
-                    db.table('users').update(user_update).eq('id', user_result.data[0]['id']).execute()
+                    await db.table('users').update(user_update).eq('id', user_result.data[0]['id']).execute()
                     if supabase_order is not None:
                         supabase_order['user_id'] = user_result.data[0]['id']
                     logger.info(f"Updated user {user_result.data[0]['id']} for bitrix_user_id {bitrix_user_id}")
                 else:
                     # Create new user
                     new_user = transformer.transform_bitrix_user(user_data, bitrix_user_id)
-                    user_result = db.table('users').insert(new_user).execute()
+                    user_result = await db.table('users').insert(new_user).execute()
                     
                     if user_result.data:
                         if supabase_order is not None:
@@ -3368,7 +3086,7 @@ async def webhook_bitrix_order(
                         logger.error(f"Failed to create user for bitrix_user_id {bitrix_user_id}")
             elif 'USER_ID' in data and data['USER_ID']:
                 # Fallback: only lookup existing user without user data
-                user_result = db.table('users').select('id').eq('bitrix_user_id', int(data['USER_ID'])).execute()
+                user_result = await db.table('users').select('id').eq('bitrix_user_id', int(data['USER_ID'])).execute()
                 if user_result.data:
                     if supabase_order is not None:
                         supabase_order['user_id'] = user_result.data[0]['id']
@@ -3382,15 +3100,15 @@ async def webhook_bitrix_order(
                 return {"status": "error", "message": "Order data transformation failed", "order_id": data.get('ID')}
             
             # Check if order already exists by bitrix_order_id
-            existing = db.table('orders').select('id').eq('bitrix_order_id', data['ID']).execute()
+            existing = await db.table('orders').select(WEBHOOK_ORDER_LOOKUP_COLUMNS).eq('bitrix_order_id', data['ID']).execute()
             
             if existing.data:
                 # Update existing order
-                result = db.table('orders').update(supabase_order).eq('bitrix_order_id', data['ID']).execute()
+                result = await db.table('orders').update(supabase_order).eq('bitrix_order_id', data['ID']).execute()
                 action = 'update_existing'
             else:
                 # Create new order
-                result = db.table('orders').insert(supabase_order).execute()
+                result = await db.table('orders').insert(supabase_order).execute()
                 action = 'create_order'
             
             # Transform and save order items
@@ -3402,7 +3120,7 @@ async def webhook_bitrix_order(
                     items.append(item)
                 # Delete old items if updating
                 if existing.data:
-                    db.table('order_items').delete().eq('order_id', existing.data[0]['id']).execute()
+                    await db.table('order_items').delete().eq('order_id', existing.data[0]['id']).execute()
                 
                 # Insert new items
                 for item in items:
@@ -3410,7 +3128,7 @@ async def webhook_bitrix_order(
                         item['order_id'] = existing.data[0]['id']
                     else:
                         item['order_id'] = result.data[0]['id']
-                    db.table('order_items').insert(item).execute()
+                    await db.table('order_items').insert(item).execute()
             
             # ====== ОБРАТНАЯ СИНХРОНИЗАЦИЯ В BITRIX ======
             # Проверяем нужно ли выполнять обратную синхронизацию
@@ -3455,7 +3173,7 @@ async def webhook_bitrix_order(
                     # Обновляем bitrix_order_id в Supabase заказе
                     try:
                         if supabase_order_id:
-                            db.table('orders').update({
+                            await db.table('orders').update({
                                 'bitrix_order_id': bitrix_order_id,
                                 'updated_at': datetime.now().isoformat()
                             }).eq('id', supabase_order_id).execute()
@@ -3493,12 +3211,12 @@ async def webhook_bitrix_order(
             logger.info(f"Production order.update data: {json.dumps(data, default=str, ensure_ascii=False)}")
             
             # Получаем текущие данные заказа перед обновлением (для отслеживания изменений)
-            current_order = db.table('orders').select('status, recipient_phone, delivery_address').eq('bitrix_order_id', data['ID']).execute()
+            current_order = await db.table('orders').select(WEBHOOK_ORDER_LOOKUP_COLUMNS).eq('bitrix_order_id', data['ID']).execute()
             previous_status = current_order.data[0]['status'] if current_order.data else None
             
             # Update existing order
             update_data = transformer.transform_bitrix_update(data)
-            result = db.table('orders').update(update_data).eq('bitrix_order_id', data['ID']).execute()
+            result = await db.table('orders').update(update_data).eq('bitrix_order_id', data['ID']).execute()
             
             # Для уведомлений передаем полные данные с номером заказа
             order_id = None
@@ -3529,12 +3247,12 @@ async def webhook_bitrix_order(
             logger.info(f"Processing status change for order {data.get('ID')}")
             
             # Получаем текущие данные заказа перед обновлением (для отслеживания изменений)
-            current_order = db.table('orders').select('status, recipient_phone, delivery_address').eq('bitrix_order_id', data['ID']).execute()
+            current_order = await db.table('orders').select(WEBHOOK_ORDER_LOOKUP_COLUMNS).eq('bitrix_order_id', data['ID']).execute()
             previous_status = current_order.data[0]['status'] if current_order.data else None
             
             # Обновляем статус заказа
             update_data = transformer.transform_bitrix_update(data)
-            result = db.table('orders').update(update_data).eq('bitrix_order_id', data['ID']).execute()
+            result = await db.table('orders').update(update_data).eq('bitrix_order_id', data['ID']).execute()
             
             # Для уведомлений передаем полные данные с номером заказа
             order_id = None
@@ -3578,7 +3296,7 @@ async def webhook_bitrix_order(
 @app.post("/api/inventory/update")
 async def update_product_quantity(
     product_data: dict,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Update quantity for a single product"""
     try:
@@ -3589,30 +3307,23 @@ async def update_product_quantity(
         if not product_id or new_quantity is None:
             raise HTTPException(status_code=400, detail="product_id and quantity are required")
         
-        # Get current quantity for history
-        current_product = db.table('products').select('quantity, name').eq('id', product_id).single().execute()
-        if not current_product.data:
+        # Stock count: the ledger records the difference from the current quantity
+        result = await apply_stock_movements(db, [
+            StockMovement('product', product_id, 'count', count=int(new_quantity), reason=reason)
+        ])
+        if result.get('missing'):
             raise HTTPException(status_code=404, detail="Product not found")
         
-        old_quantity = current_product.data.get('quantity', 0)
-        
-        # Update product quantity
-        result = db.table('products').update({
-            'quantity': new_quantity,
-            'updated_at': datetime.utcnow().isoformat()
-        }).eq('id', product_id).execute()
-        
-        if result.data:
-            logger.info(f"Updated product {product_id} quantity: {old_quantity} -> {new_quantity}")
-            return {
-                "success": True,
-                "product_id": product_id,
-                "old_quantity": old_quantity,
-                "new_quantity": new_quantity,
-                "change": new_quantity - old_quantity
-            }
-        else:
-            raise HTTPException(status_code=400, detail="Failed to update product quantity")
+        item = result['items'][0]
+        old_quantity, new_quantity = item['old_quantity'], item['new_quantity']
+        logger.info(f"Updated product {product_id} quantity: {old_quantity} -> {new_quantity}")
+        return {
+            "success": True,
+            "product_id": product_id,
+            "old_quantity": old_quantity,
+            "new_quantity": new_quantity,
+            "change": new_quantity - old_quantity
+        }
             
     except Exception as e:
         logger.error(f"Inventory update error: {e}")
@@ -3621,7 +3332,7 @@ async def update_product_quantity(
 @app.post("/api/inventory/bulk-update")
 async def bulk_update_quantities(
     update_data: dict,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Bulk update quantities for multiple products"""
     try:
@@ -3630,34 +3341,34 @@ async def bulk_update_quantities(
         if not updates:
             raise HTTPException(status_code=400, detail="No updates provided")
         
-        updated_products = []
         errors = []
+        movements = []
         
         for update in updates:
+            product_id = update.get('product_id')
+            new_quantity = update.get('quantity')
+            
+            if not product_id or new_quantity is None:
+                errors.append(f"Missing product_id or quantity in update: {update}")
+                continue
             try:
-                product_id = update.get('product_id')
-                new_quantity = update.get('quantity')
-                
-                if not product_id or new_quantity is None:
-                    errors.append(f"Missing product_id or quantity in update: {update}")
-                    continue
-                
-                # Update individual product
-                result = db.table('products').update({
-                    'quantity': new_quantity,
-                    'updated_at': datetime.utcnow().isoformat()
-                }).eq('id', product_id).execute()
-                
-                if result.data:
-                    updated_products.append({
-                        "product_id": product_id,
-                        "new_quantity": new_quantity
-                    })
-                else:
-                    errors.append(f"Failed to update product {product_id}")
-                    
-            except Exception as e:
-                errors.append(f"Error updating product {update.get('product_id', 'unknown')}: {str(e)}")
+                movements.append(StockMovement(
+                    'product', product_id, 'count', count=int(new_quantity), reason=update.get('reason', 'Bulk update')
+                ))
+            except (TypeError, ValueError) as e:
+                errors.append(f"Error updating product {product_id}: {str(e)}")
+        
+        # All counts in one ledger call; unknown products are reported and the rest applied
+        result = await apply_stock_movements(db, movements)
+        if result.get('missing'):
+            missing = {item['id'] for item in result['missing']}
+            errors.extend(f"Failed to update product {product_id}" for product_id in sorted(missing))
+            result = await apply_stock_movements(db, [m for m in movements if str(m.item_id) not in missing])
+        
+        updated_products = [
+            {"product_id": item['item_id'], "new_quantity": item['new_quantity']}
+            for item in result.get('items', [])
+        ]
         
         return {
             "success": len(updated_products) > 0,
@@ -3673,33 +3384,145 @@ async def bulk_update_quantities(
 @app.get("/api/inventory/low-stock")
 async def get_low_stock_products(
     threshold: int = 5,
-    db: Client = Depends(get_supabase)
+    lead_days: Optional[float] = None,
+    db: AsyncSupabase = Depends(get_supabase)
 ):
-    """Get products with low stock (quantity <= threshold)"""
+    """
+    Get products with low stock (quantity <= threshold) and flowers that will run out
+    before the next delivery (in lead_days, FORECAST_LEAD_DAYS by default) at the current usage rate
+    """
     try:
-        result = db.table('products')\
-            .select('id, name, quantity, price')\
-            .lte('quantity', threshold)\
-            .gt('quantity', 0)\
-            .eq('is_active', True)\
-            .order('quantity')\
-            .execute()
+        result, flowers_result, _ = await asyncio.gather(
+            db.table('products')
+                .select('id, name, quantity, price')
+                .lte('quantity', threshold)
+                .gt('quantity', 0)
+                .eq('is_active', True)
+                .order('quantity')
+                .execute(),
+            db.table('flowers').select('id, name, quantity').eq('is_active', True).execute(),
+            depletion_forecast.ensure_loaded(db)
+        )
+        flowers = depletion_forecast.at_risk(flowers_result.data or [], lead_days)
         
         return {
             "success": True,
             "threshold": threshold,
             "count": len(result.data) if result.data else 0,
-            "products": result.data or []
+            "products": result.data or [],
+            "lead_days": depletion_forecast.lead_days if lead_days is None else lead_days,
+            "forecast_enabled": depletion_forecast.enabled,
+            "flowers": flowers
         }
         
     except Exception as e:
         logger.error(f"Low stock query error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/inventory/buildable")
+async def get_buildable_products(
+    flower_id: Optional[str] = None,
+    only_buildable: bool = False,
+    db: AsyncSupabase = Depends(get_supabase)
+):
+    """
+    How many of each active product can be built right now: the minimum of flower stock // amount
+    over its composition (products without a composition report their own quantity).
+    flower_id keeps only the products that use this flower
+    """
+    try:
+        products, _ = await asyncio.gather(
+            fetch_all(lambda: db.table('products')
+                      .select('id, name, price, quantity')
+                      .eq('is_active', True)
+                      .order('name')
+                      .order('id')),
+            buildable_index.ensure_loaded(db)
+        )
+        if not buildable_index.enabled:
+            raise HTTPException(status_code=503, detail="Buildable counts require numpy")
+        
+        if flower_id:
+            using = set(buildable_index.products_with(flower_id))
+            products = [product for product in products if str(product['id']) in using]
+        counts = buildable_index.counts(str(product['id']) for product in products)
+        
+        items = []
+        for product in products:
+            composed = str(product['id']) in counts
+            buildable = counts[str(product['id'])] if composed else max(product.get('quantity') or 0, 0)
+            if only_buildable and not buildable:
+                continue
+            items.append({
+                **product,
+                "buildable": buildable,
+                "has_composition": composed,
+                "limited_by": buildable_index.limiting_flower(product['id']) if composed else None
+            })
+        
+        # Names of the limiting flowers in one query
+        limiting = {item['limited_by'] for item in items if item['limited_by']}
+        if limiting:
+            flowers_result = await db.table('flowers').select('id, name').in_('id', list(limiting)).execute()
+            names = {str(flower['id']): flower['name'] for flower in flowers_result.data or []}
+            for item in items:
+                if item['limited_by']:
+                    item['limited_by'] = {"id": item['limited_by'], "name": names.get(item['limited_by'])}
+        
+        return {
+            "success": True,
+            "count": len(items),
+            "buildable_count": sum(1 for item in items if item['buildable'] > 0),
+            "products": items,
+            "auto_deactivate": app_config.BUILDABLE_AUTO_DEACTIVATE
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Buildable products query error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def procurement_report(db: AsyncSupabase, start: Optional[date], days: int, incoming: List[dict]) -> dict:
+    """Flower shortfall report for active orders (core/procurement.py)"""
+    if not planner_available():
+        raise HTTPException(status_code=503, detail="Procurement planner requires numpy")
+    try:
+        report = await plan_procurement(db, start or date.today(), days, ACTIVE_STATUSES, incoming)
+        return {"success": True, **report}
+    except Exception as e:
+        logger.error(f"Procurement plan error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/procurement/plan")
+async def get_procurement_plan(
+    start: Optional[date] = None,
+    days: int = 7,
+    db: AsyncSupabase = Depends(get_supabase)
+):
+    """Per-day flower shortfall for active orders delivered from start (today by default) for days days"""
+    return await procurement_report(db, start, days, [])
+
+@app.post("/api/procurement/plan")
+async def post_procurement_plan(
+    plan_request: dict,
+    db: AsyncSupabase = Depends(get_supabase)
+):
+    """
+    The same plan with expected deliveries subtracted:
+    {"start": "2025-03-05", "days": 7, "incoming": [{"flower_id", "quantity", "delivery_date"}]}
+    """
+    try:
+        start = date.fromisoformat(plan_request['start']) if plan_request.get('start') else None
+        days = int(plan_request.get('days', 7))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="start must be YYYY-MM-DD and days a number")
+    return await procurement_report(db, start, days, plan_request.get('incoming') or [])
+
 @app.post("/api/inventory/delivery")
 async def add_delivery(
     delivery_data: dict,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Add delivery of products to warehouse"""
     try:
@@ -3711,53 +3534,24 @@ async def add_delivery(
         if not product_id or quantity <= 0:
             raise HTTPException(status_code=400, detail="Invalid product_id or quantity")
         
-        # Get current product
-        product_result = db.table('products')\
-            .select('id, name, quantity')\
-            .eq('id', product_id)\
-            .single()\
-            .execute()
-            
-        if not product_result.data:
+        # Quantity and delivery history in one ledger call
+        result = await apply_stock_movements(db, [
+            StockMovement('product', product_id, 'delivery', delta=quantity, note=note, delivery_date=delivery_date)
+        ])
+        if result.get('missing'):
             raise HTTPException(status_code=404, detail="Product not found")
-            
-        product = product_result.data
-        new_quantity = (product.get('quantity') or 0) + quantity
-        
-        # Update product quantity
-        db.table('products')\
-            .update({
-                'quantity': new_quantity,
-                'updated_at': datetime.utcnow().isoformat()
-            })\
-            .eq('id', product_id)\
-            .execute()
         
-        # Record delivery history  
-        delivery_record = {
-            'product_id': product_id,
-            'quantity': quantity,
-            'delivery_date': delivery_date,
-            'reason': 'delivery',
-            'note': note,
-            'created_at': datetime.utcnow().isoformat()
-        }
-        
-        # Create deliveries table entry
-        db.table('inventory_movements')\
-            .insert(delivery_record)\
-            .execute()
-        
-        logger.info(f"Delivery added: {product['name']} +{quantity} = {new_quantity}")
+        item = result['items'][0]
+        logger.info(f"Delivery added: {item['item_name']} +{quantity} = {item['new_quantity']}")
         
         return {
             'success': True,
-            'message': f"Поставка добавлена: {product['name']} +{quantity}",
+            'message': f"Поставка добавлена: {item['item_name']} +{quantity}",
             'product': {
                 'id': product_id,
-                'name': product['name'],
-                'old_quantity': product.get('quantity', 0),
-                'new_quantity': new_quantity,
+                'name': item['item_name'],
+                'old_quantity': item['old_quantity'],
+                'new_quantity': item['new_quantity'],
                 'delivery_date': delivery_date
             }
         }
@@ -3769,7 +3563,7 @@ async def add_delivery(
 @app.post("/api/inventory/writeoff")
 async def writeoff_product(
     writeoff_data: dict,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Write off products from warehouse"""
     try:
@@ -3782,58 +3576,31 @@ async def writeoff_product(
         if not product_id or quantity <= 0:
             raise HTTPException(status_code=400, detail="Invalid product_id or quantity")
         
-        # Get current product
-        product_result = db.table('products')\
-            .select('id, name, quantity')\
-            .eq('id', product_id)\
-            .single()\
-            .execute()
-            
-        if not product_result.data:
+        # Stock check, quantity and history in one ledger call (guard: never below zero)
+        result = await apply_stock_movements(db, [
+            StockMovement(
+                'product', product_id, 'writeoff', delta=-quantity, reason=reason,
+                note=f"{reason}: {note}", delivery_date=writeoff_date, guard=True
+            )
+        ])
+        if result.get('missing'):
             raise HTTPException(status_code=404, detail="Product not found")
-            
-        product = product_result.data
-        current_quantity = product.get('quantity', 0)
-        
-        if current_quantity < quantity:
-            raise HTTPException(status_code=400, detail=f"Insufficient quantity. Available: {current_quantity}")
-        
-        new_quantity = current_quantity - quantity
-        
-        # Update product quantity
-        db.table('products')\
-            .update({
-                'quantity': new_quantity,
-                'updated_at': datetime.utcnow().isoformat()
-            })\
-            .eq('id', product_id)\
-            .execute()
-        
-        # Record writeoff history  
-        writeoff_record = {
-            'product_id': product_id,
-            'quantity': -quantity,  # Negative for writeoff
-            'delivery_date': writeoff_date,
-            'reason': 'writeoff',
-            'note': f"{reason}: {note}",
-            'created_at': datetime.utcnow().isoformat()
-        }
-        
-        # Create inventory movement entry
-        db.table('inventory_movements')\
-            .insert(writeoff_record)\
-            .execute()
+        if result.get('shortages'):
+            raise HTTPException(
+                status_code=400, detail=f"Insufficient quantity. Available: {result['shortages'][0]['available']}"
+            )
         
-        logger.info(f"Writeoff recorded: {product['name']} -{quantity} = {new_quantity}")
+        item = result['items'][0]
+        logger.info(f"Writeoff recorded: {item['item_name']} -{quantity} = {item['new_quantity']}")
         
         return {
             'success': True,
-            'message': f"Списание выполнено: {product['name']} -{quantity}",
+            'message': f"Списание выполнено: {item['item_name']} -{quantity}",
             'product': {
                 'id': product_id,
-                'name': product['name'],
-                'old_quantity': current_quantity,
-                'new_quantity': new_quantity,
+                'name': item['item_name'],
+                'old_quantity': item['old_quantity'],
+                'new_quantity': item['new_quantity'],
                 'writeoff_date': writeoff_date
             }
         }
@@ -3846,22 +3613,44 @@ async def writeoff_product(
 async def get_inventory_history(
     flower_id: Optional[str] = None,
     limit: int = 50,
-    db: Client = Depends(get_supabase)
+    cursor: Optional[str] = None,
+    db: AsyncSupabase = Depends(get_supabase)
 ):
-    """Get flower inventory movement history"""
-    try:
-        query = db.table('flower_inventory_movements')\
-            .select('*, flowers(name)')\
-            .order('created_at', desc=True)\
-            .limit(limit)
+    """Get flower inventory movement history (next page via ?cursor=next_cursor)"""
+    try:
+        ledger_page = await fetch_ledger_history(db, 'flower', flower_id, limit, cursor)
+        if ledger_page is not None:
+            movements = [
+                {
+                    'id': row.get('id'),
+                    'flower_id': row.get('item_id'),
+                    'product_name': row.get('item_name') or 'Unknown Flower',
+                    'quantity': row.get('delta', 0),
+                    'balance': row.get('balance'),
+                    'delivery_date': row.get('delivery_date'),
+                    'reason': row.get('movement_type', 'unknown'),
+                    'note': row.get('note'),
+                    'created_at': row.get('created_at')
+                }
+                for row in ledger_page.data
+            ]
+            return {
+                'success': True,
+                'movements': movements,
+                'count': len(movements),
+                'next_cursor': ledger_page.next_cursor
+            }
+        
+        # Stock ledger is not installed yet (migrations/005) - legacy movements table
+        query = db.table('flower_inventory_movements').select('*, flowers(name)')
             
         if flower_id:
             query = query.eq('flower_id', flower_id)
             
-        result = query.execute()
+        page_result = await fetch_page(query, MOVEMENTS_KEYSET, limit, cursor)
         
         movements = []
-        for movement in result.data or []:
+        for movement in page_result.data:
             # Handle quantity sign based on movement type
             quantity = movement.get('quantity', 0)
             movement_type = movement.get('movement_type', '')
@@ -3884,31 +3673,69 @@ async def get_inventory_history(
         return {
             'success': True,
             'movements': movements,
-            'count': len(movements)
+            'count': len(movements),
+            'next_cursor': page_result.next_cursor
         }
         
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Get flower inventory history error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/inventory/ledger/snapshot")
+async def snapshot_stock_ledger(
+    db: AsyncSupabase = Depends(get_supabase)
+):
+    """Take a stock snapshot (normally run periodically by stock_snapshot.py)"""
+    result = await take_stock_snapshot(db)
+    if result is None:
+        raise HTTPException(status_code=503, detail="Stock ledger is not installed (apply migrations/005)")
+    return {'success': True, **result}
+
+@app.get("/api/inventory/ledger/verify")
+async def verify_stock(
+    db: AsyncSupabase = Depends(get_supabase)
+):
+    """Recompute stock from the last snapshot and the ledger and list items whose quantity drifted"""
+    mismatches = await verify_stock_ledger(db)
+    if mismatches is None:
+        raise HTTPException(status_code=503, detail="Stock ledger is not installed (apply migrations/005)")
+    return {'success': True, 'count': len(mismatches), 'mismatches': mismatches}
+
+@app.get("/api/inventory/stock-as-of")
+async def get_stock_as_of(
+    at: str,
+    item_type: Optional[str] = None,
+    db: AsyncSupabase = Depends(get_supabase)
+):
+    """Stock at a point in time: snapshot before `at` plus ledger movements up to `at`"""
+    if item_type not in (None, 'flower', 'product'):
+        raise HTTPException(status_code=400, detail="item_type must be 'flower' or 'product'")
+    balances = await stock_as_of(db, at, item_type)
+    if balances is None:
+        raise HTTPException(status_code=404, detail=f"No stock snapshot before {at}")
+    return {
+        'success': True,
+        'at': at,
+        'items': [
+            {'item_type': kind, 'item_id': item_id, 'quantity': quantity}
+            for (kind, item_id), quantity in sorted(balances.items())
+        ]
+    }
+
 # ==================== FLOWER API ENDPOINTS ====================
 
 @app.get("/api/flowers/search")
 async def search_flowers(
     q: str = "",
     limit: int = 50,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
-    """Search flowers by name"""
+    """Search flowers by name or English name (in-memory, typo and transliteration tolerant)"""
     try:
-        query = db.table('flowers').select('id, name, quantity, name_en').eq('is_active', True)
-        
-        # Add search filter if query provided
-        if q.strip():
-            query = query.ilike('name', f'%{q}%')
-            
-        result = query.limit(limit).execute()
-        return result.data or []
+        await autocomplete.ensure_loaded(db)
+        return autocomplete.flowers.search(q, limit)
         
     except Exception as e:
         logger.error(f"Search flowers error: {e}")
@@ -3917,7 +3744,7 @@ async def search_flowers(
 @app.post("/api/flowers/update-quantity")
 async def update_flower_quantity(
     request_data: dict,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Update flower quantity"""
     try:
@@ -3928,22 +3755,20 @@ async def update_flower_quantity(
         if not flower_id or quantity is None:
             raise HTTPException(status_code=400, detail="flower_id and quantity are required")
         
-        # Update flower quantity
-        result = db.table('flowers')\
-            .update({'quantity': quantity, 'updated_at': 'now()'})\
-            .eq('id', flower_id)\
-            .execute()
-        
-        if not result.data:
+        # Stock count: the ledger records the difference from the current quantity
+        result = await apply_stock_movements(db, [
+            StockMovement('flower', flower_id, 'count', count=int(quantity), reason=reason)
+        ])
+        if result.get('missing'):
             raise HTTPException(status_code=404, detail="Flower not found")
         
-        # TODO: Add to flower_movements table when created
-        
+        item = result['items'][0]
         return {
             'success': True,
             'message': 'Flower quantity updated successfully',
             'flower_id': flower_id,
-            'new_quantity': quantity
+            'previous_quantity': item['old_quantity'],
+            'new_quantity': item['new_quantity']
         }
         
     except Exception as e:
@@ -3953,7 +3778,7 @@ async def update_flower_quantity(
 @app.post("/api/flowers/delivery")
 async def add_flower_delivery(
     delivery_data: dict,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Add flower delivery (increase stock)"""
     try:
@@ -3964,43 +3789,24 @@ async def add_flower_delivery(
         if not flower_id or not quantity or quantity <= 0:
             raise HTTPException(status_code=400, detail="flower_id and positive quantity are required")
         
-        # Get current quantity
-        current_result = db.table('flowers')\
-            .select('quantity')\
-            .eq('id', flower_id)\
-            .single()\
-            .execute()
-        
-        if not current_result.data:
+        # Quantity and delivery history in one ledger call
+        result = await apply_stock_movements(db, [
+            StockMovement(
+                'flower', flower_id, 'delivery', delta=quantity, reason=delivery_data.get('reason', 'Flower delivery'),
+                note=note, delivery_date=delivery_data.get('delivery_date')
+            )
+        ])
+        if result.get('missing'):
             raise HTTPException(status_code=404, detail="Flower not found")
         
-        current_quantity = current_result.data.get('quantity', 0)
-        new_quantity = current_quantity + quantity
-        
-        # Update flower quantity
-        update_result = db.table('flowers')\
-            .update({'quantity': new_quantity, 'updated_at': 'now()'})\
-            .eq('id', flower_id)\
-            .execute()
-        
-        # Add delivery record to flower_inventory_movements
-        movement_result = db.table('flower_inventory_movements').insert({
-            'flower_id': flower_id,
-            'movement_type': 'delivery',
-            'quantity': quantity,
-            'reason': delivery_data.get('reason', 'Flower delivery'),
-            'note': note,
-            'delivery_date': delivery_data.get('delivery_date'),
-            'created_by': 'CRM System'
-        }).execute()
-        
+        item = result['items'][0]
         return {
             'success': True,
             'message': f'Added {quantity} flowers to inventory',
             'flower_id': flower_id,
-            'previous_quantity': current_quantity,
+            'previous_quantity': item['old_quantity'],
             'added_quantity': quantity,
-            'new_quantity': new_quantity
+            'new_quantity': item['new_quantity']
         }
         
     except Exception as e:
@@ -4010,7 +3816,7 @@ async def add_flower_delivery(
 @app.post("/api/flowers/writeoff")
 async def writeoff_flowers(
     writeoff_data: dict,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """Write off flowers (decrease stock)"""
     try:
@@ -4022,46 +3828,23 @@ async def writeoff_flowers(
         if not flower_id or not quantity or quantity <= 0:
             raise HTTPException(status_code=400, detail="flower_id and positive quantity are required")
         
-        # Get current quantity
-        current_result = db.table('flowers')\
-            .select('quantity')\
-            .eq('id', flower_id)\
-            .single()\
-            .execute()
-        
-        if not current_result.data:
+        # Stock check, quantity and history in one ledger call (guard: never below zero)
+        result = await apply_stock_movements(db, [
+            StockMovement('flower', flower_id, 'writeoff', delta=-quantity, reason=reason, note=note, guard=True)
+        ])
+        if result.get('missing'):
             raise HTTPException(status_code=404, detail="Flower not found")
+        if result.get('shortages'):
+            raise HTTPException(status_code=400, detail=f"Insufficient stock. Available: {result['shortages'][0]['available']}")
         
-        current_quantity = current_result.data.get('quantity', 0)
-        
-        if current_quantity < quantity:
-            raise HTTPException(status_code=400, detail=f"Insufficient stock. Available: {current_quantity}")
-        
-        new_quantity = current_quantity - quantity
-        
-        # Update flower quantity
-        update_result = db.table('flowers')\
-            .update({'quantity': new_quantity, 'updated_at': 'now()'})\
-            .eq('id', flower_id)\
-            .execute()
-        
-        # Add writeoff record to flower_inventory_movements
-        movement_result = db.table('flower_inventory_movements').insert({
-            'flower_id': flower_id,
-            'movement_type': 'writeoff',
-            'quantity': quantity,
-            'reason': reason,
-            'note': note,
-            'created_by': 'CRM System'
-        }).execute()
-        
+        item = result['items'][0]
         return {
             'success': True,
             'message': f'Wrote off {quantity} flowers',
             'flower_id': flower_id,
-            'previous_quantity': current_quantity,
+            'previous_quantity': item['old_quantity'],
             'writeoff_quantity': quantity,
-            'new_quantity': new_quantity,
+            'new_quantity': item['new_quantity'],
             'reason': reason
         }
         
@@ -4087,51 +3870,82 @@ async def get_webhook_stats():
 
 # ==================== MODULAR WEBHOOK HANDLERS ====================
 
+async def run_with_sync_client(handler, *args):
+    """
+    Run a webhooks.* coroutine that queries the blocking sync client in a worker thread
+    with its own event loop, so its .execute() calls don't stall other requests.
+    The request body is read here first; the handler then gets it from the Request cache.
+    """
+    for arg in args:
+        if isinstance(arg, Request):
+            await arg.body()
+    return await asyncio.to_thread(asyncio.run, handler(*args))
+
 @app.post("/webhooks/bitrix/product")
 async def webhook_bitrix_product(
     request: Request,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """
     Handle webhook from Bitrix for product creation/update/deletion
     Uses modular webhooks.products module for cleaner architecture
     """
     from webhooks.products import handle_product_webhook
-    return await handle_product_webhook(request, db)
+    response = await run_with_sync_client(handle_product_webhook, request, db.sync_client)
+    # Webhook writes go through the sync client, so drop cached product totals
+    # and thumbnails here (the image path may have changed)
+    invalidate_counts('products')
+    invalidate_product_views()
+    reference_replica.invalidate(('products', 'product_composition'), prune=True)
+    return response
 
 @app.post("/webhooks/bitrix/shop")
 async def webhook_bitrix_shop(
     request: Request,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """
     Handle webhook from Bitrix for shop creation/update/status changes
     Automatically updates product statuses when shop status changes
     """
     from webhooks.shops import handle_shop_webhook
-    return await handle_shop_webhook(request, db)
+    response = await run_with_sync_client(handle_shop_webhook, request, db.sync_client)
+    invalidate_counts('products')
+    row_fragments.invalidate('product')
+    autocomplete.invalidate()
+    reference_replica.invalidate(('sellers', 'products'))
+    return response
 
 @app.post("/webhooks/bitrix/florist")
 async def webhook_bitrix_florist(
     request: Request,
-    db: Client = Depends(get_supabase)
+    db: AsyncSupabase = Depends(get_supabase)
 ):
     """
     Handle webhook from Bitrix for florist activation/deactivation/shop assignment
     Automatically updates product statuses when florist status changes
     """
     from webhooks.florists import handle_florist_webhook
-    return await handle_florist_webhook(request, db)
+    response = await run_with_sync_client(handle_florist_webhook, request, db.sync_client)
+    invalidate_counts('products')
+    row_fragments.invalidate('product')
+    autocomplete.invalidate()
+    reference_replica.invalidate(('sellers', 'products'))
+    return response
 
 # ==================== MODULAR WEBHOOK API ENDPOINTS ====================
 
 @app.post("/api/sync/products/status")
-async def sync_products_status(db: Client = Depends(get_supabase)):
+async def sync_products_status(db: AsyncSupabase = Depends(get_supabase)):
     """Синхронизирует статусы всех товаров согласно 4 критериям активности"""
     from webhooks.products import sync_all_product_statuses
     
     try:
-        stats = await sync_all_product_statuses(db)
+        stats = await run_with_sync_client(sync_all_product_statuses, db.sync_client)
+        invalidate_counts('products')
+        row_fragments.invalidate('product')
+        autocomplete.invalidate()
+        reference_replica.invalidate(('products',))
         return {
             "status": "success",
             "message": "Product status synchronization completed",
@@ -4142,12 +3956,13 @@ async def sync_products_status(db: Client = Depends(get_supabase)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/sync/shops")
-async def sync_shops_from_bitrix(db: Client = Depends(get_supabase)):
+async def sync_shops_from_bitrix(db: AsyncSupabase = Depends(get_supabase)):
     """Синхронизирует магазины из Bitrix в Supabase"""
     from webhooks.shops import update_shop_product_counts
     
     try:
-        await update_shop_product_counts(db)
+        await run_with_sync_client(update_shop_product_counts, db.sync_client)
+        reference_replica.invalidate(('sellers',))
         return {
             "status": "success",
             "message": "Shop synchronization completed"
@@ -4205,8 +4020,35 @@ async def send_error_telegram_notification(error_type: str, error_data: dict):
 async def cache_stats():
     """Cache statistics endpoint for monitoring performance"""
     from cache_utils import simple_cache
+    from core.counts import count_cache
     return {
         "cache_stats": simple_cache.stats(),
+        "count_cache_stats": count_cache.stats(),
+        "thumbnail_stats": thumbnails.get_stats(),
+        "fragment_stats": row_fragments.get_stats(),
+        "bom_index_stats": bom_index.get_stats(),
+        "forecast_stats": depletion_forecast.get_stats(),
+        "buildable_stats": buildable_index.get_stats(),
+        "flower_usage_stats": flower_usage.get_stats(),
+        "autocomplete_stats": autocomplete.get_stats(),
+        "replica_stats": reference_replica.get_stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.get("/api/query-stats")
+async def get_query_stats():
+    """Aggregated query statistics per table and verb (since start or last reset)"""
+    return {
+        **query_stats.get_stats(),
+        "timestamp": datetime.now().isoformat()
+    }
+
+@app.post("/api/query-stats/reset")
+async def reset_query_stats():
+    """Reset aggregated query statistics (e.g. before a benchmark run)"""
+    query_stats.clear()
+    return {
+        "message": "Query stats reset",
         "timestamp": datetime.now().isoformat()
     }
 
@@ -4215,6 +4057,14 @@ async def clear_cache():
     """Clear all cache (for debugging)"""
     from cache_utils import simple_cache
     simple_cache.clear()
+    thumbnails.invalidate()
+    row_fragments.invalidate()
+    bom_index.invalidate()
+    depletion_forecast.invalidate()
+    buildable_index.invalidate()
+    flower_usage.invalidate()
+    autocomplete.invalidate()
+    reference_replica.invalidate(full=True)
     return {
         "message": "Cache cleared",
         "timestamp": datetime.now().isoformat()
@@ -1,20 +1,58 @@
 #!/usr/bin/env python3
 """
 Benchmark для тестирования производительности синхронизации
+
+    python benchmark_sync.py                        # против запущенного сервера на localhost:8001
+    python benchmark_sync.py --offline --latency-ms 30   # in-process, fake Supabase с фикстурами
 """
+import argparse
 import time
 import requests
 import json
 import statistics
 from typing import List
 
+from monitoring.query_stats import parse_server_timing
+
+BASE_URL = "http://localhost:8001"
+WEBHOOK_TOKEN = "fad5fbe4c8a520cf6d5453685b758c7fd9f6681f084be335fcdcd190ad9aaa0e"
+
+# HTTP клиент: requests для живого сервера, TestClient приложения в офлайн режиме
+http = requests
+
+
+def collect_db_timing(response, db_times: List[float], db_queries: List[int]):
+    """Сохраняет время и число запросов к БД из заголовка Server-Timing"""
+    db = parse_server_timing(response.headers.get('Server-Timing')).get('db')
+    if db and 'dur' in db:
+        db_times.append(db['dur'] / 1000)
+        db_queries.append(int(db.get('desc', '0').split()[0] or 0))
+
+
+def summarize(times: List[float], errors: int, iterations: int, db_times: List[float], db_queries: List[int]) -> dict:
+    """Сводка по итерациям бенчмарка"""
+    if not times:
+        return {"errors": errors, "success_rate": 0}
+    results = {
+        "min": min(times),
+        "max": max(times),
+        "avg": statistics.mean(times),
+        "median": statistics.median(times),
+        "errors": errors,
+        "success_rate": (len(times) / iterations) * 100
+    }
+    if db_times:
+        results["db_avg"] = statistics.mean(db_times)
+        results["db_queries_avg"] = statistics.mean(db_queries)
+    return results
+
 def benchmark_webhook(order_id: str = "122379", iterations: int = 5) -> dict:
     """Тестирует скорость обработки webhook"""
     
-    webhook_url = "http://localhost:8001/webhooks/bitrix/order"
+    webhook_url = f"{BASE_URL}/webhooks/bitrix/order"
     payload = {
         "event": "order.status_change",
-        "token": "fad5fbe4c8a520cf6d5453685b758c7fd9f6681f084be335fcdcd190ad9aaa0e",
+        "token": WEBHOOK_TOKEN,
         "data": {
             "ID": order_id,
             "STATUS_ID": "AP"
@@ -22,6 +60,7 @@ def benchmark_webhook(order_id: str = "122379", iterations: int = 5) -> dict:
     }
     
     times = []
+    db_times, db_queries = [], []
     errors = 0
     
     print(f"🏃 Запуск бенчмарка webhook для заказа {order_id}...")
@@ -30,9 +69,10 @@ def benchmark_webhook(order_id: str = "122379", iterations: int = 5) -> dict:
     for i in range(iterations):
         start = time.time()
         try:
-            response = requests.post(webhook_url, json=payload, timeout=30)
+            response = http.post(webhook_url, json=payload, timeout=30)
             elapsed = time.time() - start
             times.append(elapsed)
+            collect_db_timing(response, db_times, db_queries)
             
             status_icon = "✅" if response.status_code == 200 else "⚠️"
             print(f"  Итерация {i+1}: {elapsed:.3f}s {status_icon}")
@@ -43,24 +83,15 @@ def benchmark_webhook(order_id: str = "122379", iterations: int = 5) -> dict:
         # Небольшая пауза между запросами
         time.sleep(0.5)
     
-    if times:
-        return {
-            "min": min(times),
-            "max": max(times),
-            "avg": statistics.mean(times),
-            "median": statistics.median(times),
-            "errors": errors,
-            "success_rate": (len(times) / iterations) * 100
-        }
-    else:
-        return {"errors": errors, "success_rate": 0}
+    return summarize(times, errors, iterations, db_times, db_queries)
 
 def benchmark_order_detail(order_id: str = "2b5d8bca-335a-459f-882f-09eb07d9bbb5", iterations: int = 5) -> dict:
     """Тестирует скорость загрузки страницы заказа"""
     
-    detail_url = f"http://localhost:8001/crm/orders/{order_id}"
+    detail_url = f"{BASE_URL}/crm/orders/{order_id}"
     
     times = []
+    db_times, db_queries = [], []
     errors = 0
     
     print(f"\n📄 Запуск бенчмарка страницы заказа...")
@@ -69,9 +100,10 @@ def benchmark_order_detail(order_id: str = "2b5d8bca-335a-459f-882f-09eb07d9bbb5
     for i in range(iterations):
         start = time.time()
         try:
-            response = requests.get(detail_url, timeout=30)
+            response = http.get(detail_url, timeout=30)
             elapsed = time.time() - start
             times.append(elapsed)
+            collect_db_timing(response, db_times, db_queries)
             
             status_icon = "✅" if response.status_code == 200 else "⚠️"
             print(f"  Итерация {i+1}: {elapsed:.3f}s {status_icon}")
@@ -81,24 +113,15 @@ def benchmark_order_detail(order_id: str = "2b5d8bca-335a-459f-882f-09eb07d9bbb5
         
         time.sleep(0.5)
     
-    if times:
-        return {
-            "min": min(times),
-            "max": max(times),
-            "avg": statistics.mean(times),
-            "median": statistics.median(times),
-            "errors": errors,
-            "success_rate": (len(times) / iterations) * 100
-        }
-    else:
-        return {"errors": errors, "success_rate": 0}
+    return summarize(times, errors, iterations, db_times, db_queries)
 
 def benchmark_orders_list(iterations: int = 5) -> dict:
     """Тестирует скорость загрузки списка заказов"""
     
-    list_url = "http://localhost:8001/crm/orders"
+    list_url = f"{BASE_URL}/crm/orders"
     
     times = []
+    db_times, db_queries = [], []
     errors = 0
     
     print(f"\n📋 Запуск бенчмарка списка заказов...")
@@ -107,9 +130,10 @@ def benchmark_orders_list(iterations: int = 5) -> dict:
     for i in range(iterations):
         start = time.time()
         try:
-            response = requests.get(list_url, timeout=30)
+            response = http.get(list_url, timeout=30)
             elapsed = time.time() - start
             times.append(elapsed)
+            collect_db_timing(response, db_times, db_queries)
             
             status_icon = "✅" if response.status_code == 200 else "⚠️"
             print(f"  Итерация {i+1}: {elapsed:.3f}s {status_icon}")
@@ -119,17 +143,7 @@ def benchmark_orders_list(iterations: int = 5) -> dict:
         
         time.sleep(0.5)
     
-    if times:
-        return {
-            "min": min(times),
-            "max": max(times),
-            "avg": statistics.mean(times),
-            "median": statistics.median(times),
-            "errors": errors,
-            "success_rate": (len(times) / iterations) * 100
-        }
-    else:
-        return {"errors": errors, "success_rate": 0}
+    return summarize(times, errors, iterations, db_times, db_queries)
 
 def print_results(name: str, results: dict):
     """Красиво выводит результаты"""
@@ -142,6 +156,8 @@ def print_results(name: str, results: dict):
         print(f"  📈 Среднее время: {results['avg']:.3f}s")
         print(f"  📊 Медиана: {results['median']:.3f}s")
         print(f"  ✅ Успешных: {results['success_rate']:.1f}%")
+        if 'db_avg' in results:
+            print(f"  🗄️ БД: {results['db_avg']:.3f}s, запросов: {results['db_queries_avg']:.1f}")
         if results['errors'] > 0:
             print(f"  ❌ Ошибок: {results['errors']}")
     else:
@@ -153,20 +169,54 @@ def save_results(results: dict, filename: str):
         json.dump(results, f, indent=2)
     print(f"\n💾 Результаты сохранены в {filename}")
 
+def start_offline_app(latency_ms: float):
+    """
+    Запускает app.py в процессе поверх fake Supabase (core/fake_backend.py)
+    
+    Returns:
+        (bitrix_order_id, order_id) первого заказа из фикстур
+    """
+    global http, WEBHOOK_TOKEN
+    from fastapi.testclient import TestClient
+    from config import config
+    
+    config.SUPABASE_FAKE_BACKEND = True
+    config.SUPABASE_FAKE_LATENCY_MS = latency_ms
+    import app as crm_app
+    
+    http = TestClient(crm_app.app)
+    http.__enter__()  # startup event
+    WEBHOOK_TOKEN = config.WEBHOOK_TOKEN
+    
+    order = crm_app.supabase.sync_client.table('orders').select('id, bitrix_order_id').limit(1).single().execute().data
+    return str(order['bitrix_order_id']), order['id']
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк производительности CRM")
+    parser.add_argument("--offline", action="store_true", help="in-process приложение с fake Supabase вместо сервера")
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="задержка на запрос к fake Supabase")
+    args = parser.parse_args()
+    
     print("=" * 50)
     print("🚀 БЕНЧМАРК ПРОИЗВОДИТЕЛЬНОСТИ CRM")
     print("=" * 50)
     
+    webhook_kwargs, detail_kwargs = {}, {}
+    if args.offline:
+        bitrix_order_id, order_id = start_offline_app(args.latency_ms)
+        webhook_kwargs = {"order_id": bitrix_order_id}
+        detail_kwargs = {"order_id": order_id}
+        print(f"🧪 Офлайн режим: fake Supabase, {args.latency_ms}ms на запрос")
+    
     all_results = {}
     
     # Тест webhook
-    webhook_results = benchmark_webhook(iterations=5)
+    webhook_results = benchmark_webhook(iterations=5, **webhook_kwargs)
     print_results("Webhook синхронизация", webhook_results)
     all_results["webhook"] = webhook_results
     
     # Тест детальной страницы
-    detail_results = benchmark_order_detail(iterations=5)
+    detail_results = benchmark_order_detail(iterations=5, **detail_kwargs)
     print_results("Страница заказа", detail_results)
     all_results["order_detail"] = detail_results
     
@@ -177,7 +227,8 @@ if __name__ == "__main__":
     
     # Сохраняем результаты
     timestamp = time.strftime("%Y%m%d_%H%M%S")
-    save_results(all_results, f"benchmark_before_{timestamp}.json")
+    prefix = "benchmark_offline" if args.offline else "benchmark_before"
+    save_results(all_results, f"{prefix}_{timestamp}.json")
     
     print("\n" + "=" * 50)
     print("✅ Бенчмарк завершен!")
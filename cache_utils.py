@@ -39,6 +39,13 @@ class SimpleCache:
         if key in self._cache:
             del self._cache[key]
     
+    def invalidate_prefix(self, prefix: str) -> int:
+        """Удалить все ключи, начинающиеся с prefix (можно вызывать из рабочего потока)"""
+        keys = [key for key in list(self._cache) if key.startswith(prefix)]
+        for key in keys:
+            self._cache.pop(key, None)
+        return len(keys)
+    
     def clear(self):
         """Очистить весь кэш"""
         self._cache.clear()
@@ -11,6 +11,16 @@ class Config:
     SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY") 
     SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")  # Service key for full access
     
+    # Async data-access layer (shared keep-alive HTTP client)
+    SUPABASE_MAX_CONCURRENCY = int(os.getenv("SUPABASE_MAX_CONCURRENCY", 20))  # Parallel PostgREST requests per worker
+    SUPABASE_MAX_CONNECTIONS = int(os.getenv("SUPABASE_MAX_CONNECTIONS", 20))  # Keep-alive connections in the pool
+    SUPABASE_HTTP_TIMEOUT = float(os.getenv("SUPABASE_HTTP_TIMEOUT", 30))
+
+    # In-process fake backend for offline tests and benchmarks (core/fake_backend.py)
+    SUPABASE_FAKE_BACKEND = os.getenv("SUPABASE_FAKE_BACKEND", "false").lower() == "true"
+    SUPABASE_FAKE_LATENCY_MS = float(os.getenv("SUPABASE_FAKE_LATENCY_MS", 0))  # Simulated round trip per query
+    SUPABASE_FAKE_FIXTURES = os.getenv("SUPABASE_FAKE_FIXTURES")  # JSON file with tables; seeded fixtures if unset
+    
     # MySQL settings (for florists data from Bitrix)
     MYSQL_HOST = os.getenv("MYSQL_HOST", "localhost")
     MYSQL_PORT = int(os.getenv("MYSQL_PORT", 3306))
@@ -46,4 +56,59 @@ class Config:
     WEBHOOK_CACHE_TTL = int(os.getenv("WEBHOOK_CACHE_TTL", 300))  # 5 minutes
     NOTIFICATION_RATE_LIMIT = int(os.getenv("NOTIFICATION_RATE_LIMIT", 300))  # 5 minutes between notifications
 
+    # Query instrumentation
+    QUERY_SLOW_MS = float(os.getenv("QUERY_SLOW_MS", 300))  # Log queries slower than this
+    QUERY_SLOW_SAMPLE_RATE = float(os.getenv("QUERY_SLOW_SAMPLE_RATE", 1.0))  # Fraction of slow queries to log
+    QUERY_TIMING_HEADERS = os.getenv("QUERY_TIMING_HEADERS", "true").lower() == "true"  # Server-Timing response header
+
+    # /crm/orders reads the order_list_rows projection (migrations/001_order_list_rows.sql)
+    ORDER_LIST_PROJECTION = os.getenv("ORDER_LIST_PROJECTION", "true").lower() == "true"
+    # order_list_rows is kept by the migrations/001 triggers; false - the app upserts the rows itself
+    ORDER_LIST_TRIGGERS = os.getenv("ORDER_LIST_TRIGGERS", "true").lower() == "true"
+
+    # Product thumbnail URLs kept in memory (core/thumbnails.py)
+    THUMBNAIL_CACHE_SIZE = int(os.getenv("THUMBNAIL_CACHE_SIZE", 5000))
+
+    # Rendered orders/products list rows kept in memory (core/fragments.py)
+    FRAGMENT_CACHE_SIZE = int(os.getenv("FRAGMENT_CACHE_SIZE", 5000))
+
+    # Product compositions index reload interval, seconds (core/bom.py)
+    BOM_INDEX_TTL = float(os.getenv("BOM_INDEX_TTL", 600))
+
+    # Flower depletion forecast from movement history (core/forecast.py)
+    FORECAST_TTL = float(os.getenv("FORECAST_TTL", 900))
+    FORECAST_WINDOW_DAYS = int(os.getenv("FORECAST_WINDOW_DAYS", 28))
+    FORECAST_ROLLING_DAYS = int(os.getenv("FORECAST_ROLLING_DAYS", 7))
+    FORECAST_LEAD_DAYS = float(os.getenv("FORECAST_LEAD_DAYS", 3))
+
+    # Buildable product counts from flower stock (core/buildable.py)
+    BUILDABLE_TTL = float(os.getenv("BUILDABLE_TTL", 300))
+    BUILDABLE_AUTO_DEACTIVATE = os.getenv("BUILDABLE_AUTO_DEACTIVATE", "false").lower() == "true"  # Deactivate products that can no longer be built
+
+    # In-memory autocomplete for products and flowers (core/autocomplete.py)
+    AUTOCOMPLETE_TTL = float(os.getenv("AUTOCOMPLETE_TTL", 900))  # Full reload interval, seconds
+    AUTOCOMPLETE_POPULARITY_DAYS = int(os.getenv("AUTOCOMPLETE_POPULARITY_DAYS", 90))  # Order items counted for ranking
+
+    # Local SQLite replica of flowers, products, compositions and sellers (core/replica.py)
+    # Enable after applying migrations/007_reference_updated_at.sql (updated_at watermarks)
+    REPLICA_ENABLED = os.getenv("REPLICA_ENABLED", "false").lower() == "true"
+    REPLICA_PATH = os.getenv("REPLICA_PATH", "reference_replica.sqlite3")
+    REPLICA_SYNC_SECONDS = float(os.getenv("REPLICA_SYNC_SECONDS", 15))  # Catch up by updated_at at most this often
+    REPLICA_FULL_SYNC_SECONDS = float(os.getenv("REPLICA_FULL_SYNC_SECONDS", 3600))  # Full reload (drops rows deleted elsewhere)
+
+    # Stream large CRM pages (warehouse, order list) while they render (core/streaming.py)
+    STREAM_HTML = os.getenv("STREAM_HTML", "true").lower() == "true"
+    STREAM_CHUNK_BYTES = int(os.getenv("STREAM_CHUNK_BYTES", 8192))
+
+    # ETag/Last-Modified validators and 304 responses for order, product and flower pages (core/conditional.py)
+    CONDITIONAL_GET = os.getenv("CONDITIONAL_GET", "true").lower() == "true"
+
+    # Pagination totals: exact / estimated / planned / cached (see core/counts.py)
+    # Orders are also written by the Bitrix sync processes (sync/, fix_*.py), which can't
+    # invalidate this process's cache, so their totals are not cached by default
+    ORDERS_COUNT_STRATEGY = os.getenv("ORDERS_COUNT_STRATEGY", "estimated")
+    PRODUCTS_COUNT_STRATEGY = os.getenv("PRODUCTS_COUNT_STRATEGY", "cached")
+    INVENTORY_COUNT_STRATEGY = os.getenv("INVENTORY_COUNT_STRATEGY", "estimated")
+    COUNT_CACHE_TTL = int(os.getenv("COUNT_CACHE_TTL", 60))  # Seconds; writes from this process (async and sync client) invalidate earlier
+
 config = Config()
\ No newline at end of file
@@ -0,0 +1,296 @@
+"""
+Автодополнение товаров и цветов в памяти (форма заказа, составы, склад)
+Названия активных товаров и цветов (и flowers.name_en) приводятся к одной латинской форме:
+нижний регистр, ё -> е, транслитерация кириллицы, только буквы и цифры - "Тюльпанов",
+"tyulpanov" и "Tulip" из name_en ищутся одинаково. По словам строятся отсортированный
+словарь (префиксы - бинарный поиск) и триграммы (опечатки - сходство по общим триграммам),
+запрос отвечается без обращения к базе. Порядок: совпадение, затем популярность - товары
+по позициям заказов за AUTOCOMPLETE_POPULARITY_DAYS дней, цветы по числу составов.
+
+Индекс обновляется событиями: новые остатки приходят от журнала склада (add_stock_listener),
+измененные товары и цветы перечитываются по id при следующем запросе (invalidate(kind, ids)),
+полная перезагрузка - не реже AUTOCOMPLETE_TTL.
+"""
+
+import asyncio
+import bisect
+import heapq
+import logging
+import math
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from config import config
+from core.bom import BomIndex, bom_index
+from core.ledger import fetch_all
+
+logger = logging.getLogger(__name__)
+
+_TRANSLIT = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i',
+    'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't',
+    'у': 'u', 'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '',
+    'э': 'e', 'ю': 'yu', 'я': 'ya',
+    # Казахские буквы
+    'ә': 'a', 'ғ': 'g', 'қ': 'k', 'ң': 'n', 'ө': 'o', 'ұ': 'u', 'ү': 'u', 'һ': 'h', 'і': 'i',
+}
+_TRANSLIT_TABLE = str.maketrans(_TRANSLIT)
+_NON_WORD_RE = re.compile(r'[^a-z0-9]+')
+
+# Минимальное сходство по триграммам для слова с опечаткой
+SIMILARITY_THRESHOLD = 0.35
+
+# Колонки, которые возвращает поиск (как прежние ответы /api/products/search и /api/flowers/search)
+PRODUCT_COLUMNS = 'id, name, price, quantity'
+FLOWER_COLUMNS = 'id, name, quantity, name_en'
+
+
+def fold(text: Optional[str]) -> str:
+    """Латинская форма для сравнения: 'Голландская роза №5' -> 'gollandskaya roza 5'"""
+    if not text:
+        return ''
+    latin = str(text).lower().translate(_TRANSLIT_TABLE)
+    # "kh" и "h" - одна буква х в разных транслитерациях
+    return ' '.join(_NON_WORD_RE.sub(' ', latin.replace('kh', 'h')).split())
+
+
+def trigrams(word: str) -> Set[str]:
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """Слова названий -> записи: отсортированный словарь для префиксов и триграммы для опечаток"""
+
+    def __init__(self, fields: Tuple[str, ...]):
+        self.fields = fields
+        self._rows: Dict[str, dict] = {}
+        self._popularity: Dict[str, float] = {}
+        self._entry_words: Dict[str, Set[str]] = {}
+        self._word_entries: Dict[str, Set[str]] = {}
+        self._words: List[str] = []
+        self._trigram_words: Dict[str, Set[str]] = {}
+        self._word_trigrams: Dict[str, int] = {}
+        # Порядок для пустого запроса, пока записи и популярность не менялись
+        self._ranked: Optional[List[str]] = None
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def build(self, rows: Iterable[dict], popularity: Optional[Dict[str, float]] = None):
+        self._rows, self._entry_words, self._word_entries = {}, {}, {}
+        self._trigram_words, self._word_trigrams = {}, {}
+        self._words = []
+        self._ranked = None
+        self._popularity = dict(popularity or {})
+        for row in rows:
+            self.upsert(row)
+
+    def upsert(self, row: dict):
+        """Добавляет или переиндексирует одну запись"""
+        entry_id = str(row['id'])
+        self.remove(entry_id)
+        self._ranked = None
+        words = {word for field in self.fields for word in fold(row.get(field)).split()}
+        self._rows[entry_id] = dict(row)
+        self._entry_words[entry_id] = words
+        for word in words:
+            entries = self._word_entries.get(word)
+            if entries is None:
+                entries = self._word_entries[word] = set()
+                bisect.insort(self._words, word)
+                word_trigrams = trigrams(word)
+                self._word_trigrams[word] = len(word_trigrams)
+                for trigram in word_trigrams:
+                    self._trigram_words.setdefault(trigram, set()).add(word)
+            entries.add(entry_id)
+
+    def remove(self, entry_id: str):
+        for word in self._entry_words.pop(str(entry_id), ()):
+            entries = self._word_entries[word]
+            entries.discard(str(entry_id))
+            if not entries:
+                del self._word_entries[word]
+                del self._word_trigrams[word]
+                del self._words[bisect.bisect_left(self._words, word)]
+                for trigram in trigrams(word):
+                    self._trigram_words[trigram].discard(word)
+        if self._rows.pop(str(entry_id), None) is not None:
+            self._ranked = None
+
+    def update(self, entry_id: str, **values):
+        """Поля без переиндексации (остаток, цена)"""
+        row = self._rows.get(str(entry_id))
+        if row is not None:
+            row.update(values)
+
+    def set_popularity(self, popularity: Dict[str, float]):
+        self._popularity = dict(popularity)
+        self._ranked = None
+
+    def _token_scores(self, token: str) -> Dict[str, float]:
+        """Оценка записей по одному слову запроса: префикс 1.0 (слово целиком 1.2), опечатка - сходство"""
+        scores: Dict[str, float] = {}
+        start = bisect.bisect_left(self._words, token)
+        for word in self._words[start:]:
+            if not word.startswith(token):
+                break
+            score = 1.2 if word == token else 1.0
+            for entry_id in self._word_entries[word]:
+                scores[entry_id] = max(scores.get(entry_id, 0), score)
+
+        if len(token) >= 3:
+            token_trigrams = trigrams(token)
+            common: Dict[str, int] = {}
+            for trigram in token_trigrams:
+                for word in self._trigram_words.get(trigram, ()):
+                    common[word] = common.get(word, 0) + 1
+            for word, shared in common.items():
+                similarity = shared / (len(token_trigrams) + self._word_trigrams[word] - shared)
+                if similarity < SIMILARITY_THRESHOLD:
+                    continue
+                for entry_id in self._word_entries[word]:
+                    if scores.get(entry_id, 0) < similarity:
+                        scores[entry_id] = similarity
+        return scores
+
+    def search(self, query: str, limit: int = 10) -> List[dict]:
+        """Записи, в которых найдено каждое слово запроса; пустой запрос - самые популярные"""
+        tokens = fold(query).split()
+        if not tokens:
+            if self._ranked is None:
+                self._ranked = sorted(self._rows, key=lambda entry_id: (-self._popularity.get(entry_id, 0), self._rows[entry_id].get('name') or ''))
+            return [dict(self._rows[entry_id]) for entry_id in self._ranked[:limit]]
+
+        totals: Optional[Dict[str, float]] = None
+        for token in tokens:
+            scores = self._token_scores(token)
+            if totals is None:
+                totals = scores
+            else:
+                totals = {entry_id: total + scores[entry_id] for entry_id, total in totals.items() if entry_id in scores}
+            if not totals:
+                return []
+
+        ranked = heapq.nsmallest(limit, totals, key=lambda entry_id: (
+            -round(totals[entry_id] / len(tokens), 1),
+            -self._popularity.get(entry_id, 0),
+            self._rows[entry_id].get('name') or ''
+        ))
+        return [dict(self._rows[entry_id]) for entry_id in ranked]
+
+
+class Autocomplete:
+    """Индексы товаров и цветов приложения с загрузкой из базы и обновлением по событиям"""
+
+    def __init__(self, ttl_seconds: float = 900, popularity_days: int = 90, bom: BomIndex = bom_index):
+        self.ttl_seconds = ttl_seconds
+        self.popularity_days = popularity_days
+        self.bom = bom
+        self.products = NameIndex(('name',))
+        self.flowers = NameIndex(('name', 'name_en'))
+        self._dirty: Dict[str, Set[str]] = {'product': set(), 'flower': set()}
+        self._loaded_at: Optional[float] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._version = 0
+        self.loads = 0
+        self.refreshes = 0
+
+    @property
+    def is_fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl_seconds
+
+    async def ensure_loaded(self, db) -> 'Autocomplete':
+        """Полная загрузка по TTL; между ними - перечитывание только измененных записей"""
+        if self.is_fresh and not any(self._dirty.values()):
+            return self
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self.is_fresh:
+                version = self._version
+                await self._load(db)
+                if version != self._version:
+                    self._loaded_at = None
+            elif any(self._dirty.values()):
+                await self._refresh(db)
+        return self
+
+    async def _load(self, db):
+        self._dirty = {'product': set(), 'flower': set()}
+        since = (datetime.now(timezone.utc) - timedelta(days=self.popularity_days)).isoformat()
+        products, flowers, order_items, _ = await asyncio.gather(
+            fetch_all(lambda: db.table('products').select(PRODUCT_COLUMNS).eq('is_active', True).order('id')),
+            fetch_all(lambda: db.table('flowers').select(FLOWER_COLUMNS).eq('is_active', True).order('id')),
+            fetch_all(lambda: db.table('order_items').select('product_id, quantity')
+                      .gte('created_at', since).order('created_at').order('id')),
+            self.bom.ensure_loaded(db)
+        )
+        sold: Dict[str, float] = {}
+        for item in order_items:
+            if item.get('product_id'):
+                sold[str(item['product_id'])] = sold.get(str(item['product_id']), 0) + (item.get('quantity') or 1)
+        self.products.build(products, {product_id: math.log1p(count) for product_id, count in sold.items()})
+        self.flowers.build(flowers, self._flower_popularity())
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+        logger.info(f"Autocomplete loaded: {len(self.products)} products, {len(self.flowers)} flowers")
+
+    def _flower_popularity(self) -> Dict[str, float]:
+        """Число товаров, в составе которых есть цветок"""
+        _, flower_ids, _, flowers, _ = self.bom.csr()
+        counts = [0] * len(flower_ids)
+        for position in flowers:
+            counts[position] += 1
+        return {flower_id: count for flower_id, count in zip(flower_ids, counts) if count}
+
+    async def _refresh(self, db):
+        """Перечитывает измененные товары и цветы: активные переиндексируются, остальные удаляются"""
+        for kind, table, columns, index in (
+            ('product', 'products', PRODUCT_COLUMNS, self.products),
+            ('flower', 'flowers', FLOWER_COLUMNS, self.flowers),
+        ):
+            ids, self._dirty[kind] = list(self._dirty[kind]), set()
+            if not ids:
+                continue
+            result = await db.table(table).select(f'{columns}, is_active').in_('id', ids).execute()
+            found = {str(row['id']): row for row in result.data or []}
+            for entry_id in ids:
+                row = found.get(entry_id)
+                if row is not None and row.pop('is_active', True):
+                    index.upsert(row)
+                else:
+                    index.remove(entry_id)
+        if self.bom.is_fresh:
+            self.flowers.set_popularity(self._flower_popularity())
+        self.refreshes += 1
+
+    def apply_stock_changes(self, items: Iterable[dict]):
+        """Подписчик журнала склада: новые остатки без перечитывания"""
+        for item in items:
+            index = self.flowers if item.get('item_type') == 'flower' else self.products
+            index.update(str(item.get('item_id')), quantity=item.get('new_quantity'))
+
+    def invalidate(self, kind: Optional[str] = None, ids: Optional[Iterable[str]] = None):
+        """Товары/цветы ids изменились - перечитать их при следующем запросе; без ids - все"""
+        if kind is None or ids is None:
+            self._version += 1
+            self._loaded_at = None
+            return
+        self._dirty[kind].update(str(entry_id) for entry_id in ids if entry_id)
+
+    def get_stats(self) -> dict:
+        return {
+            'products': len(self.products),
+            'flowers': len(self.flowers),
+            'pending': sum(len(ids) for ids in self._dirty.values()),
+            'loads': self.loads,
+            'refreshes': self.refreshes,
+            'fresh': self.is_fresh
+        }
+
+
+# Глобальное автодополнение приложения
+autocomplete = Autocomplete(config.AUTOCOMPLETE_TTL, config.AUTOCOMPLETE_POPULARITY_DAYS)
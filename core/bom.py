@@ -0,0 +1,139 @@
+"""
+Индекс составов товаров (bill of materials) в памяти: product_id -> [(flower_id, amount)]
+Таблица product_composition читается один раз (постранично) и хранится компактно,
+в виде CSR массивов: offsets[i]..offsets[i+1] - срез строк товара i в flowers/amounts.
+План резервирования склада под заказ (core/inventory.py) считает потребность
+в цветах без запросов: explode(items) -> {flower_id: всего штук}.
+Индекс сбрасывается роутами, меняющими составы, и перечитывается не реже BOM_INDEX_TTL.
+"""
+
+import asyncio
+import logging
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Максимум строк PostgREST за один запрос
+_PAGE_SIZE = 1000
+
+
+class BomIndex:
+    """Составы всех товаров в CSR массивах"""
+
+    def __init__(self, ttl_seconds: float = 600):
+        self.ttl_seconds = ttl_seconds
+        self._products: Dict[str, int] = {}
+        self._flower_ids: List[str] = []
+        self._offsets = array('I', [0])
+        self._flowers = array('I')
+        self._amounts = array('i')
+        self._loaded_at: Optional[float] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._version = 0
+        self.loads = 0
+
+    @property
+    def is_fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl_seconds
+
+    async def ensure_loaded(self, db) -> 'BomIndex':
+        """Загружает индекс, если его нет или он устарел (один загрузчик на все корутины)"""
+        if self.is_fresh:
+            return self
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self.is_fresh:
+                version = self._version
+                rows = []
+                while True:
+                    page = await db.table('product_composition')\
+                        .select('product_id, flower_id, amount')\
+                        .order('product_id')\
+                        .order('flower_id')\
+                        .range(len(rows), len(rows) + _PAGE_SIZE - 1)\
+                        .execute()
+                    rows.extend(page.data or [])
+                    if len(page.data or []) < _PAGE_SIZE:
+                        break
+                self.load(rows)
+                if version != self._version:
+                    # Состав изменился во время чтения - данные годятся только для этого вызова
+                    self._loaded_at = None
+        return self
+
+    def load(self, rows: Iterable[dict]):
+        """Строит индекс из строк product_composition"""
+        by_product: Dict[str, Dict[str, int]] = {}
+        for row in rows:
+            if not row.get('product_id') or not row.get('flower_id') or not row.get('amount'):
+                continue
+            flowers = by_product.setdefault(str(row['product_id']), {})
+            flowers[str(row['flower_id'])] = flowers.get(str(row['flower_id']), 0) + int(row['amount'])
+
+        products, flower_ids, flower_index = {}, [], {}
+        offsets, flowers, amounts = array('I', [0]), array('I'), array('i')
+        for product_id, components in by_product.items():
+            products[product_id] = len(offsets) - 1
+            for flower_id, amount in components.items():
+                if flower_id not in flower_index:
+                    flower_index[flower_id] = len(flower_ids)
+                    flower_ids.append(flower_id)
+                flowers.append(flower_index[flower_id])
+                amounts.append(amount)
+            offsets.append(len(flowers))
+
+        self._products, self._flower_ids = products, flower_ids
+        self._offsets, self._flowers, self._amounts = offsets, flowers, amounts
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+        logger.info(f"BOM index loaded: {len(products)} products, {len(flowers)} components")
+
+    def components(self, product_id: Optional[str]) -> List[Tuple[str, int]]:
+        """Состав товара [(flower_id, amount)], пустой - товар без состава"""
+        index = self._products.get(str(product_id)) if product_id else None
+        if index is None:
+            return []
+        start, end = self._offsets[index], self._offsets[index + 1]
+        return [(self._flower_ids[self._flowers[i]], self._amounts[i]) for i in range(start, end)]
+
+    def csr(self) -> Tuple[List[str], List[str], array, array, array]:
+        """Матрица товар × цветок: (product_ids, flower_ids, offsets, flowers, amounts) - строки по порядку product_ids"""
+        return list(self._products), list(self._flower_ids), self._offsets, self._flowers, self._amounts
+
+    def has_composition(self, product_id: Optional[str]) -> bool:
+        return bool(product_id) and str(product_id) in self._products
+
+    def explode(self, items: Iterable[dict]) -> Dict[str, int]:
+        """Потребность заказа в цветах: {flower_id: amount × quantity по всем позициям}"""
+        totals = array('q', bytes(8 * len(self._flower_ids)))
+        for item in items:
+            index = self._products.get(str(item.get('product_id'))) if item.get('product_id') else None
+            if index is None:
+                continue
+            quantity = int(item.get('quantity', 1))
+            for i in range(self._offsets[index], self._offsets[index + 1]):
+                totals[self._flowers[i]] += self._amounts[i] * quantity
+        return {self._flower_ids[i]: total for i, total in enumerate(totals) if total}
+
+    def invalidate(self):
+        """Составы изменились - перечитать при следующем обращении"""
+        self._version += 1
+        self._loaded_at = None
+
+    def get_stats(self) -> dict:
+        return {
+            'products': len(self._products),
+            'flowers': len(self._flower_ids),
+            'components': len(self._flowers),
+            'loads': self.loads,
+            'fresh': self.is_fresh
+        }
+
+
+# Глобальный индекс составов приложения
+bom_index = BomIndex(config.BOM_INDEX_TTL)
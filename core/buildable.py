@@ -0,0 +1,209 @@
+"""
+Сколько букетов можно собрать прямо сейчас из остатков цветов
+Составы из bom_index (CSR массивы) - разреженная матрица товар × цветок, flowers.quantity -
+вектор остатков. Для всех товаров с составом разом, одним проходом NumPy:
+buildable[товар] = min по цветкам состава (остаток // количество в составе).
+Обратный индекс цветок -> товары (CSC) позволяет при изменении остатка одного цветка
+пересчитать только букеты с ним: журнал склада (core/ledger.py) сообщает новые остатки
+подписчикам, составы не перечитываются. Полная перезагрузка остатков - не реже BUILDABLE_TTL.
+Без numpy расчет выключен: counts() пустой, остальное работает как раньше.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, List, Optional
+
+from config import config
+from core.bom import BomIndex, bom_index
+from core.ledger import fetch_all
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+
+class BuildableIndex:
+    """Максимум букетов по каждому товару с составом и пересчет по одному цветку"""
+
+    def __init__(self, ttl_seconds: float = 300, bom: BomIndex = bom_index):
+        self.ttl_seconds = ttl_seconds
+        self.bom = bom
+        self._bom_loads: Optional[int] = None
+        self._product_ids: List[str] = []
+        self._products: Dict[str, int] = {}
+        self._flower_ids: List[str] = []
+        self._flowers: Dict[str, int] = {}
+        self._offsets = self._columns = self._amounts = None
+        self._flower_offsets = self._flower_rows = None
+        self._stock = None
+        self._counts = None
+        self._pending: Optional[List[dict]] = None
+        self._loaded_at: Optional[float] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._version = 0
+        self.loads = 0
+        self.updates = 0
+
+    @property
+    def enabled(self) -> bool:
+        return np is not None
+
+    @property
+    def is_fresh(self) -> bool:
+        return (
+            self._loaded_at is not None
+            and time.monotonic() - self._loaded_at < self.ttl_seconds
+            and self._bom_loads == self.bom.loads
+        )
+
+    async def ensure_loaded(self, db) -> 'BuildableIndex':
+        """Перечитывает остатки цветов, если они устарели или изменились составы"""
+        if not self.enabled:
+            return self
+        await self.bom.ensure_loaded(db)
+        if self.is_fresh:
+            return self
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self.is_fresh:
+                version = self._version
+                # Изменения остатков во время чтения применяются поверх прочитанного
+                self._pending = []
+                try:
+                    rows = await fetch_all(lambda: db.table('flowers').select('id, quantity').order('id'))
+                    self.load({str(row['id']): row.get('quantity') or 0 for row in rows})
+                finally:
+                    pending, self._pending = self._pending, None
+                self.apply_stock_changes(pending)
+                if version != self._version:
+                    self._loaded_at = None
+        return self
+
+    def load(self, stock: Dict[str, int]):
+        """Строит матрицу из bom_index и считает buildable для всех товаров"""
+        if not self.enabled:
+            return
+        product_ids, flower_ids, offsets, flowers, amounts = self.bom.csr()
+        self._bom_loads = self.bom.loads
+        self._product_ids, self._flower_ids = product_ids, flower_ids
+        self._products = {product_id: i for i, product_id in enumerate(product_ids)}
+        self._flowers = {flower_id: i for i, flower_id in enumerate(flower_ids)}
+        self._offsets = np.asarray(offsets, dtype=np.intp)
+        self._columns = np.asarray(flowers, dtype=np.intp)
+        self._amounts = np.maximum(np.asarray(amounts, dtype=np.int64), 1)
+
+        # Обратный индекс: товары (строки) по каждому цветку
+        rows = np.repeat(np.arange(len(product_ids), dtype=np.intp), np.diff(self._offsets))
+        self._flower_rows = rows[np.argsort(self._columns, kind='stable')]
+        self._flower_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(self._columns, minlength=len(flower_ids)))]
+        ).astype(np.intp)
+
+        self._stock = np.array([max(int(stock.get(flower_id) or 0), 0) for flower_id in flower_ids], dtype=np.int64)
+        self._counts = self._compute(np.arange(len(product_ids), dtype=np.intp))
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+        logger.info(f"Buildable counts loaded: {len(product_ids)} products, {len(flower_ids)} flowers")
+
+    def _compute(self, rows):
+        """buildable для строк rows: остаток // количество по компонентам и минимум по каждому товару"""
+        if not len(rows):
+            return np.zeros(0, dtype=np.int64)
+        starts = self._offsets[rows]
+        lengths = self._offsets[rows + 1] - starts
+        # Начала отрезков товаров в склеенном массиве компонентов
+        segments = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - segments, lengths) + np.arange(int(lengths.sum()))
+        ratios = self._stock[self._columns[positions]] // self._amounts[positions]
+        return np.minimum.reduceat(ratios, segments)
+
+    def apply_stock_changes(self, items: Iterable[dict]) -> List[str]:
+        """
+        Новые остатки из журнала склада - пересчитываются только товары с этими цветами
+
+        Returns:
+            product_id товаров, которые больше нельзя собрать (было > 0, стало 0);
+            товар без состава - когда его собственный остаток дошел до нуля
+        """
+        items = list(items)
+        if self._pending is not None:
+            self._pending.extend(items)
+        if self._counts is None:
+            return []
+
+        changed, dropped = [], []
+        for item in items:
+            if item.get('item_type') == 'flower':
+                position = self._flowers.get(str(item.get('item_id')))
+                if position is not None:
+                    self._stock[position] = max(int(item.get('new_quantity') or 0), 0)
+                    changed.append(position)
+            elif item.get('item_type') == 'product' and str(item.get('item_id')) not in self._products:
+                if (item.get('old_quantity') or 0) > 0 >= (item.get('new_quantity') or 0):
+                    dropped.append(str(item['item_id']))
+        if not changed:
+            return dropped
+
+        rows = np.unique(np.concatenate([
+            self._flower_rows[self._flower_offsets[position]:self._flower_offsets[position + 1]]
+            for position in changed
+        ]))
+        before = self._counts[rows]
+        after = self._compute(rows)
+        self._counts[rows] = after
+        self.updates += 1
+        dropped.extend(self._product_ids[row] for row in rows[(before > 0) & (after == 0)].tolist())
+        return dropped
+
+    def counts(self, product_ids: Optional[Iterable[str]] = None) -> Dict[str, int]:
+        """{product_id: сколько можно собрать} - только товары с составом"""
+        if self._counts is None:
+            return {}
+        if product_ids is None:
+            return dict(zip(self._product_ids, self._counts.tolist()))
+        return {
+            str(product_id): int(self._counts[self._products[str(product_id)]])
+            for product_id in product_ids
+            if str(product_id) in self._products
+        }
+
+    def limiting_flower(self, product_id: str) -> Optional[str]:
+        """Цветок состава, которого хватает на меньше всего букетов"""
+        row = self._products.get(str(product_id)) if self._counts is not None else None
+        if row is None:
+            return None
+        start, end = self._offsets[row], self._offsets[row + 1]
+        ratios = self._stock[self._columns[start:end]] // self._amounts[start:end]
+        return self._flower_ids[self._columns[start + int(np.argmin(ratios))]]
+
+    def products_with(self, flower_id: str) -> List[str]:
+        """Товары, в составе которых есть цветок"""
+        position = self._flowers.get(str(flower_id)) if self._counts is not None else None
+        if position is None:
+            return []
+        rows = self._flower_rows[self._flower_offsets[position]:self._flower_offsets[position + 1]]
+        return [self._product_ids[row] for row in rows.tolist()]
+
+    def invalidate(self):
+        self._version += 1
+        self._loaded_at = None
+
+    def get_stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'products': len(self._product_ids),
+            'flowers': len(self._flower_ids),
+            'buildable': int((self._counts > 0).sum()) if self._counts is not None else 0,
+            'loads': self.loads,
+            'updates': self.updates,
+            'fresh': self.is_fresh
+        }
+
+
+# Глобальный расчет приложения
+buildable_index = BuildableIndex(config.BUILDABLE_TTL)
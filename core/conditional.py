@@ -0,0 +1,104 @@
+"""
+Условные GET для HTML страниц CRM (ETag / Last-Modified -> 304 Not Modified)
+Страницы заказа, списка заказов, товара и цветка отдаются с валидаторами вместо
+no-store: браузер хранит страницу и при возврате назад присылает If-None-Match.
+Валидатор считается из первого (дешевого) запроса страницы:
+- заказ - строка, позиции с версиями товаров и пользователи страницы + поколение заказа
+- товар / цветок - updated_at строки + поколение сущности (core/fragments.py)
+- списки заказов и товаров - id и версии строк страницы, итог и курсор
+Если он совпал, остальные запросы и рендер пропускаются.
+У списков и страницы заказа только ETag: самый поздний updated_at (Last-Modified) не меняется,
+когда строка уходит со страницы или удаляется позиция, - это дало бы устаревший 304.
+
+В ETag входит BOOT_ID процесса: деплой (новые шаблоны) или перезапуск (поколения
+сбрасываются) делают все старые ETag недействительными.
+"""
+
+import hashlib
+import logging
+import uuid
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Optional
+
+from fastapi import Request, Response
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+BOOT_ID = uuid.uuid4().hex[:8]
+
+# Хранить можно, но перед показом браузер обязан переспросить сервер
+REVALIDATE_CACHE_CONTROL = 'private, no-cache'
+NO_STORE_CACHE_CONTROL = 'no-cache, no-store, must-revalidate'
+
+
+def make_etag(*parts: Any) -> str:
+    """Слабый ETag по частям версии страницы (HTML одинаков по смыслу, не побайтно)"""
+    digest = hashlib.sha1(repr((BOOT_ID,) + parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    """updated_at из Supabase (ISO строка, без зоны - UTC) -> aware datetime"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        try:
+            parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+class PageValidator:
+    """ETag и Last-Modified страницы: проверка запроса, 304 и заголовки ответа"""
+
+    def __init__(self, etag: str, last_modified: Any = None):
+        self.etag = etag
+        modified = parse_timestamp(last_modified)
+        # HTTP-дата с точностью до секунды
+        self.last_modified = modified.replace(microsecond=0) if modified else None
+
+    def matches(self, request: Request) -> bool:
+        """Копия браузера актуальна (If-None-Match, без него - If-Modified-Since)"""
+        if not config.CONDITIONAL_GET or request.method not in ('GET', 'HEAD'):
+            return False
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match is not None:
+            own = self.etag.removeprefix('W/')
+            tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+            return '*' in tags or own in tags
+        if_modified_since = request.headers.get('if-modified-since')
+        if if_modified_since and self.last_modified:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            return self.last_modified <= since
+        return False
+
+    def headers(self) -> dict:
+        headers = {'ETag': self.etag, 'Cache-Control': REVALIDATE_CACHE_CONTROL}
+        if self.last_modified:
+            headers['Last-Modified'] = format_datetime(self.last_modified, usegmt=True)
+        return headers
+
+    def not_modified(self) -> Response:
+        return Response(status_code=304, headers=self.headers())
+
+    def apply(self, response: Response) -> Response:
+        """Валидаторы на ответ; при CONDITIONAL_GET=false - прежний no-store"""
+        if config.CONDITIONAL_GET:
+            for name, value in self.headers().items():
+                response.headers[name] = value
+        else:
+            response.headers['Cache-Control'] = NO_STORE_CACHE_CONTROL
+            response.headers['Pragma'] = 'no-cache'
+            response.headers['Expires'] = '0'
+        return response
@@ -3,7 +3,6 @@ Connection Pool для оптимизации подключений к база
 Поддержка MySQL и Supabase с автоматическим управлением соединениями
 """
 
-import asyncio
 import pymysql
 from typing import Dict, Any, Optional, AsyncContextManager
 from contextlib import asynccontextmanager
@@ -13,12 +12,12 @@ import logging
 from threading import Lock
 import time
 
-from supabase import create_client, Client
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 import config
 from core.exceptions import DatabaseConnectionError, DatabaseQueryError, ConfigurationError
+from core.data_access import AsyncSupabase
 
 # Адаптер для совместимости со старой структурой настроек
 class DatabaseConfig:
@@ -236,117 +235,13 @@ class MySQLConnectionPool:
             self._stats.active_connections = 0
             self._stats.idle_connections = 0
 
-class SupabaseConnectionPool:
-    """Пул клиентов для Supabase"""
-    
-    def __init__(self, url: str, service_key: str, max_clients: int = 5):
-        self.url = url
-        self.service_key = service_key
-        self.max_clients = max_clients
-        self._clients: list = []
-        self._lock = Lock()
-        self._stats = PoolStats()
-        
-        # Проверяем конфигурацию
-        if not url or not service_key:
-            raise ConfigurationError("Supabase URL and service key are required")
-        
-        # Создаем начальный клиент
-        self._initialize_pool()
-    
-    def _initialize_pool(self):
-        """Создает начальный пул клиентов"""
-        try:
-            client = create_client(self.url, self.service_key)
-            self._clients.append({
-                'client': client,
-                'created_at': datetime.now(),
-                'last_used': datetime.now(),
-                'in_use': False
-            })
-            self._stats.total_created += 1
-            self._stats.idle_connections += 1
-        except Exception as e:
-            logger.error(f"Failed to initialize Supabase client: {e}")
-            raise DatabaseConnectionError("Supabase", self.url)
-    
-    def _create_client(self) -> Client:
-        """Создает нового клиента Supabase"""
-        try:
-            return create_client(self.url, self.service_key)
-        except Exception as e:
-            self._stats.errors_count += 1
-            raise DatabaseConnectionError("Supabase", self.url, original_error=str(e))
-    
-    @asynccontextmanager
-    async def get_client(self):
-        """Получает клиента из пула"""
-        client_item = None
-        
-        with self._lock:
-            # Ищем свободного клиента
-            for item in self._clients:
-                if not item['in_use']:
-                    item['in_use'] = True
-                    item['last_used'] = datetime.now()
-                    client_item = item
-                    self._stats.active_connections += 1
-                    self._stats.idle_connections -= 1
-                    break
-            
-            # Создаем нового клиента если нужно
-            if not client_item and len(self._clients) < self.max_clients:
-                try:
-                    new_client = self._create_client()
-                    client_item = {
-                        'client': new_client,
-                        'created_at': datetime.now(),
-                        'last_used': datetime.now(),
-                        'in_use': True
-                    }
-                    self._clients.append(client_item)
-                    self._stats.total_created += 1
-                    self._stats.active_connections += 1
-                except Exception as e:
-                    raise DatabaseConnectionError("Supabase", self.url, original_error=str(e))
-        
-        if not client_item:
-            # Ждем освобождения клиента
-            await asyncio.sleep(0.1)
-            async with self.get_client() as client:
-                yield client
-            return
-        
-        try:
-            self._stats.last_activity = datetime.now()
-            yield client_item['client']
-        finally:
-            # Возвращаем клиента в пул
-            with self._lock:
-                if client_item:
-                    client_item['in_use'] = False
-                    self._stats.active_connections -= 1
-                    self._stats.idle_connections += 1
-    
-    def get_stats(self) -> Dict[str, Any]:
-        """Возвращает статистику пула"""
-        return {
-            'active_connections': self._stats.active_connections,
-            'idle_connections': self._stats.idle_connections,
-            'total_connections': len(self._clients),
-            'total_created': self._stats.total_created,
-            'errors_count': self._stats.errors_count,
-            'max_clients': self.max_clients,
-            'last_activity': self._stats.last_activity.isoformat() if self._stats.last_activity else None
-        }
-
 class DatabasePoolManager:
     """Менеджер пулов соединений"""
     
     def __init__(self):
         self._mysql_local_pool: Optional[MySQLConnectionPool] = None
         self._mysql_production_pool: Optional[MySQLConnectionPool] = None
-        self._supabase_pool: Optional[SupabaseConnectionPool] = None
+        self._supabase: Optional[AsyncSupabase] = None
         self._initialized = False
     
     def initialize(self):
@@ -369,11 +264,13 @@ class DatabasePoolManager:
                 min_connections=1
             )
             
-            # Supabase пул
-            self._supabase_pool = SupabaseConnectionPool(
+            # Supabase: один асинхронный клиент с ограничением параллельных запросов
+            if not settings.database.supabase_url or not settings.database.supabase_service_key:
+                raise ConfigurationError("Supabase URL and service key are required")
+            self._supabase = AsyncSupabase(
                 settings.database.supabase_url,
                 settings.database.supabase_service_key,
-                max_clients=settings.production.max_connections // 3
+                max_concurrency=settings.production.max_connections // 3
             )
             
             self._initialized = True
@@ -401,11 +298,10 @@ class DatabasePoolManager:
     
     @asynccontextmanager
     async def supabase(self):
-        """Получает клиента Supabase"""
+        """Получает асинхронный клиент Supabase (общий для всех запросов)"""
         if not self._initialized:
             self.initialize()
-        async with self._supabase_pool.get_client() as client:
-            yield client
+        yield self._supabase
     
     def get_stats(self) -> Dict[str, Any]:
         """Возвращает статистику всех пулов"""
@@ -415,11 +311,11 @@ class DatabasePoolManager:
         return {
             'mysql_local': self._mysql_local_pool.get_stats(),
             'mysql_production': self._mysql_production_pool.get_stats(),
-            'supabase': self._supabase_pool.get_stats(),
+            'supabase': self._supabase.get_stats(),
             'total_connections': (
                 self._mysql_local_pool.get_stats()['total_connections'] +
                 self._mysql_production_pool.get_stats()['total_connections'] +
-                self._supabase_pool.get_stats()['total_connections']
+                self._supabase.get_stats()['total_connections']
             )
         }
     
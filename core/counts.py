@@ -0,0 +1,96 @@
+"""
+Стратегии подсчета total для пагинации
+count='exact' на больших таблицах - полный скан в Postgres на каждую страницу, поэтому
+для каждого эндпоинта можно выбрать:
+- exact     - точный COUNT(*) (как раньше)
+- estimated - точный при небольшом результате, иначе оценка планировщика (PostgREST)
+- planned   - всегда оценка планировщика
+- cached    - точный COUNT(*), закешированный по таблице и фильтрам на COUNT_CACHE_TTL;
+              сбрасывается при любой записи в таблицу через AsyncSupabase и его sync_client.
+              Записи других процессов (синхронизация с Bitrix, скрипты) кеш не видит -
+              для таблиц, которые они пишут (orders), cached не подходит
+"""
+
+import json
+import logging
+from typing import Any, Optional
+
+from cache_utils import SimpleCache
+from config import config
+
+logger = logging.getLogger(__name__)
+
+COUNT_STRATEGIES = ('exact', 'estimated', 'planned', 'cached')
+
+# Операции, которые не влияют на total (сортировка и пагинация)
+_PAGING_OPS = ('select', 'order', 'range', 'limit', 'offset', 'keyset')
+
+# Кеш total'ов: ключ "{table}:{фильтры}"
+count_cache = SimpleCache()
+
+
+def count_signature(query) -> str:
+    """Ключ кеша: таблица + фильтры запроса без сортировки и пагинации"""
+    filters = [(name, args, kwargs) for name, args, kwargs in query.ops if name not in _PAGING_OPS]
+    return f"{query.table}:{json.dumps(filters, sort_keys=True, default=str, ensure_ascii=False)}"
+
+
+def _with_count(query, count: Any):
+    """Подставляет count в select() построителя"""
+    for index, (name, args, kwargs) in enumerate(query.ops):
+        if name == 'select':
+            kwargs = {key: value for key, value in kwargs.items() if key != 'count'}
+            if count:
+                kwargs['count'] = count
+            query.ops[index] = (name, args, kwargs)
+            return query
+    raise ValueError(f"Query on {query.table} has no select()")
+
+
+async def execute_counted(query, strategy: str = 'exact'):
+    """
+    Выполняет выборку страницы и заполняет result.count выбранной стратегией
+
+    Args:
+        query: AsyncQuery с select(), фильтрами и range()
+        strategy: exact / estimated / planned / cached
+    """
+    if strategy not in COUNT_STRATEGIES:
+        logger.warning(f"Unknown count strategy '{strategy}', using exact")
+        strategy = 'exact'
+
+    if strategy != 'cached':
+        return await _with_count(query, strategy).execute()
+
+    key = count_signature(query)
+    cached = count_cache.get(key)
+    if cached is not None:
+        result = await _with_count(query, None).execute()
+        result.count = cached
+        return result
+
+    result = await _with_count(query, 'exact').execute()
+    if result.count is not None:
+        count_cache.set(key, result.count, ttl_seconds=config.COUNT_CACHE_TTL)
+    return result
+
+
+async def count_total(query, strategy: str = 'exact') -> Optional[int]:
+    """
+    Только total по фильтрам запроса (для keyset страниц, где сам запрос страницы
+    отфильтрован курсором). Для cached при попадании в кеш запрос не выполняется.
+    """
+    if strategy == 'cached':
+        cached = count_cache.get(count_signature(query))
+        if cached is not None:
+            return cached
+    result = await execute_counted(query.limit(1), strategy)
+    return result.count
+
+
+def invalidate_counts(table: str = None):
+    """Сбрасывает закешированные total'ы таблицы (или всех таблиц)"""
+    if table is None:
+        count_cache.clear()
+    else:
+        count_cache.invalidate_prefix(f"{table}:")
@@ -0,0 +1,302 @@
+"""
+Асинхронный слой доступа к данным Supabase (PostgREST)
+Все запросы идут через общий keep-alive HTTP клиент с ограничением параллельности,
+поэтому обработчики FastAPI не блокируют event loop во время сетевых запросов
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import httpx
+from postgrest import AsyncPostgrestClient
+
+from core.counts import invalidate_counts
+from core.dataloader import request_loaders
+from core.pagination import apply_keyset
+from core.search import apply_match_any
+from monitoring.query_stats import count_rows, describe_filters, instrument_sync_client, record_query
+
+logger = logging.getLogger(__name__)
+
+# Методы построителя, которые определяют тип запроса
+QUERY_VERBS = ('select', 'insert', 'update', 'delete', 'upsert')
+
+# Подписчики на выполненные записи: listener(table, verb)
+_write_listeners: List[Callable[[str, str], None]] = []
+
+
+def add_write_listener(listener: Callable[[str, str], None]):
+    """Подписка на успешные insert/update/delete/upsert этого процесса (реплики и кеши таблиц)"""
+    if listener not in _write_listeners:
+        _write_listeners.append(listener)
+
+
+def _notify_write(table: str, verb: str):
+    for listener in list(_write_listeners):
+        try:
+            listener(table, verb)
+        except Exception as e:
+            logger.error(f"Write listener {getattr(listener, '__name__', listener)} failed: {e}")
+
+
+def _sync_client_write(table: str, verb: str):
+    """Запись через sync_client (webhook'и, /api/sync/*): те же сброшенные total'ы, что у run()"""
+    invalidate_counts(None if verb == 'rpc' else table)
+
+
+class QueryResult:
+    """Результат запроса (совместим с postgrest APIResponse по полям data и count)"""
+
+    def __init__(self, data: Any = None, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+    def __repr__(self) -> str:
+        return f"QueryResult(rows={len(self.data) if isinstance(self.data, list) else self.data is not None}, count={self.count})"
+
+
+class AsyncQuery:
+    """
+    Ленивый построитель запроса
+
+    Повторяет цепочку вызовов supabase-py (select/eq/in_/order/range/single ...),
+    записывая её, и выполняет запрос только при `await query.execute()`.
+    Дополнительно поддерживает .keyset(keys, after) - курсорную пагинацию
+    и .match_any(conditions) - OR по нескольким полям (core/search.py).
+    """
+
+    def __init__(self, db: 'AsyncSupabase', table: str, kind: str = 'table'):
+        self._db = db
+        self.table = table
+        self.kind = kind
+        self.ops: List[Tuple[str, tuple, dict]] = []
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs) -> 'AsyncQuery':
+            self.ops.append((name, args, kwargs))
+            return self
+
+        return method
+
+    @property
+    def verb(self) -> str:
+        """Тип запроса: select, insert, update, delete, upsert или rpc"""
+        if self.kind == 'rpc':
+            return 'rpc'
+        for name, _, _ in self.ops:
+            if name in QUERY_VERBS:
+                return name
+        return 'select'
+
+    def copy(self) -> 'AsyncQuery':
+        """Независимая копия цепочки (например, для отдельного подсчета total)"""
+        query = AsyncQuery(self._db, self.table, self.kind)
+        query.ops = list(self.ops)
+        return query
+
+    async def execute(self) -> QueryResult:
+        return await self._db.run(self)
+
+    def __repr__(self) -> str:
+        chain = '.'.join(name for name, _, _ in self.ops)
+        return f"AsyncQuery({self.table}.{chain})"
+
+
+class _PooledPostgrestClient(AsyncPostgrestClient):
+    """AsyncPostgrestClient с общим httpx клиентом и лимитами keep-alive соединений"""
+
+    def __init__(self, base_url: str, *, headers: Dict[str, str], timeout: float, limits: httpx.Limits):
+        self._limits = limits
+        super().__init__(base_url, headers=headers, timeout=timeout)
+
+    def create_session(self, base_url: str, headers: Dict[str, str], timeout, verify: bool = True) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            verify=verify,
+            limits=self._limits,
+            follow_redirects=True,
+        )
+
+
+class AsyncSupabase:
+    """
+    Асинхронный клиент Supabase для обработчиков FastAPI
+
+    - один httpx.AsyncClient на процесс (keep-alive соединения переиспользуются)
+    - asyncio.Semaphore ограничивает число одновременных запросов к PostgREST
+    - sync_client - обычный supabase Client для модулей, которые ещё работают синхронно
+      (его HTTP запросы учитываются в monitoring.query_stats через хуки httpx)
+    - backend - in-process исполнитель вместо PostgREST для офлайн тестов и бенчмарков
+    """
+
+    def __init__(
+        self,
+        url: str,
+        key: str,
+        max_concurrency: int = 20,
+        max_connections: Optional[int] = None,
+        timeout: float = 30.0,
+        sync_client: Any = None,
+        backend: Any = None
+    ):
+        self.rest_url = f"{url.rstrip('/')}/rest/v1"
+        self.headers = {'apiKey': key, 'Authorization': f'Bearer {key}'}
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        # Запросы синхронного клиента тоже попадают в monitoring.query_stats, записи сбрасывают total'ы
+        self.sync_client = (
+            instrument_sync_client(sync_client, on_write=_sync_client_write) if sync_client is not None else None
+        )
+        # Альтернативный исполнитель запросов вместо PostgREST (core/fake_backend.py)
+        self._backend = backend
+        connections = max_connections or max_concurrency
+        self._limits = httpx.Limits(
+            max_connections=connections,
+            max_keepalive_connections=connections,
+            keepalive_expiry=30.0
+        )
+        self._rest: Optional[_PooledPostgrestClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+        # Статистика
+        self._active_requests = 0
+        self._total_requests = 0
+        self._errors_count = 0
+        self._last_activity: Optional[datetime] = None
+
+    # ==================== ПОСТРОЕНИЕ ЗАПРОСОВ ====================
+
+    def table(self, name: str) -> AsyncQuery:
+        """Начинает запрос к таблице (аналог Client.table)"""
+        return AsyncQuery(self, name)
+
+    from_ = table
+
+    def rpc(self, function_name: str, params: Optional[Dict[str, Any]] = None) -> AsyncQuery:
+        """Начинает вызов Postgres функции (аналог Client.rpc)"""
+        query = AsyncQuery(self, function_name, kind='rpc')
+        query.ops.append(('rpc', (function_name, params or {}), {}))
+        return query
+
+    # ==================== ВЫПОЛНЕНИЕ ====================
+
+    def _get_rest(self) -> _PooledPostgrestClient:
+        if self._rest is None:
+            self._rest = _PooledPostgrestClient(
+                self.rest_url,
+                headers=self.headers,
+                timeout=self.timeout,
+                limits=self._limits
+            )
+        return self._rest
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # Семафор создается лениво, внутри работающего event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _build(self, query: AsyncQuery):
+        """Воспроизводит записанную цепочку на построителе postgrest"""
+        rest = self._get_rest()
+        ops = query.ops
+        if query.kind == 'rpc':
+            _, (function_name, params), _ = ops[0]
+            builder = rest.rpc(function_name, params)
+            ops = ops[1:]
+        else:
+            builder = rest.from_(query.table)
+        for name, args, kwargs in ops:
+            if name == 'keyset':
+                # Сортировка + курсор "строго после" (core/pagination.py)
+                builder = apply_keyset(builder, *args, **kwargs)
+            elif name == 'match_any':
+                builder = apply_match_any(builder, *args, **kwargs)
+            else:
+                builder = getattr(builder, name)(*args, **kwargs)
+        return builder
+
+    async def run(self, query: AsyncQuery) -> QueryResult:
+        """
+        Выполняет запрос, не блокируя event loop
+
+        Внутри HTTP запроса точечные выборки идут через request-scoped DataLoader
+        (core/dataloader.py), а любая запись сбрасывает его кеш и закешированные
+        total'ы пагинации (core/counts.py) для таблицы; после успешной записи
+        вызываются подписчики add_write_listener.
+        """
+        verb = query.verb
+        written_table = None if verb == 'rpc' else query.table
+        if verb != 'select':
+            invalidate_counts(written_table)
+
+        loaders = request_loaders.get()
+        if loaders is not None:
+            if verb == 'select':
+                data, matched = await loaders.load(self, query)
+                if matched:
+                    return QueryResult(data)
+            else:
+                loaders.invalidate(written_table)
+        result = await self.fetch(query)
+        if written_table is not None and verb != 'select':
+            _notify_write(written_table, verb)
+        return result
+
+    async def fetch(self, query: AsyncQuery) -> QueryResult:
+        """Выполняет запрос напрямую, минуя DataLoader (время и число строк попадают в monitoring.query_stats)"""
+        builder = self._build(query) if self._backend is None else None
+        async with self._get_semaphore():
+            self._active_requests += 1
+            self._total_requests += 1
+            self._last_activity = datetime.now()
+            start = time.perf_counter()
+            rows, error = 0, None
+            try:
+                if builder is not None:
+                    response = await builder.execute()
+                else:
+                    response = await self._backend.execute(query)
+                rows = count_rows(response.data)
+            except Exception as e:
+                self._errors_count += 1
+                error = str(e)
+                raise
+            finally:
+                self._active_requests -= 1
+                record_query(
+                    'supabase',
+                    query.table,
+                    query.verb,
+                    describe_filters(query.ops),
+                    rows,
+                    (time.perf_counter() - start) * 1000,
+                    error
+                )
+        return QueryResult(response.data, getattr(response, 'count', None))
+
+    async def aclose(self):
+        """Закрывает общий HTTP клиент"""
+        if self._rest is not None:
+            await self._rest.aclose()
+            self._rest = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику клиента"""
+        return {
+            'active_requests': self._active_requests,
+            'total_requests': self._total_requests,
+            'errors_count': self._errors_count,
+            'max_concurrency': self.max_concurrency,
+            'max_connections': self._limits.max_connections,
+            'total_connections': 1 if self._rest is not None else 0,
+            'last_activity': self._last_activity.isoformat() if self._last_activity else None
+        }
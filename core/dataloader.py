@@ -0,0 +1,218 @@
+"""
+Request-scoped DataLoader для PostgREST
+Точечные запросы вида .select(...).eq('id', x), выданные в одном тике event loop,
+объединяются в один запрос .in_('id', [...]) и кешируются до конца HTTP запроса.
+single()/maybe_single() проверяются по сгруппированным строкам так же, как в PostgREST,
+а кеш выборок с вложенными ресурсами сбрасывается записью в любую из их таблиц
+"""
+
+import asyncio
+import copy
+import logging
+import re
+from contextvars import ContextVar
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from postgrest.exceptions import APIError
+
+logger = logging.getLogger(__name__)
+
+# Максимум ключей в одном .in_() (длина URL PostgREST ограничена)
+MAX_BATCH_SIZE = 100
+
+# Модификаторы, которые loader умеет применить к сгруппированному результату
+_POST_OPS = ('single', 'maybe_single', 'limit')
+
+# Вложенный ресурс в select: [alias:]table[!hint](columns)
+_EMBED_RE = re.compile(r'^(?:\w+:)?(\w+)(?:!\w+)?\((.*)\)$', re.DOTALL)
+
+
+def _split_columns(columns: str) -> List[str]:
+    """Разбивает строку select на колонки верхнего уровня (без вложенных ресурсов)"""
+    result, depth, current = [], 0, ''
+    for char in columns:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == ',' and depth == 0:
+            result.append(current.strip())
+            current = ''
+        else:
+            current += char
+    if current.strip():
+        result.append(current.strip())
+    return result
+
+
+def _referenced_tables(table: str, columns: str) -> FrozenSet[str]:
+    """Таблица выборки и таблицы всех вложенных ресурсов (на любой глубине)"""
+    tables = {table}
+    for column in _split_columns(columns):
+        embed = _EMBED_RE.match(column)
+        if embed:
+            tables |= _referenced_tables(embed.group(1), embed.group(2))
+    return frozenset(tables)
+
+
+def _single(data: List[dict], name: str) -> Optional[dict]:
+    """single()/maybe_single() как в PostgREST: ровно одна строка, иначе PGRST116"""
+    if len(data) == 1:
+        return data[0]
+    if name == 'maybe_single' and not data:
+        return None
+    raise APIError({
+        'message': 'JSON object requested, multiple (or no) rows returned',
+        'code': 'PGRST116',
+        'details': f'Results contain {len(data)} rows'
+    })
+
+
+class DataLoader:
+    """Батчинг и мемоизация выборок из одной таблицы по одной колонке"""
+
+    def __init__(self, db, table: str, column: str, columns: str):
+        self.db = db
+        self.table = table
+        self.column = column
+        self.columns = columns
+        # Запись в любую из этих таблиц сбрасывает кеш
+        self.tables = _referenced_tables(table, columns)
+        self._cache: Dict[str, asyncio.Future] = {}
+        self._queue: List[Tuple[str, Any]] = []
+        self._scheduled = False
+        self.batches = 0
+
+    def load(self, key: Any) -> asyncio.Future:
+        """Возвращает future со списком строк, где column == key"""
+        cache_key = str(key)
+        if cache_key in self._cache:
+            return self._cache[cache_key]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._cache[cache_key] = future
+        self._queue.append((cache_key, key))
+
+        if not self._scheduled:
+            self._scheduled = True
+            # Отправляем запрос после того, как отработают все задачи текущего тика
+            loop.call_soon(self._dispatch)
+        return future
+
+    def _dispatch(self):
+        self._scheduled = False
+        queue, self._queue = self._queue, []
+        for start in range(0, len(queue), MAX_BATCH_SIZE):
+            asyncio.ensure_future(self._fetch(queue[start:start + MAX_BATCH_SIZE]))
+
+    async def _fetch(self, batch: List[Tuple[str, Any]]):
+        self.batches += 1
+        try:
+            query = self.db.table(self.table).select(self.columns).in_(self.column, [key for _, key in batch])
+            result = await self.db.fetch(query)
+            rows_by_key: Dict[str, List[dict]] = {}
+            for row in result.data or []:
+                rows_by_key.setdefault(str(row.get(self.column)), []).append(row)
+            for cache_key, _ in batch:
+                future = self._cache.get(cache_key)
+                if future is not None and not future.done():
+                    future.set_result(rows_by_key.get(cache_key, []))
+        except Exception as e:
+            for cache_key, _ in batch:
+                future = self._cache.pop(cache_key, None)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+
+    def clear(self):
+        """Сбрасывает кеш (незавершенные загрузки остаются)"""
+        self._cache = {key: future for key, future in self._cache.items() if not future.done()}
+
+
+class RequestLoaders:
+    """Набор DataLoader'ов одного HTTP запроса"""
+
+    def __init__(self):
+        self._loaders: Dict[Tuple[str, str, str], DataLoader] = {}
+        self.hits = 0
+
+    @staticmethod
+    def match(query) -> Optional[Tuple[str, Any, str, list]]:
+        """
+        Проверяет, можно ли обслужить запрос через loader
+
+        Подходят только выборки: select(columns) + ровно один eq(column, value)
+        + необязательные single()/maybe_single()/limit(n).
+
+        Returns:
+            (column, value, columns, post_ops) или None
+        """
+        if query.kind != 'table':
+            return None
+
+        columns, eq_filter, post_ops = None, None, []
+        for name, args, kwargs in query.ops:
+            if name == 'select' and columns is None and len(args) == 1 and not kwargs:
+                columns = args[0]
+            elif name == 'eq' and eq_filter is None and len(args) == 2 and not kwargs:
+                eq_filter = args
+            elif name in _POST_OPS:
+                post_ops.append((name, args))
+            else:
+                return None
+
+        if columns is None or eq_filter is None:
+            return None
+
+        column, value = eq_filter
+        if '->' in column or value is None:
+            return None
+
+        # Колонка ключа нужна в результате для группировки
+        top_level = _split_columns(columns)
+        if '*' not in top_level and column not in top_level:
+            columns = f"{columns}, {column}"
+
+        return column, value, columns, post_ops
+
+    def get(self, db, table: str, column: str, columns: str) -> DataLoader:
+        key = (table, column, columns)
+        if key not in self._loaders:
+            self._loaders[key] = DataLoader(db, table, column, columns)
+        return self._loaders[key]
+
+    async def load(self, db, query):
+        """Выполняет подходящий запрос через loader; возвращает (data, matched)"""
+        matched = self.match(query)
+        if matched is None:
+            return None, False
+
+        column, value, columns, post_ops = matched
+        rows = await self.get(db, query.table, column, columns).load(value)
+        self.hits += 1
+
+        # Глубокие копии: обработчики меняют и вложенные metadata / order_items(*), а не только строку
+        data: Any = copy.deepcopy(rows)
+        for name, args in post_ops:
+            if name == 'limit':
+                data = data[:args[0]]
+            else:
+                data = _single(data, name)
+        return data, True
+
+    def invalidate(self, table: Optional[str] = None):
+        """Сбрасывает кеш после записи в таблицу (или во все таблицы), в том числе выборок, где она вложена"""
+        for loader in self._loaders.values():
+            if table is None or table in loader.tables:
+                loader.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'loaders': len(self._loaders),
+            'hits': self.hits,
+            'batches': sum(loader.batches for loader in self._loaders.values())
+        }
+
+
+# Лоадеры текущего HTTP запроса (устанавливаются middleware в app.py)
+request_loaders: ContextVar[Optional[RequestLoaders]] = ContextVar('request_loaders', default=None)
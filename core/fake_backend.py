@@ -0,0 +1,742 @@
+"""
+In-process подмена Supabase/PostgREST для офлайн тестов и бенчмарков
+Таблицы хранятся в памяти, запросы AsyncQuery (и синхронного клиента для legacy модулей)
+выполняются по записанной цепочке операций. Поддерживается подмножество, которое
+использует app.py:
+- select со вложенными ресурсами (flowers(name), order_items(*), alias:table!fk(...))
+- eq/neq/gt/gte/lt/lte/like/ilike/is_/in_, match_any, keyset, order/range/limit/offset, single/maybe_single
+- count (exact/planned/estimated считаются точно)
+- insert/update/delete/upsert и rpc через register_rpc
+  (reserve_inventory и функции журнала склада из migrations/004-005 зарегистрированы по умолчанию)
+- триггеры после записи в таблицу (проекция списка заказов из migrations/001,
+  счетчики товаров продавцов из migrations/006)
+  и updated_at = now() при UPDATE справочных таблиц (migrations/007)
+
+Задержка latency_ms добавляется к каждому запросу, чтобы число round trip'ов
+было видно во времени так же, как в продакшне.
+"""
+
+import asyncio
+import copy
+import json
+import random
+import re
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from postgrest.exceptions import APIError
+
+from core.data_access import AsyncSupabase, QueryResult
+from core.dataloader import _split_columns
+from core.ledger import expected_balances, find_mismatches, plan_stock_movements
+from core.order_flags import derive_order_flags
+from core.order_list import build_item_images, projection_row
+from core.search import phone_digits
+from core.thumbnails import miniature_url
+from monitoring.query_stats import count_rows, describe_filters, record_query
+
+_FILTERS = ('eq', 'neq', 'gt', 'gte', 'lt', 'lte', 'like', 'ilike', 'is_', 'in_', 'match_any')
+# Таблицы с триггером updated_at из migrations/007
+_TOUCHED_TABLES = ('flowers', 'products', 'product_composition', 'sellers')
+_EMBED_RE = re.compile(r'^(?:(\w+):)?(\w+)(?:!(\w+))?\((.*)\)$', re.DOTALL)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _singular(table: str) -> str:
+    return table[:-1] if table.endswith('s') else table
+
+
+def _same(value: Any, criteria: Any) -> bool:
+    """Сравнение как в Postgres после приведения строки фильтра к типу колонки"""
+    if value is None or criteria is None:
+        return value is None and criteria is None
+    if isinstance(value, bool):
+        return value == (criteria if isinstance(criteria, bool) else str(criteria).lower() == 'true')
+    if isinstance(value, (int, float)) and not isinstance(criteria, bool):
+        try:
+            return float(value) == float(criteria)
+        except (TypeError, ValueError):
+            return False
+    return str(value) == str(criteria)
+
+
+def _sort_value(value: Any):
+    if isinstance(value, bool):
+        return (0, int(value))
+    if isinstance(value, (int, float)):
+        return (0, value)
+    return (1, str(value))
+
+
+def _compare(value: Any, criteria: Any) -> Optional[int]:
+    """-1/0/1 или None, если значение NULL"""
+    if value is None or criteria is None:
+        return None
+    if isinstance(value, bool):
+        criteria = criteria if isinstance(criteria, bool) else str(criteria).lower() == 'true'
+    elif isinstance(value, (int, float)):
+        try:
+            criteria = float(criteria)
+        except (TypeError, ValueError):
+            value, criteria = str(value), str(criteria)
+    else:
+        value, criteria = str(value), str(criteria)
+    return (value > criteria) - (value < criteria)
+
+
+def _like(value: Any, pattern: str, ignore_case: bool) -> bool:
+    if value is None:
+        return False
+    regex = ''.join('.*' if char == '%' else '.' if char == '_' else re.escape(char) for char in pattern)
+    return re.fullmatch(regex, str(value), re.IGNORECASE | re.DOTALL if ignore_case else re.DOTALL) is not None
+
+
+def _matches(row: dict, name: str, args: tuple) -> bool:
+    if name == 'match_any':
+        return any(_matches(row, operator, (column, pattern)) for column, operator, pattern in args[0])
+    column, criteria = args[0], args[1]
+    value = row.get(column)
+    if name == 'eq':
+        return _same(value, criteria)
+    if name == 'neq':
+        return value is not None and not _same(value, criteria)
+    if name == 'in_':
+        return any(_same(value, item) for item in criteria)
+    if name == 'is_':
+        if criteria is None or str(criteria).lower() == 'null':
+            return value is None
+        return _same(value, criteria)
+    if name in ('like', 'ilike'):
+        return _like(value, criteria, ignore_case=name == 'ilike')
+    result = _compare(value, criteria)
+    if result is None:
+        return False
+    return {'gt': result > 0, 'gte': result >= 0, 'lt': result < 0, 'lte': result <= 0}[name]
+
+
+def _after(row: dict, keys, after) -> bool:
+    """(row keys) строго после курсора при сортировке keys"""
+    for (column, desc), value in zip(keys, after):
+        result = _compare(row.get(column), value)
+        if result is None:
+            return False
+        if result != 0:
+            return result < 0 if desc else result > 0
+    return False
+
+
+def _sort(rows: List[dict], orders: List[Tuple[str, bool]]) -> List[dict]:
+    # Стабильная сортировка с последнего ключа; NULL - последними при asc и первыми при desc, как в Postgres
+    for column, desc in reversed(orders):
+        present = [row for row in rows if row.get(column) is not None]
+        missing = [row for row in rows if row.get(column) is None]
+        present.sort(key=lambda row: _sort_value(row[column]), reverse=desc)
+        rows = missing + present if desc else present + missing
+    return rows
+
+
+class FakeBackend:
+    """Таблицы в памяти и интерпретатор цепочек AsyncQuery"""
+
+    def __init__(self, tables: Optional[Dict[str, List[dict]]] = None, latency_ms: float = 0.0):
+        self.tables: Dict[str, List[dict]] = copy.deepcopy(tables or {})
+        self.latency_ms = latency_ms
+        self.calls = 0
+        self._rpc: Dict[str, Callable[['FakeBackend', dict], Any]] = {
+            'reserve_inventory': fake_reserve_inventory,
+            'record_stock_movements': fake_record_stock_movements,
+            'take_stock_snapshot': fake_take_stock_snapshot,
+            'verify_stock_ledger': fake_verify_stock_ledger,
+            'rebuild_seller_product_counts': fake_rebuild_seller_product_counts,
+        }
+        # Триггеры после записи: handler(backend, старые строки, новые строки)
+        self._triggers: Dict[str, Callable[['FakeBackend', List[dict], List[dict]], None]] = {
+            'products': fake_seller_product_counts,
+            'orders': fake_order_list_rows,
+            'order_items': fake_order_items_list_rows,
+        }
+
+    def register_rpc(self, function_name: str, handler: Callable[['FakeBackend', dict], Any]):
+        """Регистрирует Python реализацию Postgres функции: handler(backend, params) -> data"""
+        self._rpc[function_name] = handler
+
+    async def execute(self, query) -> QueryResult:
+        """Выполняет AsyncQuery (вызывается из AsyncSupabase.fetch)"""
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        return self.execute_ops(query.table, query.kind, query.ops)
+
+    # ==================== ИНТЕРПРЕТАТОР ====================
+
+    def execute_ops(self, table: str, kind: str, ops: List[Tuple[str, tuple, dict]]) -> QueryResult:
+        self.calls += 1
+        if kind == 'rpc':
+            _, (function_name, params), _ = ops[0]
+            if function_name not in self._rpc:
+                raise APIError({'message': f'function {function_name} does not exist', 'code': '42883'})
+            return QueryResult(self._rpc[function_name](self, params))
+
+        verb, verb_args, verb_kwargs = 'select', ('*',), {}
+        filters, orders, post = [], [], []
+        keyset, row_range, limit, offset = None, None, None, 0
+        for name, args, kwargs in ops:
+            if name in ('select', 'insert', 'update', 'delete', 'upsert'):
+                if name != 'select' or verb == 'select':
+                    verb, verb_args, verb_kwargs = name, args, kwargs
+            elif name in _FILTERS:
+                filters.append((name, args))
+            elif name == 'keyset':
+                keyset = (args[0], args[1] if len(args) > 1 else kwargs.get('after'))
+            elif name == 'order':
+                orders.append((args[0], kwargs.get('desc', False)))
+            elif name == 'range':
+                row_range = (args[0], args[1])
+            elif name == 'limit':
+                limit = args[0]
+            elif name == 'offset':
+                offset = args[0]
+            elif name in ('single', 'maybe_single'):
+                post.append(name)
+            else:
+                raise NotImplementedError(f"FakeBackend does not support .{name}()")
+
+        rows = self.tables.setdefault(table, [])
+        matched = [row for row in rows if all(_matches(row, name, args) for name, args in filters)]
+        previous = [dict(row) for row in matched] if verb in ('update', 'delete') else []
+
+        if verb == 'insert':
+            data = self._insert(table, verb_args[0])
+        elif verb == 'upsert':
+            data = self._upsert(table, verb_args[0], verb_kwargs.get('on_conflict') or 'id')
+        elif verb == 'update':
+            for row in matched:
+                row.update(copy.deepcopy(verb_args[0]))
+                if table in _TOUCHED_TABLES:
+                    row['updated_at'] = _now()
+            data = [dict(row) for row in matched]
+        elif verb == 'delete':
+            ids = {id(row) for row in matched}
+            self.tables[table] = [row for row in rows if id(row) not in ids]
+            data = [dict(row) for row in matched]
+        else:
+            return self._select(table, matched, verb_args[0] if verb_args else '*', verb_kwargs,
+                                orders, keyset, row_range, limit, offset, post)
+        if table in self._triggers:
+            self._triggers[table](self, previous, data if verb != 'delete' else [])
+        return QueryResult(data)
+
+    def _select(self, table, rows, columns, kwargs, orders, keyset, row_range, limit, offset, post) -> QueryResult:
+        if keyset is not None:
+            keys, after = keyset
+            if after is not None:
+                rows = [row for row in rows if _after(row, keys, after)]
+            orders = list(keys) + orders
+        count = len(rows) if kwargs.get('count') else None
+
+        rows = _sort(rows, orders)
+        if row_range is not None:
+            rows = rows[row_range[0]:row_range[1] + 1]
+        else:
+            rows = rows[offset:]
+        if limit is not None:
+            rows = rows[:limit]
+
+        data: Any = [self._project(table, row, columns) for row in rows]
+        for name in post:
+            if len(data) == 1:
+                data = data[0]
+            elif name == 'maybe_single' and not data:
+                data = None
+            else:
+                raise APIError({
+                    'message': 'JSON object requested, multiple (or no) rows returned',
+                    'code': 'PGRST116',
+                    'details': f'Results contain {len(data)} rows'
+                })
+        return QueryResult(data, count)
+
+    def _project(self, table: str, row: dict, columns: str) -> dict:
+        result = {}
+        for column in _split_columns(columns):
+            embed = _EMBED_RE.match(column)
+            if embed:
+                alias, target, hint, inner = embed.groups()
+                result[alias or target] = self._embed(table, row, target, hint, inner)
+            elif column == '*':
+                result.update(copy.deepcopy(row))
+            elif '->' in column:
+                alias, _, expression = column.rpartition(':')
+                base, *path = re.split(r'->>?', expression)
+                value = row.get(base)
+                for key in path:
+                    value = value.get(key) if isinstance(value, dict) else None
+                result[alias or path[-1]] = copy.deepcopy(value)
+            else:
+                alias, _, name = column.rpartition(':')
+                result[alias or name] = copy.deepcopy(row.get(name))
+        return result
+
+    def _embed(self, table: str, row: dict, target: str, hint: Optional[str], columns: str):
+        """Вложенный ресурс: many-to-one по {target}_id (или !fk), иначе one-to-many по {table}_id"""
+        foreign_key = hint if hint and hint in row else f"{_singular(target)}_id"
+        target_rows = self.tables.get(target, [])
+        if foreign_key in row:
+            value = row.get(foreign_key)
+            parent = next((item for item in target_rows if value is not None and _same(item.get('id'), value)), None)
+            return self._project(target, parent, columns) if parent else None
+
+        back_key = f"{_singular(table)}_id"
+        return [self._project(target, item, columns) for item in target_rows if _same(item.get(back_key), row.get('id'))]
+
+    def _prepare(self, values: dict) -> dict:
+        row = copy.deepcopy(values)
+        row.setdefault('id', str(uuid.uuid4()))
+        now = _now()
+        row.setdefault('created_at', now)
+        row.setdefault('updated_at', now)
+        return row
+
+    def _insert(self, table: str, values) -> List[dict]:
+        rows = [self._prepare(item) for item in (values if isinstance(values, list) else [values])]
+        self.tables.setdefault(table, []).extend(rows)
+        return [dict(row) for row in rows]
+
+    def _upsert(self, table: str, values, on_conflict: str) -> List[dict]:
+        keys = [key.strip() for key in on_conflict.split(',')]
+        result = []
+        for item in values if isinstance(values, list) else [values]:
+            existing = next((
+                row for row in self.tables.setdefault(table, [])
+                if all(key in item and _same(row.get(key), item[key]) for key in keys)
+            ), None)
+            if existing is not None:
+                existing.update(copy.deepcopy(item))
+                result.append(dict(existing))
+            else:
+                result.extend(self._insert(table, item))
+        return result
+
+    # ==================== КЛИЕНТЫ ====================
+
+    def sync_client(self) -> 'FakeSupabaseClient':
+        return FakeSupabaseClient(self)
+
+
+def fake_reserve_inventory(backend: FakeBackend, params: dict) -> dict:
+    """Python версия reserve_inventory (migrations/005_stock_ledger.sql)"""
+    operation = params.get('p_operation', 'reserve')
+    sign = -1 if operation == 'reserve' else 1
+    quantities: Dict[str, int] = {}
+    for item in params.get('p_items') or []:
+        if item.get('product_id'):
+            quantities[str(item['product_id'])] = quantities.get(str(item['product_id']), 0) + int(item.get('quantity') or 1)
+
+    products = {str(row['id']): row for row in backend.tables.get('products', [])}
+    flowers = {str(row['id']): row for row in backend.tables.get('flowers', [])}
+    compositions = backend.tables.get('product_composition', [])
+    composed = {str(row['product_id']) for row in compositions}
+    needed: Dict[str, int] = {}
+    for row in compositions:
+        if str(row['product_id']) in quantities:
+            flower_id = str(row['flower_id'])
+            needed[flower_id] = needed.get(flower_id, 0) + row['amount'] * quantities[str(row['product_id'])]
+
+    if operation == 'reserve':
+        shortages = []
+        for flower_id, amount in sorted(needed.items()):
+            flower = flowers.get(flower_id) or {}
+            available = flower.get('quantity') or 0
+            if available < amount:
+                shortages.append({'kind': 'flower', 'id': flower_id, 'name': flower.get('name'), 'needed': amount,
+                                  'available': available, 'shortage': amount - available})
+        for product_id, quantity in sorted(quantities.items()):
+            product = products.get(product_id)
+            available = (product or {}).get('quantity') or 0
+            if product is None or (product_id not in composed and available < quantity):
+                shortages.append({'kind': 'product', 'id': product_id, 'name': (product or {}).get('name'),
+                                  'needed': quantity, 'available': available, 'shortage': quantity - available})
+        if shortages:
+            return {'success': False, 'shortages': shortages}
+
+    movement = {
+        'movement_type': 'order_usage' if operation == 'reserve' else 'delivery',
+        'reason': 'Used in order (Product composition)' if operation == 'reserve' else 'Order cancelled/refunded (restored)',
+        'created_by': 'Order System'
+    }
+    entries = [
+        {'item_type': 'product', 'item_id': product_id, 'delta': sign * quantity, **movement}
+        for product_id, quantity in sorted(quantities.items())
+        if product_id in products and product_id not in composed
+    ] + [
+        {'item_type': 'flower', 'item_id': flower_id, 'delta': sign * amount,
+         'note': 'Product composition × order quantity', **movement}
+        for flower_id, amount in sorted(needed.items())
+        if flower_id in flowers
+    ]
+    recorded = fake_record_stock_movements(backend, {'p_entries': entries})
+    items = recorded['items']
+    updates = [
+        {'product_id': item['item_id'], 'product_name': item['item_name'], 'old_quantity': item['old_quantity'],
+         'new_quantity': item['new_quantity'], 'change_quantity': item['new_quantity'] - item['old_quantity']}
+        for item in items if item['item_type'] == 'product'
+    ]
+    flower_updates = [
+        {'flower_id': item['item_id'], 'flower_name': item['item_name'], 'old_quantity': item['old_quantity'],
+         'new_quantity': item['new_quantity'], 'quantity': abs(item['new_quantity'] - item['old_quantity'])}
+        for item in items if item['item_type'] == 'flower'
+    ]
+    return {'success': True, 'updates': updates, 'flower_updates': flower_updates}
+
+
+def _stock_rows(backend: FakeBackend) -> Dict[Tuple[str, str], dict]:
+    return {
+        (item_type, str(row['id'])): row
+        for item_type, table in (('flower', 'flowers'), ('product', 'products'))
+        for row in backend.tables.get(table, [])
+    }
+
+
+def fake_record_stock_movements(backend: FakeBackend, params: dict) -> dict:
+    """Python версия record_stock_movements: quantity + строки stock_ledger с последовательным id"""
+    stock = _stock_rows(backend)
+    planned = plan_stock_movements(params.get('p_entries') or [], stock)
+    if not planned['success']:
+        return planned
+
+    now = _now()
+    for item in planned['items']:
+        if item['new_quantity'] != item['old_quantity']:
+            stock[(item['item_type'], item['item_id'])].update({'quantity': item['new_quantity'], 'updated_at': now})
+    ledger = backend.tables.setdefault('stock_ledger', [])
+    next_id = max((row['id'] for row in ledger), default=0) + 1
+    movements = []
+    for offset, movement in enumerate(planned['movements']):
+        row = dict(movement, id=next_id + offset, created_at=now)
+        ledger.append(row)
+        movements.append(dict(row))
+    return dict(planned, movements=movements)
+
+
+def _ledger_state(backend: FakeBackend) -> Tuple[int, int, Dict[Tuple[str, str], int], List[dict]]:
+    """Последняя строка журнала, последний снимок, остатки по журналу и движения после снимка"""
+    ledger = backend.tables.get('stock_ledger', [])
+    snapshots = backend.tables.get('stock_snapshots', [])
+    ledger_id = max((row['id'] for row in ledger), default=0)
+    snapshot_id = max((row['ledger_id'] for row in snapshots), default=0)
+    since = [row for row in ledger if row['id'] > snapshot_id]
+    base = [row for row in snapshots if row['ledger_id'] == snapshot_id]
+    return ledger_id, snapshot_id, expected_balances(base, since), since
+
+
+def fake_take_stock_snapshot(backend: FakeBackend, params: dict) -> dict:
+    """Python версия take_stock_snapshot"""
+    ledger_id, snapshot_id, balances, _ = _ledger_state(backend)
+    snapshots = backend.tables.setdefault('stock_snapshots', [])
+    if snapshots and snapshot_id >= ledger_id:
+        return {'ledger_id': ledger_id, 'items': 0}
+    stock = _stock_rows(backend)
+    now = _now()
+    rows = [
+        {'ledger_id': ledger_id, 'item_type': key[0], 'item_id': key[1], 'quantity': quantity, 'taken_at': now}
+        for key, quantity in sorted(balances.items())
+        if key in stock
+    ]
+    snapshots.extend(rows)
+    return {'ledger_id': ledger_id, 'items': len(rows)}
+
+
+def fake_verify_stock_ledger(backend: FakeBackend, params: dict) -> List[dict]:
+    """Python версия verify_stock_ledger"""
+    _, _, balances, since = _ledger_state(backend)
+    last_balances = {
+        (row['item_type'], str(row['item_id'])): row['balance']
+        for row in sorted(since, key=lambda row: row['id'])
+        if row.get('balance') is not None
+    }
+    return find_mismatches(balances, last_balances, _stock_rows(backend))
+
+
+def _count_seller_products(tables: Dict[str, List[dict]], seller_ids: Optional[set] = None) -> int:
+    """product_count и active_product_count продавцов (всех или seller_ids); число измененных"""
+    counts: Dict[str, List[int]] = {}
+    for product in tables.get('products', []):
+        if product.get('seller_id'):
+            seller_counts = counts.setdefault(str(product['seller_id']), [0, 0])
+            seller_counts[0] += 1
+            seller_counts[1] += 1 if product.get('is_active') else 0
+    changed = 0
+    for seller in tables.get('sellers', []):
+        if seller_ids is not None and str(seller['id']) not in seller_ids:
+            continue
+        products, active = counts.get(str(seller['id']), (0, 0))
+        if (seller.get('product_count'), seller.get('active_product_count')) != (products, active):
+            seller['product_count'], seller['active_product_count'] = products, active
+            seller['updated_at'] = _now()
+            changed += 1
+    return changed
+
+
+def fake_seller_product_counts(backend: FakeBackend, old_rows: List[dict], new_rows: List[dict]):
+    """Триггеры products из migrations/006: пересчет затронутых продавцов"""
+    seller_ids = {str(row['seller_id']) for row in old_rows + new_rows if row.get('seller_id')}
+    if seller_ids:
+        _count_seller_products(backend.tables, seller_ids)
+
+
+def _project_orders(tables: Dict[str, List[dict]], order_ids: Optional[set] = None):
+    """Строки order_list_rows заказов (всех или order_ids), как refresh_order_list_rows из migrations/001"""
+    urls = {
+        product['id']: miniature_url(((product.get('metadata') or {}).get('properties') or {}).get('ru_img_miniature'))
+        for product in tables.get('products', [])
+    }
+    items_by_order: Dict[str, List[dict]] = {}
+    for item in tables.get('order_items', []):
+        if order_ids is None or str(item.get('order_id')) in order_ids:
+            items_by_order.setdefault(str(item['order_id']), []).append(item)
+    rows = [
+        {**projection_row(order), 'item_images': build_item_images(items_by_order.get(str(order['id']), []), urls)}
+        for order in tables.get('orders', [])
+        if order_ids is None or str(order['id']) in order_ids
+    ]
+    kept = [row for row in tables.get('order_list_rows', []) if order_ids is not None and str(row['id']) not in order_ids]
+    tables['order_list_rows'] = kept + rows
+
+
+def fake_order_list_rows(backend: FakeBackend, old_rows: List[dict], new_rows: List[dict]):
+    """Триггеры orders из migrations/001 (удаленный заказ убирается, как ON DELETE CASCADE)"""
+    _project_orders(backend.tables, {str(row['id']) for row in old_rows + new_rows})
+
+
+def fake_order_items_list_rows(backend: FakeBackend, old_rows: List[dict], new_rows: List[dict]):
+    """Триггеры order_items из migrations/001: пересчет строк заказов измененных позиций"""
+    order_ids = {str(row['order_id']) for row in old_rows + new_rows if row.get('order_id')}
+    if order_ids:
+        _project_orders(backend.tables, order_ids)
+
+
+def fake_rebuild_seller_product_counts(backend: FakeBackend, params: dict) -> int:
+    """Python версия rebuild_seller_product_counts"""
+    return _count_seller_products(backend.tables)
+
+
+class FakeSyncQuery:
+    """Синхронный построитель для модулей, работающих с supabase Client"""
+
+    def __init__(self, backend: FakeBackend, table: str, kind: str = 'table', on_write: Optional[Callable] = None):
+        self._backend = backend
+        self._on_write = on_write
+        self.table = table
+        self.kind = kind
+        self.ops: List[Tuple[str, tuple, dict]] = []
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def method(*args, **kwargs) -> 'FakeSyncQuery':
+            self.ops.append((name, args, kwargs))
+            return self
+
+        return method
+
+    def execute(self) -> QueryResult:
+        """Как запрос supabase Client: с задержкой и учетом в monitoring.query_stats (source supabase-sync)"""
+        start = time.perf_counter()
+        if self._backend.latency_ms:
+            time.sleep(self._backend.latency_ms / 1000)
+        verb = 'rpc' if self.kind == 'rpc' else next(
+            (name for name, _, _ in self.ops if name in ('insert', 'update', 'delete', 'upsert')), 'select'
+        )
+        rows, error = 0, None
+        try:
+            result = self._backend.execute_ops(self.table, self.kind, self.ops)
+            rows = count_rows(result.data)
+            if self._on_write is not None and verb != 'select':
+                self._on_write(self.table, verb)
+            return result
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            record_query('supabase-sync', self.table, verb, describe_filters(self.ops), rows,
+                         (time.perf_counter() - start) * 1000, error)
+
+
+class FakeSupabaseClient:
+    """Подмена supabase.Client (table/from_/rpc) поверх того же FakeBackend"""
+
+    def __init__(self, backend: FakeBackend):
+        self._backend = backend
+        # Подписчик на записи (instrument_sync_client), как хук httpx у supabase.Client
+        self.on_write: Optional[Callable[[str, str], None]] = None
+
+    def table(self, name: str) -> FakeSyncQuery:
+        return FakeSyncQuery(self._backend, name, on_write=self.on_write)
+
+    from_ = table
+
+    def rpc(self, function_name: str, params: Optional[dict] = None) -> FakeSyncQuery:
+        query = FakeSyncQuery(self._backend, function_name, kind='rpc', on_write=self.on_write)
+        query.ops.append(('rpc', (function_name, params or {}), {}))
+        return query
+
+
+# ==================== ФИКСТУРЫ ====================
+
+_FLOWER_NAMES = [
+    ('Роза красная', 'Red rose'), ('Роза белая', 'White rose'), ('Роза кустовая', 'Spray rose'),
+    ('Тюльпан', 'Tulip'), ('Хризантема', 'Chrysanthemum'), ('Эустома', 'Eustoma'),
+    ('Гипсофила', 'Gypsophila'), ('Пион', 'Peony'), ('Лилия', 'Lily'), ('Гортензия', 'Hydrangea'),
+    ('Альстромерия', 'Alstroemeria'), ('Гербера', 'Gerbera'), ('Ирис', 'Iris'), ('Ранункулюс', 'Ranunculus'),
+    ('Эвкалипт', 'Eucalyptus'), ('Писташ', 'Pistache'), ('Матиола', 'Matthiola'), ('Фрезия', 'Freesia'),
+]
+_RECIPIENTS = ['Айгерим', 'Алия', 'Дана', 'Мадина', 'Асель', 'Жанна', 'Ольга', 'Наталья', 'Сауле', 'Камила']
+_STREETS = ['пр. Абая', 'ул. Сатпаева', 'пр. Достык', 'ул. Толе би', 'пр. Аль-Фараби', 'ул. Жандосова']
+_ORDER_STATUSES = ['new'] * 3 + ['paid', 'accepted', 'assembled', 'in_delivery'] * 2 + ['completed'] * 6 + ['cancelled'] * 2
+_PAYMENT_METHODS = ['kaspi', 'card', 'cash', 'transfer']
+
+
+def seed_fixtures(
+    orders: int = 300,
+    products: int = 60,
+    flowers: int = 18,
+    sellers: int = 6,
+    seed: int = 42
+) -> Dict[str, List[dict]]:
+    """Детерминированный набор данных, похожий на продакшн (продавцы, склад, товары, заказы)"""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 1, 9, 0, tzinfo=timezone.utc)
+
+    def uid() -> str:
+        return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+    def at(minutes: int) -> str:
+        return (start + timedelta(minutes=minutes)).isoformat()
+
+    tables: Dict[str, List[dict]] = {
+        'sellers': [], 'users': [], 'flowers': [], 'products': [], 'product_composition': [],
+        'orders': [], 'order_items': [], 'flower_inventory_movements': []
+    }
+
+    for index in range(sellers):
+        tables['sellers'].append({
+            'id': uid(), 'name': f'Цветочный магазин {index + 1}', 'bitrix_user_id': 1000 + index,
+            'description': None, 'is_active': index < sellers - 1, 'created_at': at(index), 'updated_at': at(index)
+        })
+
+    for index in range(4):
+        tables['users'].append({
+            'id': uid(), 'name': f'Флорист {index + 1}', 'phone': f'+7701000000{index}', 'email': None,
+            'role': 'florist', 'is_florist': True, 'is_active': True, 'created_at': at(index), 'updated_at': at(index)
+        })
+
+    for index, (name, name_en) in enumerate((_FLOWER_NAMES * (flowers // len(_FLOWER_NAMES) + 1))[:flowers]):
+        tables['flowers'].append({
+            'id': uid(), 'xml_id': f'flower-{index + 1}', 'name': name if index < len(_FLOWER_NAMES) else f'{name} {index + 1}',
+            'name_en': name_en, 'quantity': rng.randint(0, 300), 'sort_order': 500, 'is_active': True,
+            'created_at': at(index), 'updated_at': at(index)
+        })
+
+    for index in range(products):
+        created = at(60 * index)
+        bitrix_id = 700000 + index
+        seller = rng.choice(tables['sellers'])
+        product = {
+            'id': uid(), 'name': f'Букет №{index + 1}', 'slug': f'buket-{index + 1}', 'description': None,
+            'price': rng.choice([9900, 14900, 19900, 24900, 34900]), 'old_price': None, 'quantity': 0,
+            'category_id': None, 'seller_id': seller['id'], 'is_active': rng.random() > 0.2, 'sort_order': 500,
+            'metadata': {
+                'bitrix_product_id': bitrix_id,
+                'image': f'https://cvety.kz/upload/iblock/{bitrix_id}.jpg',
+                'properties': {}
+            },
+            'created_at': created, 'updated_at': created
+        }
+        tables['products'].append(product)
+        for flower in rng.sample(tables['flowers'], k=min(3, len(tables['flowers']))):
+            tables['product_composition'].append({
+                'id': uid(), 'product_id': product['id'], 'flower_id': flower['id'],
+                'amount': rng.randint(1, 15), 'created_at': created, 'updated_at': created
+            })
+
+    for index in range(orders):
+        created = at(90 * index + rng.randint(0, 60))
+        status = rng.choice(_ORDER_STATUSES)
+        order = {
+            'id': uid(), 'order_number': f'{100000 + index}', 'bitrix_order_id': 120000 + index,
+            'status': status, 'recipient_name': rng.choice(_RECIPIENTS),
+            'recipient_phone': f'+7 (7{rng.randint(0, 99):02d}) {rng.randint(100, 999)}-{rng.randint(10, 99)}-{rng.randint(10, 99)}',
+            'delivery_address': f'Алматы, {rng.choice(_STREETS)} {rng.randint(1, 200)}',
+            'delivery_date': created[:10], 'delivery_time': '12:00-14:00',
+            'payment_method': rng.choice(_PAYMENT_METHODS), 'payment_status': 'paid' if status != 'new' else 'pending',
+            'user_id': None, 'seller_id': rng.choice(tables['sellers'])['id'],
+            'responsible_id': None, 'responsible_name': None, 'comment': None,
+            'metadata': {}, 'source': 'bitrix', 'created_at': created, 'updated_at': created
+        }
+        subtotal = 0
+        for product in rng.sample(tables['products'], k=rng.randint(1, 3)):
+            quantity = rng.randint(1, 2)
+            subtotal += product['price'] * quantity
+            tables['order_items'].append({
+                'id': uid(), 'order_id': order['id'], 'product_id': product['id'], 'product_name': product['name'],
+                'quantity': quantity, 'price': product['price'], 'total': product['price'] * quantity,
+                'product_snapshot': {
+                    'name': product['name'], 'image': product['metadata']['image'],
+                    'bitrix': {'product_id': product['metadata']['bitrix_product_id']}
+                },
+                'created_at': created, 'updated_at': created
+            })
+        order['subtotal'] = order['total_amount'] = subtotal
+        order['recipient_phone_digits'] = phone_digits(order['recipient_phone'])
+        order.update(derive_order_flags(order))
+        tables['orders'].append(order)
+
+    # Счетчики товаров продавцов (как после migrations/006)
+    _count_seller_products(tables)
+
+    # Проекция списка заказов (как после migrations/001)
+    _project_orders(tables)
+
+    # Начальные остатки цветов - поставки в журнале (снимков еще нет: остаток = сумма delta)
+    tables['stock_ledger'] = []
+    for index, flower in enumerate(tables['flowers']):
+        tables['flower_inventory_movements'].append({
+            'id': uid(), 'flower_id': flower['id'], 'movement_type': 'delivery', 'quantity': flower['quantity'],
+            'note': 'Начальный остаток', 'delivery_date': at(index)[:10], 'created_by': 'seed',
+            'created_at': at(index), 'updated_at': at(index)
+        })
+        tables['stock_ledger'].append({
+            'id': index + 1, 'item_type': 'flower', 'item_id': flower['id'], 'item_name': flower['name'],
+            'delta': flower['quantity'], 'balance': flower['quantity'], 'movement_type': 'delivery',
+            'reason': None, 'note': 'Начальный остаток', 'delivery_date': at(index)[:10], 'created_by': 'seed',
+            'created_at': at(index)
+        })
+
+    return tables
+
+
+def load_fixtures(path: str) -> Dict[str, List[dict]]:
+    """Таблицы из JSON файла вида {"orders": [...], "products": [...]}"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def create_fake_supabase(
+    latency_ms: float = 0.0,
+    tables: Optional[Dict[str, List[dict]]] = None,
+    max_concurrency: int = 20
+) -> AsyncSupabase:
+    """AsyncSupabase поверх FakeBackend (sync_client работает с теми же таблицами)"""
+    backend = FakeBackend(tables if tables is not None else seed_fixtures(), latency_ms=latency_ms)
+    return AsyncSupabase(
+        'http://fake-supabase.local',
+        'fake-key',
+        max_concurrency=max_concurrency,
+        sync_client=backend.sync_client(),
+        backend=backend
+    )
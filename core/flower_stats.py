@@ -0,0 +1,112 @@
+"""
+Статистика цветов в составах для склада (/crm/warehouse): сколько штук в составах,
+в скольких товарах и несколько товаров-примеров по каждому цветку
+Считается из индекса составов bom_index (core/bom.py) и пересчитывается только после его
+перезагрузки - когда роуты составов сбросили индекс или истек BOM_INDEX_TTL. Страница
+склада читает одну таблицу flowers; названия товаров-примеров читаются при пересчете
+одним запросом по их id.
+"""
+
+import asyncio
+import heapq
+import logging
+from typing import Dict, List, Optional
+
+from core.bom import BomIndex, bom_index
+
+logger = logging.getLogger(__name__)
+
+# Ограничение длины .in_() (длина URL PostgREST)
+_BATCH_SIZE = 100
+
+
+class FlowerUsageStats:
+    """total_used, products_count и recent_usage по каждому цветку"""
+
+    def __init__(self, bom: BomIndex = bom_index, samples: int = 5):
+        self.bom = bom
+        self.samples = samples
+        self._stats: Dict[str, dict] = {}
+        self._bom_loads: Optional[int] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._version = 0
+        self.loads = 0
+
+    @property
+    def is_fresh(self) -> bool:
+        return self._bom_loads is not None and self._bom_loads == self.bom.loads
+
+    async def ensure_loaded(self, db) -> 'FlowerUsageStats':
+        """Пересчитывает статистику, если индекс составов перезагружен"""
+        await self.bom.ensure_loaded(db)
+        if self.is_fresh:
+            return self
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self.is_fresh:
+                version, bom_loads = self._version, self.bom.loads
+                stats = self.compute()
+                product_ids = list({sample['product_id'] for usage in stats.values() for sample in usage['recent_usage']})
+                names = {}
+                for start in range(0, len(product_ids), _BATCH_SIZE):
+                    result = await db.table('products').select('id, name')\
+                        .in_('id', product_ids[start:start + _BATCH_SIZE]).execute()
+                    names.update({str(row['id']): row['name'] for row in result.data or []})
+                self.load(stats, names)
+                self._bom_loads = bom_loads if version == self._version else None
+        return self
+
+    def compute(self) -> Dict[str, dict]:
+        """Один проход по CSR массивам составов: суммы, число товаров и крупнейшие вхождения"""
+        product_ids, flower_ids, offsets, flowers, amounts = self.bom.csr()
+        totals, counts = [0] * len(flower_ids), [0] * len(flower_ids)
+        usage: List[List[tuple]] = [[] for _ in flower_ids]
+        for row, product_id in enumerate(product_ids):
+            for i in range(offsets[row], offsets[row + 1]):
+                totals[flowers[i]] += amounts[i]
+                counts[flowers[i]] += 1
+                usage[flowers[i]].append((amounts[i], product_id))
+        return {
+            flower_id: {
+                'total_used': totals[i],
+                'products_count': counts[i],
+                'recent_usage': [
+                    {'product_id': product_id, 'amount': amount}
+                    for amount, product_id in heapq.nlargest(self.samples, usage[i])
+                ]
+            }
+            for i, flower_id in enumerate(flower_ids)
+        }
+
+    def load(self, stats: Dict[str, dict], names: Dict[str, str]):
+        """Статистика с названиями товаров (товары без строки в products пропускаются)"""
+        for usage in stats.values():
+            usage['recent_usage'] = [
+                {**sample, 'product_name': names[sample['product_id']]}
+                for sample in usage['recent_usage']
+                if sample['product_id'] in names
+            ]
+        self._stats = stats
+        self.loads += 1
+        logger.info(f"Flower usage stats computed for {len(stats)} flowers")
+
+    def get(self, flower_id: str) -> dict:
+        """Статистика цветка; цветок без составов - нули"""
+        return self._stats.get(str(flower_id)) or {'total_used': 0, 'products_count': 0, 'recent_usage': []}
+
+    def invalidate(self):
+        """Пересчитать при следующем обращении (например, после переименования товаров)"""
+        self._version += 1
+        self._bom_loads = None
+
+    def get_stats(self) -> dict:
+        return {
+            'flowers': len(self._stats),
+            'loads': self.loads,
+            'fresh': self.is_fresh
+        }
+
+
+# Глобальная статистика приложения
+flower_usage = FlowerUsageStats()
@@ -0,0 +1,201 @@
+"""
+Прогноз расхода цветов по истории движений склада
+Расход (order_usage и writeoff) за последние FORECAST_WINDOW_DAYS дней читается из
+журнала stock_ledger (до миграции 005 - из flower_inventory_movements) и раскладывается
+в матрицу NumPy цветок × день. Скользящее среднее за FORECAST_ROLLING_DAYS дней и дни
+до нуля считаются векторно, одним проходом по всем цветам.
+Скорости расхода кешируются на FORECAST_TTL секунд; дни до нуля пересчитываются от
+текущих остатков при каждом запросе - это одно деление массивов.
+Без numpy прогноз выключен: forecast() возвращает пустой словарь, страницы работают как раньше.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+from postgrest.exceptions import APIError
+
+from config import config
+from core.conditional import parse_timestamp
+from core.ledger import LEDGER_TABLE, fetch_all, ledger_available
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Движения, которые считаются расходом цветов
+CONSUMPTION_TYPES = ('order_usage', 'writeoff')
+
+
+async def load_consumption(db, since: datetime) -> List[dict]:
+    """Расход цветов с момента since: [{'flower_id', 'quantity' (> 0), 'created_at'}]"""
+    if ledger_available():
+        try:
+            rows = await fetch_all(lambda: db.table(LEDGER_TABLE)
+                                   .select('item_id, delta, created_at')
+                                   .eq('item_type', 'flower')
+                                   .in_('movement_type', list(CONSUMPTION_TYPES))
+                                   .gte('created_at', since.isoformat())
+                                   .order('id'))
+            return [
+                {'flower_id': row['item_id'], 'quantity': -row['delta'], 'created_at': row['created_at']}
+                for row in rows
+                if (row.get('delta') or 0) < 0
+            ]
+        except APIError as e:
+            logger.warning(f"Stock ledger is not readable, forecasting from flower_inventory_movements: {e}")
+
+    return await fetch_all(lambda: db.table('flower_inventory_movements')
+                           .select('flower_id, quantity, created_at')
+                           .in_('movement_type', list(CONSUMPTION_TYPES))
+                           .gte('created_at', since.isoformat())
+                           .order('created_at')
+                           .order('id'))
+
+
+class DepletionForecast:
+    """Дневной расход по цветам (NumPy массивы) и дни до нуля от текущих остатков"""
+
+    def __init__(self, ttl_seconds: float = 900, window_days: int = 28, rolling_days: int = 7, lead_days: float = 3):
+        self.ttl_seconds = ttl_seconds
+        self.window_days = max(int(window_days), 1)
+        self.rolling_days = max(min(int(rolling_days), self.window_days), 1)
+        self.lead_days = lead_days
+        self._index: Dict[str, int] = {}
+        self._rates = None
+        self._loaded_at: Optional[float] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._version = 0
+        self.loads = 0
+
+    @property
+    def enabled(self) -> bool:
+        return np is not None
+
+    @property
+    def is_fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl_seconds
+
+    async def ensure_loaded(self, db) -> 'DepletionForecast':
+        """Перечитывает историю, если кеш устарел (один загрузчик на все корутины)"""
+        if not self.enabled or self.is_fresh:
+            return self
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self.is_fresh:
+                version = self._version
+                now = datetime.now(timezone.utc)
+                self.load(await load_consumption(db, now - timedelta(days=self.window_days)), now)
+                if version != self._version:
+                    self._loaded_at = None
+        return self
+
+    def load(self, rows: Iterable[dict], now: Optional[datetime] = None):
+        """Строит матрицу расхода цветок × день и скорость расхода по каждому цветку"""
+        if not self.enabled:
+            return
+        now = now or datetime.now(timezone.utc)
+        # День 0 - начало окна, последний день - сегодня
+        start = now.date() - timedelta(days=self.window_days - 1)
+
+        index: Dict[str, int] = {}
+        flowers, days, amounts = [], [], []
+        for row in rows:
+            created = parse_timestamp(row.get('created_at'))
+            if not created or not row.get('flower_id'):
+                continue
+            day = (created.date() - start).days
+            if not 0 <= day < self.window_days:
+                continue
+            flowers.append(index.setdefault(str(row['flower_id']), len(index)))
+            days.append(day)
+            amounts.append(abs(row.get('quantity') or 0))
+
+        usage = np.zeros((len(index), self.window_days))
+        np.add.at(usage, (np.asarray(flowers, dtype=np.intp), np.asarray(days, dtype=np.intp)),
+                  np.asarray(amounts, dtype=float))
+
+        # Скользящее среднее - разность накопленных сумм со сдвигом на окно
+        cumulative = np.concatenate([np.zeros((len(index), 1)), np.cumsum(usage, axis=1)], axis=1)
+        rolling = (cumulative[:, self.rolling_days:] - cumulative[:, :-self.rolling_days]) / self.rolling_days
+        recent = rolling[:, -1]
+        # Цветок не расходовался последние дни - берем среднее за все окно
+        self._rates = np.where(recent > 0, recent, usage.mean(axis=1))
+        self._index = index
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+        logger.info(f"Depletion forecast loaded: {len(index)} flowers, {len(amounts)} movements")
+
+    def forecast(self, flowers: Iterable[dict], lead_days: Optional[float] = None) -> Dict[str, dict]:
+        """
+        Прогноз по строкам flowers (id, quantity)
+
+        Returns:
+            {flower_id: {'daily_usage', 'days_left', 'stockout_date', 'runs_out_before_delivery'}};
+            days_left None - расхода за окно не было
+        """
+        if self._rates is None:
+            return {}
+        flowers = [flower for flower in flowers if flower.get('id')]
+        if not flowers:
+            return {}
+        lead_days = self.lead_days if lead_days is None else lead_days
+
+        positions = np.array([self._index.get(str(flower['id']), -1) for flower in flowers], dtype=np.intp)
+        quantities = np.array([max(flower.get('quantity') or 0, 0) for flower in flowers], dtype=float)
+        rates = np.zeros(len(flowers))
+        known = positions >= 0
+        rates[known] = self._rates[positions[known]]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            days_left = np.where(rates > 0, quantities / rates, np.inf)
+
+        today = date.today()
+        result = {}
+        for flower, rate, days in zip(flowers, rates.tolist(), days_left.tolist()):
+            finite = math.isfinite(days)
+            result[str(flower['id'])] = {
+                'daily_usage': round(rate, 2),
+                'days_left': round(days, 1) if finite else None,
+                'stockout_date': (today + timedelta(days=int(days))).isoformat() if finite else None,
+                'runs_out_before_delivery': finite and days < lead_days
+            }
+        return result
+
+    def at_risk(self, flowers: Iterable[dict], lead_days: Optional[float] = None) -> List[dict]:
+        """Цветы, которые закончатся до следующей поставки, - сначала самые срочные"""
+        flowers = list(flowers)
+        forecasts = self.forecast(flowers, lead_days)
+        risky = [
+            {**{key: flower.get(key) for key in ('id', 'name', 'quantity')}, **forecasts[str(flower['id'])]}
+            for flower in flowers
+            if forecasts.get(str(flower.get('id')), {}).get('runs_out_before_delivery')
+        ]
+        risky.sort(key=lambda item: item['days_left'])
+        return risky
+
+    def invalidate(self):
+        self._version += 1
+        self._loaded_at = None
+
+    def get_stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'flowers': len(self._index),
+            'window_days': self.window_days,
+            'rolling_days': self.rolling_days,
+            'loads': self.loads,
+            'fresh': self.is_fresh
+        }
+
+
+# Глобальный прогноз приложения
+depletion_forecast = DepletionForecast(
+    config.FORECAST_TTL, config.FORECAST_WINDOW_DAYS, config.FORECAST_ROLLING_DAYS, config.FORECAST_LEAD_DAYS
+)
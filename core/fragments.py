@@ -0,0 +1,135 @@
+"""
+Кеш отрендеренных строк списков (orders.html, products.html)
+Строка таблицы рендерится из своего partial шаблона и хранится по ключу
+(вид, id) -> (версия, html), где версия = (хеш шаблона, updated_at строки, ...).
+Неизменившиеся строки при обновлении страницы не проходят через Jinja заново,
+рендерится только каркас страницы и промахи. Память ограничена LRU вытеснением;
+записи сбрасываются путями записи (core/order_list.py, товарные роуты app.py).
+Каждый сброс увеличивает поколение сущности - его учитывают ETag страниц
+(core/conditional.py), так что одни и те же вызовы invalidate сбрасывают и их.
+"""
+
+import hashlib
+import logging
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from markupsafe import Markup
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Поколения по id хранятся в фиксированном числе корзин: совпадение корзин дает
+# лишний 200 вместо 304, но не устаревшую страницу
+_GENERATION_BUCKETS = 4096
+
+
+class FragmentCache:
+    """LRU кеш HTML фрагментов строк"""
+
+    def __init__(self, max_entries: int = 5000):
+        self.max_entries = max_entries
+        self._fragments: 'OrderedDict[Tuple[str, str], Tuple[tuple, Markup]]' = OrderedDict()
+        self._template_versions: Dict[str, str] = {}
+        self._epoch = 0
+        self._kind_generations: Dict[str, int] = {}
+        self._id_generations: Dict[str, List[int]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def template_version(self, env, template_name: str) -> str:
+        """Хеш исходника partial шаблона: правка шаблона делает старые фрагменты невалидными"""
+        if template_name not in self._template_versions:
+            source, _, _ = env.loader.get_source(env, template_name)
+            self._template_versions[template_name] = hashlib.sha1(source.encode()).hexdigest()[:12]
+        return self._template_versions[template_name]
+
+    def render_rows(
+        self,
+        env,
+        template_name: str,
+        kind: str,
+        rows: Sequence[dict],
+        version_fields: Sequence[str] = ('updated_at',),
+        context: Optional[Dict[str, Any]] = None
+    ) -> List[Markup]:
+        """
+        HTML строк в порядке rows: из кеша, промахи рендерятся шаблоном
+
+        Args:
+            env: Jinja окружение (templates.env)
+            template_name: partial шаблон строки, получает строку как `row`
+            kind: вид сущности для ключа и сброса ('order', 'product')
+            rows: строки списка с 'id'
+            version_fields: поля строки, от которых зависит HTML (updated_at, миниатюра ...)
+            context: общие для всех строк переменные шаблона (справочники статусов)
+        """
+        template = None
+        template_version = self.template_version(env, template_name)
+        rendered = []
+        for row in rows:
+            key = (kind, str(row.get('id')))
+            version = (template_version, *(row.get(field) for field in version_fields))
+            cached = self._fragments.get(key)
+            if cached is not None and cached[0] == version:
+                self._fragments.move_to_end(key)
+                self.hits += 1
+                rendered.append(cached[1])
+                continue
+
+            self.misses += 1
+            if template is None:
+                template = env.get_template(template_name)
+            html = Markup(template.render(row=row, **(context or {})))
+            rendered.append(html)
+            # Без версии (нет updated_at) строку нельзя проверить на свежесть - не кешируем
+            if row.get('id') is not None and version_fields and row.get(version_fields[0]) is not None:
+                self._fragments[key] = (version, html)
+                self._fragments.move_to_end(key)
+                while len(self._fragments) > self.max_entries:
+                    self._fragments.popitem(last=False)
+        return rendered
+
+    def invalidate(self, kind: Optional[str] = None, ids: Optional[Iterable[Any]] = None):
+        """Сбрасывает фрагменты сущностей (ids=None - все фрагменты вида, kind=None - весь кеш)"""
+        if kind is None:
+            self._fragments.clear()
+            self._template_versions.clear()
+            self._epoch += 1
+        elif ids is None:
+            for key in [key for key in self._fragments if key[0] == kind]:
+                del self._fragments[key]
+            self._kind_generations[kind] = self._kind_generations.get(kind, 0) + 1
+        else:
+            buckets = self._id_generations.setdefault(kind, [0] * _GENERATION_BUCKETS)
+            for entity_id in ids:
+                self._fragments.pop((kind, str(entity_id)), None)
+                buckets[self._bucket(entity_id)] += 1
+
+    def generation(self, kind: str, entity_id: Any = None) -> str:
+        """Поколение сущности (или всего вида): меняется при каждом invalidate, затрагивающем ее"""
+        parts = [self._epoch, self._kind_generations.get(kind, 0)]
+        if entity_id is not None:
+            buckets = self._id_generations.get(kind)
+            parts.append(buckets[self._bucket(entity_id)] if buckets else 0)
+        return '.'.join(str(part) for part in parts)
+
+    @staticmethod
+    def _bucket(entity_id: Any) -> int:
+        return zlib.crc32(str(entity_id).encode()) % _GENERATION_BUCKETS
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._fragments),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0
+        }
+
+
+# Глобальный кеш строк списков
+row_fragments = FragmentCache(config.FRAGMENT_CACHE_SIZE)
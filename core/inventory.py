@@ -0,0 +1,367 @@
+"""
+Резервирование склада под заказ одной Postgres функцией reserve_inventory
+(migrations/004_reserve_inventory.sql)
+Проверка остатков, списание/возврат цветов и товаров и запись движений идут
+одной транзакцией с блокировкой строк: два параллельных заказа на одни розы
+не могут оба пройти проверку, заказ на 5 позиций - один round trip вместо 30+.
+Пока миграция не применена (функции нет), reserve_inventory возвращает None и
+вызывающий код использует пакетный путь reserve_inventory_batched: план резервирования
+(новые количества + строки движений) считается по индексу составов двумя чтениями
+и применяется одним вызовом журнала склада record_stock_movements (core/ledger.py),
+а без журнала - параллельными PATCH остатков с проверкой прочитанного значения
+(ledger.set_quantity) и одной вставкой движений. Тот же план (inverse) откатывает изменения.
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass, field, replace
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from postgrest.exceptions import APIError
+
+from core.bom import bom_index
+from core.ledger import StockMovement, notify_stock_changes, record_stock_movements, set_quantity
+
+logger = logging.getLogger(__name__)
+
+RESERVE_INVENTORY_FUNCTION = 'reserve_inventory'
+
+# "function does not exist" от Postgres и от PostgREST (нет в кеше схемы)
+_MISSING_FUNCTION_CODES = ('42883', 'PGRST202')
+
+_function_available = True
+
+
+def inventory_items(items: Iterable[dict]) -> List[Dict[str, Any]]:
+    """Позиции заказа в формате p_items: только product_id и quantity"""
+    return [
+        {'product_id': str(item['product_id']), 'quantity': int(item.get('quantity') or 1)}
+        for item in items
+        if item.get('product_id')
+    ]
+
+
+def shortage_error(shortages: List[dict]) -> str:
+    """Текст ошибки по нехваткам (тот же формат, что у прежней проверки)"""
+    flowers = [shortage for shortage in shortages if shortage.get('kind') == 'flower']
+    if flowers:
+        return "Недостаточно цветов в инвентаре:\n" + "\n".join(
+            f"{shortage.get('name') or 'Unknown'}: нужно {shortage['needed']}, доступно {shortage['available']} "
+            f"(нехватка: {shortage['shortage']})"
+            for shortage in flowers
+        )
+    messages = []
+    for shortage in shortages:
+        if shortage.get('name') is None:
+            messages.append(f"Product {shortage['id']} not found")
+        else:
+            messages.append(
+                f"Insufficient stock for {shortage['name']}. "
+                f"Available: {shortage['available']}, Required: {shortage['needed']}"
+            )
+    return "\n".join(messages)
+
+
+async def reserve_inventory(db, items: Iterable[dict], operation: str = "reserve") -> Optional[dict]:
+    """
+    Резервирует (reserve) или возвращает (release) склад под позиции заказа
+
+    Returns:
+        {'success', 'updates', 'flower_updates', 'message'} или {'success': False, 'error', 'shortages'};
+        None - функции reserve_inventory нет в базе
+    """
+    global _function_available
+    if not _function_available:
+        return None
+
+    try:
+        result = await db.rpc(RESERVE_INVENTORY_FUNCTION, {
+            'p_items': inventory_items(items),
+            'p_operation': operation
+        }).execute()
+    except APIError as e:
+        if e.code in _MISSING_FUNCTION_CODES:
+            _function_available = False
+            logger.warning(f"{RESERVE_INVENTORY_FUNCTION}() is not installed (apply migrations/004), using batched inventory updates")
+            return None
+        logger.error(f"Inventory {operation} error: {e}")
+        return {'success': False, 'error': str(e), 'shortages': []}
+    except Exception as e:
+        logger.error(f"Inventory {operation} error: {e}")
+        return {'success': False, 'error': str(e), 'shortages': []}
+
+    data = result.data or {}
+    if not data.get('success'):
+        shortages = data.get('shortages') or []
+        return {'success': False, 'error': shortage_error(shortages), 'shortages': shortages}
+
+    updates, flower_updates = data.get('updates') or [], data.get('flower_updates') or []
+    for update in flower_updates:
+        logger.info(f"Flower inventory {operation}: {update['flower_name']} {update['old_quantity']} → {update['new_quantity']}")
+    notify_stock_changes(
+        [{'item_type': 'product', 'item_id': update['product_id'], 'old_quantity': update.get('old_quantity'),
+          'new_quantity': update.get('new_quantity')} for update in updates]
+        + [{'item_type': 'flower', 'item_id': update['flower_id'], 'old_quantity': update.get('old_quantity'),
+            'new_quantity': update.get('new_quantity')} for update in flower_updates]
+    )
+    return {
+        'success': True,
+        'updates': updates,
+        'flower_updates': flower_updates,
+        'message': f"Inventory {operation}d for {len(updates)} products, {len(flower_updates)} flower movements"
+    }
+
+
+# ==================== ПАКЕТНЫЙ ПУТЬ ====================
+
+_MOVEMENT_REASONS = {
+    'reserve': ('order_usage', 'Used in order (Product composition)'),
+    'release': ('delivery', 'Order cancelled/refunded (restored)'),
+    'rollback': ('delivery', 'Order was not created (reservation rolled back)'),
+}
+
+
+@dataclass
+class StockChange:
+    id: str
+    name: Optional[str]
+    old_quantity: int
+    new_quantity: int
+
+
+@dataclass
+class ReservationPlan:
+    """Изменения склада под заказ: количества flowers/products и нехватки"""
+    operation: str
+    flowers: List[StockChange] = field(default_factory=list)
+    products: List[StockChange] = field(default_factory=list)
+    shortages: List[dict] = field(default_factory=list)
+
+    def changes(self) -> List[Tuple[str, StockChange]]:
+        """Изменения с типом позиции журнала: ('flower', ...), ('product', ...)"""
+        return [('flower', change) for change in self.flowers] + [('product', change) for change in self.products]
+
+    def movement_rows(self) -> List[dict]:
+        """По одной строке flower_inventory_movements на цветок"""
+        movement_type, reason = _MOVEMENT_REASONS[self.operation]
+        return [
+            {
+                'flower_id': change.id,
+                'movement_type': movement_type,
+                'quantity': abs(change.new_quantity - change.old_quantity),
+                'reason': reason,
+                'note': 'Product composition × order quantity',
+                'created_by': 'Order System'
+            }
+            for change in self.flowers
+        ]
+
+    def stock_movements(self) -> List[StockMovement]:
+        """Те же изменения движениями журнала (списание заказа не уводит остаток в минус)"""
+        movement_type, reason = _MOVEMENT_REASONS[self.operation]
+        return [
+            StockMovement(
+                item_type, change.id, movement_type, delta=change.new_quantity - change.old_quantity,
+                reason=reason, note=note, created_by='Order System', guard=self.operation == 'reserve'
+            )
+            for item_type, changes, note in (
+                ('product', self.products, None),
+                ('flower', self.flowers, 'Product composition × order quantity'),
+            )
+            for change in changes
+        ]
+
+    def stock_items(self) -> List[dict]:
+        """Новые остатки для подписчиков журнала (notify_stock_changes)"""
+        return [
+            {'item_type': item_type, 'item_id': change.id,
+             'old_quantity': change.old_quantity, 'new_quantity': change.new_quantity}
+            for item_type, changes in (('product', self.products), ('flower', self.flowers))
+            for change in changes
+        ]
+
+    def inverse(self) -> 'ReservationPlan':
+        """План отката: возвращает старые количества"""
+        def undo(changes):
+            return [replace(change, old_quantity=change.new_quantity, new_quantity=change.old_quantity) for change in changes]
+        return ReservationPlan('rollback', undo(self.flowers), undo(self.products))
+
+    def result(self) -> dict:
+        """Ответ в формате reserve_inventory"""
+        if self.shortages:
+            return {'success': False, 'error': shortage_error(self.shortages), 'shortages': self.shortages}
+        updates = [
+            {
+                'product_id': change.id, 'product_name': change.name,
+                'old_quantity': change.old_quantity, 'new_quantity': change.new_quantity,
+                'change_quantity': change.new_quantity - change.old_quantity
+            }
+            for change in self.products
+        ]
+        flower_updates = [
+            {
+                'flower_id': change.id, 'flower_name': change.name,
+                'old_quantity': change.old_quantity, 'new_quantity': change.new_quantity,
+                'quantity': abs(change.new_quantity - change.old_quantity)
+            }
+            for change in self.flowers
+        ]
+        return {
+            'success': True,
+            'updates': updates,
+            'flower_updates': flower_updates,
+            'plan': self,
+            'message': f"Inventory {self.operation}d for {len(updates)} products, {len(flower_updates)} flower movements"
+        }
+
+
+async def build_reservation_plan(db, items: Iterable[dict], operation: str = "reserve") -> ReservationPlan:
+    """План по составам из bom_index: два параллельных чтения (flowers и products заказа)"""
+    sign = -1 if operation == 'reserve' else 1
+    order_items = inventory_items(items)
+    quantities: Dict[str, int] = {}
+    for item in order_items:
+        quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+    plan = ReservationPlan(operation)
+    if not quantities:
+        return plan
+
+    await bom_index.ensure_loaded(db)
+    needed = bom_index.explode(order_items)
+
+    async def load(table, ids):
+        if not ids:
+            return {}
+        result = await db.table(table).select('id, name, quantity').in_('id', list(ids)).execute()
+        return {str(row['id']): row for row in result.data or []}
+
+    flowers, products = await asyncio.gather(load('flowers', needed), load('products', quantities))
+
+    for flower_id, amount in needed.items():
+        flower = flowers.get(flower_id)
+        available = (flower or {}).get('quantity') or 0
+        if operation == 'reserve' and available < amount:
+            plan.shortages.append({
+                'kind': 'flower', 'id': flower_id, 'name': (flower or {}).get('name'),
+                'needed': amount, 'available': available, 'shortage': amount - available
+            })
+        elif flower is not None:
+            plan.flowers.append(StockChange(flower_id, flower.get('name'), available, available + sign * amount))
+
+    # Товары с составом списываются цветами, без состава - своим количеством
+    for product_id, quantity in quantities.items():
+        product = products.get(product_id)
+        available = (product or {}).get('quantity') or 0
+        if product is None:
+            if operation == 'reserve':
+                plan.shortages.append({
+                    'kind': 'product', 'id': product_id, 'name': None,
+                    'needed': quantity, 'available': 0, 'shortage': quantity
+                })
+            continue
+        if bom_index.has_composition(product_id):
+            continue
+        if operation == 'reserve' and available < quantity:
+            plan.shortages.append({
+                'kind': 'product', 'id': product_id, 'name': product.get('name'),
+                'needed': quantity, 'available': available, 'shortage': quantity - available
+            })
+        else:
+            plan.products.append(StockChange(product_id, product.get('name'), available, available + sign * quantity))
+    return plan
+
+
+async def _write_change(db, item_type: str, change: StockChange, guard: bool) -> Optional[dict]:
+    """
+    Записывает изменение остатка с проверкой прочитанного значения (set_quantity);
+    change получает фактические old/new. Returns: нехватка, если guard и остаток уходит в минус
+    """
+    delta = change.new_quantity - change.old_quantity
+
+    def update(quantity):
+        return None if guard and quantity + delta < 0 else quantity + delta
+
+    old_quantity, new_quantity = await set_quantity(db, item_type, change.id, change.old_quantity, update)
+    if new_quantity is None:
+        return {
+            'kind': item_type, 'id': change.id, 'name': change.name,
+            'needed': -delta, 'available': old_quantity, 'shortage': -(old_quantity + delta)
+        }
+    change.old_quantity, change.new_quantity = old_quantity, new_quantity
+    return None
+
+
+async def _undo_changes(db, written: List[Tuple[str, StockChange]]):
+    """Возвращает записанные изменения той же дельтой в обратную сторону"""
+    for item_type, change in written:
+        undo = replace(change, old_quantity=change.new_quantity, new_quantity=change.old_quantity)
+        try:
+            await _write_change(db, item_type, undo, guard=False)
+        except Exception as e:
+            logger.error(f"Failed to roll back {item_type} {change.id} quantity: {e}")
+
+
+async def apply_reservation_plan(db, plan: ReservationPlan):
+    """
+    Записывает план одним вызовом журнала склада; без журнала - параллельные PATCH quantity
+    каждой строки с проверкой прочитанного остатка и одна вставка движений (при ошибке
+    записанное возвращается). Если остаток успел измениться и списание уводит его в минус,
+    нехватки попадают в plan.shortages
+    """
+    recorded = await record_stock_movements(db, plan.stock_movements())
+    if recorded is not None:
+        if not recorded['success']:
+            plan.shortages = recorded['shortages'] or [
+                {'kind': missing['kind'], 'id': missing['id'], 'name': None, 'needed': 0, 'available': 0, 'shortage': 0}
+                for missing in recorded['missing']
+            ]
+        return
+
+    changes = [(item_type, change) for item_type, change in plan.changes() if change.new_quantity != change.old_quantity]
+    guard = plan.operation == 'reserve'
+    results = await asyncio.gather(
+        *(_write_change(db, item_type, change, guard) for item_type, change in changes),
+        return_exceptions=True
+    )
+    written = [pair for pair, result in zip(changes, results) if result is None]
+    errors = [result for result in results if isinstance(result, BaseException)]
+    shortages = [result for result in results if isinstance(result, dict)]
+    if errors or shortages:
+        await _undo_changes(db, written)
+        if errors:
+            raise errors[0]
+        plan.shortages = shortages
+        return
+
+    try:
+        movements = plan.movement_rows()
+        if movements:
+            await db.table('flower_inventory_movements').insert(movements).execute()
+    except Exception:
+        await _undo_changes(db, written)
+        raise
+    notify_stock_changes(plan.stock_items())
+
+
+async def reserve_inventory_batched(db, items: Iterable[dict], operation: str = "reserve") -> dict:
+    """Резервирование без функции reserve_inventory: план + пакетная запись (тот же формат ответа)"""
+    try:
+        plan = await build_reservation_plan(db, items, operation)
+        if not plan.shortages:
+            await apply_reservation_plan(db, plan)
+        return plan.result()
+    except Exception as e:
+        logger.error(f"Inventory {operation} error: {e}")
+        return {'success': False, 'error': str(e), 'shortages': []}
+
+
+async def rollback_reservation(db, reservation: dict, items: Iterable[dict]):
+    """Откат резервирования заказа, который не удалось создать"""
+    plan = reservation.get('plan')
+    if plan is not None:
+        await apply_reservation_plan(db, plan.inverse())
+        return
+    # Резерв сделан функцией reserve_inventory - возвращаем тем же путем
+    result = await reserve_inventory(db, items, 'release')
+    if result is None:
+        await reserve_inventory_batched(db, items, 'release')
@@ -0,0 +1,472 @@
+"""
+Журнал движений склада stock_ledger (migrations/005_stock_ledger.sql)
+flowers.quantity и products.quantity - поддерживаемый остаток (чтение за O(1)), но
+меняются только вместе со строкой журнала: функция record_stock_movements блокирует
+строки, считает новый остаток и пишет quantity и журнал одной транзакцией.
+Периодические снимки stock_snapshots (stock_snapshot.py по cron) дают остаток на любой
+момент: снимок + delta журнала после него (stock_as_of). verify_stock_ledger пересчитывает
+остатки пачкой и находит расхождения - quantity, измененные в обход журнала.
+
+Пока миграция не применена, apply_stock_movements считает то же самое в Python и пишет
+количества напрямую (PATCH с проверкой прочитанного остатка, set_quantity), а движения -
+в прежние таблицы (flower_inventory_movements, inventory_movements).
+"""
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+from postgrest.exceptions import APIError
+
+from core.pagination import KeysetPage, MOVEMENTS_KEYSET, fetch_page
+
+logger = logging.getLogger(__name__)
+
+LEDGER_TABLE = 'stock_ledger'
+SNAPSHOTS_TABLE = 'stock_snapshots'
+RECORD_FUNCTION = 'record_stock_movements'
+SNAPSHOT_FUNCTION = 'take_stock_snapshot'
+VERIFY_FUNCTION = 'verify_stock_ledger'
+
+ITEM_TABLES = {'flower': 'flowers', 'product': 'products'}
+
+# Нет функции (Postgres / кеш схемы PostgREST) или таблицы журнала
+_MISSING_CODES = ('42883', 'PGRST202', '42P01', 'PGRST205')
+
+# Движения, которые прежний код писал в старые таблицы (пересчеты туда не попадали)
+_LEGACY_MOVEMENT_TYPES = ('delivery', 'writeoff', 'order_usage')
+
+# Максимум строк PostgREST за один запрос
+_PAGE_SIZE = 1000
+
+# Попытки записи остатка без журнала, если строку параллельно меняет другой запрос
+_SET_QUANTITY_ATTEMPTS = 5
+
+_ledger_available = True
+
+# Подписчики на новые остатки: [{'item_type', 'item_id', 'old_quantity', 'new_quantity'}]
+_stock_listeners: List[Callable[[List[dict]], None]] = []
+
+StockKey = Tuple[str, str]
+
+
+@dataclass
+class StockMovement:
+    """Движение склада: delta (изменение) или count (пересчет - новый остаток)"""
+    item_type: str
+    item_id: str
+    movement_type: str
+    delta: Optional[int] = None
+    count: Optional[int] = None
+    reason: Optional[str] = None
+    note: Optional[str] = None
+    delivery_date: Optional[str] = None
+    created_by: str = 'CRM System'
+    # Отказ, если остаток уйдет в минус (списания)
+    guard: bool = False
+
+    def entry(self) -> dict:
+        """Элемент p_entries для record_stock_movements"""
+        entry = {
+            'item_type': self.item_type, 'item_id': str(self.item_id), 'movement_type': self.movement_type,
+            'reason': self.reason, 'note': self.note, 'delivery_date': self.delivery_date,
+            'created_by': self.created_by, 'guard': self.guard
+        }
+        if self.count is not None:
+            entry['count'] = int(self.count)
+        else:
+            entry['delta'] = int(self.delta or 0)
+        return {key: value for key, value in entry.items() if value is not None}
+
+
+def ledger_available() -> bool:
+    return _ledger_available
+
+
+def _mark_missing(error: APIError) -> bool:
+    """Миграция 005 не применена - дальше без журнала"""
+    global _ledger_available
+    if error.code not in _MISSING_CODES:
+        return False
+    if _ledger_available:
+        logger.warning(f"Stock ledger is not installed (apply migrations/005), writing quantities directly: {error.message}")
+    _ledger_available = False
+    return True
+
+
+# ==================== РАСЧЕТ ====================
+
+def plan_stock_movements(entries: List[dict], stock: Dict[StockKey, dict]) -> dict:
+    """
+    Расчет record_stock_movements в Python (запасной путь и FakeBackend)
+
+    Args:
+        entries: элементы p_entries
+        stock: {(item_type, item_id): {'name', 'quantity'}} - текущие строки flowers/products
+
+    Returns:
+        {'success': True, 'items', 'movements'} (строки журнала без id/created_at)
+        или {'success': False, 'missing', 'shortages'}
+    """
+    items: Dict[StockKey, dict] = {}
+    movements, missing, shortages = [], [], []
+    for entry in entries:
+        key = (entry['item_type'], str(entry['item_id']))
+        item = items.get(key)
+        if item is None:
+            row = stock.get(key)
+            if row is None:
+                missing.append({'kind': key[0], 'id': key[1]})
+                continue
+            quantity = row.get('quantity') or 0
+            item = items[key] = {
+                'item_type': key[0], 'item_id': key[1], 'item_name': row.get('name'),
+                'old_quantity': quantity, 'new_quantity': quantity
+            }
+
+        old = item['new_quantity']
+        if entry.get('count') is not None:
+            new = int(entry['count'])
+            delta = new - old
+        else:
+            delta = int(entry.get('delta') or 0)
+            new = old + delta
+        if entry.get('guard') and new < 0:
+            shortages.append({
+                'kind': key[0], 'id': key[1], 'name': item['item_name'],
+                'needed': -delta, 'available': old, 'shortage': -new
+            })
+        item['new_quantity'] = new
+        if delta:
+            movements.append({
+                'item_type': key[0], 'item_id': key[1], 'item_name': item['item_name'],
+                'delta': delta, 'balance': new,
+                'movement_type': entry.get('movement_type') or 'adjustment',
+                'reason': entry.get('reason'), 'note': entry.get('note'),
+                'delivery_date': entry.get('delivery_date'), 'created_by': entry.get('created_by') or 'CRM System'
+            })
+
+    if missing or shortages:
+        return {'success': False, 'missing': missing, 'shortages': shortages}
+    return {'success': True, 'items': list(items.values()), 'movements': movements}
+
+
+def expected_balances(snapshot: Iterable[dict], movements: Iterable[dict]) -> Dict[StockKey, int]:
+    """Остатки по журналу: строки снимка + delta движений после него (balance null - перенесенная история)"""
+    balances = {(row['item_type'], str(row['item_id'])): int(row.get('quantity') or 0) for row in snapshot}
+    for row in movements:
+        if row.get('balance') is None:
+            continue
+        key = (row['item_type'], str(row['item_id']))
+        balances[key] = balances.get(key, 0) + int(row['delta'])
+    return balances
+
+
+def find_mismatches(
+    expected: Dict[StockKey, int],
+    last_balances: Dict[StockKey, int],
+    counters: Dict[StockKey, dict]
+) -> List[dict]:
+    """Позиции, где quantity не сходится с журналом (формат verify_stock_ledger)"""
+    mismatches = []
+    for key, row in counters.items():
+        quantity = row.get('quantity') or 0
+        balance = last_balances.get(key)
+        if expected.get(key, 0) != quantity or (balance is not None and balance != quantity):
+            mismatches.append({
+                'item_type': key[0], 'item_id': key[1], 'item_name': row.get('name'),
+                'expected': expected.get(key, 0), 'ledger_balance': balance, 'quantity': quantity
+            })
+    return mismatches
+
+
+# ==================== ЗАПИСЬ ====================
+
+def add_stock_listener(listener: Callable[[List[dict]], None]):
+    """Подписка на записанные изменения остатков (индексы в памяти пересчитывают только их)"""
+    if listener not in _stock_listeners:
+        _stock_listeners.append(listener)
+
+
+def notify_stock_changes(items: Iterable[dict]):
+    """Передает подписчикам позиции, у которых остаток действительно изменился"""
+    changed = [item for item in items if item.get('new_quantity') != item.get('old_quantity')]
+    if not changed:
+        return
+    for listener in list(_stock_listeners):
+        try:
+            listener(changed)
+        except Exception as e:
+            logger.error(f"Stock listener {getattr(listener, '__name__', listener)} failed: {e}")
+
+
+async def set_quantity(
+    db,
+    item_type: str,
+    item_id: str,
+    quantity: Optional[int],
+    update: Callable[[int], Optional[int]]
+) -> Tuple[int, Optional[int]]:
+    """
+    Остаток одной строки flowers/products без журнала: PATCH только quantity с условием
+    quantity = прочитанному (compare-and-set). Если строку успели изменить, остаток
+    перечитывается и update считается заново - параллельные списания не теряются.
+
+    Args:
+        quantity: прочитанный остаток (None - NULL в базе)
+        update: update(остаток) -> новый остаток или None (отказ, например нехватка)
+
+    Returns:
+        (остаток до записи, записанный остаток); записанный None - update отказал
+    """
+    table = ITEM_TABLES[item_type]
+    for _ in range(_SET_QUANTITY_ATTEMPTS):
+        new_quantity = update(quantity or 0)
+        if new_quantity is None:
+            return quantity or 0, None
+        query = db.table(table).update({'quantity': new_quantity}).eq('id', item_id)
+        query = query.eq('quantity', quantity) if quantity is not None else query.is_('quantity', 'null')
+        result = await query.execute()
+        if result.data:
+            return quantity or 0, new_quantity
+        current = await db.table(table).select('quantity').eq('id', item_id).execute()
+        if not current.data:
+            raise LookupError(f"{table} {item_id} not found")
+        quantity = current.data[0].get('quantity')
+    raise RuntimeError(f"{table} {item_id}: quantity keeps changing concurrently, not written")
+
+
+async def record_stock_movements(db, movements: Iterable[StockMovement]) -> Optional[dict]:
+    """
+    Движения одним вызовом record_stock_movements
+
+    Returns:
+        {'success', 'items', 'movements'} или {'success': False, 'missing', 'shortages'};
+        None - журнала нет в базе
+    """
+    entries = [movement.entry() for movement in movements]
+    if not _ledger_available:
+        return None
+    if not entries:
+        return {'success': True, 'items': [], 'movements': []}
+    try:
+        result = await db.rpc(RECORD_FUNCTION, {'p_entries': entries}).execute()
+    except APIError as e:
+        if _mark_missing(e):
+            return None
+        raise
+    data = result.data or {}
+    if not data.get('success'):
+        return {'success': False, 'missing': data.get('missing') or [], 'shortages': data.get('shortages') or []}
+    items = data.get('items') or []
+    notify_stock_changes(items)
+    return {'success': True, 'items': items, 'movements': data.get('movements') or []}
+
+
+async def apply_stock_movements(db, movements: Iterable[StockMovement]) -> dict:
+    """Движения через журнал, без миграции 005 - прежней записью количеств (тот же формат ответа)"""
+    movements = list(movements)
+    result = await record_stock_movements(db, movements)
+    if result is None:
+        result = await _apply_directly(db, movements)
+    return result
+
+
+async def _apply_directly(db, movements: List[StockMovement]) -> dict:
+    """
+    Чтение позиций, PATCH quantity каждой строки с проверкой прочитанного остатка
+    (set_quantity, параллельно) и вставка движений в старые таблицы
+    """
+    ids: Dict[str, set] = {}
+    for movement in movements:
+        ids.setdefault(movement.item_type, set()).add(str(movement.item_id))
+
+    async def load(item_type, item_ids):
+        result = await db.table(ITEM_TABLES[item_type]).select('id, name, quantity').in_('id', list(item_ids)).execute()
+        return {(item_type, str(row['id'])): row for row in result.data or []}
+
+    stock: Dict[StockKey, dict] = {}
+    for part in await asyncio.gather(*(load(item_type, item_ids) for item_type, item_ids in ids.items())):
+        stock.update(part)
+
+    entries = [movement.entry() for movement in movements]
+    planned = plan_stock_movements(entries, stock)
+    if not planned['success']:
+        return planned
+
+    async def write(item):
+        key = (item['item_type'], item['item_id'])
+        item_entries = [entry for entry in entries if (entry['item_type'], str(entry['item_id'])) == key]
+
+        def update(quantity):
+            # Те же движения поверх остатка, который сейчас в базе
+            replanned = plan_stock_movements(item_entries, {key: {'name': item['item_name'], 'quantity': quantity}})
+            return replanned['items'][0]['new_quantity'] if replanned['success'] else None
+
+        return await set_quantity(db, key[0], key[1], stock[key].get('quantity'), update)
+
+    changed = [item for item in planned['items'] if item['new_quantity'] != item['old_quantity']]
+    results = await asyncio.gather(*(write(item) for item in changed), return_exceptions=True)
+    written = {
+        (item['item_type'], item['item_id']): result
+        for item, result in zip(changed, results)
+        if isinstance(result, tuple) and result[1] is not None
+    }
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors or len(written) < len(changed):
+        for (item_type, item_id), (old, new) in written.items():
+            try:
+                await set_quantity(db, item_type, item_id, new, lambda quantity, delta=new - old: quantity - delta)
+            except Exception as e:
+                logger.error(f"Failed to roll back {item_type} {item_id} quantity: {e}")
+        if errors:
+            raise errors[0]
+        # Остаток изменился параллельно и списание больше не проходит - нехватка по текущим остаткам
+        current = dict(stock)
+        for item, result in zip(changed, results):
+            key = (item['item_type'], item['item_id'])
+            current[key] = {'name': item['item_name'], 'quantity': result[0]}
+        return plan_stock_movements(entries, current)
+
+    # Движения и ответ - от остатков, поверх которых действительно записано
+    for key, (old, _) in written.items():
+        stock[key] = {**stock[key], 'quantity': old}
+    planned = plan_stock_movements(entries, stock)
+
+    now = datetime.utcnow().isoformat()
+    legacy = [row for row in planned['movements'] if row['movement_type'] in _LEGACY_MOVEMENT_TYPES]
+    flower_rows = [
+        {key: value for key, value in {
+            'flower_id': row['item_id'], 'movement_type': row['movement_type'], 'quantity': abs(row['delta']),
+            'reason': row['reason'], 'note': row['note'], 'delivery_date': row['delivery_date'],
+            'created_by': row['created_by']
+        }.items() if value is not None}
+        for row in legacy if row['item_type'] == 'flower'
+    ]
+    product_rows = [
+        {
+            'product_id': row['item_id'], 'quantity': row['delta'], 'delivery_date': row['delivery_date'],
+            'reason': row['movement_type'], 'note': row['note'], 'created_at': now
+        }
+        for row in legacy if row['item_type'] == 'product'
+    ]
+    if flower_rows:
+        await db.table('flower_inventory_movements').insert(flower_rows).execute()
+    if product_rows:
+        await db.table('inventory_movements').insert(product_rows).execute()
+    notify_stock_changes(planned['items'])
+    return planned
+
+
+# ==================== СНИМКИ, ПРОВЕРКА, ИСТОРИЯ ====================
+
+async def take_stock_snapshot(db) -> Optional[dict]:
+    """Снимок остатков, если после прошлого были движения: {'ledger_id', 'items'}; None - журнала нет"""
+    try:
+        result = await db.rpc(SNAPSHOT_FUNCTION, {}).execute()
+    except APIError as e:
+        if _mark_missing(e):
+            return None
+        raise
+    return result.data
+
+
+async def verify_stock_ledger(db) -> Optional[List[dict]]:
+    """
+    Пересчет остатков по снимку и журналу одним запросом
+
+    Returns:
+        [{'item_type', 'item_id', 'item_name', 'expected', 'ledger_balance', 'quantity'}] - только
+        расхождения; None - журнала нет
+    """
+    try:
+        result = await db.rpc(VERIFY_FUNCTION, {}).execute()
+    except APIError as e:
+        if _mark_missing(e):
+            return None
+        raise
+    mismatches = result.data or []
+    for mismatch in mismatches:
+        logger.warning(
+            f"Stock drift: {mismatch['item_type']} {mismatch.get('item_name') or mismatch['item_id']} "
+            f"quantity={mismatch['quantity']}, ledger={mismatch['expected']}"
+        )
+    return mismatches
+
+
+async def iter_pages(query_factory) -> AsyncIterator[List[dict]]:
+    """Строки запроса страницами по _PAGE_SIZE (query_factory() - новый запрос с сортировкой)"""
+    offset = 0
+    while True:
+        page = await query_factory().range(offset, offset + _PAGE_SIZE - 1).execute()
+        rows = page.data or []
+        if rows:
+            yield rows
+        if len(rows) < _PAGE_SIZE:
+            return
+        offset += len(rows)
+
+
+async def fetch_all(query_factory) -> List[dict]:
+    """Все строки запроса постранично"""
+    rows: List[dict] = []
+    async for page in iter_pages(query_factory):
+        rows.extend(page)
+    return rows
+
+
+async def stock_as_of(db, at: str, item_type: Optional[str] = None) -> Optional[Dict[StockKey, int]]:
+    """
+    Остатки на момент at (ISO время): последний снимок до at + движения журнала после него до at
+
+    Returns:
+        {(item_type, item_id): quantity}; None - на этот момент снимков еще не было
+    """
+    snapshot = await db.table(SNAPSHOTS_TABLE).select('ledger_id')\
+        .lte('taken_at', at)\
+        .order('ledger_id', desc=True)\
+        .limit(1)\
+        .execute()
+    if not snapshot.data:
+        return None
+    ledger_id = snapshot.data[0]['ledger_id']
+
+    def snapshot_rows():
+        query = db.table(SNAPSHOTS_TABLE).select('item_type, item_id, quantity').eq('ledger_id', ledger_id)
+        if item_type:
+            query = query.eq('item_type', item_type)
+        return query.order('item_type').order('item_id')
+
+    def ledger_rows():
+        query = db.table(LEDGER_TABLE).select('item_type, item_id, delta, balance')\
+            .gt('id', ledger_id)\
+            .lte('created_at', at)
+        if item_type:
+            query = query.eq('item_type', item_type)
+        return query.order('id')
+
+    rows, movements = await asyncio.gather(fetch_all(snapshot_rows), fetch_all(ledger_rows))
+    return expected_balances(rows, movements)
+
+
+async def fetch_ledger_history(
+    db,
+    item_type: str,
+    item_id: Optional[str],
+    limit: int,
+    cursor: Optional[str] = None
+) -> Optional[KeysetPage]:
+    """Страница журнала позиции (или всех позиций типа) по MOVEMENTS_KEYSET; None - журнала нет"""
+    if not _ledger_available:
+        return None
+    query = db.table(LEDGER_TABLE).select('*').eq('item_type', item_type)
+    if item_id:
+        query = query.eq('item_id', item_id)
+    try:
+        return await fetch_page(query, MOVEMENTS_KEYSET, limit, cursor)
+    except APIError as e:
+        if _mark_missing(e):
+            return None
+        raise
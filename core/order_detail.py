@@ -0,0 +1,115 @@
+"""
+Данные страницы заказа /crm/orders/{id} за один запрос PostgREST
+Заказ, позиции с товаром каталога (название, миниатюра) и пользователи
+(клиент, ответственный флорист) встраиваются в один select вместо пяти
+последовательных запросов. Если встраивание недоступно (нет связи в схеме
+PostgREST), данные собираются параллельными запросами: заказ и позиции вместе,
+затем товары и пользователи вместе - два round trip'а вместо пяти.
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from postgrest.exceptions import APIError
+
+from core.thumbnails import MINIATURE_COLUMN, miniature_url, snapshot_url
+
+logger = logging.getLogger(__name__)
+
+# Товар позиции: название и путь к миниатюре (без metadata целиком), updated_at - для ETag страницы
+ORDER_ITEM_PRODUCT_COLUMNS = f'id, name, updated_at, {MINIATURE_COLUMN}'
+
+# orders.user_id и orders.responsible_id ссылаются на users - связь указывается колонкой
+ORDER_DETAIL_SELECT = (
+    f'*, order_items(*, products({ORDER_ITEM_PRODUCT_COLUMNS})), '
+    'customer:users!user_id(*), florist:users!responsible_id(*)'
+)
+
+UNNAMED_PRODUCT = "Товар (название не указано)"
+
+
+async def load_order_detail(db, order_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Заказ со встроенными order_items (+ products), customer и florist
+
+    Returns:
+        Строка заказа или None, если заказа нет
+    """
+    try:
+        result = await db.table('orders').select(ORDER_DETAIL_SELECT).eq('id', order_id).execute()
+    except APIError as e:
+        logger.warning(f"Embedded order detail select failed, loading order {order_id} in parallel: {e}")
+        return await _load_order_detail_parallel(db, order_id)
+    return result.data[0] if result.data else None
+
+
+async def _load_order_detail_parallel(db, order_id: str) -> Optional[Dict[str, Any]]:
+    """Та же форма данных без встраивания: 2 волны независимых запросов"""
+    order_result, items_result = await asyncio.gather(
+        db.table('orders').select('*').eq('id', order_id).execute(),
+        db.table('order_items').select('*').eq('order_id', order_id).execute()
+    )
+    if not order_result.data:
+        return None
+    order = order_result.data[0]
+    items = items_result.data or []
+
+    async def load_products():
+        product_ids = list(dict.fromkeys(item['product_id'] for item in items if item.get('product_id')))
+        if not product_ids:
+            return {}
+        result = await db.table('products').select(ORDER_ITEM_PRODUCT_COLUMNS).in_('id', product_ids).execute()
+        return {product['id']: product for product in result.data or []}
+
+    async def load_user(user_id):
+        # Оба запроса users уходят вместе - DataLoader запроса склеивает их в один .in_()
+        if not user_id:
+            return None
+        try:
+            result = await db.table('users').select('*').eq('id', user_id).execute()
+            return result.data[0] if result.data else None
+        except Exception as e:
+            logger.warning(f"Failed to load user {user_id} for order {order_id}: {e}")
+            return None
+
+    products, customer, florist = await asyncio.gather(
+        load_products(),
+        load_user(order.get('user_id')),
+        load_user(order.get('responsible_id'))
+    )
+    order['order_items'] = [dict(item, products=products.get(item.get('product_id'))) for item in items]
+    order['customer'] = customer
+    order['florist'] = florist
+    return order
+
+
+def detail_version(order: dict, items: List[dict], customer: Optional[dict], florist: Optional[dict]) -> tuple:
+    """
+    Версия всего, что показывает страница заказа (для ETag, core/conditional.py):
+    строка заказа, позиции с версиями товаров и встроенные пользователи
+    Записи синхронизации с Bitrix и правки товаров меняют ее и в других процессах.
+    """
+    return (
+        order.get('id'), order.get('updated_at'),
+        [
+            (item.get('id'), item.get('product_id'), item.get('quantity'), item.get('price'),
+             (item.get('products') or {}).get('updated_at'))
+            for item in items
+        ],
+        [(user.get('id'), user.get('updated_at')) if user else None for user in (customer, florist)]
+    )
+
+
+def detail_items(items: List[dict]) -> List[dict]:
+    """Позиции для шаблона: product_name и product_image (каталог, иначе снимок позиции)"""
+    result = []
+    for item in items:
+        item = dict(item)
+        product = item.pop('products', None) or {}
+        snapshot = item.get('product_snapshot')
+        snapshot_name = snapshot.get('name') if isinstance(snapshot, dict) else None
+        item['product_name'] = product.get('name') or snapshot_name or UNNAMED_PRODUCT
+        item['product_image'] = miniature_url(product.get('miniature')) or snapshot_url(snapshot)
+        result.append(item)
+    return result
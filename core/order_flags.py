@@ -0,0 +1,75 @@
+"""
+Производные колонки заказа (migrations/003_order_flags.sql)
+Считаются один раз при записи (OptimizedTransformer, create_order/api_create_order)
+вместо разбора на каждом просмотре:
+- is_test                 - тестовые/синхронизационные заказы, скрытые из активного списка
+- payment_method_resolved - способ оплаты с учетом свойств заказа Bitrix (kaspiPhone, METHOD_PAY ...)
+- is_pickup               - самовывоз
+"""
+
+from typing import Any, Dict, Optional
+
+# bitrix_order_id тестовых заказов (timestamp-подобные id)
+TEST_BITRIX_ID_PREFIX = '175691'
+
+# Получатели заказов обратной синхронизации ("Получатель Обратной Синхронизации")
+TEST_RECIPIENT_MARKERS = ('синхронизации', 'reverse_sync')
+
+PICKUP_ADDRESS = 'Самовывоз'
+
+# Ключевые слова METHOD_PAY -> способ оплаты
+_METHOD_KEYWORDS = (
+    ('cash', ('cash', 'наличн')),
+    ('card', ('card', 'карт')),
+    ('transfer', ('transfer', 'перевод')),
+)
+
+
+def flatten_properties(props: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    """Свойства Bitrix в виде {code: value} (старый формат {"CODE": {"VALUE": ...}} и новый)"""
+    flat = {}
+    for code, prop in (props or {}).items():
+        if isinstance(prop, dict) and 'VALUE' in prop:
+            code, prop = prop.get('CODE', code), prop.get('VALUE')
+        value = str(prop).strip() if prop is not None else ''
+        if value and value != 'NULL':
+            flat[code] = value
+    return flat
+
+
+def is_test_order(order: Dict[str, Any]) -> bool:
+    """Тестовый заказ по bitrix id или имени получателя"""
+    bitrix_id = order.get('bitrix_order_id')
+    if bitrix_id and str(bitrix_id).startswith(TEST_BITRIX_ID_PREFIX):
+        return True
+    recipient = str(order.get('recipient_name') or '').lower()
+    return any(marker in recipient for marker in TEST_RECIPIENT_MARKERS)
+
+
+def resolve_payment_method(props: Optional[Dict[str, Any]]) -> str:
+    """Способ оплаты по признакам Kaspi и METHOD_PAY из свойств, иначе 'unknown' (как на странице заказа)"""
+    flat = flatten_properties(props)
+    if flat.get('kaspiPhone') or flat.get('CHECK_NUMBER'):
+        return 'kaspi'
+    method = flat.get('METHOD_PAY', '').lower()
+    for resolved, keywords in _METHOD_KEYWORDS:
+        if any(keyword in method for keyword in keywords):
+            return resolved
+    return 'unknown'
+
+
+def is_pickup_order(order: Dict[str, Any], props: Optional[Dict[str, Any]] = None) -> bool:
+    """Самовывоз по свойствам iWillGet/pickup или адресу"""
+    flat = flatten_properties(props)
+    if any(flat.get(code, '').upper() == 'Y' for code in ('iWillGet', 'pickup')):
+        return True
+    return (order.get('delivery_address') or '').strip() == PICKUP_ADDRESS
+
+
+def derive_order_flags(order: Dict[str, Any], props: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Колонки is_test, payment_method_resolved, is_pickup для записи вместе с заказом"""
+    return {
+        'is_test': is_test_order(order),
+        'payment_method_resolved': resolve_payment_method(props),
+        'is_pickup': is_pickup_order(order, props),
+    }
@@ -0,0 +1,157 @@
+"""
+Проекция списка заказов order_list_rows (migrations/001_order_list_rows.sql)
+Колонки списка + заранее посчитанные item_images, чтобы /crm/orders читал одну таблицу
+одним индексным запросом. Строки поддерживают триггеры на orders и order_items (любой
+писатель, включая синхронизацию с Bitrix и скрипты), миграция заполняет проекцию.
+refresh_order_list_rows после записей приложения сбрасывает отрендеренные строки списка
+(и пишет проекцию сам при ORDER_LIST_TRIGGERS=false - база без триггеров), ремонт -
+rebuild_order_list_rows.py
+"""
+
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+from config import config
+from core.fragments import row_fragments
+from core.thumbnails import snapshot_url, thumbnails
+
+logger = logging.getLogger(__name__)
+
+ORDER_LIST_TABLE = 'order_list_rows'
+
+# Колонки orders, которые копируются в проекцию
+ORDER_LIST_COLUMNS = (
+    'id, order_number, bitrix_order_id, status, recipient_name, recipient_phone, '
+    'recipient_phone_digits, delivery_address, total_amount, created_at, responsible_name, '
+    'is_test, is_pickup, payment_method_resolved'
+)
+
+# Сколько миниатюр товаров показывается в строке списка
+MAX_ITEM_IMAGES = 6
+
+# Ограничение длины .in_() (длина URL PostgREST)
+_BATCH_SIZE = 100
+
+
+def build_item_images(items: Iterable[dict], urls: Dict[str, Optional[str]]) -> List[str]:
+    """Миниатюры первых MAX_ITEM_IMAGES позиций заказа (urls - product_id -> url каталога)"""
+    images = []
+    for item in list(items)[:MAX_ITEM_IMAGES]:
+        image = urls.get(item.get('product_id')) or snapshot_url(item.get('product_snapshot'))
+        if image:
+            images.append(image)
+    return images
+
+
+def _chunks(values: List[Any]) -> Iterable[List[Any]]:
+    for start in range(0, len(values), _BATCH_SIZE):
+        yield values[start:start + _BATCH_SIZE]
+
+
+async def attach_item_images(db, orders: List[dict]) -> List[dict]:
+    """
+    Добавляет item_images и first_item_image к заказам (batch запрос позиций +
+    миниатюры из core/thumbnails.py)
+
+    Используется при обновлении проекции и как запасной путь списка без проекции.
+    """
+    order_ids = [order['id'] for order in orders]
+    items_by_order: Dict[str, List[dict]] = {}
+    for chunk in _chunks(order_ids):
+        items = await db.table('order_items').select('order_id, product_id, product_snapshot').in_('order_id', chunk).execute()
+        for item in items.data or []:
+            items_by_order.setdefault(item['order_id'], []).append(item)
+
+    urls = await thumbnails.product_urls(db, (
+        item.get('product_id')
+        for items in items_by_order.values()
+        for item in items[:MAX_ITEM_IMAGES]
+    ))
+
+    result = []
+    for order in orders:
+        order_dict = dict(order)
+        order_dict['item_images'] = build_item_images(items_by_order.get(order['id'], []), urls)
+        # Keep backward compatibility for now
+        order_dict['first_item_image'] = order_dict['item_images'][0] if order_dict['item_images'] else None
+        result.append(order_dict)
+    return result
+
+
+def projection_row(order: dict) -> dict:
+    """Строка order_list_rows из заказа с item_images"""
+    row = {column.strip(): order.get(column.strip()) for column in ORDER_LIST_COLUMNS.split(',')}
+    row['item_images'] = order.get('item_images') or []
+    row['refreshed_at'] = datetime.utcnow().isoformat()
+    return row
+
+
+async def refresh_order_list_rows(
+    db,
+    order_ids: Optional[List[str]] = None,
+    bitrix_order_ids: Optional[List[Any]] = None
+) -> int:
+    """
+    Обновляет список заказов после записи: с триггерами проекцию уже пересчитала база -
+    только сброс отрендеренных строк; без них - пересчет строк проекции здесь
+
+    Ошибки только логируются: запись заказа не должна падать из-за проекции,
+    а отставшую строку исправит rebuild_order_list_rows.py.
+
+    Returns:
+        Количество обновленных строк
+    """
+    try:
+        if config.ORDER_LIST_TRIGGERS:
+            ids = [order_id for order_id in (order_ids or []) if order_id is not None]
+            bitrix_ids = [value for value in (bitrix_order_ids or []) if value is not None]
+            for chunk in _chunks(bitrix_ids):
+                result = await db.table('orders').select('id').in_('bitrix_order_id', chunk).execute()
+                ids.extend(order['id'] for order in result.data or [])
+            if ids:
+                row_fragments.invalidate('order', ids)
+            return len(ids)
+
+        orders: List[dict] = []
+        for column, values in (('id', order_ids), ('bitrix_order_id', bitrix_order_ids)):
+            values = [value for value in (values or []) if value is not None]
+            for chunk in _chunks(values):
+                result = await db.table('orders').select(ORDER_LIST_COLUMNS).in_(column, chunk).execute()
+                orders.extend(result.data or [])
+
+        # Удаленные заказы убираем из проекции
+        found = {order['id'] for order in orders}
+        missing = [order_id for order_id in (order_ids or []) if order_id not in found]
+        if missing:
+            await db.table(ORDER_LIST_TABLE).delete().in_('id', missing).execute()
+            row_fragments.invalidate('order', missing)
+
+        if not orders:
+            return 0
+
+        rows = [projection_row(order) for order in await attach_item_images(db, orders)]
+        await db.table(ORDER_LIST_TABLE).upsert(rows, on_conflict='id').execute()
+        # Отрендеренные строки списка (core/fragments.py) для этих заказов устарели
+        row_fragments.invalidate('order', [row['id'] for row in rows])
+        return len(rows)
+    except Exception as e:
+        logger.error(f"Failed to refresh {ORDER_LIST_TABLE} for {order_ids or bitrix_order_ids}: {e}")
+        return 0
+
+
+async def rebuild_order_list_rows(db, batch_size: int = 500) -> int:
+    """Полная пересборка проекции по всем заказам (по keyset страницам orders)"""
+    from core.pagination import ORDERS_KEYSET, fetch_keyset_page
+
+    total, cursor = 0, None
+    while True:
+        page = await fetch_keyset_page(db.table('orders').select(ORDER_LIST_COLUMNS), ORDERS_KEYSET, cursor, batch_size)
+        if page.data:
+            rows = [projection_row(order) for order in await attach_item_images(db, page.data)]
+            await db.table(ORDER_LIST_TABLE).upsert(rows, on_conflict='id').execute()
+            total += len(rows)
+            logger.info(f"Rebuilt {total} {ORDER_LIST_TABLE} rows")
+        if not page.has_more:
+            return total
+        cursor = page.next_cursor
@@ -0,0 +1,156 @@
+"""
+Keyset (cursor) пагинация для PostgREST
+Вместо .range(offset, ...) страница начинается строго после последней строки предыдущей:
+    (created_at, id) < (last_created_at, last_id)
+Стоимость глубоких страниц не растет, а новые заказы из webhook'ов не сдвигают выдачу.
+Курсор - непрозрачный base64 токен со значениями ключей последней строки.
+"""
+
+import asyncio
+import base64
+import binascii
+import json
+from dataclasses import dataclass
+from typing import Any, List, Optional, Sequence, Tuple
+
+from core.counts import count_total, execute_counted
+
+# (колонка, desc) - последняя колонка должна быть уникальной
+Keyset = Sequence[Tuple[str, bool]]
+
+ORDERS_KEYSET: Keyset = (('created_at', True), ('id', True))
+PRODUCTS_KEYSET: Keyset = (('is_active', True), ('created_at', True), ('id', True))
+MOVEMENTS_KEYSET: Keyset = (('created_at', True), ('id', True))
+
+
+class InvalidCursor(ValueError):
+    """Курсор поврежден или выдан для другого набора ключей"""
+
+
+@dataclass
+class KeysetPage:
+    data: List[dict]
+    next_cursor: Optional[str]
+    has_more: bool
+    count: Optional[int] = None
+
+
+def encode_cursor(row: dict, keys: Keyset) -> Optional[str]:
+    """Токен для строки; None, если у строки пустое значение ключа"""
+    values = [row.get(column) for column, _ in keys]
+    if any(value is None for value in values):
+        return None
+    raw = json.dumps(values, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token: str, keys: Keyset) -> List[Any]:
+    """Значения ключей из токена"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {e}")
+    if not isinstance(values, list) or len(values) != len(keys):
+        raise InvalidCursor("Cursor does not match the sort keys")
+    return values
+
+
+def _literal(value: Any) -> str:
+    """Значение для логического фильтра PostgREST (в кавычках из-за ':' и '.' в датах)"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    text = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{text}"'
+
+
+def keyset_filter(keys: Keyset, after: Sequence[Any]) -> str:
+    """
+    Условие "строго после" для составного ключа в синтаксисе or=(...):
+        a.lt.A, and(a.eq.A, b.lt.B), and(a.eq.A, b.eq.B, c.lt.C)
+    """
+    branches = []
+    for index, (column, desc) in enumerate(keys):
+        conditions = [f"{prev}.eq.{_literal(after[i])}" for i, (prev, _) in enumerate(keys[:index])]
+        conditions.append(f"{column}.{'lt' if desc else 'gt'}.{_literal(after[index])}")
+        branches.append(conditions[0] if len(conditions) == 1 else f"and({','.join(conditions)})")
+    return ','.join(branches)
+
+
+def apply_keyset(builder, keys: Keyset, after: Optional[Sequence[Any]] = None):
+    """Применяет сортировку и курсор к построителю postgrest (вызывается из AsyncSupabase._build)"""
+    # Одним параметром order=a.desc,b.desc (postgrest-py 0.13 на каждый .order() добавляет отдельный order=)
+    builder.params = builder.params.add('order', ','.join(f"{column}.{'desc' if desc else 'asc'}" for column, desc in keys))
+    if after is not None:
+        builder.params = builder.params.add('or', f"({keyset_filter(keys, after)})")
+    return builder
+
+
+async def fetch_keyset_page(
+    query,
+    keys: Keyset,
+    cursor: Optional[str],
+    limit: int,
+    count_strategy: Optional[str] = None
+) -> KeysetPage:
+    """
+    Загружает страницу после курсора (или первую страницу, если курсора нет)
+
+    Args:
+        query: AsyncQuery с select() и фильтрами, без order()/range()
+        keys: ключи сортировки (ORDERS_KEYSET, PRODUCTS_KEYSET ...)
+        cursor: next_cursor предыдущей страницы
+        limit: размер страницы
+        count_strategy: если задана, считает total по фильтрам без курсора (core/counts.py)
+
+    Raises:
+        InvalidCursor: если токен не разбирается
+    """
+    after = decode_cursor(cursor, keys) if cursor else None
+    count_query = query.copy() if count_strategy else None
+
+    page_query = query.keyset(keys, after).limit(limit + 1)
+    if count_query is not None:
+        result, count = await asyncio.gather(
+            page_query.execute(),
+            count_total(count_query, count_strategy)
+        )
+    else:
+        result, count = await page_query.execute(), None
+
+    rows = result.data or []
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1], keys) if has_more and rows else None
+    return KeysetPage(rows, next_cursor, has_more, count)
+
+
+async def fetch_page(
+    query,
+    keys: Keyset,
+    limit: int,
+    cursor: Optional[str] = None,
+    page: int = 1,
+    count_strategy: Optional[str] = None
+) -> KeysetPage:
+    """
+    Страница списка: по курсору (и для первой страницы), offset - только запасной вариант
+    для ссылок вида ?page=N без курсора. next_cursor есть в обоих случаях, так что
+    после offset страницы навигация дальше снова идет по курсору.
+    """
+    if cursor or page <= 1:
+        return await fetch_keyset_page(query, keys, cursor, limit, count_strategy)
+
+    offset = (page - 1) * limit
+    # На одну строку больше, чтобы узнать, есть ли следующая страница
+    query = query.keyset(keys).range(offset, offset + limit)
+    if count_strategy:
+        result = await execute_counted(query, count_strategy)
+    else:
+        result = await query.execute()
+
+    rows = result.data or []
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(rows[-1], keys) if has_more and rows else None
+    return KeysetPage(rows, next_cursor, has_more, result.count)
@@ -0,0 +1,196 @@
+"""
+План закупки цветов по будущим заказам
+Активные заказы с delivery_date в окне читаются постранично вместе с позициями (orders
+со вложенным order_items - один запрос на страницу), каждая страница сразу раскладывается
+в матрицу товар × день. Потребность в цветах по дням получается из составов bom_index
+одной операцией NumPy (np.add.at по CSR), дальше векторно по всем цветам:
+дефицит на день = накопленная потребность - остаток - накопленные ожидаемые поставки,
+закупить к дню = прирост накопленного максимума дефицита (купленное раньше покрывает
+и следующие дни).
+Заказы CRM (без bitrix_order_id) списали цветы со склада при создании (core/inventory.py) -
+они показываются как зарезервированные и в дефицит не входят, иначе учлись бы дважды.
+"""
+
+import asyncio
+import logging
+from datetime import date, timedelta
+from typing import Dict, Iterable, Optional
+
+from core.bom import BomIndex, bom_index
+from core.ledger import fetch_all, iter_pages
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Самое длинное окно плана, дней
+MAX_PLAN_DAYS = 31
+
+
+def planner_available() -> bool:
+    return np is not None
+
+
+def _parse_date(value) -> Optional[date]:
+    try:
+        return date.fromisoformat(str(value)[:10]) if value else None
+    except ValueError:
+        return None
+
+
+class FlowerDemand:
+    """Потребность заказов по дням: товар × день по мере чтения, цветок × день через составы"""
+
+    # Индексы первой оси матриц
+    OPEN, RESERVED = 0, 1
+
+    def __init__(self, bom: BomIndex, start: date, days: int):
+        product_ids, flower_ids, offsets, flowers, amounts = bom.csr()
+        self.start, self.days = start, days
+        self.flower_ids = flower_ids
+        self._products = {product_id: i for i, product_id in enumerate(product_ids)}
+        self._offsets = np.asarray(offsets, dtype=np.intp)
+        self._columns = np.asarray(flowers, dtype=np.intp)
+        self._amounts = np.asarray(amounts, dtype=np.int64)
+        self._product_days = np.zeros((2, len(product_ids), days), dtype=np.int64)
+        self.orders = np.zeros((2, days), dtype=np.int64)
+        self.items_without_composition = 0
+
+    def add_orders(self, orders: Iterable[dict]):
+        """Страница заказов с order_items - одна запись в матрицу на страницу"""
+        kinds, rows, days, quantities = [], [], [], []
+        for order in orders:
+            delivery = _parse_date(order.get('delivery_date'))
+            day = (delivery - self.start).days if delivery else -1
+            if not 0 <= day < self.days:
+                continue
+            kind = self.OPEN if order.get('bitrix_order_id') else self.RESERVED
+            self.orders[kind, day] += 1
+            for item in order.get('order_items') or []:
+                row = self._products.get(str(item.get('product_id')))
+                if row is None:
+                    self.items_without_composition += 1
+                    continue
+                kinds.append(kind)
+                rows.append(row)
+                days.append(day)
+                quantities.append(int(item.get('quantity') or 1))
+        if rows:
+            np.add.at(self._product_days, (np.asarray(kinds, dtype=np.intp), np.asarray(rows, dtype=np.intp),
+                                           np.asarray(days, dtype=np.intp)), np.asarray(quantities, dtype=np.int64))
+
+    def flower_days(self):
+        """Цветы по дням: массив (2, цветок, день) - к закупке и зарезервированные"""
+        component_rows = np.repeat(np.arange(len(self._products), dtype=np.intp), np.diff(self._offsets))
+        result = np.zeros((2, len(self.flower_ids), self.days), dtype=np.int64)
+        np.add.at(result, (slice(None), self._columns),
+                  self._amounts[None, :, None] * self._product_days[:, component_rows, :])
+        return result
+
+    def report(self, flowers: Iterable[dict], incoming: Iterable[dict] = ()) -> dict:
+        """
+        Недостача по дням
+
+        Args:
+            flowers: строки flowers (id, name, quantity) - текущие остатки
+            incoming: ожидаемые поставки [{'flower_id', 'quantity', 'delivery_date'}];
+                поставка до начала окна считается в первый день
+        """
+        index = {flower_id: i for i, flower_id in enumerate(self.flower_ids)}
+        names: Dict[str, Optional[str]] = {}
+        stock = np.zeros(len(self.flower_ids), dtype=np.int64)
+        for flower in flowers:
+            position = index.get(str(flower.get('id')))
+            if position is not None:
+                stock[position] = max(flower.get('quantity') or 0, 0)
+                names[str(flower['id'])] = flower.get('name')
+
+        supply = np.zeros((len(self.flower_ids), self.days), dtype=np.int64)
+        for delivery in incoming:
+            position = index.get(str(delivery.get('flower_id')))
+            arrives = _parse_date(delivery.get('delivery_date')) or self.start
+            day = max((arrives - self.start).days, 0)
+            if position is not None and day < self.days:
+                supply[position, day] += max(int(delivery.get('quantity') or 0), 0)
+
+        demand = self.flower_days()
+        required, reserved = demand[self.OPEN], demand[self.RESERVED]
+        deficit = np.cumsum(required, axis=1) - stock[:, None] - np.cumsum(supply, axis=1)
+        to_buy = np.maximum.accumulate(np.maximum(deficit, 0), axis=1)
+        shortfall = np.diff(to_buy, axis=1, prepend=0)
+
+        used = np.flatnonzero((required + reserved).sum(axis=1))
+        days = []
+        for day in range(self.days):
+            needed = used[(required[used, day] + reserved[used, day] + shortfall[used, day]) > 0]
+            day_flowers = [
+                {
+                    'flower_id': self.flower_ids[position], 'name': names.get(self.flower_ids[position]),
+                    'required': int(required[position, day]), 'reserved': int(reserved[position, day]),
+                    'shortfall': int(shortfall[position, day])
+                }
+                for position in needed.tolist()
+            ]
+            day_flowers.sort(key=lambda flower: (-flower['shortfall'], -flower['required']))
+            days.append({
+                'date': (self.start + timedelta(days=day)).isoformat(),
+                'orders': int(self.orders[self.OPEN, day]),
+                'reserved_orders': int(self.orders[self.RESERVED, day]),
+                'shortfall': int(shortfall[:, day].sum()),
+                'flowers': day_flowers
+            })
+
+        totals = [
+            {
+                'flower_id': self.flower_ids[position], 'name': names.get(self.flower_ids[position]),
+                'required': int(required[position].sum()), 'reserved': int(reserved[position].sum()),
+                'stock': int(stock[position]), 'incoming': int(supply[position].sum()),
+                'shortfall': int(to_buy[position, -1])
+            }
+            for position in used.tolist()
+        ]
+        totals.sort(key=lambda flower: (-flower['shortfall'], flower['name'] or ''))
+        return {
+            'start': self.start.isoformat(),
+            'end': (self.start + timedelta(days=self.days - 1)).isoformat(),
+            'orders': int(self.orders[self.OPEN].sum()),
+            'reserved_orders': int(self.orders[self.RESERVED].sum()),
+            'items_without_composition': self.items_without_composition,
+            'shortfall': int(to_buy[:, -1].sum()),
+            'days': days,
+            'flowers': totals
+        }
+
+
+async def plan_procurement(
+    db, start: date, days: int, statuses: Iterable[str], incoming: Iterable[dict] = (), bom: BomIndex = bom_index
+) -> dict:
+    """Отчет о недостаче цветов на days дней с start: заказы страницами параллельно с остатками"""
+    days = max(min(int(days), MAX_PLAN_DAYS), 1)
+    end = start + timedelta(days=days - 1)
+    await bom.ensure_loaded(db)
+    demand = FlowerDemand(bom, start, days)
+
+    async def stream_orders():
+        async for page in iter_pages(lambda: db.table('orders')
+                                     .select('id, delivery_date, bitrix_order_id, order_items(product_id, quantity)')
+                                     .gte('delivery_date', start.isoformat())
+                                     .lte('delivery_date', end.isoformat())
+                                     .in_('status', list(statuses))
+                                     .order('delivery_date')
+                                     .order('id')):
+            demand.add_orders(page)
+
+    _, flowers = await asyncio.gather(
+        stream_orders(),
+        fetch_all(lambda: db.table('flowers').select('id, name, quantity').order('id'))
+    )
+    report = demand.report(flowers, incoming)
+    logger.info(
+        f"Procurement plan {report['start']}..{report['end']}: {report['orders']} orders, "
+        f"{report['reserved_orders']} reserved, shortfall {report['shortfall']}"
+    )
+    return report
@@ -0,0 +1,445 @@
+"""
+Локальная реплика справочных таблиц в SQLite: flowers, products, product_composition, sellers
+Склад, карточка цветка, состав товара и список товаров читают и соединяют эти таблицы
+локально, Supabase остается источником истины. Реплика догоняет базу по updated_at:
+строки с updated_at не раньше максимума в реплике (минус OVERLAP на транзакции,
+закоммиченные позже своего now()) перечитываются и заменяют локальные. updated_at при
+любом UPDATE выставляют триггеры migrations/007_reference_updated_at.sql.
+
+Когда реплика догоняет базу:
+- при чтении, если прошло REPLICA_SYNC_SECONDS;
+- при следующем чтении после записи этого процесса в таблицу (add_write_listener) и
+  после webhook'ов товаров, магазинов и флористов (invalidate);
+- удаления по updated_at не видны: после delete и webhook'а товаров сверяются id таблицы,
+  а целиком таблицы перезагружаются раз в REPLICA_FULL_SYNC_SECONDS.
+Новые остатки приходят от журнала склада (add_stock_listener) сразу.
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+import zlib
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from postgrest.exceptions import APIError
+
+from config import config
+from core.ledger import fetch_all
+from core.pagination import Keyset, KeysetPage, decode_cursor, encode_cursor
+from monitoring.query_stats import record_query
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ReplicaTable:
+    """Таблица реплики: выборка PostgREST и колонки SQLite для фильтров, соединений и сортировки"""
+    name: str
+    select: str
+    columns: Tuple[str, ...]
+    indexes: Tuple[Tuple[str, ...], ...] = ()
+
+
+# Колонки списка товаров и карточки цветка (metadata целиком не реплицируется)
+PRODUCT_COLUMNS = (
+    'id, name, price, old_price, quantity, is_active, created_at, updated_at, description, slug, seller_id, '
+    'category_id, in_stock:metadata->properties->>IN_STOCK, ru_url:metadata->properties->>ru_url'
+)
+
+REPLICA_TABLES = (
+    ReplicaTable('flowers', '*', ('name', 'is_active')),
+    ReplicaTable('products', PRODUCT_COLUMNS, ('name', 'is_active', 'created_at', 'seller_id', 'category_id'),
+                 (('is_active', 'created_at', 'id'), ('seller_id',))),
+    ReplicaTable('product_composition', '*', ('product_id', 'flower_id', 'amount'),
+                 (('product_id',), ('flower_id',))),
+    ReplicaTable('sellers', '*', ('name', 'is_active')),
+)
+
+# Запас на транзакции, закоммиченные позже, чем начались (updated_at = now() начала транзакции)
+OVERLAP = timedelta(seconds=60)
+
+# Нет колонки updated_at (migrations/007 не применена) - такая таблица перезагружается целиком
+_MISSING_COLUMN_CODES = ('42703', 'PGRST204')
+
+
+def _value(column: str, value: Any) -> Any:
+    """Значение колонки SQLite: id и внешние ключи - строки, чтобы соединения не зависели от типа"""
+    if value is not None and (column == 'id' or column.endswith('_id')):
+        return str(value)
+    return value
+
+
+class ReferenceReplica:
+    """SQLite копия справочных таблиц с догоняющей синхронизацией по updated_at"""
+
+    def __init__(
+        self,
+        path: str = ':memory:',
+        sync_seconds: float = 15,
+        full_sync_seconds: float = 3600,
+        tables: Sequence[ReplicaTable] = REPLICA_TABLES,
+        enabled: bool = True
+    ):
+        self.path = path
+        self.sync_seconds = sync_seconds
+        self.full_sync_seconds = full_sync_seconds
+        self.enabled = enabled
+        self.tables: Dict[str, ReplicaTable] = {table.name: table for table in tables}
+        self._conn: Optional[sqlite3.Connection] = None
+        self._synced_at: Optional[float] = None
+        self._stale: Set[str] = set(self.tables)
+        self._prune: Set[str] = set()
+        self._full: Set[str] = set()
+        self._watermarkless: Set[str] = set()
+        self._lock: Optional[asyncio.Lock] = None
+        self.syncs = 0
+        self.full_loads = 0
+        self.rows_synced = 0
+        self.errors = 0
+
+    # ==================== ФАЙЛ ====================
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = self._open()
+        return self._conn
+
+    def _schema(self) -> List[str]:
+        statements = ['CREATE TABLE replica_state (name TEXT PRIMARY KEY, loaded_at REAL NOT NULL)']
+        for table in self.tables.values():
+            columns = ['id TEXT PRIMARY KEY', 'updated_at TEXT', *table.columns]
+            if 'name' in table.columns:
+                columns.append('name_lower TEXT')
+            columns.append('data TEXT NOT NULL')
+            statements.append(f"CREATE TABLE {table.name} ({', '.join(columns)})")
+            for index in (('updated_at',), *table.indexes):
+                statements.append(f"CREATE INDEX {table.name}_{'_'.join(index)}_idx ON {table.name} ({', '.join(index)})")
+        return statements
+
+    def _open(self) -> sqlite3.Connection:
+        """Открывает файл реплики; схема другой версии пересоздается (данные загрузятся заново)"""
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        schema = self._schema()
+        version = zlib.crc32(';'.join(schema).encode()) & 0x7fffffff
+        if conn.execute('PRAGMA user_version').fetchone()[0] != version:
+            existing = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            with conn:
+                for name in existing:
+                    conn.execute(f'DROP TABLE IF EXISTS {name}')
+                for statement in schema:
+                    conn.execute(statement)
+                conn.execute(f'PRAGMA user_version = {version}')
+        return conn
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    # ==================== СИНХРОНИЗАЦИЯ ====================
+
+    @property
+    def is_fresh(self) -> bool:
+        return (self._synced_at is not None and time.monotonic() - self._synced_at < self.sync_seconds
+                and not self._stale)
+
+    async def ready(self, db) -> bool:
+        """Догоняет базу перед чтением; False - реплика выключена или не синхронизирована (читать из Supabase)"""
+        if not self.enabled:
+            return False
+        try:
+            await self.ensure_synced(db)
+            return True
+        except Exception as e:
+            logger.warning(f"Reference replica sync failed, reading from Supabase: {e}")
+            return False
+
+    async def ensure_synced(self, db) -> 'ReferenceReplica':
+        if self.is_fresh:
+            return self
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self.is_fresh:
+                await self._sync(db)
+        return self
+
+    async def _sync(self, db):
+        """Одна синхронизация: по истечении интервала - все таблицы, иначе только измененные"""
+        started = time.monotonic()
+        expired = self._synced_at is None or started - self._synced_at >= self.sync_seconds
+        names = set(self.tables) if expired else self._stale & set(self.tables)
+        # Записи во время синхронизации снова помечают таблицу - следующее чтение ее догонит
+        prune, full = self._prune & names, self._full & names
+        self._stale -= names
+        self._prune -= names
+        self._full -= names
+        try:
+            changes = await asyncio.gather(*(
+                self._fetch(db, self.tables[name], name in prune, name in full) for name in names
+            ))
+        except Exception:
+            self._stale |= names
+            self._prune |= prune
+            self._full |= full
+            self.errors += 1
+            raise
+
+        with self.conn:
+            for change in changes:
+                self._apply(*change)
+        if expired:
+            self._synced_at = started
+        self.syncs += 1
+
+    def _loaded_at(self, name: str) -> Optional[float]:
+        row = self.conn.execute('SELECT loaded_at FROM replica_state WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else None
+
+    def _since(self, name: str) -> Optional[str]:
+        """Нижняя граница updated_at для догоняющей выборки; None - нужна полная загрузка"""
+        if name in self._watermarkless:
+            return None
+        loaded_at = self._loaded_at(name)
+        if loaded_at is None or time.time() - loaded_at >= self.full_sync_seconds:
+            return None
+        watermark = self.conn.execute(f'SELECT max(updated_at) FROM {name}').fetchone()[0]
+        if watermark is None:
+            return None
+        try:
+            return (datetime.fromisoformat(str(watermark)) - OVERLAP).isoformat()
+        except ValueError:
+            return None
+
+    async def _fetch(self, db, table: ReplicaTable, prune: bool, full: bool) -> tuple:
+        """Строки из Supabase: (таблица, строки, id в базе для удаления лишних, полная загрузка)"""
+        since = None if full else self._since(table.name)
+        if since is not None:
+            remote_ids = None
+            if prune:
+                remote_ids = {str(row['id']) for row in await fetch_all(
+                    lambda: db.table(table.name).select('id').order('id')
+                )}
+            try:
+                rows = await fetch_all(
+                    lambda: db.table(table.name).select(table.select)
+                    .gte('updated_at', since).order('updated_at').order('id')
+                )
+                return table, rows, remote_ids, False
+            except APIError as e:
+                if e.code not in _MISSING_COLUMN_CODES:
+                    raise
+                logger.warning(f"{table.name}.updated_at is not available (apply migrations/007), replica reloads it in full")
+                self._watermarkless.add(table.name)
+
+        rows = await fetch_all(lambda: db.table(table.name).select(table.select).order('id'))
+        return table, rows, None, True
+
+    def _record(self, table: ReplicaTable, row: dict) -> tuple:
+        values = [str(row['id']), row.get('updated_at')]
+        values.extend(_value(column, row.get(column)) for column in table.columns)
+        if 'name' in table.columns:
+            values.append((row.get('name') or '').lower())
+        values.append(json.dumps(row, ensure_ascii=False, default=str))
+        return tuple(values)
+
+    def _apply(self, table: ReplicaTable, rows: List[dict], remote_ids: Optional[Set[str]], full: bool):
+        """Применяет выборку внутри транзакции синхронизации"""
+        if full:
+            self.conn.execute(f'DELETE FROM {table.name}')
+        elif remote_ids is not None:
+            deleted = [(row_id,) for (row_id,) in self.conn.execute(f'SELECT id FROM {table.name}') if row_id not in remote_ids]
+            self.conn.executemany(f'DELETE FROM {table.name} WHERE id = ?', deleted)
+
+        columns = ['id', 'updated_at', *table.columns, *(('name_lower',) if 'name' in table.columns else ()), 'data']
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [self._record(table, row) for row in rows]
+        )
+        self.rows_synced += len(rows)
+        if full:
+            self.conn.execute('INSERT OR REPLACE INTO replica_state (name, loaded_at) VALUES (?, ?)', (table.name, time.time()))
+            self.full_loads += 1
+            logger.info(f"Reference replica loaded {table.name}: {len(rows)} rows")
+
+    # ==================== СОБЫТИЯ ====================
+
+    def note_write(self, table: str, verb: str):
+        """Подписчик записей AsyncSupabase: догнать таблицу при следующем чтении (после delete - сверить id)"""
+        if table in self.tables:
+            self._stale.add(table)
+            if verb == 'delete':
+                self._prune.add(table)
+
+    def apply_stock_changes(self, items: Iterable[dict]):
+        """Подписчик журнала склада: новые остатки цветов и товаров сразу"""
+        if self._conn is None:
+            return
+        updates = [
+            (item.get('new_quantity'), str(item.get('item_id')), 'flowers' if item.get('item_type') == 'flower' else 'products')
+            for item in items
+        ]
+        with self._conn:
+            for quantity, item_id, table in updates:
+                self._conn.execute(f"UPDATE {table} SET data = json_set(data, '$.quantity', ?) WHERE id = ?", (quantity, item_id))
+
+    def invalidate(self, tables: Optional[Iterable[str]] = None, prune: bool = False, full: bool = False):
+        """
+        Догнать таблицы (все, если None) при следующем чтении
+        prune - сверить id (после удалений), full - перезагрузить целиком
+        """
+        names = set(self.tables) if tables is None else set(tables) & set(self.tables)
+        self._stale |= names
+        if prune:
+            self._prune |= names
+        if full:
+            self._full |= names
+
+    # ==================== ЧТЕНИЕ ====================
+
+    def _query(self, table: str, sql: str, params: Sequence[Any] = (), filters: Sequence[str] = ()) -> List[tuple]:
+        start = time.perf_counter()
+        rows = self.conn.execute(sql, params).fetchall()
+        record_query('sqlite', table, 'select', list(filters), len(rows), (time.perf_counter() - start) * 1000)
+        return rows
+
+    @staticmethod
+    def _where(where: Optional[Dict[str, Any]], search: Optional[str]) -> Tuple[List[str], List[Any], List[str]]:
+        """Равенства по колонкам реплики и поиск подстроки в названии (как ilike %search%)"""
+        clauses, params, filters = [], [], []
+        for column, value in (where or {}).items():
+            clauses.append(f'{column} = ?')
+            params.append(_value(column, value))
+            filters.append(f'{column} eq')
+        if search:
+            clauses.append('name_lower LIKE ?')
+            params.append(f'%{search.lower()}%')
+            filters.append('name ilike')
+        return clauses, params, filters
+
+    def get(self, table: str, row_id: Any) -> Optional[dict]:
+        rows = self._query(table, f'SELECT data FROM {table} WHERE id = ?', (str(row_id),), ['id eq'])
+        return json.loads(rows[0][0]) if rows else None
+
+    def get_many(self, table: str, ids: Iterable[Any]) -> Dict[str, dict]:
+        """Строки по id: {str(id): строка}"""
+        ids = list({str(row_id) for row_id in ids})
+        if not ids:
+            return {}
+        rows = self._query(
+            table, f"SELECT id, data FROM {table} WHERE id IN ({', '.join('?' * len(ids))})", ids, [f'id in[{len(ids)}]']
+        )
+        return {row_id: json.loads(data) for row_id, data in rows}
+
+    def rows(
+        self,
+        table: str,
+        where: Optional[Dict[str, Any]] = None,
+        search: Optional[str] = None,
+        order: Keyset = (('name', False),)
+    ) -> List[dict]:
+        clauses, params, filters = self._where(where, search)
+        sql = f'SELECT data FROM {table}'
+        if clauses:
+            sql += f" WHERE {' AND '.join(clauses)}"
+        sql += f" ORDER BY {', '.join(f'{column} {_direction(desc)}' for column, desc in order)}"
+        return [json.loads(data) for (data,) in self._query(table, sql, params, filters)]
+
+    def page(
+        self,
+        table: str,
+        keys: Keyset,
+        limit: int,
+        cursor: Optional[str] = None,
+        page: int = 1,
+        where: Optional[Dict[str, Any]] = None,
+        search: Optional[str] = None
+    ) -> KeysetPage:
+        """
+        Страница как core.pagination.fetch_page (те же курсоры), total - точный count(*)
+
+        Raises:
+            InvalidCursor: если токен не разбирается
+        """
+        after = decode_cursor(cursor, keys) if cursor else None
+        clauses, params, filters = self._where(where, search)
+        condition = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        count = self._query(table, f'SELECT count(*) FROM {table}{condition}', params, filters)[0][0]
+
+        offset = 0
+        if after is not None:
+            # "Строго после" курсора: a < A OR (a = A AND b < B) ...
+            branches = []
+            for index, (column, desc) in enumerate(keys):
+                branch = [f'{previous} = ?' for previous, _ in keys[:index]]
+                branch.append(f"{column} {'<' if desc else '>'} ?")
+                branches.append(f"({' AND '.join(branch)})")
+                params.extend(_value(previous, after[i]) for i, (previous, _) in enumerate(keys[:index + 1]))
+            clauses.append(f"({' OR '.join(branches)})")
+            filters.append('keyset')
+        elif page > 1:
+            offset = (page - 1) * limit
+
+        sql = f'SELECT data FROM {table}'
+        if clauses:
+            sql += f" WHERE {' AND '.join(clauses)}"
+        sql += f" ORDER BY {', '.join(f'{column} {_direction(desc)}' for column, desc in keys)} LIMIT ? OFFSET ?"
+        rows = [json.loads(data) for (data,) in self._query(table, sql, [*params, limit + 1, offset], filters)]
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1], keys) if has_more and rows else None
+        return KeysetPage(rows, next_cursor, has_more, count)
+
+    def compositions(self, flower_id: Any = None, product_id: Any = None) -> List[dict]:
+        """
+        Составы цветка (с вложенным products) или товара (с вложенным flowers) в форме
+        вложенных ресурсов PostgREST, по убыванию количества
+        """
+        if flower_id is not None:
+            column, value, target, key = 'flower_id', flower_id, 'products', 'product_id'
+        else:
+            column, value, target, key = 'product_id', product_id, 'flowers', 'flower_id'
+        rows = self._query(
+            'product_composition',
+            f'SELECT c.data, t.data FROM product_composition c LEFT JOIN {target} t ON t.id = c.{key} '
+            f'WHERE c.{column} = ? ORDER BY c.amount DESC, c.id',
+            (str(value),),
+            [f'{column} eq', f'{target} join']
+        )
+        return [{**json.loads(composition), target: json.loads(embedded) if embedded else None} for composition, embedded in rows]
+
+    def get_stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'path': self.path,
+            'rows': {
+                name: self._conn.execute(f'SELECT count(*) FROM {name}').fetchone()[0] for name in self.tables
+            } if self._conn is not None else {},
+            'stale': sorted(self._stale),
+            'syncs': self.syncs,
+            'full_loads': self.full_loads,
+            'rows_synced': self.rows_synced,
+            'errors': self.errors,
+            'fresh': self.is_fresh
+        }
+
+
+def _direction(desc: bool) -> str:
+    return 'DESC' if desc else 'ASC'
+
+
+# Глобальная реплика приложения
+reference_replica = ReferenceReplica(
+    config.REPLICA_PATH,
+    config.REPLICA_SYNC_SECONDS,
+    config.REPLICA_FULL_SYNC_SECONDS,
+    enabled=config.REPLICA_ENABLED
+)
@@ -0,0 +1,122 @@
+"""
+Поиск заказов по номеру, получателю, телефону и адресу (migrations/002_order_search.sql)
+Телефон хранится нормализованными цифрами (recipient_phone_digits), имя и адрес
+покрыты trigram (pg_trgm) индексами, поэтому ilike '%...%' идет по индексу, а не сканом.
+Кандидаты выбираются одним запросом с условием "любое из полей", затем ранжируются.
+"""
+
+from typing import List, Optional, Sequence, Tuple
+
+from core.pagination import _literal
+
+# (колонка, оператор, шаблон с %) - условия, объединяемые через OR
+Condition = Tuple[str, str, str]
+
+# Сколько последних совпадений ранжируется
+ORDER_SEARCH_CANDIDATES = 200
+
+# Минимальная длина для trigram индекса (короче - индекс не используется)
+MIN_TRIGRAM_LENGTH = 3
+
+
+def phone_digits(value: Optional[str]) -> Optional[str]:
+    """
+    Цифры телефона в одном формате: 8 701 ... и +7 (701) ... -> 7701...
+    Используется и при записи (transformer, create_order), и для строки поиска.
+    """
+    digits = ''.join(c for c in str(value or '') if c.isdigit())
+    if len(digits) == 11 and digits.startswith('8'):
+        digits = '7' + digits[1:]
+    elif len(digits) == 10 and digits.startswith('7'):
+        # Без кода страны: 701 123 45 67
+        digits = '7' + digits
+    return digits or None
+
+
+def _escape(term: str) -> str:
+    """Убирает подстановочные символы пользователя"""
+    return term.replace('%', '').replace('*', '').strip()
+
+
+def _phone_fragment(digits: str) -> str:
+    """Полный номер нормализуется, часть номера ищется как есть (кроме префикса 8 7xx)"""
+    if len(digits) >= 10:
+        return phone_digits(digits)
+    if len(digits) >= 4 and digits.startswith('87'):
+        return '7' + digits[1:]
+    return digits
+
+
+def order_search_conditions(term: str) -> List[Condition]:
+    """Условия по полям заказа для строки поиска"""
+    text = _escape(term)
+    if not text:
+        return []
+    conditions: List[Condition] = [('order_number', 'ilike', f'%{text}%')]
+
+    digits = ''.join(c for c in text if c.isdigit())
+    if any(c.isalpha() for c in text):
+        conditions.append(('recipient_name', 'ilike', f'%{text}%'))
+        conditions.append(('delivery_address', 'ilike', f'%{text}%'))
+    elif len(digits) >= MIN_TRIGRAM_LENGTH:
+        # Телефон в любом формате ввода: +7 (701) 123-45-67, 8701..., 123-45-67
+        conditions.append(('recipient_phone_digits', 'like', f'%{_phone_fragment(digits)}%'))
+    return conditions
+
+
+def match_any_filter(conditions: Sequence[Condition]) -> str:
+    """Условие or(...) PostgREST; % заменяется на * (подстановка в URL фильтрах)"""
+    return ','.join(f"{column}.{operator}.{_literal(pattern.replace('%', '*'))}" for column, operator, pattern in conditions)
+
+
+def apply_match_any(builder, conditions: Sequence[Condition]):
+    """
+    Применяет "любое из условий" к построителю postgrest (вызывается из AsyncSupabase._build)
+
+    Через and=(or(...)), чтобы не конфликтовать с or=(...) курсора keyset пагинации.
+    """
+    if conditions:
+        builder.params = builder.params.add('and', f"(or({match_any_filter(conditions)}))")
+    return builder
+
+
+def rank_order(order: dict, term: str) -> int:
+    """Релевантность заказа: номер > телефон > имя получателя > адрес"""
+    text = _escape(term).lower()
+    digits = ''.join(c for c in text if c.isdigit())
+    score = 0
+
+    if text in (str(order.get('order_number') or '').lower(), str(order.get('bitrix_order_id') or '')):
+        score += 100
+    elif text and text in str(order.get('order_number') or '').lower():
+        score += 30
+
+    order_phone = order.get('recipient_phone_digits') or phone_digits(order.get('recipient_phone')) or ''
+    if len(digits) >= MIN_TRIGRAM_LENGTH and order_phone:
+        normalized = _phone_fragment(digits)
+        if order_phone == normalized:
+            score += 90
+        elif order_phone.endswith(normalized):
+            score += 70
+        elif normalized in order_phone:
+            score += 50
+
+    name = str(order.get('recipient_name') or '').lower()
+    if name and text:
+        if name == text:
+            score += 80
+        elif name.startswith(text) or any(word.startswith(text) for word in name.split()):
+            score += 60
+        elif text in name:
+            score += 40
+
+    if text and text in str(order.get('delivery_address') or '').lower():
+        score += 20
+    return score
+
+
+def rank_orders(orders: List[dict], term: str, limit: int) -> List[dict]:
+    """Лучшие совпадения; при равной релевантности сохраняется порядок (новые выше)"""
+    scored = [(rank_order(order, term), index, order) for index, order in enumerate(orders)]
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return [order for _, _, order in scored[:limit]]
@@ -0,0 +1,69 @@
+"""
+Счетчики товаров продавцов sellers.product_count / active_product_count
+(migrations/006_seller_product_counts.sql)
+Триггеры на products поддерживают их при вставке, удалении, активации и деактивации,
+rebuild_seller_product_counts() пересчитывает всех продавцов одним GROUP BY
+(update_seller_product_counts.py). Фильтр магазинов на странице товаров читает счетчики
+вместе с именами - без подсчетов и разбора description.
+"""
+
+import logging
+from typing import Iterable, List, Optional
+
+from postgrest.exceptions import APIError
+
+logger = logging.getLogger(__name__)
+
+REBUILD_FUNCTION = 'rebuild_seller_product_counts'
+
+# Колонок еще нет (Postgres / кеш схемы PostgREST) или нет функции пересчета
+_MISSING_CODES = ('42703', 'PGRST204', '42883', 'PGRST202')
+
+_counters_available = True
+
+
+async def load_seller_filter(db) -> List[dict]:
+    """
+    Активные продавцы для фильтра товаров: id, name, product_count, active_product_count
+    До миграции 006 счетчики None - фильтр показывает только имена
+    """
+    global _counters_available
+    query = db.table('sellers').select('id, name, product_count, active_product_count') if _counters_available \
+        else db.table('sellers').select('id, name')
+    try:
+        result = await query.eq('is_active', True).order('name').execute()
+    except APIError as e:
+        if not _counters_available or e.code not in _MISSING_CODES:
+            raise
+        _counters_available = False
+        logger.warning("sellers.product_count is not installed (apply migrations/006), seller filter shows names only")
+        return await load_seller_filter(db)
+
+    return seller_filter_rows(result.data or [])
+
+
+def seller_filter_rows(sellers: Iterable[dict]) -> List[dict]:
+    """Строки фильтра из строк sellers (например, из локальной реплики core/replica.py)"""
+    return [
+        {
+            'id': seller['id'],
+            'name': seller['name'],
+            'product_count': seller.get('product_count'),
+            'active_product_count': seller.get('active_product_count')
+        }
+        for seller in sellers
+    ]
+
+
+async def rebuild_seller_product_counts(db) -> Optional[int]:
+    """Пересчет счетчиков одним запросом: число исправленных продавцов; None - миграция не применена"""
+    try:
+        result = await db.rpc(REBUILD_FUNCTION, {}).execute()
+    except APIError as e:
+        if e.code in _MISSING_CODES:
+            return None
+        raise
+    fixed = result.data or 0
+    if fixed:
+        logger.warning(f"Seller product counts drifted for {fixed} sellers, rebuilt")
+    return fixed
@@ -0,0 +1,104 @@
+"""
+Потоковый рендер HTML страниц CRM (Jinja2 async generation + StreamingResponse)
+Страница отдается по мере рендера: шапка и навигация base.html уходят в браузер сразу,
+пока ниже рендерятся строки или шаблон ждет данные. Данные можно отложить в сам
+шаблон: async функция из контекста, вызванная в шаблоне, автоматически await'ится
+(см. load_warehouse в warehouse.html), так что запросы к БД идут уже после первых байт.
+
+Мелкие куски Jinja склеиваются до STREAM_CHUNK_BYTES; если рендер ждет (данные БД),
+накопленное отправляется, не дожидаясь заполнения буфера.
+"""
+
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Dict, Optional
+
+import jinja2
+from fastapi.responses import StreamingResponse
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Пауза рендера, после которой буфер отправляется
+_IDLE_FLUSH_SECONDS = 0.01
+
+# Сообщение вместо остатка страницы, если рендер упал после отправки заголовков
+_STREAM_ERROR_HTML = (
+    '<div class="card" style="color: #721c24; background: #f8d7da; padding: 1rem;">'
+    'Ошибка загрузки данных. Обновите страницу.</div>'
+)
+
+
+async def coalesce_chunks(
+    chunks: AsyncIterator[str],
+    chunk_bytes: int,
+    idle_flush: float = _IDLE_FLUSH_SECONDS
+) -> AsyncIterator[bytes]:
+    """Склеивает куски рендера; отправляет при заполнении буфера или паузе рендера"""
+    buffer, size = [], 0
+    iterator = chunks.__aiter__()
+    pending: Optional[asyncio.Future] = None
+    try:
+        while True:
+            pending = asyncio.ensure_future(iterator.__anext__())
+            if buffer:
+                done, _ = await asyncio.wait({pending}, timeout=idle_flush)
+                if not done:
+                    # Рендер ждет данные - отдаем то, что уже готово
+                    yield ''.join(buffer).encode()
+                    buffer, size = [], 0
+            try:
+                chunk = await pending
+            except StopAsyncIteration:
+                break
+            finally:
+                pending = None
+            buffer.append(chunk)
+            size += len(chunk)
+            if size >= chunk_bytes:
+                yield ''.join(buffer).encode()
+                buffer, size = [], 0
+    except Exception as e:
+        # Статус и заголовки уже отправлены: вместо error.html - сообщение в конце страницы
+        logger.error(f"Streaming render error: {e}")
+        buffer.append(_STREAM_ERROR_HTML)
+    finally:
+        if pending is not None:
+            pending.cancel()
+    if buffer:
+        yield ''.join(buffer).encode()
+
+
+class StreamingTemplates:
+    """Аналог Jinja2Templates.TemplateResponse с потоковой отдачей"""
+
+    def __init__(self, templates, chunk_bytes: int = 8192):
+        source = templates.env
+        self.env = jinja2.Environment(
+            loader=source.loader,
+            autoescape=source.autoescape,
+            enable_async=True
+        )
+        self.env.globals.update(source.globals)
+        self.env.filters.update(source.filters)
+        self.chunk_bytes = chunk_bytes
+
+    def TemplateResponse(
+        self,
+        name: str,
+        context: Dict[str, Any],
+        status_code: int = 200,
+        headers: Optional[Dict[str, str]] = None
+    ) -> StreamingResponse:
+        template = self.env.get_template(name)
+        return StreamingResponse(
+            coalesce_chunks(template.generate_async(context), self.chunk_bytes),
+            status_code=status_code,
+            headers=headers,
+            media_type='text/html'
+        )
+
+
+def create_streaming_templates(templates) -> StreamingTemplates:
+    return StreamingTemplates(templates, chunk_bytes=config.STREAM_CHUNK_BYTES)
@@ -0,0 +1,121 @@
+"""
+Миниатюры товаров для списков и страниц заказов
+Один резолвер вместо копий логики в list_orders/order_detail/products:
+- картинка каталога: products.metadata.properties.ru_img_miniature
+- для собранных букетов без товара в каталоге: по bitrix id из product_snapshot
+Из products читается только путь к миниатюре (JSON path), а не весь metadata.
+URL'ы хранятся в ограниченной LRU карте product_id -> url, сбрасываются
+webhook'ом товаров и при редактировании товара.
+"""
+
+import logging
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Колонка вместо metadata целиком
+MINIATURE_COLUMN = 'miniature:metadata->properties->>ru_img_miniature'
+
+# Ограничение длины .in_() (длина URL PostgREST)
+_BATCH_SIZE = 100
+
+# Товар без миниатюры тоже кешируется, чтобы не перезапрашивать его
+_NO_IMAGE = ''
+
+
+def miniature_url(path: Optional[str]) -> Optional[str]:
+    """URL картинки каталога по пути ru_img_miniature"""
+    return f"https://cvety.kz{path}" if path else None
+
+
+def snapshot_url(snapshot: Optional[dict]) -> Optional[str]:
+    """URL миниатюры собранного букета по bitrix id из снимка позиции"""
+    if isinstance(snapshot, dict) and (snapshot.get('bitrix') or {}).get('product_id'):
+        return f"https://cvety.kz/miniature/{snapshot['bitrix']['product_id']}-obrannyy-buket.jpg"
+    return None
+
+
+class ThumbnailResolver:
+    """Bulk резолвер миниатюр с LRU картой product_id -> url"""
+
+    def __init__(self, max_size: int = 5000):
+        self.max_size = max_size
+        self._urls: 'OrderedDict[str, str]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def product_urls(self, db, product_ids: Iterable[Optional[str]]) -> Dict[str, Optional[str]]:
+        """URL каталога для товаров (один batch запрос на все промахи)"""
+        urls: Dict[str, Optional[str]] = {}
+        missing = []
+        for product_id in dict.fromkeys(pid for pid in product_ids if pid):
+            if product_id in self._urls:
+                self._urls.move_to_end(product_id)
+                urls[product_id] = self._urls[product_id] or None
+                self.hits += 1
+            else:
+                missing.append(product_id)
+        self.misses += len(missing)
+
+        for start in range(0, len(missing), _BATCH_SIZE):
+            chunk = missing[start:start + _BATCH_SIZE]
+            try:
+                result = await db.table('products').select(f'id, {MINIATURE_COLUMN}').in_('id', chunk).execute()
+            except Exception as e:
+                logger.warning(f"Failed to load thumbnails for {len(chunk)} products: {e}")
+                continue
+            found = {row['id']: miniature_url(row.get('miniature')) for row in result.data or []}
+            for product_id in chunk:
+                urls[product_id] = found.get(product_id)
+                self._remember(product_id, found.get(product_id))
+        return urls
+
+    async def resolve(
+        self,
+        db,
+        product_ids: Sequence[Optional[str]],
+        snapshots: Optional[Sequence[Optional[dict]]] = None
+    ) -> List[Optional[str]]:
+        """
+        Миниатюры позиций: product_ids[i] и snapshots[i] относятся к одной позиции
+
+        Returns:
+            URL для каждой позиции (картинка каталога, иначе по снимку, иначе None)
+        """
+        snapshots = snapshots if snapshots is not None else [None] * len(product_ids)
+        urls = await self.product_urls(db, product_ids)
+        return [
+            (urls.get(product_id) if product_id else None) or snapshot_url(snapshot)
+            for product_id, snapshot in zip(product_ids, snapshots)
+        ]
+
+    def _remember(self, product_id: str, url: Optional[str]):
+        self._urls[product_id] = url or _NO_IMAGE
+        self._urls.move_to_end(product_id)
+        while len(self._urls) > self.max_size:
+            self._urls.popitem(last=False)
+
+    def invalidate(self, product_ids: Optional[Iterable[str]] = None):
+        """Сбрасывает URL'ы товаров (или все)"""
+        if product_ids is None:
+            self._urls.clear()
+            return
+        for product_id in product_ids:
+            self._urls.pop(product_id, None)
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'size': len(self._urls),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0
+        }
+
+
+# Глобальный резолвер приложения
+thumbnails = ThumbnailResolver(config.THUMBNAIL_CACHE_SIZE)
@@ -10,6 +10,9 @@ import json
 import re
 from functools import lru_cache
 
+from core.order_flags import derive_order_flags
+from core.search import phone_digits
+
 logger = logging.getLogger(__name__)
 
 # Константы ограничений полей БД
@@ -299,6 +302,9 @@ class OptimizedTransformer:
             
             supabase_order['metadata'] = metadata
             
+            # Производные колонки (тестовый заказ, способ оплаты, самовывоз)
+            supabase_order.update(derive_order_flags(supabase_order, props_data))
+            
             return supabase_order
             
         except Exception as e:
@@ -371,6 +377,8 @@ class OptimizedTransformer:
                     if phone_clean and not phone_clean.startswith('+'):
                         phone_clean = '+' + phone_clean
                     result[field_name] = phone_clean[:20]
+                    # Цифры для поиска по телефону в любом формате (core/search.py)
+                    result['recipient_phone_digits'] = phone_digits(phone_clean)
                 elif field_name == 'delivery_date_raw':
                     # Обрабатываем дату доставки в формате YYYY-MM-DD
                     if len(value) == 10 and value.count('-') == 2:  # Формат YYYY-MM-DD
@@ -470,6 +478,16 @@ class OptimizedTransformer:
         if props_data and isinstance(props_data, dict):
             extracted_props = self._extract_order_properties(props_data)
             update_data.update(extracted_props)
+            
+            # Производные колонки - только по полям, пришедшим в обновлении
+            flags = derive_order_flags({**update_data, 'bitrix_order_id': bitrix_data.get('ID')}, props_data)
+            if 'recipient_name' not in update_data:
+                flags.pop('is_test')
+            if 'delivery_address' not in update_data:
+                flags.pop('is_pickup')
+            if flags['payment_method_resolved'] == 'unknown':
+                flags.pop('payment_method_resolved')
+            update_data.update(flags)
         
         # Обновляем timestamp
         update_data['updated_at'] = datetime.now().isoformat()
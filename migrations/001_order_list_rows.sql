@@ -0,0 +1,135 @@
+-- Проекция списка заказов для /crm/orders (core/order_list.py)
+-- Колонки списка + заранее посчитанные миниатюры товаров. Строки поддерживают триггеры на
+-- orders и order_items - при любой записи, в том числе через синхронизацию с Bitrix и
+-- скрипты исправлений; приложение дополнительно сбрасывает свои отрендеренные строки.
+-- Проекция заполняется в конце миграции; python rebuild_order_list_rows.py - ремонт.
+
+CREATE TABLE IF NOT EXISTS order_list_rows (
+    id               uuid PRIMARY KEY REFERENCES orders(id) ON DELETE CASCADE,
+    order_number     text,
+    bitrix_order_id  bigint,
+    status           text NOT NULL,
+    recipient_name   text,
+    recipient_phone  text,
+    delivery_address text,
+    total_amount     numeric,
+    responsible_name text,
+    item_images      jsonb NOT NULL DEFAULT '[]'::jsonb,
+    created_at       timestamptz NOT NULL,
+    refreshed_at     timestamptz NOT NULL DEFAULT now()
+);
+
+-- Список: фильтр по статусу + keyset (created_at, id)
+CREATE INDEX IF NOT EXISTS order_list_rows_status_created_idx
+    ON order_list_rows (status, created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS order_list_rows_created_idx
+    ON order_list_rows (created_at DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS order_list_rows_bitrix_idx
+    ON order_list_rows (bitrix_order_id);
+
+-- Строки проекции заказов: колонки копируются из orders по именам (колонки, добавленные
+-- в обе таблицы миграциями 002-003, подхватываются без изменения функции), item_images -
+-- как core/order_list.build_item_images: первые 6 позиций, картинка каталога или по снимку
+CREATE OR REPLACE FUNCTION refresh_order_list_rows(order_ids uuid[])
+RETURNS integer
+LANGUAGE plpgsql AS $$
+DECLARE
+    refreshed integer;
+BEGIN
+    DELETE FROM order_list_rows WHERE id = ANY(order_ids);
+
+    INSERT INTO order_list_rows
+    SELECT (jsonb_populate_record(
+        NULL::order_list_rows,
+        to_jsonb(o) || jsonb_build_object(
+            'item_images', (
+                SELECT coalesce(jsonb_agg(i.image ORDER BY i.position), '[]'::jsonb)
+                FROM (
+                    SELECT row_number() OVER (ORDER BY oi.created_at, oi.id) AS position,
+                           coalesce(
+                               'https://cvety.kz' || nullif(p.metadata->'properties'->>'ru_img_miniature', ''),
+                               'https://cvety.kz/miniature/' || (oi.product_snapshot->'bitrix'->>'product_id') || '-obrannyy-buket.jpg'
+                           ) AS image
+                    FROM order_items oi
+                    LEFT JOIN products p ON p.id = oi.product_id
+                    WHERE oi.order_id = o.id
+                    ORDER BY oi.created_at, oi.id
+                    LIMIT 6
+                ) i
+                WHERE i.image IS NOT NULL
+            ),
+            'refreshed_at', now()
+        )
+    )).*
+    FROM orders o
+    WHERE o.id = ANY(order_ids);
+
+    GET DIAGNOSTICS refreshed = ROW_COUNT;
+    RETURN refreshed;
+END;
+$$;
+
+-- Триггеры уровня оператора: один пересчет на заказы, затронутые оператором
+-- (удаление заказа убирает строку через ON DELETE CASCADE)
+CREATE OR REPLACE FUNCTION refresh_order_list_rows_from_orders()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM refresh_order_list_rows(ARRAY(SELECT id FROM new_rows));
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION refresh_order_list_rows_from_items()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM refresh_order_list_rows(ARRAY(SELECT DISTINCT order_id FROM new_rows WHERE order_id IS NOT NULL));
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM refresh_order_list_rows(ARRAY(SELECT DISTINCT order_id FROM old_rows WHERE order_id IS NOT NULL));
+    ELSE
+        PERFORM refresh_order_list_rows(ARRAY(
+            SELECT order_id FROM new_rows WHERE order_id IS NOT NULL
+            UNION
+            SELECT order_id FROM old_rows WHERE order_id IS NOT NULL
+        ));
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS orders_order_list_insert ON orders;
+CREATE TRIGGER orders_order_list_insert
+    AFTER INSERT ON orders
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION refresh_order_list_rows_from_orders();
+
+DROP TRIGGER IF EXISTS orders_order_list_update ON orders;
+CREATE TRIGGER orders_order_list_update
+    AFTER UPDATE ON orders
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION refresh_order_list_rows_from_orders();
+
+DROP TRIGGER IF EXISTS order_items_order_list_insert ON order_items;
+CREATE TRIGGER order_items_order_list_insert
+    AFTER INSERT ON order_items
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION refresh_order_list_rows_from_items();
+
+DROP TRIGGER IF EXISTS order_items_order_list_update ON order_items;
+CREATE TRIGGER order_items_order_list_update
+    AFTER UPDATE ON order_items
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION refresh_order_list_rows_from_items();
+
+DROP TRIGGER IF EXISTS order_items_order_list_delete ON order_items;
+CREATE TRIGGER order_items_order_list_delete
+    AFTER DELETE ON order_items
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION refresh_order_list_rows_from_items();
+
+-- Заполнение проекции всеми заказами, включая исторические и синхронизированные из Bitrix
+SELECT refresh_order_list_rows(ARRAY(SELECT id FROM orders));
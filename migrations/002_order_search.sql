@@ -0,0 +1,48 @@
+-- Поиск заказов по получателю, телефону и адресу (core/search.py)
+-- recipient_phone_digits заполняет приложение (core.search.phone_digits при записи заказа),
+-- здесь - только заполнение существующих строк тем же правилом.
+-- name/address/digits ищутся через ilike/like '%...%', это покрывают GIN trigram индексы.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS recipient_phone_digits text;
+ALTER TABLE order_list_rows ADD COLUMN IF NOT EXISTS recipient_phone_digits text;
+
+-- Цифры телефона: 8XXXXXXXXXX -> 7XXXXXXXXXX, 10 цифр с 7 -> +код страны
+CREATE OR REPLACE FUNCTION normalize_phone_digits(phone text) RETURNS text
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE
+        WHEN length(d) = 11 AND d LIKE '8%' THEN '7' || substr(d, 2)
+        WHEN length(d) = 10 AND d LIKE '7%' THEN '7' || d
+        ELSE nullif(d, '')
+    END
+    FROM (SELECT regexp_replace(coalesce(phone, ''), '\D', '', 'g') AS d) digits
+$$;
+
+UPDATE orders
+SET recipient_phone_digits = normalize_phone_digits(recipient_phone)
+WHERE recipient_phone IS NOT NULL AND recipient_phone_digits IS NULL;
+
+UPDATE order_list_rows r
+SET recipient_phone_digits = o.recipient_phone_digits
+FROM orders o
+WHERE o.id = r.id AND r.recipient_phone_digits IS NULL;
+
+-- Список заказов читает order_list_rows (ORDER_LIST_PROJECTION), без проекции - orders
+CREATE INDEX IF NOT EXISTS order_list_rows_phone_digits_trgm_idx
+    ON order_list_rows USING gin (recipient_phone_digits gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS order_list_rows_recipient_name_trgm_idx
+    ON order_list_rows USING gin (recipient_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS order_list_rows_delivery_address_trgm_idx
+    ON order_list_rows USING gin (delivery_address gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS order_list_rows_order_number_trgm_idx
+    ON order_list_rows USING gin (order_number gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS orders_phone_digits_trgm_idx
+    ON orders USING gin (recipient_phone_digits gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS orders_recipient_name_trgm_idx
+    ON orders USING gin (recipient_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS orders_delivery_address_trgm_idx
+    ON orders USING gin (delivery_address gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS orders_order_number_trgm_idx
+    ON orders USING gin (order_number gin_trgm_ops);
@@ -0,0 +1,54 @@
+-- Производные колонки заказа (core/order_flags.py)
+-- Заполняются приложением при записи заказа (OptimizedTransformer, create_order);
+-- здесь - заполнение существующих строк теми же правилами и индексы для фильтра в SQL.
+
+ALTER TABLE orders
+    ADD COLUMN IF NOT EXISTS is_test boolean NOT NULL DEFAULT false,
+    ADD COLUMN IF NOT EXISTS payment_method_resolved text,
+    ADD COLUMN IF NOT EXISTS is_pickup boolean NOT NULL DEFAULT false;
+
+ALTER TABLE order_list_rows
+    ADD COLUMN IF NOT EXISTS is_test boolean NOT NULL DEFAULT false,
+    ADD COLUMN IF NOT EXISTS payment_method_resolved text,
+    ADD COLUMN IF NOT EXISTS is_pickup boolean NOT NULL DEFAULT false;
+
+UPDATE orders
+SET is_test = (
+        coalesce(bitrix_order_id::text LIKE '175691%', false)
+        OR lower(coalesce(recipient_name, '')) LIKE '%синхронизации%'
+        OR lower(coalesce(recipient_name, '')) LIKE '%reverse_sync%'
+    ),
+    is_pickup = (
+        trim(coalesce(delivery_address, '')) = 'Самовывоз'
+        -- Приводится к boolean только распознаваемое значение: '' и прочее приведение бы уронило
+        OR CASE
+            WHEN lower(metadata->>'pickup_order') ~ '^(true|false|t|f|0|1|y|n|yes|no)$'
+                THEN (metadata->>'pickup_order')::boolean
+            ELSE false
+        END
+    ),
+    payment_method_resolved = CASE
+        WHEN coalesce(metadata->'order_properties'->>'kaspiPhone', '') <> ''
+          OR coalesce(metadata->'order_properties'->>'CHECK_NUMBER', '') <> '' THEN 'kaspi'
+        WHEN lower(metadata->'order_properties'->>'METHOD_PAY') ~ '(cash|наличн)' THEN 'cash'
+        WHEN lower(metadata->'order_properties'->>'METHOD_PAY') ~ '(card|карт)' THEN 'card'
+        WHEN lower(metadata->'order_properties'->>'METHOD_PAY') ~ '(transfer|перевод)' THEN 'transfer'
+        ELSE 'unknown'
+    END
+WHERE payment_method_resolved IS NULL;
+
+UPDATE order_list_rows r
+SET is_test = o.is_test,
+    is_pickup = o.is_pickup,
+    payment_method_resolved = o.payment_method_resolved
+FROM orders o
+WHERE o.id = r.id;
+
+-- Активный список: статус + keyset (created_at, id) только по нетестовым заказам
+CREATE INDEX IF NOT EXISTS order_list_rows_active_idx
+    ON order_list_rows (status, created_at DESC, id DESC) WHERE NOT is_test;
+CREATE INDEX IF NOT EXISTS orders_active_idx
+    ON orders (status, created_at DESC, id DESC) WHERE NOT is_test;
+
+CREATE INDEX IF NOT EXISTS orders_payment_method_resolved_idx ON orders (payment_method_resolved);
+CREATE INDEX IF NOT EXISTS orders_is_pickup_idx ON orders (is_pickup) WHERE is_pickup;
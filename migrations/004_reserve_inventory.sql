@@ -0,0 +1,125 @@
+-- Атомарное резервирование склада под заказ (core/inventory.py)
+-- Вызывается через RPC одной транзакцией вместо цепочки select/update/insert из приложения:
+-- 1. блокирует строки products и flowers заказа (FOR UPDATE, всегда в порядке id -
+--    параллельные заказы ждут друг друга, а не проходят проверку одновременно);
+-- 2. при reserve проверяет остатки: цветы по составам, товары без состава по quantity;
+--    при нехватке ничего не меняет и возвращает {"success": false, "shortages": [...]};
+-- 3. списывает (reserve) или возвращает (release) количества и пишет движения
+--    flower_inventory_movements одним INSERT.
+--
+-- p_items: [{"product_id": "...", "quantity": 2}, ...]
+
+CREATE OR REPLACE FUNCTION reserve_inventory(p_items jsonb, p_operation text DEFAULT 'reserve')
+RETURNS jsonb
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_sign integer;
+    v_product_ids uuid[];
+    v_quantities integer[];
+    v_flower_ids uuid[];
+    v_needed integer[];
+    v_shortages jsonb;
+    v_updates jsonb;
+    v_flower_updates jsonb;
+BEGIN
+    IF p_operation NOT IN ('reserve', 'release') THEN
+        RAISE EXCEPTION 'Unknown inventory operation: %', p_operation;
+    END IF;
+    v_sign := CASE WHEN p_operation = 'reserve' THEN -1 ELSE 1 END;
+
+    -- Количества по товарам (одинаковые товары заказа складываются)
+    SELECT array_agg(product_id ORDER BY product_id), array_agg(quantity ORDER BY product_id)
+    INTO v_product_ids, v_quantities
+    FROM (
+        SELECT (item->>'product_id')::uuid AS product_id,
+               sum(coalesce((item->>'quantity')::integer, 1))::integer AS quantity
+        FROM jsonb_array_elements(coalesce(p_items, '[]'::jsonb)) AS item
+        WHERE coalesce(item->>'product_id', '') <> ''
+        GROUP BY 1
+    ) order_products;
+
+    IF v_product_ids IS NULL THEN
+        RETURN jsonb_build_object('success', true, 'updates', '[]'::jsonb, 'flower_updates', '[]'::jsonb);
+    END IF;
+
+    PERFORM 1 FROM products WHERE id = ANY(v_product_ids) ORDER BY id FOR UPDATE;
+
+    -- Потребность в цветах по составам товаров
+    SELECT array_agg(flower_id ORDER BY flower_id), array_agg(needed ORDER BY flower_id)
+    INTO v_flower_ids, v_needed
+    FROM (
+        SELECT pc.flower_id, sum(pc.amount * op.quantity)::integer AS needed
+        FROM unnest(v_product_ids, v_quantities) AS op(product_id, quantity)
+        JOIN product_composition pc ON pc.product_id = op.product_id
+        GROUP BY pc.flower_id
+    ) flower_needs;
+
+    PERFORM 1 FROM flowers WHERE id = ANY(coalesce(v_flower_ids, '{}')) ORDER BY id FOR UPDATE;
+
+    IF p_operation = 'reserve' THEN
+        SELECT coalesce(jsonb_agg(to_jsonb(s)), '[]'::jsonb) INTO v_shortages
+        FROM (
+            SELECT 'flower' AS kind, fn.flower_id AS id, f.name, fn.needed,
+                   coalesce(f.quantity, 0) AS available, fn.needed - coalesce(f.quantity, 0) AS shortage
+            FROM unnest(coalesce(v_flower_ids, '{}'), coalesce(v_needed, '{}')) AS fn(flower_id, needed)
+            LEFT JOIN flowers f ON f.id = fn.flower_id
+            WHERE coalesce(f.quantity, 0) < fn.needed
+            UNION ALL
+            -- Товары без состава проверяются по своему quantity; отсутствующий товар - name = null
+            SELECT 'product', op.product_id, p.name, op.quantity,
+                   coalesce(p.quantity, 0), op.quantity - coalesce(p.quantity, 0)
+            FROM unnest(v_product_ids, v_quantities) AS op(product_id, quantity)
+            LEFT JOIN products p ON p.id = op.product_id
+            WHERE p.id IS NULL
+               OR (coalesce(p.quantity, 0) < op.quantity
+                   AND NOT EXISTS (SELECT 1 FROM product_composition pc WHERE pc.product_id = op.product_id))
+        ) s;
+
+        IF jsonb_array_length(v_shortages) > 0 THEN
+            RETURN jsonb_build_object('success', false, 'shortages', v_shortages);
+        END IF;
+    END IF;
+
+    -- Товары без состава: количество товара; товары с составом списываются цветами
+    WITH changed AS (
+        UPDATE products p
+        SET quantity = p.quantity + v_sign * op.quantity, updated_at = now()
+        FROM unnest(v_product_ids, v_quantities) AS op(product_id, quantity)
+        WHERE p.id = op.product_id
+          AND NOT EXISTS (SELECT 1 FROM product_composition pc WHERE pc.product_id = op.product_id)
+        RETURNING p.id, p.name, p.quantity AS new_quantity, v_sign * op.quantity AS change_quantity
+    )
+    SELECT coalesce(jsonb_agg(jsonb_build_object(
+        'product_id', id, 'product_name', name,
+        'old_quantity', new_quantity - change_quantity, 'new_quantity', new_quantity,
+        'change_quantity', change_quantity
+    )), '[]'::jsonb) INTO v_updates
+    FROM changed;
+
+    WITH changed AS (
+        UPDATE flowers f
+        SET quantity = f.quantity + v_sign * fn.needed, updated_at = now()
+        FROM unnest(coalesce(v_flower_ids, '{}'), coalesce(v_needed, '{}')) AS fn(flower_id, needed)
+        WHERE f.id = fn.flower_id
+        RETURNING f.id, f.name, f.quantity AS new_quantity, fn.needed
+    ), movements AS (
+        INSERT INTO flower_inventory_movements (flower_id, movement_type, quantity, reason, note, created_by)
+        SELECT id,
+               CASE WHEN p_operation = 'reserve' THEN 'order_usage' ELSE 'delivery' END,
+               needed,
+               CASE WHEN p_operation = 'reserve' THEN 'Used in order (Product composition)'
+                    ELSE 'Order cancelled/refunded (restored)' END,
+               'Product composition × order quantity',
+               'Order System'
+        FROM changed
+    )
+    SELECT coalesce(jsonb_agg(jsonb_build_object(
+        'flower_id', id, 'flower_name', name,
+        'old_quantity', new_quantity - v_sign * needed, 'new_quantity', new_quantity,
+        'quantity', needed
+    )), '[]'::jsonb) INTO v_flower_updates
+    FROM changed;
+
+    RETURN jsonb_build_object('success', true, 'updates', v_updates, 'flower_updates', v_flower_updates);
+END;
+$$;
@@ -0,0 +1,403 @@
+-- Журнал движений склада с периодическими снимками (core/ledger.py)
+-- flowers.quantity и products.quantity остаются текущим остатком (running balance,
+-- чтение за O(1)), но меняются только вместе со строкой append-only журнала stock_ledger:
+-- record_stock_movements блокирует строки, считает новый остаток, обновляет quantity
+-- и дописывает журнал (delta + balance после движения) одной транзакцией.
+-- stock_snapshots - периодические снимки (take_stock_snapshot, stock_snapshot.py по cron):
+-- остаток на момент T = снимок до T + сумма delta журнала после него.
+-- verify_stock_ledger пересчитывает остатки по снимку и журналу одним запросом и
+-- возвращает расхождения с quantity (запись в обход журнала) и с balance журнала.
+-- reserve_inventory (004) пересоздается: списания заказов тоже идут через журнал.
+
+CREATE TABLE IF NOT EXISTS stock_ledger (
+    id bigserial PRIMARY KEY,
+    item_type text NOT NULL CHECK (item_type IN ('flower', 'product')),
+    item_id uuid NOT NULL,
+    item_name text,
+    delta integer NOT NULL,
+    -- Остаток после движения; null - история, перенесенная из старых таблиц движений
+    balance integer,
+    movement_type text NOT NULL,
+    reason text,
+    note text,
+    delivery_date text,
+    created_by text,
+    created_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS stock_ledger_item_idx ON stock_ledger (item_type, item_id, id);
+CREATE INDEX IF NOT EXISTS stock_ledger_history_idx ON stock_ledger (item_type, created_at DESC, id DESC);
+
+CREATE OR REPLACE FUNCTION stock_ledger_append_only()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    RAISE EXCEPTION 'stock_ledger is append-only, record a compensating movement instead';
+END;
+$$;
+
+DROP TRIGGER IF EXISTS stock_ledger_append_only ON stock_ledger;
+CREATE TRIGGER stock_ledger_append_only
+    BEFORE UPDATE OR DELETE ON stock_ledger
+    FOR EACH ROW EXECUTE FUNCTION stock_ledger_append_only();
+
+-- Снимок = все позиции склада на строке журнала ledger_id (включительно)
+CREATE TABLE IF NOT EXISTS stock_snapshots (
+    ledger_id bigint NOT NULL,
+    item_type text NOT NULL,
+    item_id uuid NOT NULL,
+    quantity integer NOT NULL,
+    taken_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (ledger_id, item_type, item_id)
+);
+
+CREATE INDEX IF NOT EXISTS stock_snapshots_taken_idx ON stock_snapshots (taken_at DESC);
+
+-- ==================== ПЕРЕНОС ИСТОРИИ И НАЧАЛЬНЫЙ СНИМОК ====================
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM stock_snapshots) THEN
+        INSERT INTO stock_ledger (item_type, item_id, item_name, delta, balance, movement_type,
+                                  reason, note, delivery_date, created_by, created_at)
+        SELECT 'flower', m.flower_id, f.name,
+               CASE WHEN m.movement_type IN ('writeoff', 'order_usage') THEN -abs(m.quantity) ELSE abs(m.quantity) END,
+               NULL, m.movement_type, m.reason, m.note, m.delivery_date::text, m.created_by, m.created_at
+        FROM flower_inventory_movements m
+        LEFT JOIN flowers f ON f.id = m.flower_id
+        ORDER BY m.created_at, m.id;
+
+        INSERT INTO stock_ledger (item_type, item_id, item_name, delta, balance, movement_type,
+                                  note, delivery_date, created_at)
+        SELECT 'product', m.product_id, p.name, m.quantity, NULL, coalesce(m.reason, 'adjustment'),
+               m.note, m.delivery_date::text, m.created_at
+        FROM inventory_movements m
+        LEFT JOIN products p ON p.id = m.product_id
+        ORDER BY m.created_at, m.id;
+
+        -- Перенесенная история закрыта снимком текущих остатков
+        INSERT INTO stock_snapshots (ledger_id, item_type, item_id, quantity)
+        SELECT (SELECT coalesce(max(id), 0) FROM stock_ledger), 'flower', id, coalesce(quantity, 0) FROM flowers
+        UNION ALL
+        SELECT (SELECT coalesce(max(id), 0) FROM stock_ledger), 'product', id, coalesce(quantity, 0) FROM products;
+    END IF;
+END;
+$$;
+
+-- ==================== ЗАПИСЬ ДВИЖЕНИЙ ====================
+-- p_entries: [{"item_type": "flower", "item_id": "...", "delta": -3 | "count": 12,
+--              "movement_type": "writeoff", "reason", "note", "delivery_date", "created_by",
+--              "guard": true}, ...]
+-- count - пересчет (новый остаток), guard - отказ, если остаток уйдет в минус.
+-- Движения с нулевым delta в журнал не пишутся.
+-- Returns {"success": true, "items": [{item_type, item_id, item_name, old_quantity, new_quantity}],
+--          "movements": [строки stock_ledger]} или {"success": false, "missing", "shortages"}
+
+CREATE OR REPLACE FUNCTION record_stock_movements(p_entries jsonb)
+RETURNS jsonb
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_entry jsonb;
+    v_key text;
+    v_item jsonb;
+    v_items jsonb := '{}'::jsonb;
+    v_old integer;
+    v_delta integer;
+    v_new integer;
+    v_planned jsonb := '[]'::jsonb;
+    v_missing jsonb := '[]'::jsonb;
+    v_shortages jsonb := '[]'::jsonb;
+    v_movements jsonb;
+BEGIN
+    -- Порядок блокировок как в reserve_inventory: товары, затем цветы, по id
+    PERFORM 1 FROM products WHERE id IN (
+        SELECT (entry->>'item_id')::uuid FROM jsonb_array_elements(coalesce(p_entries, '[]'::jsonb)) AS entry
+        WHERE entry->>'item_type' = 'product'
+    ) ORDER BY id FOR UPDATE;
+    PERFORM 1 FROM flowers WHERE id IN (
+        SELECT (entry->>'item_id')::uuid FROM jsonb_array_elements(coalesce(p_entries, '[]'::jsonb)) AS entry
+        WHERE entry->>'item_type' = 'flower'
+    ) ORDER BY id FOR UPDATE;
+
+    FOR v_entry IN SELECT value FROM jsonb_array_elements(coalesce(p_entries, '[]'::jsonb)) LOOP
+        v_key := (v_entry->>'item_type') || ':' || (v_entry->>'item_id');
+        v_item := v_items->v_key;
+        IF v_item IS NULL THEN
+            IF v_entry->>'item_type' = 'flower' THEN
+                SELECT jsonb_build_object('item_type', 'flower', 'item_id', id, 'item_name', name,
+                                          'old_quantity', coalesce(quantity, 0), 'new_quantity', coalesce(quantity, 0))
+                INTO v_item FROM flowers WHERE id = (v_entry->>'item_id')::uuid;
+            ELSIF v_entry->>'item_type' = 'product' THEN
+                SELECT jsonb_build_object('item_type', 'product', 'item_id', id, 'item_name', name,
+                                          'old_quantity', coalesce(quantity, 0), 'new_quantity', coalesce(quantity, 0))
+                INTO v_item FROM products WHERE id = (v_entry->>'item_id')::uuid;
+            ELSE
+                RAISE EXCEPTION 'Unknown stock item type: %', v_entry->>'item_type';
+            END IF;
+            IF v_item IS NULL THEN
+                v_missing := v_missing || jsonb_build_array(
+                    jsonb_build_object('kind', v_entry->>'item_type', 'id', v_entry->>'item_id'));
+                CONTINUE;
+            END IF;
+        END IF;
+
+        v_old := (v_item->>'new_quantity')::integer;
+        IF v_entry ? 'count' THEN
+            v_new := (v_entry->>'count')::integer;
+            v_delta := v_new - v_old;
+        ELSE
+            v_delta := coalesce((v_entry->>'delta')::integer, 0);
+            v_new := v_old + v_delta;
+        END IF;
+
+        IF coalesce((v_entry->>'guard')::boolean, false) AND v_new < 0 THEN
+            v_shortages := v_shortages || jsonb_build_array(jsonb_build_object(
+                'kind', v_entry->>'item_type', 'id', v_entry->>'item_id', 'name', v_item->>'item_name',
+                'needed', -v_delta, 'available', v_old, 'shortage', -v_new));
+        END IF;
+
+        v_items := v_items || jsonb_build_object(v_key, v_item || jsonb_build_object('new_quantity', v_new));
+        IF v_delta <> 0 THEN
+            v_planned := v_planned || jsonb_build_array(v_entry || jsonb_build_object(
+                'item_name', v_item->>'item_name', 'delta', v_delta, 'balance', v_new));
+        END IF;
+    END LOOP;
+
+    IF jsonb_array_length(v_missing) > 0 OR jsonb_array_length(v_shortages) > 0 THEN
+        RETURN jsonb_build_object('success', false, 'missing', v_missing, 'shortages', v_shortages);
+    END IF;
+
+    UPDATE products p
+    SET quantity = (item.value->>'new_quantity')::integer, updated_at = now()
+    FROM jsonb_each(v_items) AS item
+    WHERE item.value->>'item_type' = 'product'
+      AND p.id = (item.value->>'item_id')::uuid
+      AND (item.value->>'new_quantity')::integer <> (item.value->>'old_quantity')::integer;
+
+    UPDATE flowers f
+    SET quantity = (item.value->>'new_quantity')::integer, updated_at = now()
+    FROM jsonb_each(v_items) AS item
+    WHERE item.value->>'item_type' = 'flower'
+      AND f.id = (item.value->>'item_id')::uuid
+      AND (item.value->>'new_quantity')::integer <> (item.value->>'old_quantity')::integer;
+
+    WITH inserted AS (
+        INSERT INTO stock_ledger (item_type, item_id, item_name, delta, balance, movement_type,
+                                  reason, note, delivery_date, created_by)
+        SELECT entry->>'item_type', (entry->>'item_id')::uuid, entry->>'item_name',
+               (entry->>'delta')::integer, (entry->>'balance')::integer,
+               coalesce(entry->>'movement_type', 'adjustment'), entry->>'reason', entry->>'note',
+               entry->>'delivery_date', coalesce(entry->>'created_by', 'CRM System')
+        FROM jsonb_array_elements(v_planned) WITH ORDINALITY AS planned(entry, position)
+        ORDER BY position
+        RETURNING *
+    )
+    SELECT coalesce(jsonb_agg(to_jsonb(inserted) ORDER BY id), '[]'::jsonb) INTO v_movements FROM inserted;
+
+    RETURN jsonb_build_object(
+        'success', true,
+        'items', (SELECT coalesce(jsonb_agg(value), '[]'::jsonb) FROM jsonb_each(v_items)),
+        'movements', v_movements
+    );
+END;
+$$;
+
+-- ==================== СНИМКИ И ПРОВЕРКА ====================
+
+-- Остатки по журналу на строке p_ledger_id: последний снимок до нее + delta после снимка
+CREATE OR REPLACE FUNCTION stock_balances_at(p_ledger_id bigint)
+RETURNS TABLE (item_type text, item_id uuid, quantity integer)
+LANGUAGE sql STABLE AS $$
+    WITH base AS (
+        SELECT max(ledger_id) AS ledger_id FROM stock_snapshots WHERE ledger_id <= p_ledger_id
+    ), snapshot AS (
+        SELECT s.item_type, s.item_id, s.quantity
+        FROM stock_snapshots s, base
+        WHERE s.ledger_id = base.ledger_id
+    ), moved AS (
+        SELECT l.item_type, l.item_id, sum(l.delta)::integer AS delta
+        FROM stock_ledger l, base
+        WHERE l.id > coalesce(base.ledger_id, 0) AND l.id <= p_ledger_id AND l.balance IS NOT NULL
+        GROUP BY l.item_type, l.item_id
+    )
+    SELECT coalesce(s.item_type, m.item_type), coalesce(s.item_id, m.item_id),
+           coalesce(s.quantity, 0) + coalesce(m.delta, 0)
+    FROM snapshot s
+    FULL JOIN moved m ON m.item_type = s.item_type AND m.item_id = s.item_id
+$$;
+
+-- Новый снимок, если после последнего были движения. Returns {"ledger_id", "items"}
+CREATE OR REPLACE FUNCTION take_stock_snapshot()
+RETURNS jsonb
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_ledger_id bigint;
+    v_items integer;
+BEGIN
+    -- Ждем текущие записи журнала и не пускаем новые до конца снимка
+    LOCK TABLE stock_ledger IN SHARE MODE;
+    SELECT coalesce(max(id), 0) INTO v_ledger_id FROM stock_ledger;
+
+    IF EXISTS (SELECT 1 FROM stock_snapshots WHERE ledger_id >= v_ledger_id) THEN
+        RETURN jsonb_build_object('ledger_id', v_ledger_id, 'items', 0);
+    END IF;
+
+    INSERT INTO stock_snapshots (ledger_id, item_type, item_id, quantity)
+    SELECT v_ledger_id, b.item_type, b.item_id, b.quantity
+    FROM stock_balances_at(v_ledger_id) b
+    WHERE EXISTS (SELECT 1 FROM flowers f WHERE b.item_type = 'flower' AND f.id = b.item_id)
+       OR EXISTS (SELECT 1 FROM products p WHERE b.item_type = 'product' AND p.id = b.item_id);
+    GET DIAGNOSTICS v_items = ROW_COUNT;
+
+    RETURN jsonb_build_object('ledger_id', v_ledger_id, 'items', v_items);
+END;
+$$;
+
+-- Расхождения: остаток по снимку и журналу (expected) против quantity и balance журнала
+CREATE OR REPLACE FUNCTION verify_stock_ledger()
+RETURNS TABLE (item_type text, item_id uuid, item_name text, expected integer, ledger_balance integer, quantity integer)
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_ledger_id bigint;
+    v_snapshot_id bigint;
+BEGIN
+    LOCK TABLE stock_ledger IN SHARE MODE;
+    SELECT coalesce(max(id), 0) INTO v_ledger_id FROM stock_ledger;
+    SELECT coalesce(max(ledger_id), 0) INTO v_snapshot_id FROM stock_snapshots;
+
+    RETURN QUERY
+    WITH expected AS (
+        SELECT * FROM stock_balances_at(v_ledger_id)
+    ), last_balance AS (
+        SELECT DISTINCT ON (l.item_type, l.item_id) l.item_type, l.item_id, l.balance
+        FROM stock_ledger l
+        WHERE l.id > v_snapshot_id AND l.balance IS NOT NULL
+        ORDER BY l.item_type, l.item_id, l.id DESC
+    ), counters AS (
+        SELECT 'flower'::text AS item_type, f.id AS item_id, f.name AS item_name, coalesce(f.quantity, 0) AS quantity FROM flowers f
+        UNION ALL
+        SELECT 'product', p.id, p.name, coalesce(p.quantity, 0) FROM products p
+    )
+    SELECT c.item_type, c.item_id, c.item_name, coalesce(e.quantity, 0), lb.balance, c.quantity
+    FROM counters c
+    LEFT JOIN expected e ON e.item_type = c.item_type AND e.item_id = c.item_id
+    LEFT JOIN last_balance lb ON lb.item_type = c.item_type AND lb.item_id = c.item_id
+    WHERE coalesce(e.quantity, 0) <> c.quantity
+       OR (lb.balance IS NOT NULL AND lb.balance <> c.quantity);
+END;
+$$;
+
+-- ==================== РЕЗЕРВИРОВАНИЕ ЧЕРЕЗ ЖУРНАЛ ====================
+-- Та же проверка остатков, что в 004; изменения пишет record_stock_movements
+
+CREATE OR REPLACE FUNCTION reserve_inventory(p_items jsonb, p_operation text DEFAULT 'reserve')
+RETURNS jsonb
+LANGUAGE plpgsql AS $$
+DECLARE
+    v_sign integer;
+    v_product_ids uuid[];
+    v_quantities integer[];
+    v_flower_ids uuid[];
+    v_needed integer[];
+    v_shortages jsonb;
+    v_entries jsonb;
+    v_recorded jsonb;
+    v_updates jsonb;
+    v_flower_updates jsonb;
+BEGIN
+    IF p_operation NOT IN ('reserve', 'release') THEN
+        RAISE EXCEPTION 'Unknown inventory operation: %', p_operation;
+    END IF;
+    v_sign := CASE WHEN p_operation = 'reserve' THEN -1 ELSE 1 END;
+
+    SELECT array_agg(product_id ORDER BY product_id), array_agg(quantity ORDER BY product_id)
+    INTO v_product_ids, v_quantities
+    FROM (
+        SELECT (item->>'product_id')::uuid AS product_id,
+               sum(coalesce((item->>'quantity')::integer, 1))::integer AS quantity
+        FROM jsonb_array_elements(coalesce(p_items, '[]'::jsonb)) AS item
+        WHERE coalesce(item->>'product_id', '') <> ''
+        GROUP BY 1
+    ) order_products;
+
+    IF v_product_ids IS NULL THEN
+        RETURN jsonb_build_object('success', true, 'updates', '[]'::jsonb, 'flower_updates', '[]'::jsonb);
+    END IF;
+
+    PERFORM 1 FROM products WHERE id = ANY(v_product_ids) ORDER BY id FOR UPDATE;
+
+    SELECT array_agg(flower_id ORDER BY flower_id), array_agg(needed ORDER BY flower_id)
+    INTO v_flower_ids, v_needed
+    FROM (
+        SELECT pc.flower_id, sum(pc.amount * op.quantity)::integer AS needed
+        FROM unnest(v_product_ids, v_quantities) AS op(product_id, quantity)
+        JOIN product_composition pc ON pc.product_id = op.product_id
+        GROUP BY pc.flower_id
+    ) flower_needs;
+
+    PERFORM 1 FROM flowers WHERE id = ANY(coalesce(v_flower_ids, '{}')) ORDER BY id FOR UPDATE;
+
+    IF p_operation = 'reserve' THEN
+        SELECT coalesce(jsonb_agg(to_jsonb(s)), '[]'::jsonb) INTO v_shortages
+        FROM (
+            SELECT 'flower' AS kind, fn.flower_id AS id, f.name, fn.needed,
+                   coalesce(f.quantity, 0) AS available, fn.needed - coalesce(f.quantity, 0) AS shortage
+            FROM unnest(coalesce(v_flower_ids, '{}'), coalesce(v_needed, '{}')) AS fn(flower_id, needed)
+            LEFT JOIN flowers f ON f.id = fn.flower_id
+            WHERE coalesce(f.quantity, 0) < fn.needed
+            UNION ALL
+            SELECT 'product', op.product_id, p.name, op.quantity,
+                   coalesce(p.quantity, 0), op.quantity - coalesce(p.quantity, 0)
+            FROM unnest(v_product_ids, v_quantities) AS op(product_id, quantity)
+            LEFT JOIN products p ON p.id = op.product_id
+            WHERE p.id IS NULL
+               OR (coalesce(p.quantity, 0) < op.quantity
+                   AND NOT EXISTS (SELECT 1 FROM product_composition pc WHERE pc.product_id = op.product_id))
+        ) s;
+
+        IF jsonb_array_length(v_shortages) > 0 THEN
+            RETURN jsonb_build_object('success', false, 'shortages', v_shortages);
+        END IF;
+    END IF;
+
+    SELECT coalesce(jsonb_agg(entry), '[]'::jsonb) INTO v_entries
+    FROM (
+        -- Товары без состава - своим количеством, товары с составом - цветами
+        SELECT jsonb_build_object('item_type', 'product', 'item_id', op.product_id, 'delta', v_sign * op.quantity) AS entry
+        FROM unnest(v_product_ids, v_quantities) AS op(product_id, quantity)
+        JOIN products p ON p.id = op.product_id
+        WHERE NOT EXISTS (SELECT 1 FROM product_composition pc WHERE pc.product_id = op.product_id)
+        UNION ALL
+        SELECT jsonb_build_object('item_type', 'flower', 'item_id', fn.flower_id, 'delta', v_sign * fn.needed,
+                                  'note', 'Product composition × order quantity')
+        FROM unnest(coalesce(v_flower_ids, '{}'), coalesce(v_needed, '{}')) AS fn(flower_id, needed)
+        JOIN flowers f ON f.id = fn.flower_id
+    ) entries;
+
+    SELECT coalesce(jsonb_agg(entry || jsonb_build_object(
+        'movement_type', CASE WHEN p_operation = 'reserve' THEN 'order_usage' ELSE 'delivery' END,
+        'reason', CASE WHEN p_operation = 'reserve' THEN 'Used in order (Product composition)'
+                       ELSE 'Order cancelled/refunded (restored)' END,
+        'created_by', 'Order System'
+    )), '[]'::jsonb) INTO v_entries
+    FROM jsonb_array_elements(v_entries) AS entry;
+
+    v_recorded := record_stock_movements(v_entries);
+
+    SELECT
+        coalesce(jsonb_agg(jsonb_build_object(
+            'product_id', item->>'item_id', 'product_name', item->>'item_name',
+            'old_quantity', (item->>'old_quantity')::integer, 'new_quantity', (item->>'new_quantity')::integer,
+            'change_quantity', (item->>'new_quantity')::integer - (item->>'old_quantity')::integer
+        )) FILTER (WHERE item->>'item_type' = 'product'), '[]'::jsonb),
+        coalesce(jsonb_agg(jsonb_build_object(
+            'flower_id', item->>'item_id', 'flower_name', item->>'item_name',
+            'old_quantity', (item->>'old_quantity')::integer, 'new_quantity', (item->>'new_quantity')::integer,
+            'quantity', abs((item->>'new_quantity')::integer - (item->>'old_quantity')::integer)
+        )) FILTER (WHERE item->>'item_type' = 'flower'), '[]'::jsonb)
+    INTO v_updates, v_flower_updates
+    FROM jsonb_array_elements(v_recorded->'items') AS item;
+
+    RETURN jsonb_build_object('success', true, 'updates', v_updates, 'flower_updates', v_flower_updates);
+END;
+$$;
@@ -0,0 +1,111 @@
+-- Счетчики товаров продавца (core/seller_counts.py)
+-- sellers.product_count и active_product_count вместо "Товаров: N" в sellers.description.
+-- Поддерживаются триггерами на products при вставке, удалении, активации, деактивации и
+-- смене продавца: один UPDATE sellers на оператор (переходные таблицы, GROUP BY по
+-- продавцам), поэтому массовая деактивация не пишет продавца на каждую строку.
+-- Пересчет с нуля одним GROUP BY - rebuild_seller_product_counts()
+-- (python update_seller_product_counts.py), он же выполняется в конце миграции.
+
+ALTER TABLE sellers
+    ADD COLUMN IF NOT EXISTS product_count integer NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS active_product_count integer NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS products_seller_id_idx ON products (seller_id);
+
+-- Изменения счетчиков по продавцам: -1 за каждую старую строку, +1 за каждую новую
+CREATE OR REPLACE FUNCTION apply_seller_product_counts()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE sellers s
+        SET product_count = s.product_count + d.products,
+            active_product_count = s.active_product_count + d.active
+        FROM (
+            SELECT seller_id, count(*)::integer AS products,
+                   (count(*) FILTER (WHERE is_active))::integer AS active
+            FROM new_rows
+            WHERE seller_id IS NOT NULL
+            GROUP BY seller_id
+        ) d
+        WHERE s.id = d.seller_id;
+    ELSIF TG_OP = 'DELETE' THEN
+        UPDATE sellers s
+        SET product_count = s.product_count - d.products,
+            active_product_count = s.active_product_count - d.active
+        FROM (
+            SELECT seller_id, count(*)::integer AS products,
+                   (count(*) FILTER (WHERE is_active))::integer AS active
+            FROM old_rows
+            WHERE seller_id IS NOT NULL
+            GROUP BY seller_id
+        ) d
+        WHERE s.id = d.seller_id;
+    ELSE
+        UPDATE sellers s
+        SET product_count = s.product_count + d.products,
+            active_product_count = s.active_product_count + d.active
+        FROM (
+            SELECT seller_id, sum(products)::integer AS products, sum(active)::integer AS active
+            FROM (
+                SELECT seller_id, -1 AS products, -(is_active IS TRUE)::integer AS active FROM old_rows
+                UNION ALL
+                SELECT seller_id, 1, (is_active IS TRUE)::integer FROM new_rows
+            ) changes
+            WHERE seller_id IS NOT NULL
+            GROUP BY seller_id
+            HAVING sum(products) <> 0 OR sum(active) <> 0
+        ) d
+        WHERE s.id = d.seller_id;
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS products_seller_counts_insert ON products;
+CREATE TRIGGER products_seller_counts_insert
+    AFTER INSERT ON products
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_seller_product_counts();
+
+DROP TRIGGER IF EXISTS products_seller_counts_update ON products;
+CREATE TRIGGER products_seller_counts_update
+    AFTER UPDATE ON products
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_seller_product_counts();
+
+DROP TRIGGER IF EXISTS products_seller_counts_delete ON products;
+CREATE TRIGGER products_seller_counts_delete
+    AFTER DELETE ON products
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION apply_seller_product_counts();
+
+-- Пересчет всех продавцов одним GROUP BY; возвращает число исправленных строк
+CREATE OR REPLACE FUNCTION rebuild_seller_product_counts()
+RETURNS integer
+LANGUAGE sql AS $$
+    WITH counts AS (
+        SELECT s.id,
+               count(p.id)::integer AS products,
+               (count(p.id) FILTER (WHERE p.is_active))::integer AS active
+        FROM sellers s
+        LEFT JOIN products p ON p.seller_id = s.id
+        GROUP BY s.id
+    ), changed AS (
+        UPDATE sellers s
+        SET product_count = c.products,
+            active_product_count = c.active
+        FROM counts c
+        WHERE s.id = c.id
+          AND (s.product_count, s.active_product_count) IS DISTINCT FROM (c.products, c.active)
+        RETURNING s.id
+    )
+    SELECT count(*)::integer FROM changed;
+$$;
+
+SELECT rebuild_seller_product_counts();
+
+-- Количество больше не хранится в описании
+UPDATE sellers
+SET description = nullif(regexp_replace(description, '(\s*\|\s*)?Товаров: \d+', ''), '')
+WHERE description LIKE '%Товаров:%';
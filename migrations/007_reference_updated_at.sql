@@ -0,0 +1,36 @@
+-- updated_at справочных таблиц для локальной реплики (core/replica.py)
+-- Реплика догоняет flowers, products, product_composition и sellers по updated_at, поэтому
+-- колонка выставляется триггером при любом UPDATE - в том числе в webhook'ах, скриптах
+-- синхронизации, функциях склада (004-005) и счетчиках продавцов (006), а не только там,
+-- где ее передает приложение. Индекс (updated_at, id) - для догоняющей выборки по порядку.
+-- Удаления по updated_at не видны: реплика сверяет id после удалений и периодически
+-- перезагружает таблицы целиком.
+
+ALTER TABLE flowers ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+ALTER TABLE products ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+ALTER TABLE product_composition ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+ALTER TABLE sellers ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+
+CREATE OR REPLACE FUNCTION touch_updated_at()
+RETURNS trigger
+LANGUAGE plpgsql AS $$
+BEGIN
+    NEW.updated_at = now();
+    RETURN NEW;
+END;
+$$;
+
+DO $$
+DECLARE
+    t text;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['flowers', 'products', 'product_composition', 'sellers'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', t || '_touch_updated_at', t);
+        EXECUTE format(
+            'CREATE TRIGGER %I BEFORE UPDATE ON %I FOR EACH ROW EXECUTE FUNCTION touch_updated_at()',
+            t || '_touch_updated_at', t
+        );
+        EXECUTE format('CREATE INDEX IF NOT EXISTS %I ON %I (updated_at, id)', t || '_updated_at_id_idx', t);
+    END LOOP;
+END;
+$$;
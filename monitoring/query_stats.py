@@ -0,0 +1,335 @@
+"""
+Инструментация запросов к базам данных
+Для каждого запроса фиксируются таблица, фильтры, число строк и время выполнения
+(AsyncSupabase, синхронный supabase Client через хуки httpx, курсор MySQL):
+- сводка по HTTP запросу (заголовок Server-Timing, см. middleware в app.py)
+- выборочный лог медленных запросов выше порога
+- агрегаты по процессу для /api/query-stats и бенчмарков
+"""
+
+import logging
+import random
+import re
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from config import config
+
+logger = logging.getLogger(__name__)
+
+# Операции построителя, которые являются фильтрами (а не select/order/range)
+FILTER_OPS = {
+    'eq', 'neq', 'gt', 'gte', 'lt', 'lte', 'like', 'ilike', 'is_', 'in_',
+    'contains', 'contained_by', 'or_', 'filter', 'match', 'text_search', 'match_any'
+}
+
+# Параметры PostgREST, которые не являются фильтрами
+_REST_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+_REST_VERBS = {'GET': 'select', 'HEAD': 'select', 'POST': 'insert', 'PATCH': 'update', 'DELETE': 'delete'}
+
+_SQL_TABLE_RE = re.compile(r'\b(?:FROM|INTO|UPDATE|JOIN)\s+`?(\w+)`?', re.IGNORECASE)
+_SQL_VERB_RE = re.compile(r'^\s*(\w+)')
+
+
+@dataclass
+class QueryRecord:
+    """Один выполненный запрос"""
+    source: str
+    table: str
+    verb: str
+    filters: List[str]
+    rows: int
+    duration_ms: float
+    error: Optional[str] = None
+
+    def describe(self) -> str:
+        filters = ', '.join(self.filters) if self.filters else '-'
+        return f"{self.source} {self.verb} {self.table} [{filters}] rows={self.rows} {self.duration_ms:.1f}ms"
+
+
+@dataclass
+class RequestQueryStats:
+    """Запросы одного HTTP запроса"""
+    started_at: float = field(default_factory=time.perf_counter)
+    records: List[QueryRecord] = field(default_factory=list)
+
+    @property
+    def count(self) -> int:
+        return len(self.records)
+
+    @property
+    def total_ms(self) -> float:
+        return sum(record.duration_ms for record in self.records)
+
+    def summary(self) -> Dict[str, Any]:
+        slowest = max(self.records, key=lambda r: r.duration_ms) if self.records else None
+        by_table: Dict[str, int] = {}
+        for record in self.records:
+            by_table[record.table] = by_table.get(record.table, 0) + 1
+        return {
+            'queries': self.count,
+            'db_ms': round(self.total_ms, 1),
+            'by_table': by_table,
+            'slowest': slowest.describe() if slowest else None
+        }
+
+    def server_timing(self, loader_hits: int = 0) -> str:
+        """Значение заголовка Server-Timing"""
+        app_ms = (time.perf_counter() - self.started_at) * 1000
+        return (
+            f'db;dur={self.total_ms:.1f};desc="{self.count} queries", '
+            f'loader;desc="{loader_hits} cached lookups", '
+            f'app;dur={app_ms:.1f}'
+        )
+
+
+class QueryStatsAggregator:
+    """Агрегированная статистика по процессу: (source, verb, table) -> count/total/max"""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self.slow_queries = 0
+
+    def add(self, record: QueryRecord):
+        key = f"{record.source}:{record.verb}:{record.table}"
+        entry = self._stats.setdefault(key, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0, 'errors': 0})
+        entry['count'] += 1
+        entry['total_ms'] += record.duration_ms
+        entry['max_ms'] = max(entry['max_ms'], record.duration_ms)
+        entry['rows'] += record.rows
+        if record.error:
+            entry['errors'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        queries = {
+            key: {
+                **entry,
+                'total_ms': round(entry['total_ms'], 1),
+                'max_ms': round(entry['max_ms'], 1),
+                'avg_ms': round(entry['total_ms'] / entry['count'], 1) if entry['count'] else 0
+            }
+            for key, entry in sorted(self._stats.items(), key=lambda item: item[1]['total_ms'], reverse=True)
+        }
+        return {'queries': queries, 'slow_queries': self.slow_queries}
+
+    def clear(self):
+        self._stats.clear()
+        self.slow_queries = 0
+
+
+# Сводка текущего HTTP запроса (устанавливается middleware в app.py)
+current_query_stats: ContextVar[Optional[RequestQueryStats]] = ContextVar('current_query_stats', default=None)
+
+# Глобальный агрегатор
+query_stats = QueryStatsAggregator()
+
+
+def describe_filters(ops) -> List[str]:
+    """Описание фильтров цепочки postgrest без значений (значения могут содержать телефоны и т.п.)"""
+    filters = []
+    for name, args, _ in ops:
+        if name not in FILTER_OPS or not args:
+            continue
+        if name == 'in_' and len(args) > 1:
+            filters.append(f"{args[0]} in[{len(args[1])}]")
+        elif name == 'or_':
+            filters.append('or(...)')
+        elif name == 'match_any':
+            filters.append(f"any({','.join(column for column, _, _ in args[0])})")
+        else:
+            filters.append(f"{args[0]} {name.rstrip('_')}")
+    return filters
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    """Разбирает заголовок Server-Timing: {'db': {'dur': 12.3, 'desc': '4 queries'}, ...}"""
+    metrics: Dict[str, Dict[str, Any]] = {}
+    for metric in (header or '').split(','):
+        parts = [part.strip() for part in metric.split(';') if part.strip()]
+        if not parts:
+            continue
+        values: Dict[str, Any] = {}
+        for param in parts[1:]:
+            name, _, value = param.partition('=')
+            value = value.strip('"')
+            if name == 'dur':
+                try:
+                    values[name] = float(value)
+                except ValueError:
+                    continue
+            else:
+                values[name] = value
+        metrics[parts[0]] = values
+    return metrics
+
+
+def record_query(source: str, table: str, verb: str, filters: List[str], rows: int,
+                 duration_ms: float, error: Optional[str] = None) -> QueryRecord:
+    """Регистрирует выполненный запрос"""
+    record = QueryRecord(source, table, verb, filters, rows, duration_ms, error)
+    query_stats.add(record)
+
+    request_stats = current_query_stats.get()
+    if request_stats is not None:
+        request_stats.records.append(record)
+
+    if duration_ms >= config.QUERY_SLOW_MS and random.random() < config.QUERY_SLOW_SAMPLE_RATE:
+        query_stats.slow_queries += 1
+        logger.warning(f"🐌 Slow query: {record.describe()}")
+
+    return record
+
+
+def count_rows(data: Any) -> int:
+    if isinstance(data, list):
+        return len(data)
+    return 1 if data else 0
+
+
+class InstrumentedCursor:
+    """Обертка над DB-API курсором MySQL, которая замеряет execute()"""
+
+    def __init__(self, cursor, source: str = 'mysql'):
+        self._cursor = cursor
+        self._source = source
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        sql = str(operation)
+        table_match = _SQL_TABLE_RE.search(sql)
+        verb_match = _SQL_VERB_RE.search(sql)
+        start = time.perf_counter()
+        error = None
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        except Exception as e:
+            error = str(e)
+            raise
+        finally:
+            record_query(
+                self._source,
+                table_match.group(1) if table_match else '?',
+                verb_match.group(1).lower() if verb_match else '?',
+                [],
+                max(getattr(self._cursor, 'rowcount', 0) or 0, 0),
+                (time.perf_counter() - start) * 1000,
+                error
+            )
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+        return False
+
+
+def instrument_cursor(cursor, source: str = 'mysql') -> InstrumentedCursor:
+    """Оборачивает курсор MySQL для учета запросов"""
+    return InstrumentedCursor(cursor, source)
+
+
+# ==================== СИНХРОННЫЙ КЛИЕНТ SUPABASE ====================
+
+def describe_rest_request(request) -> Tuple[str, str, List[str]]:
+    """Таблица, операция и фильтры (без значений) HTTP запроса к PostgREST: /rest/v1/<table>?column=op.value"""
+    path = request.url.path.rstrip('/')
+    name = path.rsplit('/', 1)[-1]
+    if path.rsplit('/', 2)[-2:-1] == ['rpc']:
+        return name, 'rpc', []
+
+    verb = _REST_VERBS.get(request.method, request.method.lower())
+    if verb == 'insert' and 'merge-duplicates' in request.headers.get('prefer', ''):
+        verb = 'upsert'
+    filters = []
+    for column, value in request.url.params.multi_items():
+        if column in _REST_PARAMS:
+            continue
+        if column in ('or', 'and'):
+            filters.append(f"{column}(...)")
+            continue
+        operator, _, operand = value.partition('.')
+        if operator == 'in':
+            filters.append(f"{column} in[{len(operand.strip('()').split(',')) if operand.strip('()') else 0}]")
+        else:
+            filters.append(f"{column} {operator}")
+    return name, verb, filters
+
+
+def _response_rows(response) -> int:
+    """Число строк ответа PostgREST: по Content-Range (0-24/*), иначе по телу"""
+    first, _, _ = response.headers.get('content-range', '').partition('/')
+    start, _, end = first.partition('-')
+    if start.isdigit() and end.isdigit():
+        return int(end) - int(start) + 1
+    try:
+        return count_rows(response.json()) if response.content else 0
+    except ValueError:
+        return 0
+
+
+def instrument_http_client(session, source: str = 'supabase-sync', on_write: Optional[Callable[[str, str], None]] = None):
+    """
+    Хуки httpx.Client синхронного клиента PostgREST: каждый запрос попадает в record_query
+    так же, как запросы AsyncSupabase (Server-Timing, лог медленных запросов, /api/query-stats);
+    после успешной записи или rpc вызывается on_write(table, verb)
+    """
+    if getattr(session, '_query_stats_source', None):
+        return session
+
+    def on_request(request):
+        request.extensions['query_started'] = time.perf_counter()
+
+    def on_response(response):
+        started = response.request.extensions.get('query_started')
+        if started is None:
+            return
+        # Тело все равно читает postgrest - читаем здесь, чтобы время включало передачу
+        response.read()
+        table, verb, filters = describe_rest_request(response.request)
+        error = None if response.is_success else f"HTTP {response.status_code}"
+        rows = _response_rows(response) if response.is_success else 0
+        record_query(source, table, verb, filters, rows, (time.perf_counter() - started) * 1000, error)
+        if on_write is not None and response.is_success and verb != 'select':
+            on_write(table, verb)
+
+    hooks = session.event_hooks
+    session.event_hooks = {
+        'request': [*hooks.get('request', []), on_request],
+        'response': [*hooks.get('response', []), on_response]
+    }
+    session._query_stats_source = source
+    return session
+
+
+def instrument_sync_client(client, source: str = 'supabase-sync', on_write: Optional[Callable[[str, str], None]] = None):
+    """
+    supabase.Client: хуки на сессии PostgREST, в том числе пересозданной клиентом
+    после смены токена. Клиенты без PostgREST (FakeSupabaseClient) сами учитывают
+    запросы и получают только on_write
+    """
+    init_postgrest = getattr(client, '_init_postgrest_client', None)
+    if init_postgrest is None:
+        if hasattr(client, 'on_write'):
+            client.on_write = on_write
+        return client
+    if getattr(client, '_query_stats_source', None):
+        return client
+
+    def init_instrumented(*args, **kwargs):
+        postgrest = init_postgrest(*args, **kwargs)
+        instrument_http_client(postgrest.session, source, on_write)
+        return postgrest
+
+    client._init_postgrest_client = init_instrumented
+    if getattr(client, '_postgrest', None) is not None:
+        instrument_http_client(client._postgrest.session, source, on_write)
+    client._query_stats_source = source
+    return client
@@ -7,6 +7,7 @@ import mysql.connector
 from typing import List, Dict, Optional
 import logging
 from config import config
+from monitoring.query_stats import instrument_cursor
 
 logger = logging.getLogger(__name__)
 
@@ -48,7 +49,7 @@ class MySQLClient:
                 return []
         
         try:
-            cursor = self.connection.cursor(dictionary=True)
+            cursor = instrument_cursor(self.connection.cursor(dictionary=True))
             
             # Get all florists with their roles
             query = """
@@ -120,7 +121,7 @@ class MySQLClient:
                 return None
                 
         try:
-            cursor = self.connection.cursor(dictionary=True)
+            cursor = instrument_cursor(self.connection.cursor(dictionary=True))
             
             query = """
             SELECT 
@@ -5,9 +5,9 @@
 import json
 import glob
 
-def load_benchmark_results():
-    """Загружает результаты бенчмарков"""
-    files = glob.glob("benchmark_before_*.json")
+def load_benchmark_results(prefix: str = "benchmark_before"):
+    """Загружает результаты бенчмарков (benchmark_offline - офлайн прогоны с fake Supabase)"""
+    files = glob.glob(f"{prefix}_*.json")
     
     if len(files) < 2:
         print("❌ Недостаточно файлов с результатами бенчмарков")
@@ -57,7 +57,12 @@ def compare_results(before, after):
                     print(f"  ✅ Улучшение: {improvement:.1f}% (в {speed_ratio:.2f}x быстрее)")
                 else:
                     print(f"  ⚠️  Замедление: {abs(improvement):.1f}% (в {1/speed_ratio:.2f}x медленнее)")
-                
+
+                # Время и число запросов к БД (из заголовка Server-Timing)
+                if 'db_queries_avg' in before[test] and 'db_queries_avg' in after[test]:
+                    print(f"  🗄️ Запросов к БД: {before[test]['db_queries_avg']:.1f} → {after[test]['db_queries_avg']:.1f}")
+                    print(f"  🗄️ Время БД: {before[test]['db_avg']:.3f}s → {after[test]['db_avg']:.3f}s")
+
                 improvements.append({
                     'test': test,
                     'improvement_percent': improvement,
@@ -96,7 +101,8 @@ def show_optimizations():
     print("   - /cache/clear - очистка кэша")
 
 if __name__ == "__main__":
-    before, after = load_benchmark_results()
+    import sys
+    before, after = load_benchmark_results("benchmark_offline" if "--offline" in sys.argv else "benchmark_before")
     
     if before and after:
         improvements = compare_results(before, after)
@@ -0,0 +1,32 @@
+#!/usr/bin/env python3
+"""
+Полная пересборка проекции списка заказов order_list_rows
+Проекцию поддерживают триггеры migrations/001_order_list_rows.sql; скрипт - ремонт
+при подозрении на расхождение (например, после отключения триггеров)
+"""
+
+import asyncio
+import logging
+
+from config import config
+from core.data_access import AsyncSupabase
+from core.order_list import rebuild_order_list_rows
+
+logging.basicConfig(level=logging.INFO)
+
+
+async def main():
+    db = AsyncSupabase(config.SUPABASE_URL, config.SUPABASE_SERVICE_KEY or config.SUPABASE_ANON_KEY)
+    try:
+        total = await rebuild_order_list_rows(db)
+        print(f"✅ Пересобрано строк: {total}")
+    finally:
+        await db.aclose()
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("  ПЕРЕСБОРКА order_list_rows")
+    print("=" * 60)
+    
+    asyncio.run(main())
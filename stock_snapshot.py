@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Периодический снимок склада и проверка журнала stock_ledger (migrations/005_stock_ledger.sql)
+Запускать по cron (например, раз в сутки ночью): снимок ограничивает число строк журнала,
+которые нужно сложить для остатка на дату, проверка находит quantity, измененные в обход журнала.
+"""
+
+import asyncio
+import logging
+import sys
+
+from config import config
+from core.data_access import AsyncSupabase
+from core.ledger import take_stock_snapshot, verify_stock_ledger
+
+logging.basicConfig(level=logging.INFO)
+
+
+async def main() -> int:
+    db = AsyncSupabase(config.SUPABASE_URL, config.SUPABASE_SERVICE_KEY or config.SUPABASE_ANON_KEY)
+    try:
+        mismatches = await verify_stock_ledger(db)
+        if mismatches is None:
+            print("❌ Журнал склада не установлен (примените migrations/005_stock_ledger.sql)")
+            return 1
+        for mismatch in mismatches:
+            print(
+                f"⚠️  {mismatch['item_type']} {mismatch.get('item_name') or mismatch['item_id']}: "
+                f"quantity={mismatch['quantity']}, по журналу={mismatch['expected']}, "
+                f"balance={mismatch['ledger_balance']}"
+            )
+        print(f"{'✅' if not mismatches else '⚠️ '} Расхождений: {len(mismatches)}")
+
+        snapshot = await take_stock_snapshot(db)
+        print(f"✅ Снимок на строке журнала {snapshot['ledger_id']}: позиций {snapshot['items']}")
+        return 0 if not mismatches else 2
+    finally:
+        await db.aclose()
+
+
+if __name__ == "__main__":
+    print("=" * 60)
+    print("  СНИМОК СКЛАДА")
+    print("=" * 60)
+
+    sys.exit(asyncio.run(main()))
@@ -24,6 +24,7 @@ from dotenv import load_dotenv
 # Импорты из core модулей
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from core.transformer import OptimizedTransformer
+from monitoring.query_stats import instrument_cursor
 
 load_dotenv()
 
@@ -120,7 +121,7 @@ class SyncManager:
                     print("❌ Не удалось подключиться к MySQL для поиска пропущенных заказов")
                     return []
             
-            cursor = self.mysql_conn.cursor()
+            cursor = instrument_cursor(self.mysql_conn.cursor())
             cursor.execute("""
                 SELECT ID FROM b_sale_order 
                 WHERE ID BETWEEN %s AND %s 
@@ -161,7 +162,7 @@ class SyncManager:
                     print(f"❌ Не удалось подключиться к MySQL для заказа {order_id}")
                     return None
             
-            cursor = self.mysql_conn.cursor(dictionary=True)
+            cursor = instrument_cursor(self.mysql_conn.cursor(dictionary=True))
             
             # Основные данные заказа
             cursor.execute("""
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Тест автодополнения товаров и цветов: транслитерация, опечатки, популярность и обновление по событиям
+"""
+
+import asyncio
+from datetime import datetime, timezone
+
+from core.autocomplete import Autocomplete, NameIndex, fold
+from core.bom import BomIndex
+from core.fake_backend import create_fake_supabase
+
+
+def _tables():
+    now = datetime.now(timezone.utc).isoformat()
+    return {
+        'products': [
+            {'id': 'p1', 'name': 'Букет тюльпанов', 'price': 9000, 'quantity': 3, 'is_active': True},
+            {'id': 'p2', 'name': 'Тюльпаны микс', 'price': 12000, 'quantity': 1, 'is_active': True},
+            {'id': 'p3', 'name': 'Розы 25 шт', 'price': 15000, 'quantity': 2, 'is_active': True},
+            {'id': 'p4', 'name': 'Тюльпан старый', 'price': 5000, 'quantity': 0, 'is_active': False},
+        ],
+        'flowers': [
+            {'id': 'f1', 'name': 'Тюльпан', 'name_en': 'Tulip', 'quantity': 40, 'is_active': True},
+            {'id': 'f2', 'name': 'Роза', 'name_en': 'Rose', 'quantity': 100, 'is_active': True},
+            {'id': 'f3', 'name': 'Хризантема', 'name_en': 'Chrysanthemum', 'quantity': 10, 'is_active': True},
+        ],
+        'order_items': [
+            {'id': 'i1', 'product_id': 'p2', 'quantity': 5, 'created_at': now},
+            {'id': 'i2', 'product_id': 'p1', 'quantity': 1, 'created_at': now},
+        ],
+        'product_composition': [
+            {'product_id': 'p1', 'flower_id': 'f1', 'amount': 15},
+            {'product_id': 'p2', 'flower_id': 'f1', 'amount': 25},
+            {'product_id': 'p3', 'flower_id': 'f2', 'amount': 25},
+        ],
+    }
+
+
+def test_fold_transliterates():
+    assert fold('Тюльпанов') == 'tyulpanov'
+    assert fold('Хризантема кустовая!') == fold('khrizantema  KUSTOVAYA')
+    assert fold('Ёлка №5') == 'elka 5'
+
+
+def test_name_index_prefix_and_typos():
+    index = NameIndex(('name', 'name_en'))
+    index.build(_tables()['flowers'])
+    assert [row['id'] for row in index.search('тюл')] == ['f1']
+    assert [row['id'] for row in index.search('tulip')] == ['f1']
+    # Опечатки в русском и латинском написании
+    assert [row['id'] for row in index.search('хризантнма')] == ['f3']
+    assert [row['id'] for row in index.search('tyulpan')] == ['f1']
+    assert index.search('пион') == []
+
+
+def test_autocomplete_loads_and_follows_changes():
+    db = create_fake_supabase(tables=_tables())
+    autocomplete = Autocomplete(bom=BomIndex())
+
+    async def run():
+        await autocomplete.ensure_loaded(db)
+        # Популярный товар выше; неактивный не найден
+        assert [row['id'] for row in autocomplete.products.search('тюльпан')] == ['p2', 'p1']
+        assert autocomplete.products.search('тюльпан')[0] == {'id': 'p2', 'name': 'Тюльпаны микс', 'price': 12000, 'quantity': 1}
+        # Пустой запрос - цветы по числу составов
+        assert [row['id'] for row in autocomplete.flowers.search('', 2)] == ['f1', 'f2']
+
+        calls = db._backend.calls
+        await autocomplete.ensure_loaded(db)
+        assert db._backend.calls == calls
+
+        # Остатки от журнала склада - без запросов
+        autocomplete.apply_stock_changes([{'item_type': 'flower', 'item_id': 'f2', 'old_quantity': 100, 'new_quantity': 75}])
+        assert autocomplete.flowers.search('роза')[0]['quantity'] == 75
+
+        # Изменения товаров перечитываются по id одним запросом на таблицу
+        products = {row['id']: row for row in db._backend.tables['products']}
+        products['p4']['is_active'] = True
+        products['p1']['is_active'] = False
+        products['p3']['name'] = 'Пионовидные розы'
+        autocomplete.invalidate('product', ['p1', 'p3', 'p4'])
+        await autocomplete.ensure_loaded(db)
+        assert db._backend.calls == calls + 1
+        # Слово целиком выше префикса
+        assert [row['id'] for row in autocomplete.products.search('тюльпан')] == ['p4', 'p2']
+        assert [row['id'] for row in autocomplete.products.search('пионовидные')] == ['p3']
+        assert autocomplete.loads == 1 and autocomplete.refreshes == 1
+
+        autocomplete.invalidate()
+        await autocomplete.ensure_loaded(db)
+        assert autocomplete.loads == 2
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_fold_transliterates()
+    test_name_index_prefix_and_typos()
+    test_autocomplete_loads_and_follows_changes()
+    print("✅ autocomplete tests passed")
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Тест индекса составов (BOM): загрузка одним чтением, explode и сброс
+"""
+
+import asyncio
+
+from core.bom import BomIndex
+from core.fake_backend import create_fake_supabase, seed_fixtures
+
+
+def test_explode_sums_components():
+    index = BomIndex()
+    index.load([
+        {'product_id': 'bouquet', 'flower_id': 'rose', 'amount': 11},
+        {'product_id': 'bouquet', 'flower_id': 'gyps', 'amount': 2},
+        {'product_id': 'mono', 'flower_id': 'rose', 'amount': 25},
+        {'product_id': 'broken', 'flower_id': None, 'amount': 3},
+    ])
+
+    assert index.components('bouquet') == [('rose', 11), ('gyps', 2)]
+    assert index.components('card') == [] and not index.has_composition('card') and not index.has_composition('broken')
+    assert index.explode([
+        {'product_id': 'bouquet', 'quantity': 2},
+        {'product_id': 'mono'},
+        {'product_id': 'card', 'quantity': 5},
+        {'product_id': None},
+    ]) == {'rose': 47, 'gyps': 4}
+
+
+def test_loads_once_until_invalidated():
+    tables = seed_fixtures(orders=0, products=30)
+    db = create_fake_supabase(tables=tables)
+    index = BomIndex()
+    product_id = tables['product_composition'][0]['product_id']
+
+    async def run():
+        await asyncio.gather(index.ensure_loaded(db), index.ensure_loaded(db))
+        calls = db._backend.calls
+        await index.ensure_loaded(db)
+        assert db._backend.calls == calls and index.loads == 1
+
+        await db.table('product_composition').delete().eq('product_id', product_id).execute()
+        assert index.has_composition(product_id)
+        index.invalidate()
+        await index.ensure_loaded(db)
+
+    asyncio.run(run())
+    assert index.loads == 2 and not index.has_composition(product_id)
+    assert index.get_stats()['components'] == len(tables['product_composition']) - 3
+
+
+if __name__ == "__main__":
+    test_explode_sums_components()
+    test_loads_once_until_invalidated()
+    print("✅ BOM index tests passed")
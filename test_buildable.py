@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Тест расчета букетов из остатков: векторный расчет, пересчет по одному цветку и журнал склада
+"""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip('numpy')
+
+import core.ledger as ledger
+from core.bom import BomIndex
+from core.buildable import BuildableIndex
+from core.fake_backend import create_fake_supabase
+from core.ledger import StockMovement, apply_stock_movements
+
+COMPOSITION = [
+    # Букет роз: 5 роз + 1 зелень; микс: 3 розы + 4 тюльпана; тюльпаны: 9 тюльпанов
+    {'product_id': 'roses', 'flower_id': 'rose', 'amount': 5},
+    {'product_id': 'roses', 'flower_id': 'green', 'amount': 1},
+    {'product_id': 'mix', 'flower_id': 'rose', 'amount': 3},
+    {'product_id': 'mix', 'flower_id': 'tulip', 'amount': 4},
+    {'product_id': 'tulips', 'flower_id': 'tulip', 'amount': 9},
+]
+
+
+def test_counts_and_single_flower_update():
+    bom = BomIndex()
+    bom.load(COMPOSITION)
+    index = BuildableIndex(bom=bom)
+    index.load({'rose': 17, 'green': 10, 'tulip': 16})
+
+    assert index.counts() == {'roses': 3, 'mix': 4, 'tulips': 1}
+    assert index.limiting_flower('roses') == 'rose'
+    assert index.limiting_flower('mix') == 'tulip'
+    assert sorted(index.products_with('rose')) == ['mix', 'roses']
+
+    # Роз осталось 4: букет роз не собрать, микс - один; тюльпаны не пересчитываются
+    dropped = index.apply_stock_changes([{'item_type': 'flower', 'item_id': 'rose', 'old_quantity': 17, 'new_quantity': 4}])
+    assert dropped == ['roses']
+    assert index.counts(['roses', 'mix', 'tulips', 'card']) == {'roses': 0, 'mix': 1, 'tulips': 1}
+
+    # Товар без состава - по собственному остатку, цветы вне составов не важны
+    dropped = index.apply_stock_changes([
+        {'item_type': 'product', 'item_id': 'card', 'old_quantity': 1, 'new_quantity': 0},
+        {'item_type': 'flower', 'item_id': 'peony', 'old_quantity': 0, 'new_quantity': 5},
+    ])
+    assert dropped == ['card'] and index.updates == 1
+
+
+def test_follows_ledger_movements():
+    tables = {
+        'flowers': [
+            {'id': 'rose', 'name': 'Роза', 'quantity': 10},
+            {'id': 'green', 'name': 'Зелень', 'quantity': 10},
+            {'id': 'tulip', 'name': 'Тюльпан', 'quantity': 9},
+        ],
+        'products': [],
+        'product_composition': [dict(row) for row in COMPOSITION],
+    }
+    db = create_fake_supabase(tables=tables)
+    index = BuildableIndex(bom=BomIndex())
+    ledger.add_stock_listener(index.apply_stock_changes)
+    try:
+        async def run():
+            await index.ensure_loaded(db)
+            assert index.counts() == {'roses': 2, 'mix': 2, 'tulips': 1}
+            calls = db._backend.calls
+            await apply_stock_movements(db, [StockMovement('flower', 'tulip', 'writeoff', delta=-2)])
+            # Остатки не перечитываются: одна запись журнала
+            assert db._backend.calls == calls + 1
+            await index.ensure_loaded(db)
+            assert db._backend.calls == calls + 1
+
+        asyncio.run(run())
+    finally:
+        ledger._stock_listeners.remove(index.apply_stock_changes)
+    assert index.counts() == {'roses': 2, 'mix': 1, 'tulips': 0}
+    assert index.get_stats()['buildable'] == 2
+
+
+if __name__ == "__main__":
+    test_counts_and_single_flower_update()
+    test_follows_ledger_movements()
+    print("✅ buildable products tests passed")
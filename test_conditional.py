@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Тест условных GET: ETag/Last-Modified валидаторы страниц и поколения сущностей
+"""
+
+from starlette.requests import Request
+
+from config import config
+from core.conditional import PageValidator, make_etag, parse_timestamp
+from core.fragments import FragmentCache
+
+
+def _request(**headers):
+    return Request({
+        'type': 'http', 'method': 'GET', 'path': '/crm/orders/1',
+        'headers': [(name.replace('_', '-').encode(), value.encode()) for name, value in headers.items()]
+    })
+
+
+def test_validator_matches_etag_and_last_modified():
+    validator = PageValidator(make_etag('order-1', '2025-08-25T10:00:00.5+00:00'), '2025-08-25T10:00:00.5+00:00')
+    headers = validator.headers()
+    assert headers['ETag'].startswith('W/"') and headers['Last-Modified'] == 'Mon, 25 Aug 2025 10:00:00 GMT'
+
+    assert not validator.matches(_request())
+    assert validator.matches(_request(if_none_match=f'"other", {headers["ETag"]}'))
+    assert validator.matches(_request(if_none_match=headers['ETag'].removeprefix('W/')))
+    # If-None-Match важнее If-Modified-Since
+    assert not validator.matches(_request(if_none_match='"other"', if_modified_since=headers['Last-Modified']))
+    assert validator.matches(_request(if_modified_since=headers['Last-Modified']))
+    assert not validator.matches(_request(if_modified_since='Mon, 25 Aug 2025 09:59:59 GMT'))
+
+    response = validator.not_modified()
+    assert response.status_code == 304 and response.headers['cache-control'] == 'private, no-cache'
+
+    config.CONDITIONAL_GET = False
+    try:
+        assert not validator.matches(_request(if_none_match=headers['ETag']))
+    finally:
+        config.CONDITIONAL_GET = True
+
+    # Строки без зоны считаются UTC
+    assert parse_timestamp('2025-08-25T09:00:00').isoformat() == '2025-08-25T09:00:00+00:00'
+    assert parse_timestamp('2025-08-25T12:00:00+03:00') == parse_timestamp('2025-08-25T09:00:00Z')
+    assert parse_timestamp(None) is None and parse_timestamp('вчера') is None
+
+
+def test_invalidate_bumps_generation():
+    cache = FragmentCache()
+    before = cache.generation('product', 'p1'), cache.generation('product', 'p2'), cache.generation('order', 'p1')
+
+    cache.invalidate('product', ['p1'])
+    assert cache.generation('product', 'p1') != before[0]
+    assert cache.generation('product', 'p2') == before[1]
+    assert cache.generation('order', 'p1') == before[2]
+
+    # Сброс всего вида или всего кеша меняет поколения всех сущностей
+    cache.invalidate('product')
+    assert cache.generation('product', 'p2') != before[1]
+    cache.invalidate()
+    assert cache.generation('order', 'p1') != before[2]
+
+
+if __name__ == "__main__":
+    test_validator_matches_etag_and_last_modified()
+    test_invalidate_bumps_generation()
+    print("✅ conditional GET tests passed")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Тест стратегий подсчета total для пагинации (core/counts.py)
+"""
+
+import asyncio
+
+from core.counts import count_cache, execute_counted, invalidate_counts
+from core.fake_backend import create_fake_supabase
+
+
+class FakeResult:
+    def __init__(self, data, count):
+        self.data = data
+        self.count = count
+
+
+class FakeQuery:
+    """Записывает цепочку и возвращает count только если его запросили"""
+
+    executed = []
+
+    def __init__(self, table, total=120):
+        self.table = table
+        self.kind = 'table'
+        self.ops = []
+        self.total = total
+
+    def __getattr__(self, name):
+        def method(*args, **kwargs):
+            self.ops.append((name, args, kwargs))
+            return self
+        return method
+
+    async def execute(self):
+        select_kwargs = next(kwargs for name, _, kwargs in self.ops if name == 'select')
+        FakeQuery.executed.append(select_kwargs.get('count'))
+        return FakeResult([], self.total if select_kwargs.get('count') else None)
+
+
+def orders_page(page: int, total: int = 120):
+    offset = (page - 1) * 50
+    return FakeQuery('orders', total).select('id').eq('status', 'new').order('created_at', desc=True).range(offset, offset + 49)
+
+
+def test_passes_count_method_through():
+    """exact/estimated/planned уходят в select(count=...)"""
+    FakeQuery.executed.clear()
+    for strategy in ('exact', 'estimated', 'planned'):
+        result = asyncio.run(execute_counted(orders_page(1), strategy))
+        assert result.count == 120
+    assert FakeQuery.executed == ['exact', 'estimated', 'planned']
+
+
+def test_cached_count_reused_across_pages_and_invalidated():
+    """cached: COUNT(*) только на первой странице, до записи в таблицу"""
+    count_cache.clear()
+    FakeQuery.executed.clear()
+
+    first = asyncio.run(execute_counted(orders_page(1), 'cached'))
+    second = asyncio.run(execute_counted(orders_page(2, total=999), 'cached'))
+    assert first.count == second.count == 120
+    assert FakeQuery.executed == ['exact', None]
+
+    invalidate_counts('products')
+    asyncio.run(execute_counted(orders_page(3), 'cached'))
+    assert FakeQuery.executed[-1] is None
+
+    invalidate_counts('orders')
+    result = asyncio.run(execute_counted(orders_page(1, total=121), 'cached'))
+    assert result.count == 121
+    assert FakeQuery.executed[-1] == 'exact'
+
+
+def test_sync_client_writes_invalidate():
+    """Запись через sync_client (webhook'и, /api/sync/*) сбрасывает total таблицы"""
+    count_cache.clear()
+    db = create_fake_supabase(tables={'orders': [{'id': 'o1', 'status': 'new'}], 'products': []})
+
+    def total():
+        return asyncio.run(execute_counted(db.table('orders').select('id').eq('status', 'new').range(0, 49), 'cached')).count
+
+    assert total() == 1
+    db.sync_client.table('products').insert({'id': 'p1', 'name': 'Букет'}).execute()
+    db._backend.tables['orders'].append({'id': 'o2', 'status': 'new'})
+    assert total() == 1
+    db.sync_client.table('orders').update({'status': 'new'}).eq('id', 'o2').execute()
+    assert total() == 2
+
+
+if __name__ == "__main__":
+    test_passes_count_method_through()
+    test_cached_count_reused_across_pages_and_invalidated()
+    test_sync_client_writes_invalidate()
+    print("✅ Тесты стратегий подсчета пройдены")
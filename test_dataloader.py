@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Тест request-scoped DataLoader: батчинг точечных запросов в один .in_() и мемоизация
+"""
+
+import asyncio
+
+from postgrest.exceptions import APIError
+
+from core.dataloader import RequestLoaders
+
+
+class FakeQuery:
+    """Минимальный построитель, совместимый с AsyncQuery"""
+
+    def __init__(self, db, table):
+        self._db = db
+        self.table = table
+        self.kind = 'table'
+        self.ops = []
+
+    def __getattr__(self, name):
+        def method(*args, **kwargs):
+            self.ops.append((name, args, kwargs))
+            return self
+        return method
+
+
+class FakeResult:
+    def __init__(self, data):
+        self.data = data
+        self.count = None
+
+
+class FakeDB:
+    """Считает запросы и отвечает на .in_() из таблицы в памяти"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.fetches = []
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    async def fetch(self, query):
+        self.fetches.append(query.ops)
+        column, keys = next(args for name, args, _ in query.ops if name == 'in_')
+        keys = [str(key) for key in keys]
+        return FakeResult([row for row in self.rows if str(row.get(column)) in keys])
+
+
+def test_batches_lookups_in_same_tick():
+    """Запросы из asyncio.gather уходят одним .in_()"""
+    db = FakeDB([{'id': 'a', 'name': 'Роза'}, {'id': 'b', 'name': 'Тюльпан'}])
+    loaders = RequestLoaders()
+
+    async def run():
+        return await asyncio.gather(
+            loaders.load(db, db.table('products').select('id, name').eq('id', 'a').single()),
+            loaders.load(db, db.table('products').select('id, name').eq('id', 'b').single()),
+            loaders.load(db, db.table('products').select('id, name').eq('id', 'missing').maybe_single()),
+            loaders.load(db, db.table('products').select('id, name').eq('id', 'missing').single()),
+            return_exceptions=True
+        )
+
+    (first, _), (second, _), (missing, _), error = asyncio.run(run())
+
+    assert len(db.fetches) == 1
+    assert first == {'id': 'a', 'name': 'Роза'}
+    assert second == {'id': 'b', 'name': 'Тюльпан'}
+    assert missing is None
+    # single() без строки - ошибка, как у PostgREST
+    assert isinstance(error, APIError) and error.code == 'PGRST116'
+
+
+def test_single_rejects_duplicates():
+    """Несколько строк по ключу не прячутся за первой"""
+    db = FakeDB([{'id': 1, 'order_id': 'o1'}, {'id': 2, 'order_id': 'o1'}])
+    loaders = RequestLoaders()
+
+    async def run():
+        data, _ = await loaders.load(db, db.table('order_items').select('id').eq('order_id', 'o1'))
+        assert [row['id'] for row in data] == [1, 2]
+        try:
+            await loaders.load(db, db.table('order_items').select('id').eq('order_id', 'o1').maybe_single())
+        except APIError as e:
+            assert e.code == 'PGRST116'
+        else:
+            raise AssertionError('maybe_single() returned one of two rows')
+
+    asyncio.run(run())
+
+
+def test_embedded_tables_invalidate():
+    """Запись во вложенную таблицу сбрасывает кеш выборок, где она встречается"""
+    db = FakeDB([{'id': 1, 'flower_id': 'rose', 'flowers': {'name': 'Роза'}}])
+    loaders = RequestLoaders()
+
+    async def run():
+        query = lambda: db.table('product_composition').select('id, flower:flowers!flower_id(name, colors(name))').eq('id', 1)
+        await loaders.load(db, query())
+        loaders.invalidate('products')
+        await loaders.load(db, query())
+        assert len(db.fetches) == 1
+        for table in ('flowers', 'colors'):
+            loaders.invalidate(table)
+            await loaders.load(db, query())
+        assert len(db.fetches) == 3
+
+    asyncio.run(run())
+
+
+def test_memoizes_and_invalidates_on_write():
+    """Повторный запрос берется из кеша, запись в таблицу сбрасывает кеш"""
+    db = FakeDB([{'id': 1, 'quantity': 5}])
+    loaders = RequestLoaders()
+
+    async def run():
+        await loaders.load(db, db.table('flowers').select('quantity').eq('id', 1))
+        await loaders.load(db, db.table('flowers').select('quantity').eq('id', 1).single())
+        assert len(db.fetches) == 1
+
+        loaders.invalidate('flowers')
+        data, matched = await loaders.load(db, db.table('flowers').select('quantity').eq('id', 1).single())
+        assert matched and data['quantity'] == 5
+        assert len(db.fetches) == 2
+
+    asyncio.run(run())
+
+
+def test_nested_changes_stay_out_of_cache():
+    """Изменения вложенных metadata и order_items(*) в обработчике не видны следующим запросам"""
+    db = FakeDB([{'id': 'o1', 'metadata': {'tags': ['vip']}, 'order_items': [{'id': 1, 'quantity': 2}]}])
+    loaders = RequestLoaders()
+
+    async def run():
+        query = lambda: db.table('orders').select('id, metadata, order_items(*)').eq('id', 'o1').single()
+        order, _ = await loaders.load(db, query())
+        order['metadata']['tags'].append('changed')
+        order['order_items'][0]['quantity'] = 99
+        again, _ = await loaders.load(db, query())
+        assert len(db.fetches) == 1
+        assert again == {'id': 'o1', 'metadata': {'tags': ['vip']}, 'order_items': [{'id': 1, 'quantity': 2}]}
+
+    asyncio.run(run())
+
+
+def test_skips_non_point_queries():
+    """Запросы с другими фильтрами и сортировкой выполняются напрямую"""
+    db = FakeDB([])
+    loaders = RequestLoaders()
+    query = db.table('orders').select('id').eq('status', 'new').order('created_at', desc=True)
+    assert loaders.match(query) is None
+
+
+if __name__ == "__main__":
+    test_batches_lookups_in_same_tick()
+    test_single_rejects_duplicates()
+    test_embedded_tables_invalidate()
+    test_memoizes_and_invalidates_on_write()
+    test_nested_changes_stay_out_of_cache()
+    test_skips_non_point_queries()
+    print("✅ DataLoader тесты пройдены")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Тест in-process fake Supabase: выборки со вложенными ресурсами, фильтры, запись и задержка
+"""
+
+import asyncio
+import time
+
+from core.fake_backend import FakeBackend, create_fake_supabase, seed_fixtures
+
+
+def test_select_with_embeds_filters_and_count():
+    db = create_fake_supabase(tables=seed_fixtures(orders=40, products=10))
+
+    async def run():
+        orders = await db.table('orders')\
+            .select('id, status, created_at, order_items(*)', count='exact')\
+            .in_('status', ['new', 'paid'])\
+            .order('created_at', desc=True)\
+            .range(0, 4)\
+            .execute()
+        compositions = await db.table('product_composition').select('flower_id, amount, flowers(name)').limit(3).execute()
+        roses = await db.table('flowers').select('name').ilike('name', '%роза%').execute()
+        return orders, compositions, roses
+
+    orders, compositions, roses = asyncio.run(run())
+
+    assert orders.count >= len(orders.data) and len(orders.data) <= 5
+    assert all(order['status'] in ('new', 'paid') for order in orders.data)
+    assert all(item['order_id'] == order['id'] for order in orders.data for item in order['order_items'])
+    assert [row['created_at'] for row in orders.data] == sorted((row['created_at'] for row in orders.data), reverse=True)
+    assert compositions.data and all(set(row) == {'flower_id', 'amount', 'flowers'} and row['flowers']['name'] for row in compositions.data)
+    assert roses.data and all('роза' in row['name'].lower() for row in roses.data)
+
+
+def test_writes_and_single():
+    db = create_fake_supabase(tables={'flowers': []})
+
+    async def run():
+        created = await db.table('flowers').insert({'name': 'Пион', 'quantity': 10}).execute()
+        flower_id = created.data[0]['id']
+        await db.table('flowers').update({'quantity': 7}).eq('id', flower_id).execute()
+        await db.table('flowers').upsert({'id': flower_id, 'quantity': 3}).execute()
+        single = await db.table('flowers').select('quantity').eq('id', flower_id).single().execute()
+        missing = await db.table('flowers').select('id').eq('id', 'missing').maybe_single().execute()
+        await db.table('flowers').delete().eq('id', flower_id).execute()
+        left = await db.table('flowers').select('id', count='exact').execute()
+        return single, missing, left
+
+    single, missing, left = asyncio.run(run())
+    assert single.data == {'quantity': 3}
+    assert missing.data is None
+    assert left.count == 0
+
+    # Синхронный клиент legacy модулей видит те же таблицы
+    db.sync_client.table('flowers').insert({'name': 'Тюльпан'}).execute()
+    assert asyncio.run(db.table('flowers').select('name').execute()).data == [{'name': 'Тюльпан'}]
+
+
+def test_latency_per_round_trip():
+    """Параллельные запросы платят задержку один раз, последовательные - за каждый"""
+    backend_tables = {'flowers': [{'id': str(i), 'name': f'Цветок {i}'} for i in range(5)]}
+    db = create_fake_supabase(latency_ms=20, tables=backend_tables)
+
+    async def sequential():
+        for i in range(5):
+            await db.table('flowers').select('name').eq('id', str(i)).execute()
+
+    async def concurrent():
+        await asyncio.gather(*(db.table('flowers').select('name').eq('id', str(i)).execute() for i in range(5)))
+
+    start = time.perf_counter()
+    asyncio.run(sequential())
+    sequential_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    asyncio.run(concurrent())
+    concurrent_time = time.perf_counter() - start
+
+    assert sequential_time >= 0.1
+    assert concurrent_time < sequential_time / 2
+
+
+def test_rpc_handler():
+    backend = FakeBackend({'flowers': [{'id': '1', 'quantity': 5}]})
+    backend.register_rpc('total_stock', lambda b, params: sum(row['quantity'] for row in b.tables['flowers']))
+    assert backend.sync_client().rpc('total_stock').execute().data == 5
+
+
+if __name__ == "__main__":
+    test_select_with_embeds_filters_and_count()
+    test_writes_and_single()
+    test_latency_per_round_trip()
+    test_rpc_handler()
+    print("✅ Тесты fake Supabase пройдены")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Тест статистики цветов склада: пересчет только после перезагрузки индекса составов
+"""
+
+import asyncio
+
+from core.bom import BomIndex
+from core.fake_backend import create_fake_supabase
+from core.flower_stats import FlowerUsageStats
+
+
+def _tables():
+    return {
+        'products': [
+            {'id': 'roses', 'name': 'Букет роз'},
+            {'id': 'mix', 'name': 'Микс'},
+            {'id': 'small', 'name': 'Мини'},
+        ],
+        'product_composition': [
+            {'product_id': 'roses', 'flower_id': 'rose', 'amount': 25},
+            {'product_id': 'mix', 'flower_id': 'rose', 'amount': 5},
+            {'product_id': 'mix', 'flower_id': 'tulip', 'amount': 7},
+            {'product_id': 'small', 'flower_id': 'rose', 'amount': 3},
+            # Товар удален - в примеры не попадает, в суммы попадает
+            {'product_id': 'gone', 'flower_id': 'tulip', 'amount': 2},
+        ],
+    }
+
+
+def test_stats_follow_bom_reloads():
+    db = create_fake_supabase(tables=_tables())
+    bom = BomIndex()
+    stats = FlowerUsageStats(bom, samples=2)
+
+    async def run():
+        await stats.ensure_loaded(db)
+        calls = db._backend.calls
+        # Составы не менялись - ни одного запроса
+        await stats.ensure_loaded(db)
+        assert db._backend.calls == calls
+
+        db._backend.tables['product_composition'].append({'product_id': 'small', 'flower_id': 'tulip', 'amount': 1})
+        bom.invalidate()
+        await stats.ensure_loaded(db)
+
+    asyncio.run(run())
+    assert stats.get('rose') == {
+        'total_used': 33, 'products_count': 3,
+        'recent_usage': [
+            {'product_id': 'roses', 'amount': 25, 'product_name': 'Букет роз'},
+            {'product_id': 'mix', 'amount': 5, 'product_name': 'Микс'},
+        ]
+    }
+    tulip = stats.get('tulip')
+    assert tulip['total_used'] == 10 and tulip['products_count'] == 3
+    assert [sample['product_name'] for sample in tulip['recent_usage']] == ['Микс']
+    assert stats.get('peony') == {'total_used': 0, 'products_count': 0, 'recent_usage': []}
+    assert stats.loads == 2
+
+
+if __name__ == "__main__":
+    test_stats_follow_bom_reloads()
+    print("✅ flower usage stats tests passed")
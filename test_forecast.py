@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Тест прогноза расхода цветов: скользящий расход по истории и дни до нуля
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from core.fake_backend import create_fake_supabase
+from core.forecast import DepletionForecast
+
+NOW = datetime(2025, 3, 31, 12, 0, tzinfo=timezone.utc)
+
+
+def _ago(days: int) -> str:
+    return (NOW - timedelta(days=days)).isoformat()
+
+
+def test_rolling_rate_and_days_left():
+    forecast = DepletionForecast(window_days=28, rolling_days=7, lead_days=3)
+    rows = (
+        # Роза: 10 шт. в день последнюю неделю, раньше меньше
+        [{'flower_id': 'rose', 'quantity': 10, 'created_at': _ago(day)} for day in range(7)]
+        + [{'flower_id': 'rose', 'quantity': 2, 'created_at': _ago(day)} for day in range(7, 28)]
+        # Тюльпан: только две недели назад - берется среднее за окно
+        + [{'flower_id': 'tulip', 'quantity': 56, 'created_at': _ago(14)}]
+        # За окном не учитывается
+        + [{'flower_id': 'rose', 'quantity': 1000, 'created_at': _ago(40)}]
+    )
+    forecast.load(rows, NOW)
+
+    result = forecast.forecast([
+        {'id': 'rose', 'quantity': 25},
+        {'id': 'tulip', 'quantity': 40},
+        {'id': 'peony', 'quantity': 5},
+    ])
+    assert result['rose']['daily_usage'] == 10 and result['rose']['days_left'] == 2.5
+    assert result['rose']['runs_out_before_delivery'] is True
+    assert result['tulip']['daily_usage'] == 2 and result['tulip']['days_left'] == 20
+    assert result['tulip']['runs_out_before_delivery'] is False
+    # Не расходовался - прогноза нет
+    assert result['peony']['days_left'] is None and result['peony']['runs_out_before_delivery'] is False
+
+    risky = forecast.at_risk([{'id': 'rose', 'name': 'Роза', 'quantity': 25}, {'id': 'tulip', 'quantity': 40}], lead_days=30)
+    assert [item['id'] for item in risky] == ['rose', 'tulip']
+
+
+def test_loads_consumption_from_ledger():
+    now = datetime.now(timezone.utc)
+    tables = {
+        'stock_ledger': [
+            {'id': 1, 'item_type': 'flower', 'item_id': 'rose', 'delta': 100, 'balance': 100,
+             'movement_type': 'delivery', 'created_at': (now - timedelta(days=3)).isoformat()},
+            {'id': 2, 'item_type': 'flower', 'item_id': 'rose', 'delta': -14, 'balance': 86,
+             'movement_type': 'order_usage', 'created_at': (now - timedelta(days=2)).isoformat()},
+            {'id': 3, 'item_type': 'product', 'item_id': 'card', 'delta': -1, 'balance': 2,
+             'movement_type': 'order_usage', 'created_at': now.isoformat()},
+        ],
+    }
+    db = create_fake_supabase(tables=tables)
+    forecast = DepletionForecast(window_days=7, rolling_days=7)
+
+    async def run():
+        await forecast.ensure_loaded(db)
+        calls = db._backend.calls
+        # Повторно история не читается до TTL
+        await forecast.ensure_loaded(db)
+        assert db._backend.calls == calls
+
+    asyncio.run(run())
+    assert forecast.get_stats()['flowers'] == 1
+    assert forecast.forecast([{'id': 'rose', 'quantity': 86}])['rose']['daily_usage'] == 2
+
+
+if __name__ == "__main__":
+    test_rolling_rate_and_days_left()
+    test_loads_consumption_from_ledger()
+    print("✅ depletion forecast tests passed")
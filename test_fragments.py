@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Тест кеша отрендеренных строк списков: попадания, версия по updated_at, сброс и LRU
+"""
+
+from jinja2 import DictLoader, Environment
+
+from core.fragments import FragmentCache
+
+
+def _env(row_template='<tr>{{ row.name }} {{ statuses[row.status] }}</tr>'):
+    return Environment(loader=DictLoader({'row.html': row_template}), autoescape=True)
+
+
+def test_rows_rendered_once_until_changed():
+    env, cache = _env(), FragmentCache(max_entries=10)
+    rows = [
+        {'id': 1, 'name': 'Роза <red>', 'status': 'new', 'updated_at': 't1'},
+        {'id': 2, 'name': 'Пион', 'status': 'paid', 'updated_at': 't1'},
+    ]
+    context = {'statuses': {'new': 'Новый', 'paid': 'Оплачен'}}
+
+    first = cache.render_rows(env, 'row.html', 'order', rows, context=context)
+    assert first[0] == '<tr>Роза &lt;red&gt; Новый</tr>'
+    assert cache.render_rows(env, 'row.html', 'order', rows, context=context) == first
+    assert cache.get_stats()['hits'] == 2
+
+    # Новый updated_at - строка рендерится заново, соседняя берется из кеша
+    rows[1] = dict(rows[1], status='new', updated_at='t2')
+    second = cache.render_rows(env, 'row.html', 'order', rows, context=context)
+    assert second[1] == '<tr>Пион Новый</tr>' and cache.get_stats()['hits'] == 3
+
+    # Явный сброс из пути записи
+    cache.invalidate('order', [1])
+    cache.render_rows(env, 'row.html', 'order', rows, context=context)
+    assert cache.get_stats()['misses'] == 4
+
+
+def test_template_version_and_lru_bound():
+    cache = FragmentCache(max_entries=2)
+    rows = [{'id': index, 'name': str(index), 'status': 'new', 'updated_at': 't'} for index in range(3)]
+    cache.render_rows(_env(), 'row.html', 'product', rows, context={'statuses': {'new': ''}})
+    assert cache.get_stats()['size'] == 2
+
+    # Другой исходник шаблона - другая версия, старые фрагменты не отдаются
+    cache.invalidate()
+    html = cache.render_rows(_env('<tr>v2 {{ row.name }}</tr>'), 'row.html', 'product', rows[:1])
+    assert html == ['<tr>v2 0</tr>']
+
+    # Строки без updated_at не кешируются
+    cache.render_rows(_env(), 'row.html', 'product', [{'id': 9, 'name': 'x', 'status': 'new'}], context={'statuses': {'new': ''}})
+    assert ('product', '9') not in cache._fragments
+
+
+if __name__ == "__main__":
+    test_rows_rendered_once_until_changed()
+    test_template_version_and_lru_bound()
+    print("✅ fragment cache tests passed")
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Тест резервирования склада: reserve_inventory (один RPC) и пакетный план без функции
+"""
+
+import asyncio
+import time
+
+import core.inventory as inventory
+import core.ledger as ledger
+from core.fake_backend import create_fake_supabase
+from core.bom import bom_index
+from core.inventory import (
+    apply_reservation_plan, build_reservation_plan, reserve_inventory, reserve_inventory_batched, rollback_reservation
+)
+
+
+def _tables():
+    return {
+        'flowers': [
+            {'id': 'rose', 'name': 'Роза красная', 'quantity': 30},
+            {'id': 'gyps', 'name': 'Гипсофила', 'quantity': 5},
+        ],
+        'products': [
+            {'id': 'bouquet', 'name': 'Букет роз', 'quantity': 0},
+            {'id': 'card', 'name': 'Открытка', 'quantity': 3},
+        ],
+        'product_composition': [
+            {'product_id': 'bouquet', 'flower_id': 'rose', 'amount': 11},
+            {'product_id': 'bouquet', 'flower_id': 'gyps', 'amount': 2},
+        ],
+        'flower_inventory_movements': [],
+    }
+
+
+def _stock(db, table):
+    return {row['id']: row['quantity'] for row in db._backend.tables[table]}
+
+
+def test_reserve_and_release_in_one_call():
+    db = create_fake_supabase(tables=_tables())
+    items = [{'product_id': 'bouquet', 'quantity': 2}, {'product_id': 'card', 'quantity': 1}, {'product_id': None}]
+
+    result = asyncio.run(reserve_inventory(db, items))
+    assert result['success'] and db._backend.calls == 1
+    assert _stock(db, 'flowers') == {'rose': 8, 'gyps': 1}
+    # Товар с составом списывается цветами, без состава - своим количеством
+    assert _stock(db, 'products') == {'bouquet': 0, 'card': 2}
+    # Движения - в журнале склада, с остатком после движения
+    movements = db._backend.tables['stock_ledger']
+    assert sorted((row['item_id'], row['movement_type'], row['delta'], row['balance']) for row in movements) == [
+        ('card', 'order_usage', -1, 2), ('gyps', 'order_usage', -4, 1), ('rose', 'order_usage', -22, 8)
+    ]
+
+    released = asyncio.run(reserve_inventory(db, items, operation='release'))
+    assert released['success'] and _stock(db, 'flowers') == {'rose': 30, 'gyps': 5}
+    assert _stock(db, 'products') == {'bouquet': 0, 'card': 3}
+
+
+def test_shortage_changes_nothing():
+    db = create_fake_supabase(tables=_tables())
+    result = asyncio.run(reserve_inventory(db, [{'product_id': 'bouquet', 'quantity': 3}]))
+
+    assert not result['success']
+    assert result['error'].startswith('Недостаточно цветов в инвентаре') and 'Роза красная: нужно 33, доступно 30' in result['error']
+    assert _stock(db, 'flowers') == {'rose': 30, 'gyps': 5}
+    assert db._backend.tables.get('stock_ledger', []) == []
+
+    missing = asyncio.run(reserve_inventory(db, [{'product_id': 'unknown', 'quantity': 1}]))
+    assert missing['error'] == 'Product unknown not found'
+
+
+def test_missing_function_falls_back():
+    db = create_fake_supabase(tables=_tables())
+    db._backend._rpc.clear()
+    try:
+        assert asyncio.run(reserve_inventory(db, [{'product_id': 'card', 'quantity': 1}])) is None
+        # Повторно RPC не вызывается
+        calls = db._backend.calls
+        assert asyncio.run(reserve_inventory(db, [{'product_id': 'card', 'quantity': 1}])) is None
+        assert db._backend.calls == calls
+    finally:
+        inventory._function_available = True
+
+
+def test_batched_plan_has_constant_round_trips():
+    tables = _tables()
+    # Сложный букет: 12 видов цветов
+    for index in range(10):
+        tables['flowers'].append({'id': f'extra{index}', 'name': f'Зелень {index}', 'quantity': 100})
+        tables['product_composition'].append({'product_id': 'bouquet', 'flower_id': f'extra{index}', 'amount': 1})
+    db = create_fake_supabase(tables=tables, latency_ms=20)
+    bom_index.invalidate()
+    items = [{'product_id': 'bouquet', 'quantity': 2}, {'product_id': 'card', 'quantity': 1}]
+    # Без миграций 004/005: ни функции резервирования, ни журнала склада
+    ledger._ledger_available = False
+
+    async def run():
+        await bom_index.ensure_loaded(db)
+        calls = db._backend.calls
+        started = time.perf_counter()
+        result = await reserve_inventory_batched(db, items)
+        elapsed = time.perf_counter() - started
+        # 2 чтения (flowers, products) + PATCH каждой строки (13) + insert движений
+        assert db._backend.calls - calls == 16
+        # ...но последовательно только 3 round trip'а: чтения и PATCH идут параллельно
+        assert elapsed < 0.2, elapsed
+        return result
+
+    result = asyncio.run(run())
+    assert result['success'] and len(result['flower_updates']) == 12
+    assert _stock(db, 'flowers')['rose'] == 8 and _stock(db, 'flowers')['extra0'] == 98
+    assert _stock(db, 'products') == {'bouquet': 0, 'card': 2}
+    assert len(db._backend.tables['flower_inventory_movements']) == 12
+
+    # Откат тем же планом
+    asyncio.run(rollback_reservation(db, result, items))
+    assert _stock(db, 'flowers')['rose'] == 30 and _stock(db, 'products')['card'] == 3
+    movements = db._backend.tables['flower_inventory_movements']
+    assert len(movements) == 24 and movements[-1]['movement_type'] == 'delivery'
+
+    shortage = asyncio.run(reserve_inventory_batched(db, [{'product_id': 'card', 'quantity': 4}]))
+    assert shortage['error'] == 'Insufficient stock for Открытка. Available: 3, Required: 4'
+    assert _stock(db, 'products')['card'] == 3
+    ledger._ledger_available = True
+
+
+def test_batched_plan_keeps_concurrent_changes():
+    db = create_fake_supabase(tables=_tables())
+    bom_index.invalidate()
+    ledger._ledger_available = False
+    items = [{'product_id': 'bouquet', 'quantity': 2}]
+
+    async def run():
+        plan = await build_reservation_plan(db, items)
+        # Параллельный заказ списал 5 роз между чтением и записью
+        await db.table('flowers').update({'quantity': 25}).eq('id', 'rose').execute()
+        await apply_reservation_plan(db, plan)
+        assert not plan.shortages and _stock(db, 'flowers') == {'rose': 3, 'gyps': 1}
+        assert {change.id: (change.old_quantity, change.new_quantity) for change in plan.flowers} == {'rose': (25, 3), 'gyps': (5, 1)}
+
+        # Остатка уже не хватает: ничего не списано, нехватка в плане
+        plan = await build_reservation_plan(db, [{'product_id': 'card', 'quantity': 2}])
+        await db.table('products').update({'quantity': 1}).eq('id', 'card').execute()
+        await apply_reservation_plan(db, plan)
+        assert plan.shortages == [{'kind': 'product', 'id': 'card', 'name': 'Открытка', 'needed': 2, 'available': 1, 'shortage': 1}]
+        assert _stock(db, 'products') == {'bouquet': 0, 'card': 1}
+
+    try:
+        asyncio.run(run())
+    finally:
+        ledger._ledger_available = True
+
+
+def test_batched_plan_writes_ledger():
+    db = create_fake_supabase(tables=_tables())
+    bom_index.invalidate()
+    items = [{'product_id': 'bouquet', 'quantity': 2}]
+
+    async def run():
+        await bom_index.ensure_loaded(db)
+        calls = db._backend.calls
+        result = await reserve_inventory_batched(db, items)
+        # 2 чтения + один вызов журнала вместо upsert'ов и вставки движений
+        assert db._backend.calls - calls == 3
+        return result
+
+    result = asyncio.run(run())
+    assert result['success'] and _stock(db, 'flowers') == {'rose': 8, 'gyps': 1}
+    assert sorted((row['item_id'], row['balance']) for row in db._backend.tables['stock_ledger']) == [('gyps', 1), ('rose', 8)]
+
+    asyncio.run(rollback_reservation(db, result, items))
+    assert _stock(db, 'flowers') == {'rose': 30, 'gyps': 5}
+    assert sorted(row['delta'] for row in db._backend.tables['stock_ledger']) == [-22, -4, 4, 22]
+
+
+if __name__ == "__main__":
+    test_reserve_and_release_in_one_call()
+    test_shortage_changes_nothing()
+    test_missing_function_falls_back()
+    test_batched_plan_has_constant_round_trips()
+    test_batched_plan_keeps_concurrent_changes()
+    test_batched_plan_writes_ledger()
+    print("✅ inventory reservation tests passed")
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Тест SQL миграций на настоящем Postgres: migrations/*.sql применяются к базовой схеме,
+и функции склада (004, 005), счетчики продавцов (006) и проекция списка заказов (001)
+дают тот же результат, что их Python версии в core/fake_backend.py.
+Нужен TEST_DATABASE_URL (пустая база или база, где можно создать схему); без него тест пропускается.
+Каждый тест работает в своей схеме и удаляет ее в конце.
+"""
+
+import copy
+import json
+import os
+import uuid
+from pathlib import Path
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+from psycopg2.extras import Json  # noqa: E402
+
+from core.fake_backend import create_fake_supabase  # noqa: E402
+
+DSN_ENV = 'TEST_DATABASE_URL'
+MIGRATIONS = sorted((Path(__file__).parent / 'migrations').glob('*.sql'))
+
+# Таблицы Supabase, на которые опираются миграции (только колонки, которые они используют)
+BASE_SCHEMA = """
+CREATE TABLE sellers (
+    id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+    name text NOT NULL,
+    description text,
+    is_active boolean DEFAULT true
+);
+CREATE TABLE products (
+    id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+    name text NOT NULL,
+    price numeric NOT NULL,
+    quantity integer DEFAULT 0,
+    is_active boolean DEFAULT true,
+    seller_id uuid REFERENCES sellers(id),
+    metadata jsonb DEFAULT '{}'::jsonb,
+    created_at timestamptz DEFAULT now()
+);
+CREATE TABLE flowers (
+    id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+    name text NOT NULL,
+    xml_id text,
+    quantity integer DEFAULT 0,
+    is_active boolean DEFAULT true
+);
+CREATE TABLE product_composition (
+    id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+    product_id uuid REFERENCES products(id) ON DELETE CASCADE,
+    flower_id uuid REFERENCES flowers(id),
+    amount integer NOT NULL
+);
+CREATE TABLE orders (
+    id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+    order_number text,
+    bitrix_order_id bigint,
+    status text NOT NULL DEFAULT 'new',
+    recipient_name text,
+    recipient_phone text,
+    delivery_address text,
+    total_amount numeric,
+    responsible_name text,
+    payment_method text,
+    metadata jsonb DEFAULT '{}'::jsonb,
+    created_at timestamptz NOT NULL DEFAULT now(),
+    updated_at timestamptz DEFAULT now()
+);
+CREATE TABLE order_items (
+    id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+    order_id uuid REFERENCES orders(id) ON DELETE CASCADE,
+    product_id uuid REFERENCES products(id),
+    product_name text,
+    quantity integer,
+    price numeric,
+    product_snapshot jsonb,
+    created_at timestamptz DEFAULT now()
+);
+CREATE TABLE flower_inventory_movements (
+    id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+    flower_id uuid REFERENCES flowers(id),
+    movement_type text,
+    quantity integer,
+    reason text,
+    note text,
+    delivery_date date,
+    created_by text,
+    created_at timestamptz DEFAULT now()
+);
+CREATE TABLE inventory_movements (
+    id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+    product_id uuid REFERENCES products(id),
+    quantity integer,
+    reason text,
+    note text,
+    delivery_date date,
+    created_at timestamptz DEFAULT now()
+);
+"""
+
+SHOP, ARCHIVE = '5e11e000-0000-0000-0000-000000000001', '5e11e000-0000-0000-0000-000000000002'
+BOUQUET, CARD, VASE = ('90000000-0000-0000-0000-00000000000%d' % index for index in (1, 2, 3))
+ROSE, GYPS = 'f1000000-0000-0000-0000-000000000001', 'f1000000-0000-0000-0000-000000000002'
+ORDER, SECOND_ORDER = '0d000000-0000-0000-0000-000000000001', '0d000000-0000-0000-0000-000000000002'
+
+
+def _tables():
+    """Строки до миграций - одни и те же для Postgres и FakeBackend"""
+    return {
+        'sellers': [
+            {'id': SHOP, 'name': 'Цветы Алматы'},
+            {'id': ARCHIVE, 'name': 'Архив'},
+        ],
+        'products': [
+            {'id': BOUQUET, 'name': 'Букет роз', 'price': 15000, 'quantity': 0, 'is_active': True, 'seller_id': SHOP,
+             'metadata': {'properties': {'ru_img_miniature': '/upload/bouquet.jpg'}}},
+            {'id': CARD, 'name': 'Открытка', 'price': 500, 'quantity': 3, 'is_active': True, 'seller_id': SHOP, 'metadata': {}},
+            {'id': VASE, 'name': 'Ваза', 'price': 4000, 'quantity': 1, 'is_active': False, 'seller_id': ARCHIVE, 'metadata': {}},
+        ],
+        'flowers': [
+            {'id': ROSE, 'name': 'Роза красная', 'quantity': 30},
+            {'id': GYPS, 'name': 'Гипсофила', 'quantity': 5},
+        ],
+        'product_composition': [
+            {'id': str(uuid.uuid4()), 'product_id': BOUQUET, 'flower_id': ROSE, 'amount': 11},
+            {'id': str(uuid.uuid4()), 'product_id': BOUQUET, 'flower_id': GYPS, 'amount': 2},
+        ],
+        'orders': [
+            {'id': ORDER, 'order_number': '1001', 'bitrix_order_id': 122183, 'status': 'new',
+             'recipient_name': 'Айгуль', 'recipient_phone': '8 (701) 123-45-67', 'delivery_address': 'Абая 1',
+             'created_at': '2025-01-01T10:00:00+00:00'},
+        ],
+        'order_items': [
+            {'id': str(uuid.uuid4()), 'order_id': ORDER, 'product_id': BOUQUET, 'quantity': 1,
+             'created_at': '2025-01-01T10:00:00+00:00'},
+        ],
+        'flower_inventory_movements': [],
+        'inventory_movements': [],
+    }
+
+
+@pytest.fixture
+def pg():
+    dsn = os.environ.get(DSN_ENV)
+    if not dsn:
+        pytest.skip(f'{DSN_ENV} is not set')
+    connection = psycopg2.connect(dsn)
+    connection.autocommit = True
+    cursor = connection.cursor()
+    cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+    if cursor.fetchone() is None:
+        connection.close()
+        pytest.skip('pg_trgm is not available (migrations/002)')
+
+    schema = f'migrations_test_{uuid.uuid4().hex[:8]}'
+    cursor.execute(f'CREATE SCHEMA {schema}')
+    cursor.execute(f'SET search_path TO {schema}, public')
+    try:
+        cursor.execute(BASE_SCHEMA)
+        for table, rows in _tables().items():
+            for row in rows:
+                columns = ', '.join(row)
+                placeholders = ', '.join(['%s'] * len(row))
+                values = [Json(value) if isinstance(value, dict) else value for value in row.values()]
+                cursor.execute(f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', values)
+        for path in MIGRATIONS:
+            cursor.execute(path.read_text(encoding='utf-8'))
+        yield cursor
+    finally:
+        cursor.execute(f'DROP SCHEMA {schema} CASCADE')
+        connection.close()
+
+
+def _fake():
+    """FakeBackend в состоянии после миграций: проекция заказов (001), начальный снимок остатков (005), счетчики (006)"""
+    db = create_fake_supabase(tables=_tables())
+    backend = db._backend
+    backend._triggers['orders'](backend, [], backend.tables['orders'])
+    backend._rpc['rebuild_seller_product_counts'](backend, {})
+    db._backend.tables['stock_snapshots'] = [
+        {'ledger_id': 0, 'item_type': item_type, 'item_id': row['id'], 'quantity': row['quantity']}
+        for item_type, table in (('flower', 'flowers'), ('product', 'products'))
+        for row in db._backend.tables[table]
+    ]
+    return db._backend
+
+
+def _call(cursor, function: str, params: dict, rows: bool = False):
+    """Вызов функции как через PostgREST rpc: именованные аргументы, ответ jsonb"""
+    arguments = ', '.join(f'{name} => %s' for name in params)
+    values = [Json(value) if isinstance(value, (dict, list)) else value for value in params.values()]
+    if rows:
+        cursor.execute(f'SELECT coalesce(jsonb_agg(to_jsonb(r)), \'[]\') FROM {function}({arguments}) r', values)
+    else:
+        cursor.execute(f'SELECT {function}({arguments})', values)
+    return cursor.fetchone()[0]
+
+
+def _normalize(value):
+    """Списки без учета порядка, без id/created_at строк журнала"""
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items() if key not in ('id', 'created_at')}
+    if isinstance(value, list):
+        return sorted((_normalize(item) for item in value), key=lambda item: json.dumps(item, sort_keys=True))
+    return value
+
+
+def _quantities(cursor):
+    cursor.execute("SELECT id::text, quantity FROM flowers UNION ALL SELECT id::text, quantity FROM products")
+    return dict(cursor.fetchall())
+
+
+def _fake_quantities(backend):
+    return {row['id']: row['quantity'] for table in ('flowers', 'products') for row in backend.tables[table]}
+
+
+def _ledger(cursor):
+    cursor.execute("SELECT item_type, item_id::text, delta, balance, movement_type FROM stock_ledger ORDER BY id")
+    return [list(row) for row in cursor.fetchall()]
+
+
+def _fake_ledger(backend):
+    return [
+        [row['item_type'], row['item_id'], row['delta'], row['balance'], row['movement_type']]
+        for row in backend.tables.get('stock_ledger', [])
+    ]
+
+
+def test_reserve_inventory_matches_fake(pg):
+    backend = _fake()
+    calls = [
+        {'p_items': [{'product_id': BOUQUET, 'quantity': 2}, {'product_id': CARD, 'quantity': 1}], 'p_operation': 'reserve'},
+        # Нехватка: ничего не меняется
+        {'p_items': [{'product_id': BOUQUET, 'quantity': 1}], 'p_operation': 'reserve'},
+        {'p_items': [{'product_id': str(uuid.uuid4()), 'quantity': 1}], 'p_operation': 'reserve'},
+        {'p_items': [{'product_id': BOUQUET, 'quantity': 2}, {'product_id': CARD, 'quantity': 1}], 'p_operation': 'release'},
+    ]
+    for params in calls:
+        expected = backend._rpc['reserve_inventory'](backend, copy.deepcopy(params))
+        assert _normalize(_call(pg, 'reserve_inventory', params)) == _normalize(expected), params
+        assert _quantities(pg) == _fake_quantities(backend)
+    assert sorted(_ledger(pg)) == sorted(_fake_ledger(backend))
+
+
+def test_stock_ledger_matches_fake(pg):
+    backend = _fake()
+    entries = [
+        [{'item_type': 'flower', 'item_id': ROSE, 'movement_type': 'delivery', 'delta': 20},
+         {'item_type': 'product', 'item_id': CARD, 'movement_type': 'count', 'count': 7}],
+        [{'item_type': 'flower', 'item_id': GYPS, 'movement_type': 'writeoff', 'delta': -9, 'guard': True}],
+        [{'item_type': 'flower', 'item_id': str(uuid.uuid4()), 'movement_type': 'delivery', 'delta': 1}],
+    ]
+    for params in entries:
+        expected = backend._rpc['record_stock_movements'](backend, {'p_entries': copy.deepcopy(params)})
+        assert _normalize(_call(pg, 'record_stock_movements', {'p_entries': params})) == _normalize(expected)
+    assert _quantities(pg) == _fake_quantities(backend)
+    assert _ledger(pg) == _fake_ledger(backend)
+
+    expected = backend._rpc['take_stock_snapshot'](backend, {})
+    assert _call(pg, 'take_stock_snapshot', {})['items'] == expected['items']
+    assert _call(pg, 'verify_stock_ledger', {}, rows=True) == [] == backend._rpc['verify_stock_ledger'](backend, {})
+
+    # Запись в обход журнала находится проверкой
+    pg.execute('UPDATE flowers SET quantity = 1 WHERE id = %s', (ROSE,))
+    next(row for row in backend.tables['flowers'] if row['id'] == ROSE)['quantity'] = 1
+    drift = _call(pg, 'verify_stock_ledger', {}, rows=True)
+    assert _normalize(drift) == _normalize(backend._rpc['verify_stock_ledger'](backend, {}))
+    assert [(row['item_id'], row['expected'], row['quantity']) for row in drift] == [(ROSE, 50, 1)]
+
+
+def test_seller_counts_follow_products(pg):
+    backend = _fake()
+    client = backend.sync_client()
+
+    def counts():
+        pg.execute('SELECT id::text, product_count, active_product_count FROM sellers ORDER BY id')
+        return [list(row) for row in pg.fetchall()]
+
+    def fake_counts():
+        return [
+            [row['id'], row['product_count'], row['active_product_count']]
+            for row in sorted(backend.tables['sellers'], key=lambda row: row['id'])
+        ]
+
+    # Заполнены миграцией
+    assert counts() == fake_counts() == [[SHOP, 2, 2], [ARCHIVE, 1, 0]]
+
+    extra = str(uuid.uuid4())
+    pg.execute('INSERT INTO products (id, name, price, is_active, seller_id) VALUES (%s, %s, 100, false, %s)', (extra, 'Лента', SHOP))
+    client.table('products').insert({'id': extra, 'name': 'Лента', 'price': 100, 'is_active': False, 'seller_id': SHOP}).execute()
+    pg.execute('UPDATE products SET is_active = false WHERE seller_id = %s', (SHOP,))
+    client.table('products').update({'is_active': False}).eq('seller_id', SHOP).execute()
+    pg.execute('UPDATE products SET seller_id = %s, is_active = true WHERE id = %s', (ARCHIVE, CARD))
+    client.table('products').update({'seller_id': ARCHIVE, 'is_active': True}).eq('id', CARD).execute()
+    pg.execute('DELETE FROM products WHERE id = %s', (VASE,))
+    client.table('products').delete().eq('id', VASE).execute()
+
+    assert counts() == fake_counts() == [[SHOP, 2, 0], [ARCHIVE, 1, 1]]
+    # Пересчет с нуля ничего не меняет
+    assert _call(pg, 'rebuild_seller_product_counts', {}) == 0
+
+
+def test_order_list_rows_follow_orders(pg):
+    backend = _fake()
+    client = backend.sync_client()
+
+    def rows():
+        pg.execute('SELECT id::text, status, item_images FROM order_list_rows ORDER BY id')
+        return [list(row) for row in pg.fetchall()]
+
+    def fake_rows():
+        return [
+            [row['id'], row['status'], row['item_images']]
+            for row in sorted(backend.tables['order_list_rows'], key=lambda row: row['id'])
+        ]
+
+    # Заполнены миграцией, картинки - как у core/order_list
+    assert rows() == fake_rows() == [[ORDER, 'new', ['https://cvety.kz/upload/bouquet.jpg']]]
+
+    # Запись в обход приложения (скрипты синхронизации, webhook'и) обновляет проекцию триггерами
+    second, item = SECOND_ORDER, str(uuid.uuid4())
+    pg.execute("INSERT INTO orders (id, status, created_at) VALUES (%s, 'new', '2025-01-02T10:00:00+00:00')", (second,))
+    client.table('orders').insert({'id': second, 'status': 'new', 'created_at': '2025-01-02T10:00:00+00:00'}).execute()
+    snapshot = {'bitrix': {'product_id': 77}}
+    pg.execute('INSERT INTO order_items (id, order_id, product_snapshot) VALUES (%s, %s, %s)', (item, second, Json(snapshot)))
+    client.table('order_items').insert({'id': item, 'order_id': second, 'product_id': None, 'product_snapshot': snapshot}).execute()
+    pg.execute("UPDATE orders SET status = 'paid' WHERE id = %s", (second,))
+    client.table('orders').update({'status': 'paid'}).eq('id', second).execute()
+    pg.execute('DELETE FROM order_items WHERE order_id = %s', (ORDER,))
+    client.table('order_items').delete().eq('order_id', ORDER).execute()
+    assert rows() == fake_rows()
+    assert [row[1:] for row in rows()] == [['new', []], ['paid', ['https://cvety.kz/miniature/77-obrannyy-buket.jpg']]]
+
+    pg.execute('DELETE FROM orders WHERE id = %s', (second,))
+    client.table('orders').delete().eq('id', second).execute()
+    assert rows() == fake_rows() and len(rows()) == 1
+
+
+def test_order_flags_backfill_tolerates_legacy_rows(pg):
+    """migrations/003 на строках старых писателей: NULL в bitrix id/получателе, pickup_order строкой"""
+    legacy = {
+        'empty': ({'pickup_order': ''}, None),
+        'yes': ({'pickup_order': 'Y'}, None),
+        'true': ({'pickup_order': 'true'}, 'card'),
+        'kaspi': ({'order_properties': {'kaspiPhone': '87011234567'}}, 'cash'),
+    }
+    ids = {name: str(uuid.uuid4()) for name in legacy}
+    for name, (metadata, payment_method) in legacy.items():
+        pg.execute(
+            'INSERT INTO orders (id, metadata, payment_method) VALUES (%s, %s, %s)',
+            (ids[name], Json(metadata), payment_method)
+        )
+    # Миграция повторяемая: заполняет только строки без payment_method_resolved
+    pg.execute(next(path for path in MIGRATIONS if path.name.startswith('003_')).read_text(encoding='utf-8'))
+
+    pg.execute('SELECT id::text, is_test, is_pickup, payment_method_resolved FROM orders WHERE id = ANY(%s::uuid[])',
+               (list(ids.values()),))
+    flags = {row[0]: list(row[1:]) for row in pg.fetchall()}
+    assert {name: flags[ids[name]] for name in legacy} == {
+        'empty': [False, False, 'unknown'],
+        'yes': [False, True, 'unknown'],
+        'true': [False, True, 'unknown'],
+        'kaspi': [False, False, 'kaspi'],
+    }
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-q']))
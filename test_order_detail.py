@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Тест загрузки страницы заказа: один встроенный запрос и параллельный запасной путь
+"""
+
+import asyncio
+
+from core.fake_backend import create_fake_supabase, seed_fixtures
+from core.order_detail import UNNAMED_PRODUCT, _load_order_detail_parallel, detail_items, detail_version, load_order_detail
+
+
+def _db():
+    tables = seed_fixtures(orders=5, products=6)
+    order = tables['orders'][0]
+    order['user_id'], order['responsible_id'] = tables['users'][0]['id'], tables['users'][1]['id']
+    return create_fake_supabase(tables=tables), order
+
+
+def test_embedded_detail_in_one_request():
+    db, order = _db()
+    calls = db._backend.calls
+    detail = asyncio.run(load_order_detail(db, order['id']))
+
+    assert db._backend.calls - calls == 1
+    assert detail['customer']['id'] == order['user_id'] and detail['florist']['id'] == order['responsible_id']
+    assert detail['order_items'] and all(set(item['products']) == {'id', 'name', 'updated_at', 'miniature'} for item in detail['order_items'])
+    assert asyncio.run(load_order_detail(db, 'missing')) is None
+
+
+def test_parallel_fallback_matches_embedded():
+    db, order = _db()
+    embedded = asyncio.run(load_order_detail(db, order['id']))
+    parallel = asyncio.run(_load_order_detail_parallel(db, order['id']))
+
+    assert parallel['customer'] == embedded['customer'] and parallel['florist'] == embedded['florist']
+    assert detail_items(parallel['order_items']) == detail_items(embedded['order_items'])
+
+    # Без товара каталога - название и миниатюра из снимка позиции
+    items = detail_items([{'products': None, 'product_snapshot': {'bitrix': {'product_id': 555}}}])
+    assert items[0]['product_name'] == UNNAMED_PRODUCT
+    assert items[0]['product_image'] == 'https://cvety.kz/miniature/555-obrannyy-buket.jpg'
+
+
+def test_version_follows_embedded_rows():
+    """Правки товара позиции и пользователей (в том числе из других процессов) меняют версию страницы"""
+    db, order = _db()
+
+    def version():
+        detail = asyncio.run(load_order_detail(db, order['id']))
+        return detail_version(detail, detail['order_items'], detail['customer'], detail['florist'])
+
+    sync = db.sync_client
+    item = sync.table('order_items').select('product_id').eq('order_id', order['id']).limit(1).execute().data[0]
+    first = version()
+    assert version() == first
+    sync.table('products').update({'name': 'Новый букет', 'updated_at': '2030-01-01T00:00:00+00:00'}).eq('id', item['product_id']).execute()
+    second = version()
+    assert second != first
+    sync.table('users').update({'name': 'Айгерим', 'updated_at': '2030-01-01T00:00:00+00:00'}).eq('id', order['responsible_id']).execute()
+    third = version()
+    assert third != second
+    sync.table('order_items').delete().eq('order_id', order['id']).execute()
+    assert version() != third
+
+
+if __name__ == "__main__":
+    test_embedded_detail_in_one_request()
+    test_parallel_fallback_matches_embedded()
+    test_version_follows_embedded_rows()
+    print("✅ order detail loading tests passed")
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Тест производных колонок заказа: тестовый заказ, способ оплаты, самовывоз
+"""
+
+from core.order_flags import derive_order_flags, is_test_order, resolve_payment_method
+from core.transformer import OptimizedTransformer
+
+
+def test_derive_order_flags():
+    assert is_test_order({'bitrix_order_id': 1756910001})
+    assert is_test_order({'recipient_name': 'Получатель Обратной Синхронизации'})
+    assert is_test_order({'recipient_name': 'REVERSE_SYNC test'})
+    assert not is_test_order({'bitrix_order_id': 120001, 'recipient_name': 'Айгерим'})
+
+    assert resolve_payment_method({'kaspiPhone': '+77011234567'}) == 'kaspi'
+    assert resolve_payment_method({'METHOD_PAY': {'CODE': 'METHOD_PAY', 'VALUE': 'Оплата картой'}}) == 'card'
+    assert resolve_payment_method({'METHOD_PAY': 'Наличными курьеру'}) == 'cash'
+    # payment_method заказа не учитывается - без признаков в свойствах способ неизвестен
+    assert resolve_payment_method({}) == 'unknown'
+    assert resolve_payment_method(None) == 'unknown'
+
+    assert derive_order_flags({'delivery_address': 'Самовывоз', 'payment_method': 'card'}) == {
+        'is_test': False, 'payment_method_resolved': 'unknown', 'is_pickup': True
+    }
+
+
+def test_transformer_writes_flags():
+    transformer = OptimizedTransformer()
+    order = transformer.transform_bitrix_to_supabase({
+        'ID': '120500', 'ACCOUNT_NUMBER': '120500', 'STATUS_ID': 'N', 'PRICE': '14900',
+        'DATE_INSERT': '2025-01-10 10:00:00', 'PAY_SYSTEM_ID': '2',
+        'properties': {'nameRecipient': 'Алия', 'iWillGet': 'Y', 'kaspiPhone': '87011234567'}
+    })
+    assert order['is_test'] is False
+    assert order['is_pickup'] is True
+    assert order['payment_method_resolved'] == 'kaspi'
+
+    # Частичное обновление без свойств не трогает флаги
+    assert 'is_test' not in transformer.transform_bitrix_update({'ID': '120500', 'STATUS_ID': 'P'})
+
+    update = transformer.transform_bitrix_update({
+        'ID': '120500', 'properties': {'nameRecipient': 'Получатель Обратной Синхронизации'}
+    })
+    assert update['is_test'] is True
+    assert 'is_pickup' not in update and 'payment_method_resolved' not in update
+
+
+if __name__ == "__main__":
+    test_derive_order_flags()
+    test_transformer_writes_flags()
+    print("✅ order flags tests passed")
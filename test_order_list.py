@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Тест проекции order_list_rows: миниатюры позиций и обновление строк после записи заказа
+"""
+
+import asyncio
+
+from config import config
+from core.fake_backend import create_fake_supabase, seed_fixtures
+from core.fragments import row_fragments
+from core.order_list import (
+    MAX_ITEM_IMAGES, ORDER_LIST_TABLE, build_item_images,
+    rebuild_order_list_rows, refresh_order_list_rows
+)
+
+
+def test_build_item_images():
+    snapshot = {'product_snapshot': {'bitrix': {'product_id': 555}}}
+    items = [{'product_id': 'a'}, dict(snapshot, product_id='b'), {'product_id': 'c'}]
+    urls = {'a': 'https://cvety.kz/upload/mini/1.jpg', 'b': None}
+
+    # Картинка каталога, иначе по снимку позиции, позиции без картинки пропускаются
+    assert build_item_images(items, urls) == [
+        'https://cvety.kz/upload/mini/1.jpg',
+        'https://cvety.kz/miniature/555-obrannyy-buket.jpg'
+    ]
+    many = [dict(snapshot, product_id=str(index)) for index in range(MAX_ITEM_IMAGES + 3)]
+    assert len(build_item_images(many, {})) == MAX_ITEM_IMAGES
+
+
+def test_refresh_after_status_change_and_delete():
+    # База без триггеров migrations/001: проекцию пишет приложение
+    config.ORDER_LIST_TRIGGERS = False
+    db = create_fake_supabase(tables=seed_fixtures(orders=20, products=8))
+    db._backend._triggers.pop('orders')
+    db._backend._triggers.pop('order_items')
+    order = db.sync_client.table('orders').select('id, bitrix_order_id').limit(1).execute().data[0]
+
+    async def run():
+        await db.table('orders').update({'status': 'completed'}).eq('id', order['id']).execute()
+        updated = await refresh_order_list_rows(db, bitrix_order_ids=[order['bitrix_order_id']])
+        row = await db.table(ORDER_LIST_TABLE).select('status, item_images').eq('id', order['id']).single().execute()
+
+        await db.table('orders').delete().eq('id', order['id']).execute()
+        await refresh_order_list_rows(db, order_ids=[order['id']])
+        left = await db.table(ORDER_LIST_TABLE).select('id').eq('id', order['id']).execute()
+        return updated, row, left
+
+    try:
+        updated, row, left = asyncio.run(run())
+    finally:
+        config.ORDER_LIST_TRIGGERS = True
+    assert updated == 1
+    assert row.data['status'] == 'completed' and row.data['item_images']
+    assert left.data == []
+
+
+def test_refresh_with_triggers_only_invalidates_rows():
+    db = create_fake_supabase(tables=seed_fixtures(orders=5, products=8))
+    order = db.sync_client.table('orders').select('id, bitrix_order_id').limit(1).execute().data[0]
+    before = row_fragments.generation('order', order['id'])
+
+    async def run():
+        await db.table('orders').update({'status': 'completed'}).eq('id', order['id']).execute()
+        calls = db._backend.calls
+        assert await refresh_order_list_rows(db, order_ids=[order['id']]) == 1
+        # Строку уже пересчитал триггер - ни одного запроса
+        assert db._backend.calls == calls
+        assert await refresh_order_list_rows(db, bitrix_order_ids=[order['bitrix_order_id']]) == 1
+        assert db._backend.calls == calls + 1
+        return await db.table(ORDER_LIST_TABLE).select('status').eq('id', order['id']).single().execute()
+
+    row = asyncio.run(run())
+    assert row.data['status'] == 'completed'
+    assert row_fragments.generation('order', order['id']) != before
+
+
+def test_rebuild_matches_orders():
+    tables = seed_fixtures(orders=35, products=8)
+    tables['order_list_rows'] = []
+    db = create_fake_supabase(tables=tables)
+
+    total = asyncio.run(rebuild_order_list_rows(db, batch_size=10))
+    rows = db.sync_client.table(ORDER_LIST_TABLE).select('id').execute().data
+    assert total == 35 and len(rows) == 35
+
+
+def test_triggers_follow_sync_client_writes():
+    # SyncManager, reverse sync и скрипты пишут через синхронный клиент, минуя приложение
+    db = create_fake_supabase(tables=seed_fixtures(orders=5, products=8))
+    sync = db.sync_client
+    order = sync.table('orders').insert({
+        'order_number': 'B-1', 'bitrix_order_id': 999001, 'status': 'new', 'recipient_name': 'Айгерим'
+    }).execute().data[0]
+    sync.table('order_items').insert({
+        'order_id': order['id'], 'product_id': None, 'quantity': 1, 'product_snapshot': {'bitrix': {'product_id': 77}}
+    }).execute()
+    sync.table('orders').update({'status': 'paid'}).eq('id', order['id']).execute()
+
+    row = sync.table(ORDER_LIST_TABLE).select('status, item_images').eq('id', order['id']).single().execute().data
+    assert row['status'] == 'paid' and row['item_images'] == ['https://cvety.kz/miniature/77-obrannyy-buket.jpg']
+
+    sync.table('orders').delete().eq('id', order['id']).execute()
+    assert sync.table(ORDER_LIST_TABLE).select('id').eq('id', order['id']).execute().data == []
+
+
+if __name__ == "__main__":
+    test_build_item_images()
+    test_refresh_after_status_change_and_delete()
+    test_refresh_with_triggers_only_invalidates_rows()
+    test_rebuild_matches_orders()
+    test_triggers_follow_sync_client_writes()
+    print("✅ order_list_rows projection tests passed")
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Тест поиска заказов: нормализация телефона, условия по полям и ранжирование
+"""
+
+import asyncio
+
+from core.fake_backend import create_fake_supabase
+from core.pagination import ORDERS_KEYSET
+from core.search import apply_match_any, order_search_conditions, phone_digits, rank_orders
+from core.transformer import OptimizedTransformer
+
+
+def test_phone_digits_any_format():
+    assert phone_digits('+7 (701) 123-45-67') == '77011234567'
+    assert phone_digits('8 701 123 45 67') == '77011234567'
+    assert phone_digits('701 123 45 67') == '77011234567'
+    assert phone_digits('') is None
+
+    props = OptimizedTransformer()._extract_order_properties({'phoneRecipient': '8 (701) 123-45-67'})
+    assert props['recipient_phone_digits'] == '77011234567'
+
+
+def test_conditions_and_postgrest_filter():
+    assert [column for column, _, _ in order_search_conditions('Айгерим')] == ['order_number', 'recipient_name', 'delivery_address']
+    assert order_search_conditions('8 (701) 123-45-67')[-1] == ('recipient_phone_digits', 'like', '%77011234567%')
+    assert order_search_conditions('%*') == []
+
+    class Builder:
+        def __init__(self):
+            import httpx
+            self.params = httpx.QueryParams()
+
+    builder = apply_match_any(Builder(), order_search_conditions('пр. Абая, 5'))
+    assert builder.params['and'] == '(or(order_number.ilike."*пр. Абая, 5*",recipient_name.ilike."*пр. Абая, 5*",delivery_address.ilike."*пр. Абая, 5*"))'
+
+
+def test_ranked_search_over_fake_backend():
+    tables = {'orders': [
+        {'id': '1', 'order_number': '100001', 'recipient_name': 'Мадина', 'recipient_phone_digits': '77011234567',
+         'delivery_address': 'ул. Айгерим 5', 'created_at': '2025-01-03T10:00:00+00:00'},
+        {'id': '2', 'order_number': '100002', 'recipient_name': 'Айгерим', 'recipient_phone_digits': '77051112233',
+         'delivery_address': 'пр. Абая 1', 'created_at': '2025-01-02T10:00:00+00:00'},
+        {'id': '3', 'order_number': '100003', 'recipient_name': 'Ольга', 'recipient_phone_digits': '77024567890',
+         'delivery_address': 'пр. Достык 7', 'created_at': '2025-01-01T10:00:00+00:00'},
+    ]}
+    db = create_fake_supabase(tables=tables)
+
+    async def search(term):
+        result = await db.table('orders').select('*').match_any(order_search_conditions(term)).keyset(ORDERS_KEYSET).execute()
+        return [order['id'] for order in rank_orders(result.data, term, 10)]
+
+    assert asyncio.run(search('айгерим')) == ['2', '1']  # имя важнее адреса
+    assert asyncio.run(search('8 701 123 45 67')) == ['1']
+    assert asyncio.run(search('8 701')) == ['1']
+    assert asyncio.run(search('45-67')) == ['1', '3']  # совпадение в конце номера выше
+    assert asyncio.run(search('Достык')) == ['3']
+
+
+if __name__ == "__main__":
+    test_phone_digits_any_format()
+    test_conditions_and_postgrest_filter()
+    test_ranked_search_over_fake_backend()
+    print("✅ order search tests passed")
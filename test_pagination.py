@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Тест keyset пагинации: токены курсора, фильтр PostgREST и разбиение на страницы
+"""
+
+import asyncio
+
+from core.data_access import AsyncSupabase
+from core.pagination import (
+    InvalidCursor, ORDERS_KEYSET, PRODUCTS_KEYSET, decode_cursor, encode_cursor,
+    fetch_keyset_page, keyset_filter
+)
+
+
+class FakeResult:
+    def __init__(self, data):
+        self.data = data
+        self.count = None
+
+
+class FakeQuery:
+    """Сортирует строки по (created_at, id) desc и применяет курсор как PostgREST"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.table = 'orders'
+        self.ops = []
+
+    def __getattr__(self, name):
+        def method(*args, **kwargs):
+            self.ops.append((name, args, kwargs))
+            return self
+        return method
+
+    async def execute(self):
+        keys, after = next(args for name, args, _ in self.ops if name == 'keyset')
+        limit = next(args[0] for name, args, _ in self.ops if name == 'limit')
+        rows = sorted(self.rows, key=lambda r: [r[column] for column, _ in keys], reverse=True)
+        if after is not None:
+            rows = [r for r in rows if [r[column] for column, _ in keys] < list(after)]
+        return FakeResult(rows[:limit])
+
+
+def test_cursor_roundtrip_and_validation():
+    row = {'created_at': '2025-01-02T10:00:00+00:00', 'id': 'b1'}
+    token = encode_cursor(row, ORDERS_KEYSET)
+    assert decode_cursor(token, ORDERS_KEYSET) == ['2025-01-02T10:00:00+00:00', 'b1']
+    assert encode_cursor({'created_at': None, 'id': 'x'}, ORDERS_KEYSET) is None
+
+    for bad in ('not-base64!!', encode_cursor(row, ORDERS_KEYSET)):
+        try:
+            decode_cursor(bad, PRODUCTS_KEYSET)
+        except InvalidCursor:
+            continue
+        raise AssertionError(f"cursor {bad!r} should be rejected")
+
+
+def test_keyset_filter_on_postgrest_builder():
+    """Курсор превращается в or=(...) и сортировку по всем ключам"""
+    assert keyset_filter(PRODUCTS_KEYSET, [True, '2025-01-01', 'p1']) == (
+        'is_active.lt.true,'
+        'and(is_active.eq.true,created_at.lt."2025-01-01"),'
+        'and(is_active.eq.true,created_at.eq."2025-01-01",id.lt."p1")'
+    )
+
+    db = AsyncSupabase('http://localhost', 'key')
+    query = db.table('orders').select('id').eq('status', 'new').keyset(ORDERS_KEYSET, ['2025-01-01T10:00:00', 'o1']).limit(51)
+    params = dict(db._build(query).params)
+    assert params['order'] == 'created_at.desc,id.desc'
+    assert params['or'] == '(created_at.lt."2025-01-01T10:00:00",and(created_at.eq."2025-01-01T10:00:00",id.lt."o1"))'
+    assert params['status'] == 'eq.new'
+
+
+def test_pages_do_not_overlap_with_equal_timestamps():
+    """Одинаковый created_at не приводит к пропускам и повторам"""
+    rows = [{'created_at': '2025-01-01', 'id': f'{i:02d}'} for i in range(5)] + \
+           [{'created_at': '2025-01-02', 'id': f'{i:02d}'} for i in range(5, 7)]
+
+    async def run():
+        seen, cursor = [], None
+        while True:
+            page = await fetch_keyset_page(FakeQuery(rows), ORDERS_KEYSET, cursor, limit=3)
+            seen.extend(row['id'] for row in page.data)
+            if not page.has_more:
+                return seen
+            cursor = page.next_cursor
+
+    assert asyncio.run(run()) == ['06', '05', '04', '03', '02', '01', '00']
+
+
+if __name__ == "__main__":
+    test_cursor_roundtrip_and_validation()
+    test_keyset_filter_on_postgrest_builder()
+    test_pages_do_not_overlap_with_equal_timestamps()
+    print("✅ Тесты keyset пагинации пройдены")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Тест плана закупки: потребность по дням из составов, остаток, ожидаемые поставки и резерв CRM
+"""
+
+import asyncio
+from datetime import date
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from core.bom import BomIndex
+from core.fake_backend import create_fake_supabase
+from core.procurement import FlowerDemand, plan_procurement
+
+START = date(2025, 3, 6)
+
+COMPOSITION = [
+    {'product_id': 'roses', 'flower_id': 'rose', 'amount': 5},
+    {'product_id': 'mix', 'flower_id': 'rose', 'amount': 3},
+    {'product_id': 'mix', 'flower_id': 'tulip', 'amount': 4},
+]
+
+
+def _order(order_id, day, items, bitrix_order_id=1, status='paid'):
+    return {
+        'id': order_id, 'delivery_date': f'2025-03-{day:02d}', 'bitrix_order_id': bitrix_order_id, 'status': status,
+        'order_items': [{'product_id': product_id, 'quantity': quantity} for product_id, quantity in items]
+    }
+
+
+def test_daily_shortfall():
+    bom = BomIndex()
+    bom.load(COMPOSITION)
+    demand = FlowerDemand(bom, START, 3)
+    demand.add_orders([
+        _order('a', 6, [('roses', 2), ('mix', 1)]),     # 13 роз, 4 тюльпана
+        _order('b', 7, [('mix', 3), ('card', 1)]),      # 9 роз, 12 тюльпанов, открытка без состава
+        _order('c', 8, [('roses', 4)]),                 # 20 роз
+        _order('d', 8, [('roses', 1)], bitrix_order_id=None),  # заказ CRM - уже списан со склада
+        _order('e', 9, [('roses', 10)]),                # за окном
+    ])
+    report = demand.report(
+        [{'id': 'rose', 'name': 'Роза', 'quantity': 20}, {'id': 'tulip', 'name': 'Тюльпан', 'quantity': 10}],
+        incoming=[{'flower_id': 'rose', 'quantity': 10, 'delivery_date': '2025-03-08'}]
+    )
+
+    assert [day['orders'] for day in report['days']] == [1, 1, 1]
+    assert report['reserved_orders'] == 1 and report['items_without_composition'] == 1
+    by_day = [{flower['flower_id']: flower['shortfall'] for flower in day['flowers']} for day in report['days']]
+    # Розы: 20 в наличии, 13 + 9 к 7-му - не хватает 2; 8-го еще 20, пришло 10 - еще 10
+    # Тюльпаны: 10 в наличии, 4 + 12 к 7-му - не хватает 6
+    assert by_day == [{'rose': 0, 'tulip': 0}, {'rose': 2, 'tulip': 6}, {'rose': 10}]
+    assert report['days'][2]['flowers'][0]['reserved'] == 5
+    totals = {flower['flower_id']: flower for flower in report['flowers']}
+    assert totals['rose']['shortfall'] == 12 and totals['rose']['incoming'] == 10
+    assert totals['tulip']['required'] == 16 and report['shortfall'] == 18
+
+
+def test_plan_reads_orders_in_pages():
+    tables = {
+        'flowers': [{'id': 'rose', 'name': 'Роза', 'quantity': 4}, {'id': 'tulip', 'name': 'Тюльпан', 'quantity': 0}],
+        'product_composition': [dict(row) for row in COMPOSITION],
+        'orders': [
+            {key: value for key, value in _order('a', 6, []).items() if key != 'order_items'},
+            {key: value for key, value in _order('b', 7, [], status='cancelled').items() if key != 'order_items'},
+        ],
+        'order_items': [
+            {'id': 'i1', 'order_id': 'a', 'product_id': 'roses', 'quantity': 1},
+            {'id': 'i2', 'order_id': 'b', 'product_id': 'roses', 'quantity': 5},
+        ],
+    }
+    db = create_fake_supabase(tables=tables)
+    report = asyncio.run(plan_procurement(db, START, 7, ['paid'], bom=BomIndex()))
+    assert report['end'] == '2025-03-12' and report['orders'] == 1
+    assert report['flowers'] == [{
+        'flower_id': 'rose', 'name': 'Роза', 'required': 5, 'reserved': 0, 'stock': 4, 'incoming': 0, 'shortfall': 1
+    }]
+
+
+if __name__ == "__main__":
+    test_daily_shortfall()
+    test_plan_reads_orders_in_pages()
+    print("✅ procurement plan tests passed")
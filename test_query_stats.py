@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Тест инструментации запросов: сводка по HTTP запросу, Server-Timing, синхронный клиент PostgREST и курсор MySQL
+"""
+
+import httpx
+from postgrest import SyncPostgrestClient
+
+from monitoring.query_stats import (
+    RequestQueryStats, current_query_stats, describe_filters, instrument_cursor,
+    instrument_http_client, parse_server_timing, query_stats, record_query
+)
+
+
+class FakeCursor:
+    """DB-API курсор без базы"""
+
+    def __init__(self):
+        self.rowcount = -1
+        self.executed = []
+
+    def execute(self, operation, params=None):
+        self.executed.append((operation, params))
+        self.rowcount = 3
+
+    def fetchall(self):
+        return [(1,), (2,), (3,)]
+
+
+def test_describe_filters_hides_values():
+    """В описании фильтров только колонки и операции, без значений"""
+    ops = [
+        ('select', ('id',), {}),
+        ('eq', ('recipient_phone', '+77011234567'), {}),
+        ('in_', ('id', [1, 2, 3]), {}),
+        ('order', ('created_at',), {'desc': True}),
+    ]
+    assert describe_filters(ops) == ['recipient_phone eq', 'id in[3]']
+
+
+def test_request_summary_and_server_timing():
+    """Запросы попадают в сводку текущего HTTP запроса и в заголовок"""
+    stats = RequestQueryStats()
+    token = current_query_stats.set(stats)
+    try:
+        record_query('supabase', 'orders', 'select', [], 20, 12.5)
+        record_query('supabase', 'order_items', 'select', ['order_id in[20]'], 45, 7.5)
+    finally:
+        current_query_stats.reset(token)
+
+    summary = stats.summary()
+    assert summary['queries'] == 2
+    assert summary['db_ms'] == 20.0
+    assert summary['by_table'] == {'orders': 1, 'order_items': 1}
+
+    timing = parse_server_timing(stats.server_timing(loader_hits=4))
+    assert timing['db']['dur'] == 20.0
+    assert timing['db']['desc'] == '2 queries'
+    assert timing['loader']['desc'] == '4 cached lookups'
+    assert 'dur' in timing['app']
+
+
+def test_instrumented_mysql_cursor():
+    """Курсор MySQL записывает таблицу, тип запроса и число строк"""
+    query_stats.clear()
+    cursor = instrument_cursor(FakeCursor())
+    cursor.execute("SELECT ID FROM b_sale_order WHERE ID > %s", (100,))
+
+    assert cursor.fetchall() == [(1,), (2,), (3,)]
+    entry = query_stats.get_stats()['queries']['mysql:select:b_sale_order']
+    assert entry['count'] == 1
+    assert entry['rows'] == 3
+
+
+def test_sync_postgrest_client_hooks():
+    """Запросы синхронного клиента (webhook'и, скрипты синхронизации) тоже в сводке запроса"""
+    def respond(request):
+        if request.method == 'GET':
+            return httpx.Response(200, json=[{'id': 1}, {'id': 2}], headers={'content-range': '0-1/*'})
+        return httpx.Response(201, json=[{'id': 3}])
+
+    client = SyncPostgrestClient('http://supabase.test/rest/v1')
+    client.session = instrument_http_client(
+        httpx.Client(base_url='http://supabase.test/rest/v1', transport=httpx.MockTransport(respond))
+    )
+    stats = RequestQueryStats()
+    token = current_query_stats.set(stats)
+    try:
+        client.from_('orders').select('id').eq('recipient_phone', '+77011234567').in_('status', ['new', 'paid']).execute()
+        client.from_('sync_log').insert({'action': 'update_status'}).execute()
+        client.rpc('reserve_inventory', {'p_items': []}).execute()
+    finally:
+        current_query_stats.reset(token)
+
+    described = [(record.source, record.verb, record.table, record.filters, record.rows) for record in stats.records]
+    assert described == [
+        ('supabase-sync', 'select', 'orders', ['recipient_phone eq', 'status in[2]'], 2),
+        ('supabase-sync', 'insert', 'sync_log', [], 1),
+        ('supabase-sync', 'rpc', 'reserve_inventory', [], 1),
+    ]
+
+
+if __name__ == "__main__":
+    test_describe_filters_hides_values()
+    test_request_summary_and_server_timing()
+    test_instrumented_mysql_cursor()
+    test_sync_postgrest_client_hooks()
+    print("✅ Тесты инструментации запросов пройдены")
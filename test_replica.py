@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Тест локальной реплики справочных таблиц: догоняющая синхронизация по updated_at,
+удаления, остатки журнала склада и страницы с теми же курсорами, что у Supabase
+"""
+
+import asyncio
+
+from core.data_access import add_write_listener
+from core.fake_backend import create_fake_supabase
+from core.pagination import PRODUCTS_KEYSET, fetch_page
+from core.replica import ReferenceReplica
+
+
+def _tables():
+    return {
+        'sellers': [
+            {'id': 's1', 'name': 'Цветы Алматы', 'is_active': True, 'updated_at': '2025-01-01T00:00:00+00:00'},
+            {'id': 's2', 'name': 'Архив', 'is_active': False, 'updated_at': '2025-01-01T00:00:00+00:00'},
+        ],
+        'flowers': [
+            {'id': 'rose', 'name': 'Роза', 'xml_id': 'rose', 'quantity': 100, 'is_active': True, 'updated_at': '2025-01-01T00:00:00+00:00'},
+            {'id': 'tulip', 'name': 'Тюльпан', 'xml_id': 'tulip', 'quantity': 40, 'is_active': True, 'updated_at': '2025-01-01T00:00:00+00:00'},
+        ],
+        'products': [
+            {
+                'id': f'p{index}', 'name': f'Букет {index}', 'price': 1000 * index, 'quantity': 1,
+                'is_active': index % 3 != 0, 'seller_id': 's1' if index % 2 else 's2', 'metadata': {},
+                'created_at': f'2025-01-{index:02d}T10:00:00+00:00', 'updated_at': '2025-01-01T00:00:00+00:00'
+            }
+            for index in range(1, 8)
+        ],
+        'product_composition': [
+            {'id': 'c1', 'product_id': 'p1', 'flower_id': 'rose', 'amount': 25, 'updated_at': '2025-01-01T00:00:00+00:00'},
+            {'id': 'c2', 'product_id': 'p2', 'flower_id': 'rose', 'amount': 5, 'updated_at': '2025-01-01T00:00:00+00:00'},
+            {'id': 'c3', 'product_id': 'p2', 'flower_id': 'tulip', 'amount': 7, 'updated_at': '2025-01-01T00:00:00+00:00'},
+        ],
+    }
+
+
+def test_reads_match_supabase():
+    db = create_fake_supabase(tables=_tables())
+    replica = ReferenceReplica(':memory:')
+
+    async def run():
+        assert await replica.ready(db)
+        assert replica.get_stats()['rows'] == {'flowers': 2, 'products': 7, 'product_composition': 3, 'sellers': 2}
+
+        # Страницы и курсоры совпадают со страницами из Supabase
+        cursor = local_cursor = None
+        for _ in range(3):
+            remote = await fetch_page(db.table('products').select('id, is_active, created_at'), PRODUCTS_KEYSET, 3, cursor)
+            local = replica.page('products', PRODUCTS_KEYSET, 3, local_cursor)
+            assert [row['id'] for row in local.data] == [row['id'] for row in remote.data]
+            assert local.next_cursor == remote.next_cursor and local.count == 7
+            cursor = local_cursor = remote.next_cursor
+        assert replica.page('products', PRODUCTS_KEYSET, 3, page=2).data[0]['id'] == \
+            (await fetch_page(db.table('products').select('id, is_active, created_at'), PRODUCTS_KEYSET, 3, page=2)).data[0]['id']
+
+        active = replica.page('products', PRODUCTS_KEYSET, 50, where={'is_active': True, 'seller_id': 's1'}, search='БУКЕТ')
+        assert [row['id'] for row in active.data] == ['p7', 'p5', 'p1']
+
+        # Соединения: составы цветка с товарами и состав товара с цветами
+        rose = replica.compositions(flower_id='rose')
+        assert [(item['product_id'], item['amount'], item['products']['name']) for item in rose] == [('p1', 25, 'Букет 1'), ('p2', 5, 'Букет 2')]
+        assert [item['flowers']['xml_id'] for item in replica.compositions(product_id='p2')] == ['tulip', 'rose']
+        assert [seller['name'] for seller in replica.rows('sellers', {'is_active': True})] == ['Цветы Алматы']
+        assert replica.get_many('sellers', ['s2'])['s2']['name'] == 'Архив'
+
+    asyncio.run(run())
+
+
+def test_catches_up_after_writes():
+    db = create_fake_supabase(tables=_tables())
+    replica = ReferenceReplica(':memory:', sync_seconds=3600)
+    add_write_listener(replica.note_write)
+
+    async def run():
+        await replica.ensure_synced(db)
+        calls = db._backend.calls
+        await replica.ensure_synced(db)
+        assert db._backend.calls == calls
+
+        # UPDATE выставляет updated_at (migrations/007) - догоняется только таблица товаров
+        await db.table('products').update({'name': 'Букет роз'}).eq('id', 'p1').execute()
+        calls = db._backend.calls
+        await replica.ensure_synced(db)
+        assert db._backend.calls == calls + 1
+        assert replica.get('products', 'p1')['name'] == 'Букет роз'
+
+        # Удаление: сверка id и новые строки после него
+        await db.table('product_composition').delete().eq('product_id', 'p2').execute()
+        await db.table('product_composition').insert({'product_id': 'p2', 'flower_id': 'tulip', 'amount': 9}).execute()
+        await replica.ensure_synced(db)
+        assert [(item['flower_id'], item['amount']) for item in replica.compositions(product_id='p2')] == [('tulip', 9)]
+        assert [item['product_id'] for item in replica.compositions(flower_id='rose')] == ['p1']
+
+        # Webhook (запись через синхронный клиент) - invalidate
+        db._backend.sync_client().table('sellers').update({'is_active': True}).eq('id', 's2').execute()
+        replica.invalidate(('sellers',))
+        await replica.ensure_synced(db)
+        assert len(replica.rows('sellers', {'is_active': True})) == 2
+
+        # Остатки журнала склада - сразу, без синхронизации
+        replica.apply_stock_changes([{'item_type': 'flower', 'item_id': 'rose', 'old_quantity': 100, 'new_quantity': 75}])
+        assert replica.get('flowers', 'rose')['quantity'] == 75
+        assert replica.full_loads == 4
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_reads_match_supabase()
+    test_catches_up_after_writes()
+    print("✅ reference replica tests passed")
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Тест счетчиков товаров продавцов: поддержка при записи товаров, пересчет и фильтр магазинов
+"""
+
+import asyncio
+
+import core.seller_counts as seller_counts
+from core.fake_backend import create_fake_supabase
+from core.seller_counts import load_seller_filter, rebuild_seller_product_counts
+
+
+def _tables():
+    return {
+        'sellers': [
+            {'id': 's1', 'name': 'Б магазин', 'is_active': True, 'product_count': 0, 'active_product_count': 0},
+            {'id': 's2', 'name': 'А магазин', 'is_active': True, 'product_count': 0, 'active_product_count': 0},
+            {'id': 's3', 'name': 'Закрыт', 'is_active': False, 'product_count': 0, 'active_product_count': 0},
+        ],
+        'products': [],
+    }
+
+
+def _counts(db):
+    return {seller['id']: (seller['product_count'], seller['active_product_count']) for seller in db._backend.tables['sellers']}
+
+
+def test_counters_follow_product_writes():
+    db = create_fake_supabase(tables=_tables())
+
+    async def run():
+        await db.table('products').insert([
+            {'id': 'p1', 'seller_id': 's1', 'is_active': True},
+            {'id': 'p2', 'seller_id': 's1', 'is_active': True},
+            {'id': 'p3', 'seller_id': 's2', 'is_active': False},
+        ]).execute()
+        assert _counts(db) == {'s1': (2, 2), 's2': (1, 0), 's3': (0, 0)}
+
+        await db.table('products').update({'is_active': False}).in_('id', ['p1', 'p2']).execute()
+        await db.table('products').update({'is_active': True}).eq('id', 'p3').execute()
+        await db.table('products').delete().eq('id', 'p2').execute()
+        assert _counts(db) == {'s1': (1, 0), 's2': (1, 1), 's3': (0, 0)}
+
+        # Ремонт: счетчики разошлись - пересчет одним вызовом
+        db._backend.tables['sellers'][0]['product_count'] = 40
+        assert await rebuild_seller_product_counts(db) == 1
+        assert await rebuild_seller_product_counts(db) == 0
+
+        sellers = await load_seller_filter(db)
+        assert [(seller['name'], seller['product_count'], seller['active_product_count']) for seller in sellers] == [
+            ('А магазин', 1, 1), ('Б магазин', 1, 0)
+        ]
+
+    asyncio.run(run())
+
+
+def test_without_migration():
+    db = create_fake_supabase(tables={'sellers': [{'id': 's1', 'name': 'Магазин', 'is_active': True}]})
+    db._backend._rpc.clear()
+
+    async def run():
+        assert await rebuild_seller_product_counts(db) is None
+        seller_counts._counters_available = False
+        try:
+            assert await load_seller_filter(db) == [
+                {'id': 's1', 'name': 'Магазин', 'product_count': None, 'active_product_count': None}
+            ]
+        finally:
+            seller_counts._counters_available = True
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_counters_follow_product_writes()
+    test_without_migration()
+    print("✅ seller product counts tests passed")
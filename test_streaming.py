@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Тест потокового рендера: шапка отправляется до загрузки данных, куски склеиваются
+"""
+
+import asyncio
+
+from jinja2 import DictLoader, Environment
+
+from core.streaming import StreamingTemplates, coalesce_chunks
+
+
+class _Templates:
+    env = Environment(loader=DictLoader({
+        'base.html': '<header>шапка</header>{% block content %}{% endblock %}',
+        'page.html': (
+            '{% extends "base.html" %}{% block content %}'
+            '{% set data = load() %}{% for row in data.rows %}<tr>{{ row }}</tr>{% endfor %}'
+            '{% endblock %}'
+        ),
+        'broken.html': '<header>шапка</header>{{ fail() }}',
+    }), autoescape=True)
+
+
+async def _collect(response):
+    return [chunk async for chunk in response.body_iterator]
+
+
+def test_shell_flushed_before_data_loads():
+    events = []
+
+    async def load():
+        events.append('load')
+        await asyncio.sleep(0.05)
+        return {'rows': ['<a>', 'b']}
+
+    async def run():
+        response = StreamingTemplates(_Templates(), chunk_bytes=1 << 20).TemplateResponse('page.html', {'load': load})
+        chunks = []
+        async for chunk in response.body_iterator:
+            events.append('chunk')
+            chunks.append(chunk.decode())
+        return response, chunks
+
+    response, chunks = asyncio.run(run())
+    assert response.media_type.startswith('text/html')
+    # Шапка ушла отдельным куском, пока шаблон ждал данные
+    assert chunks[0] == '<header>шапка</header>'
+    assert ''.join(chunks) == '<header>шапка</header><tr>&lt;a&gt;</tr><tr>b</tr>'
+    assert events.index('load') < events.index('chunk') or events[0] == 'load'
+
+
+def test_coalesce_and_error_tail():
+    async def parts():
+        for part in ('a' * 5, 'b' * 5, 'c'):
+            yield part
+
+    async def run():
+        return [chunk async for chunk in coalesce_chunks(parts(), chunk_bytes=8)]
+
+    assert asyncio.run(run()) == [b'aaaaabbbbb', b'c']
+
+    def fail():
+        raise RuntimeError('db down')
+
+    response = StreamingTemplates(_Templates()).TemplateResponse('broken.html', {'fail': fail})
+    html = b''.join(asyncio.run(_collect(response))).decode()
+    assert html.startswith('<header>шапка</header>') and 'Ошибка загрузки данных' in html
+
+
+if __name__ == "__main__":
+    test_shell_flushed_before_data_loads()
+    test_coalesce_and_error_tail()
+    print("✅ streaming render tests passed")
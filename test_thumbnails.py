@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Тест резолвера миниатюр: bulk запрос без metadata, LRU карта и сброс
+"""
+
+import asyncio
+
+from core.fake_backend import create_fake_supabase
+from core.thumbnails import ThumbnailResolver, miniature_url, snapshot_url
+
+
+def _products():
+    return {'products': [
+        {'id': 'p1', 'metadata': {'properties': {'ru_img_miniature': '/upload/mini/1.jpg'}, 'big': 'x' * 1000}},
+        {'id': 'p2', 'metadata': {'properties': {}}},
+        {'id': 'p3', 'metadata': {'properties': {'ru_img_miniature': '/upload/mini/3.jpg'}}},
+    ]}
+
+
+def test_url_rules():
+    assert miniature_url('/upload/mini/1.jpg') == 'https://cvety.kz/upload/mini/1.jpg'
+    assert miniature_url(None) is None
+    assert snapshot_url({'bitrix': {'product_id': 555}}) == 'https://cvety.kz/miniature/555-obrannyy-buket.jpg'
+    assert snapshot_url({'name': 'Букет'}) is None and snapshot_url(None) is None
+
+
+def test_resolve_batches_and_caches():
+    db = create_fake_supabase(tables=_products())
+    resolver = ThumbnailResolver(max_size=10)
+    snapshot = {'bitrix': {'product_id': 555}}
+
+    urls = asyncio.run(resolver.resolve(db, ['p1', 'p2', None, 'p1'], [None, snapshot, snapshot, None]))
+    assert urls == [
+        'https://cvety.kz/upload/mini/1.jpg',
+        'https://cvety.kz/miniature/555-obrannyy-buket.jpg',  # у товара нет картинки - по снимку
+        'https://cvety.kz/miniature/555-obrannyy-buket.jpg',
+        'https://cvety.kz/upload/mini/1.jpg'
+    ]
+    calls = db._backend.calls
+
+    # Повтор (включая товар без картинки) - без запросов к БД
+    asyncio.run(resolver.resolve(db, ['p1', 'p2']))
+    assert db._backend.calls == calls
+    assert resolver.get_stats()['hits'] == 2
+
+    # После сброса товара URL перечитывается
+    db.sync_client.table('products').update({'metadata': {'properties': {'ru_img_miniature': '/new.jpg'}}}).eq('id', 'p1').execute()
+    resolver.invalidate(['p1'])
+    assert asyncio.run(resolver.resolve(db, ['p1'])) == ['https://cvety.kz/new.jpg']
+
+
+def test_map_is_bounded():
+    db = create_fake_supabase(tables=_products())
+    resolver = ThumbnailResolver(max_size=2)
+    asyncio.run(resolver.product_urls(db, ['p1', 'p2', 'p3']))
+    assert resolver.get_stats()['size'] == 2
+
+
+if __name__ == "__main__":
+    test_url_rules()
+    test_resolve_batches_and_caches()
+    test_map_is_bounded()
+    print("✅ thumbnail resolver tests passed")
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Тест WebhookHandler на AsyncSupabase: статус заказа, лог синхронизации и статистика без синхронного клиента
+"""
+
+import asyncio
+
+from core.fake_backend import create_fake_supabase
+from webhook_handler import WebhookHandler
+
+
+def _tables():
+    return {
+        'orders': [{'id': 'o1', 'status': 'new', 'created_at': '2025-01-01T10:00:00+00:00'}],
+        'sync_mapping': [{'id': 'm1', 'entity_type': 'order', 'bitrix_id': '555', 'supabase_id': 'o1'}],
+        'sync_log': [],
+    }
+
+
+def test_status_webhook_is_async():
+    db = create_fake_supabase(tables=_tables())
+    handler = WebhookHandler(db)
+
+    async def run():
+        result = await handler.handle_status_webhook({'order_id': '555', 'status': 'D'})
+        assert result == {'success': True, 'order_id': 'o1', 'new_status': 'delivered'}
+        stats = await handler.get_sync_statistics()
+        assert stats['last_sync']['action'] == 'update_status'
+
+    asyncio.run(run())
+    assert db._backend.tables['orders'][0]['status'] == 'delivered'
+    # Проекция списка обновлена триггером (migrations/001)
+    assert db._backend.tables['order_list_rows'][0]['status'] == 'delivered'
+
+
+if __name__ == "__main__":
+    test_status_webhook_is_async()
+    print("✅ webhook handler tests passed")
@@ -1,107 +1,52 @@
 #!/usr/bin/env python3
 """
-Скрипт для обновления количества товаров у каждого продавца в description
-Временное решение пока не создана RPC функция
+Пересчет счетчиков товаров продавцов sellers.product_count / active_product_count
+Счетчики поддерживают триггеры migrations/006_seller_product_counts.sql; скрипт нужен
+для ремонта (например, после отключения триггеров) - один GROUP BY в базе вместо
+подсчета по каждому продавцу.
 """
 
-from supabase import create_client
-import os
-from dotenv import load_dotenv
+import asyncio
+import logging
+import sys
 
-load_dotenv()
+from config import config
+from core.data_access import AsyncSupabase
+from core.seller_counts import rebuild_seller_product_counts
 
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY") or os.getenv("SUPABASE_ANON_KEY")
+logging.basicConfig(level=logging.INFO)
 
-def update_product_counts():
-    """Обновить количество товаров в описании каждого продавца"""
-    
-    supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
-    
-    print("Получаем всех продавцов...")
-    sellers_result = supabase.table('sellers').select('id, name, description').execute()
-    
-    if not sellers_result.data:
-        print("Продавцы не найдены")
-        return
-    
-    sellers = sellers_result.data
-    print(f"Найдено {len(sellers)} продавцов")
-    
-    updated_count = 0
-    
-    # Для каждого продавца обновляем количество товаров
-    for i, seller in enumerate(sellers):
-        if i % 50 == 0:
-            print(f"Обработано: {i}/{len(sellers)}")
-        
-        # Подсчитываем товары
-        count_result = supabase.table('products')\
-            .select('id', count='exact')\
-            .eq('seller_id', seller['id'])\
+
+async def update_product_counts() -> int:
+    """Пересчитать счетчики и показать топ-10 продавцов"""
+    db = AsyncSupabase(config.SUPABASE_URL, config.SUPABASE_SERVICE_KEY or config.SUPABASE_ANON_KEY)
+    try:
+        fixed = await rebuild_seller_product_counts(db)
+        if fixed is None:
+            print("❌ Счетчики не установлены (примените migrations/006_seller_product_counts.sql)")
+            return 1
+        print(f"✅ Исправлено продавцов: {fixed}")
+
+        print("\n📊 Топ-10 продавцов по количеству товаров:")
+        top = await db.table('sellers')\
+            .select('name, product_count, active_product_count')\
+            .gt('product_count', 0)\
+            .order('product_count', desc=True)\
+            .limit(10)\
             .execute()
-        
-        product_count = count_result.count if hasattr(count_result, 'count') else 0
-        
-        # Обновляем описание с количеством товаров
-        new_description = f"Товаров: {product_count}"
-        if seller.get('description'):
-            # Если есть описание, добавляем к нему
-            if 'Товаров:' not in seller['description']:
-                new_description = f"{seller['description']} | Товаров: {product_count}"
-            else:
-                # Обновляем существующее количество
-                import re
-                new_description = re.sub(r'Товаров: \d+', f'Товаров: {product_count}', seller['description'])
-        
-        try:
-            # Обновляем продавца
-            supabase.table('sellers')\
-                .update({'description': new_description})\
-                .eq('id', seller['id'])\
-                .execute()
-            
-            updated_count += 1
-            
-            if product_count > 0 and updated_count <= 10:
-                print(f"  ✅ {seller['name']}: {product_count} товаров")
-                
-        except Exception as e:
-            print(f"  ❌ Ошибка для {seller['name']}: {e}")
-    
-    print(f"\n✅ Обновлено {updated_count} продавцов")
-    
-    # Показываем топ продавцов
-    print("\n📊 Топ-10 продавцов по количеству товаров:")
-    
-    # Получаем обновленных продавцов
-    sellers_result = supabase.table('sellers').select('name, description').execute()
-    
-    if sellers_result.data:
-        # Извлекаем количество из описания
-        sellers_with_counts = []
-        for seller in sellers_result.data:
-            if seller.get('description') and 'Товаров:' in seller['description']:
-                import re
-                match = re.search(r'Товаров: (\d+)', seller['description'])
-                if match:
-                    count = int(match.group(1))
-                    if count > 0:
-                        sellers_with_counts.append({
-                            'name': seller['name'],
-                            'count': count
-                        })
-        
-        # Сортируем и показываем топ-10
-        sellers_with_counts.sort(key=lambda x: x['count'], reverse=True)
-        for i, seller in enumerate(sellers_with_counts[:10], 1):
-            print(f"  {i}. {seller['name']}: {seller['count']} товаров")
+        for i, seller in enumerate(top.data or [], 1):
+            print(f"  {i}. {seller['name']}: {seller['product_count']} товаров ({seller['active_product_count']} активных)")
+        return 0
+    finally:
+        await db.aclose()
+
 
 if __name__ == "__main__":
     print("="*60)
     print("  ОБНОВЛЕНИЕ КОЛИЧЕСТВА ТОВАРОВ")
     print("="*60)
-    
-    update_product_counts()
-    
-    print("\n" + "="*60)
\ No newline at end of file
+
+    code = asyncio.run(update_product_counts())
+
+    print("\n" + "="*60)
+    sys.exit(code)
@@ -1,10 +1,11 @@
 """
 Webhook handler для приема данных от Bitrix
 Обрабатывает входящие webhooks и синхронизирует данные с Supabase
+Запросы идут через AsyncSupabase: обработка webhook не блокирует цикл событий
 """
 
 from fastapi import HTTPException, Request, Header, Depends
-from supabase import Client
+from core.data_access import AsyncSupabase
 from typing import Optional, Dict, Any
 import logging
 from datetime import datetime
@@ -18,7 +19,7 @@ logger = logging.getLogger(__name__)
 class WebhookHandler:
     """Обработчик webhook запросов от Bitrix"""
     
-    def __init__(self, supabase: Client):
+    def __init__(self, supabase: AsyncSupabase):
         self.supabase = supabase
         self.webhook_token = config.WEBHOOK_TOKEN if hasattr(config, 'WEBHOOK_TOKEN') else 'secret-webhook-token-2024'
     
@@ -55,7 +56,7 @@ class WebhookHandler:
             
             # Проверяем, существует ли уже этот заказ
             # Сначала пробуем найти по bitrix_order_id напрямую в orders
-            existing_order = self.supabase.table('orders')\
+            existing_order = await self.supabase.table('orders')\
                 .select('id')\
                 .eq('bitrix_order_id', int(bitrix_order_id))\
                 .execute()
@@ -65,7 +66,7 @@ class WebhookHandler:
                 existing_mapping_data = [{'supabase_id': existing_order.data[0]['id']}]
             else:
                 # Проверяем в таблице маппинга (для обратной совместимости)
-                existing_mapping = self.supabase.table('sync_mapping')\
+                existing_mapping = await self.supabase.table('sync_mapping')\
                     .select('*')\
                     .eq('entity_type', 'order')\
                     .eq('bitrix_id', bitrix_order_id)\
@@ -86,7 +87,7 @@ class WebhookHandler:
             
             # Записываем в лог успешную синхронизацию
             processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
-            self._log_sync(
+            await self._log_sync(
                 action=action,
                 direction='bitrix_to_supabase',
                 bitrix_id=bitrix_order_id,
@@ -121,7 +122,7 @@ class WebhookHandler:
             
             # Логируем ошибку
             processing_time = int((datetime.now() - start_time).total_seconds() * 1000)
-            self._log_sync(
+            await self._log_sync(
                 action='order_webhook_error',
                 direction='bitrix_to_supabase',
                 bitrix_id=data.get('order_id'),
@@ -159,7 +160,7 @@ class WebhookHandler:
         supabase_order = self._validate_dates(supabase_order)
         
         # Создаем заказ в Supabase
-        order_result = self.supabase.table('orders').insert(supabase_order).execute()
+        order_result = await self.supabase.table('orders').insert(supabase_order).execute()
         
         if not order_result.data:
             raise Exception("Failed to create order in Supabase")
@@ -167,7 +168,7 @@ class WebhookHandler:
         new_order = order_result.data[0]
         
         # Создаем маппинг
-        self.supabase.table('sync_mapping').insert({
+        await self.supabase.table('sync_mapping').insert({
             'entity_type': 'order',
             'bitrix_id': bitrix_data.get('order_id') or bitrix_data.get('ID'),
             'supabase_id': new_order['id'],
@@ -197,13 +198,13 @@ class WebhookHandler:
         update_data = self._validate_dates(update_data)
         
         # Обновляем заказ
-        self.supabase.table('orders')\
+        await self.supabase.table('orders')\
             .update(update_data)\
             .eq('id', supabase_order_id)\
             .execute()
         
         # Обновляем маппинг
-        self.supabase.table('sync_mapping')\
+        await self.supabase.table('sync_mapping')\
             .update({
                 'last_sync_at': datetime.now().isoformat(),
                 'sync_status': 'synced'
@@ -221,14 +222,14 @@ class WebhookHandler:
         transformer = OrderTransformer()
         
         # Удаляем существующие товары (для простоты, можно улучшить)
-        self.supabase.table('order_items').delete().eq('order_id', order_id).execute()
+        await self.supabase.table('order_items').delete().eq('order_id', order_id).execute()
         
         # Добавляем новые товары
         for item in bitrix_items:
             order_item = transformer.transform_basket_item(item)
             order_item['order_id'] = order_id
             
-            self.supabase.table('order_items').insert(order_item).execute()
+            await self.supabase.table('order_items').insert(order_item).execute()
     
     async def handle_status_webhook(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -242,7 +243,7 @@ class WebhookHandler:
                 raise ValueError("Order ID or status not found in webhook data")
             
             # Находим заказ в маппинге
-            mapping = self.supabase.table('sync_mapping')\
+            mapping = await self.supabase.table('sync_mapping')\
                 .select('supabase_id')\
                 .eq('entity_type', 'order')\
                 .eq('bitrix_id', bitrix_order_id)\
@@ -265,7 +266,7 @@ class WebhookHandler:
             supabase_status = status_map.get(new_status, 'new')
             
             # Обновляем статус в Supabase
-            self.supabase.table('orders')\
+            await self.supabase.table('orders')\
                 .update({
                     'status': supabase_status,
                     'updated_at': datetime.now().isoformat()
@@ -274,7 +275,7 @@ class WebhookHandler:
                 .execute()
             
             # Логируем успешную синхронизацию
-            self._log_sync(
+            await self._log_sync(
                 action='update_status',
                 direction='bitrix_to_supabase',
                 bitrix_id=bitrix_order_id,
@@ -292,7 +293,7 @@ class WebhookHandler:
         except Exception as e:
             logger.error(f"Error processing status webhook: {e}")
             
-            self._log_sync(
+            await self._log_sync(
                 action='status_webhook_error',
                 direction='bitrix_to_supabase',
                 bitrix_id=data.get('order_id'),
@@ -303,7 +304,7 @@ class WebhookHandler:
             
             raise HTTPException(status_code=500, detail=str(e))
     
-    def _log_sync(self, **kwargs):
+    async def _log_sync(self, **kwargs):
         """Запись в лог синхронизации"""
         try:
             log_entry = {
@@ -318,16 +319,16 @@ class WebhookHandler:
                 'created_at': datetime.now().isoformat()
             }
             
-            self.supabase.table('sync_log').insert(log_entry).execute()
+            await self.supabase.table('sync_log').insert(log_entry).execute()
             
         except Exception as e:
             logger.error(f"Failed to write sync log: {e}")
     
-    def get_sync_statistics(self) -> Dict[str, Any]:
+    async def get_sync_statistics(self) -> Dict[str, Any]:
         """Получение статистики синхронизации"""
         try:
             # Последние синхронизации
-            recent_syncs = self.supabase.table('sync_log')\
+            recent_syncs = await self.supabase.table('sync_log')\
                 .select('*')\
                 .order('created_at', desc=True)\
                 .limit(10)\
@@ -337,13 +338,13 @@ class WebhookHandler:
             from datetime import timedelta
             yesterday = (datetime.now() - timedelta(days=1)).isoformat()
             
-            daily_stats = self.supabase.table('sync_log')\
+            daily_stats = await self.supabase.table('sync_log')\
                 .select('action, status', count='exact')\
                 .gte('created_at', yesterday)\
                 .execute()
             
             # Последние ошибки
-            recent_errors = self.supabase.table('sync_log')\
+            recent_errors = await self.supabase.table('sync_log')\
                 .select('*')\
                 .eq('status', 'error')\
                 .order('created_at', desc=True)\